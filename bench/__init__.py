@@ -0,0 +1 @@
+"""Benchmarks for the capture and upload pipeline."""
@@ -0,0 +1,88 @@
+"""
+Benchmark hotspot capture filter profiles on a capture.
+
+Applies every capture filter profile to a mixed capture (synthetic unless
+one is given) and reports the frames and bytes each keeps, raw and gzip
+compressed, i.e. how much tmpfs and uplink a profile saves.
+
+    python -m bench.bench_capture_filters
+    python -m bench.bench_capture_filters --capture x.pcapng --bssid 02:aa:bb:cc:dd:ee
+"""
+import argparse
+import gzip
+import io
+import tempfile
+
+from bench.synthetic import PcapngWriter, TrafficGenerator
+from src.capture_filter import PROFILES
+from src.probe_extractor import (
+    LINKTYPE_IEEE802_11_RADIOTAP,
+    PcapngReader,
+    parse_radiotap,
+)
+
+
+def filtered(path, profile, bssid):
+    """Return (frames, pcapng bytes, gzip bytes) kept by profile."""
+    output = io.BytesIO()
+    writer = PcapngWriter(output)
+    frames = 0
+    with open(path, "rb") as capture:
+        for linktype, timestamp, data in PcapngReader(capture).packets():
+            frame = data
+            if linktype == LINKTYPE_IEEE802_11_RADIOTAP:
+                frame = data[parse_radiotap(data)[0]:]
+            if profile.matches(frame, bssid):
+                writer.write_packet(data, timestamp or 0.0)
+                frames += 1
+    content = output.getvalue()
+    return frames, len(content), len(gzip.compress(content, 6))
+
+
+def run(path, bssid):
+    """Print benchmark table for path."""
+    print(f"capture: {path}, BSSID {bssid}")
+    print(
+        f"{'profile':<11} {'frames':>8} {'MB':>7} {'removed':>8} "
+        f"{'gzip MB':>8} {'removed':>8}  filter"
+    )
+    baseline = None
+    for name, profile in PROFILES.items():
+        frames, size, compressed = filtered(path, profile, bssid)
+        if baseline is None:
+            baseline = (size, compressed)
+        print(
+            f"{name:<11} {frames:>8} {size / 1048576:>7.2f} "
+            f"{1 - size / baseline[0]:>8.1%} {compressed / 1048576:>8.2f} "
+            f"{1 - compressed / baseline[1]:>8.1%}  {profile.bpf(bssid) or '-'}"
+        )
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--capture", help="Capture to benchmark, synthetic if unset.")
+    parser.add_argument("--bssid", help="BSSID of the hotspot in --capture.")
+    parser.add_argument("--size_mb", type=float, default=20, help="Synthetic size.")
+    parser.add_argument(
+        "--neighbour_data_rate",
+        type=float,
+        default=50,
+        help="Data frames per second of neighbouring networks in the synthetic capture.",
+    )
+    args = parser.parse_args()
+    if args.capture:
+        if not args.bssid:
+            parser.error("--bssid is needed with --capture")
+        run(args.capture, args.bssid)
+        return
+    generator = TrafficGenerator(neighbour_data_rate=args.neighbour_data_rate)
+    bssid = ":".join(f"{byte:02x}" for byte in generator.bssid)
+    with tempfile.NamedTemporaryFile(suffix=".pcapng") as capture:
+        generator.write_size(capture, int(args.size_mb * 1024 * 1024))
+        capture.flush()
+        run(capture.name, bssid)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Benchmark upload compression on a capture.
+
+Reports compression ratio and CPU seconds per MB of capture for each
+encoding and level, to pick a level the Pi can sustain at the capture rate.
+
+    python -m bench.bench_compression
+    python -m bench.bench_compression --capture /tmp/pi_sniffer_data/x.pcapng
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from src.compression import CompressedReader, available_encodings
+from bench.synthetic import TrafficGenerator
+
+LEVELS = {"gzip": [1, 3, 6, 9], "zstd": [1, 3, 6, 10]}
+
+
+def compress_file(path, encoding, level):
+    """Compress path, returning (compressed bytes, CPU seconds)."""
+    start = time.process_time()
+    with open(path, "rb") as data_file:
+        reader = CompressedReader(data_file, encoding, level)
+        while reader.read(64 * 1024):
+            pass
+    return reader.bytes_out, time.process_time() - start
+
+
+def run(path):
+    """Print benchmark table for path."""
+    size = os.path.getsize(path)
+    megabytes = size / (1024 * 1024)
+    print(f"capture: {path} ({megabytes:.1f} MB)")
+    print(f"{'encoding':<8} {'level':>5} {'ratio':>7} {'cpu s/MB':>9} {'MB/s':>8}")
+    for encoding in available_encodings():
+        for level in LEVELS[encoding]:
+            compressed, cpu_seconds = compress_file(path, encoding, level)
+            print(
+                f"{encoding:<8} {level:>5} {size / compressed:>7.2f} "
+                f"{cpu_seconds / megabytes:>9.4f} {megabytes / max(cpu_seconds, 1e-9):>8.1f}"
+            )
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--capture", help="Capture to benchmark, synthetic if unset.")
+    parser.add_argument("--size_mb", type=float, default=20, help="Synthetic size.")
+    args = parser.parse_args()
+    if args.capture:
+        run(args.capture)
+        return
+    with tempfile.NamedTemporaryFile(suffix=".pcapng") as capture:
+        TrafficGenerator().write_size(capture, int(args.size_mb * 1024 * 1024))
+        capture.flush()
+        run(capture.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""
+Load test the control plane with a fleet of simulated pis.
+
+Runs ``--pis`` PiSniffer instances in this process, each with a
+``SimulatedWiFi`` in place of the WiFiHandler so no hardware, root or
+external tools are needed, against one local stand-in backend. Every pi
+polls ``status/update/`` and, as the backend issues it instructions, walks
+through probe request and hotspot sessions, so the backend sees the same
+status, instruction, session, AP and upload calls as from real pis.
+
+Reports requests per second and request/response bytes per endpoint, and
+the latency from an instruction being issued to the pi acknowledging it.
+All pis share one Python process, so at high counts latencies include
+time waiting for the GIL; compare runs at the same fleet size.
+
+    python -m bench.bench_fleet
+    python -m bench.bench_fleet --pis 500 --duration 120 --control_plane batched
+    python -m bench.bench_fleet --status_reporting delta --instruction_channel sse
+"""
+import argparse
+import io
+import os
+import random
+import tempfile
+import threading
+import time
+
+from bench.bench_pipeline import percentiles
+from bench.synthetic import PcapngWriter, probe_request, radiotap
+from pi_sniffer import PiSniffer, WiFiState
+from test.fake_backend import FakeBackend
+
+# Next instruction for a pi in each state: start a probe request or hotspot
+# session when idle, stop the running one otherwise.
+NEXT_CODES = {
+    WiFiState.NoState: (1, 3, 6),
+    WiFiState.ProbeReq: (2,),
+    WiFiState.HostAP: (4, 5),
+}
+
+
+class SimulatedWiFi:  # pylint: disable=too-many-public-methods
+    """WiFiHandler stand-in that touches no hardware.
+
+    Probe request capture writes a small synthetic capture so it can be
+    uploaded, hotspot capture writes nothing. Clients join and leave the
+    hotspot at random.
+    """
+
+    def __init__(self, index, seed=0, probes=20, clients=10):
+        """Initialize simulated WiFi of the index-th pi of the fleet."""
+        self.mac = "02:00:00:{:02x}:{:02x}:{:02x}".format(
+            (index >> 16) & 0xFF, (index >> 8) & 0xFF, index & 0xFF
+        )
+        self.rng = random.Random(f"{seed}-{index}")
+        self.probes = probes
+        self.clients = [
+            "0a:00:00:00:{:02x}:{:02x}".format(index & 0xFF, client)
+            for client in range(clients)
+        ]
+        self.connected = set()
+        self.dumpcap_file_generation_duration = 15
+        self.probe_outputs = {}
+        self.ap_running = False
+
+    def get_device_mac(self):
+        """Return the pi's MAC."""
+        return self.mac
+
+    @staticmethod
+    def get_external_ip():
+        """Return the pi's IP."""
+        return "127.0.0.1"
+
+    def nm_disable(self):
+        """Nothing to hand over from NetworkManager."""
+
+    def set_probe_req_mode(self):
+        """Switch to monitor mode."""
+
+    def set_hostap_mode(self):
+        """Start the hotspot."""
+        self.connected = set()
+
+    def change_hostap(self, ssid, channel):
+        """Change the hotspot's SSID and channel."""
+
+    def stop_hostap(self):
+        """Stop the hotspot."""
+        self.connected = set()
+
+    def restart_opennds(self):
+        """Forget authenticated devices."""
+
+    def start_collecting_data(self, output, **_kwargs):
+        """Write a capture of a few probe requests to output."""
+        self.probe_outputs = {"sim0": output}
+        capture = io.BytesIO()
+        writer = PcapngWriter(capture)
+        for seq in range(self.probes):
+            source = bytes.fromhex(self.rng.choice(self.clients).replace(":", ""))
+            writer.write_packet(radiotap() + probe_request(source, seq), time.time())
+        with open(output, "wb") as capture_file:
+            capture_file.write(capture.getvalue())
+
+    def stop_collecting_data(self):
+        """Stop probe request capture."""
+
+    def start_collecting_ap_data(self, _output, _ring=None, **_kwargs):
+        """Start hotspot capture."""
+        self.ap_running = True
+
+    def stop_collecting_ap_data(self):
+        """Stop hotspot capture."""
+        self.ap_running = False
+
+    def rearm_collecting_ap_data(self, _output, _ring):
+        """Restart hotspot capture."""
+
+    def pause_collecting_ap_data(self, paused=True):
+        """Pause or resume hotspot capture."""
+
+    def get_connected_users(self):
+        """Return hotspot clients, one may join or leave on every call."""
+        client = self.rng.choice(self.clients)
+        if self.rng.random() < 0.2:
+            self.connected ^= {client}
+        return sorted(self.connected)
+
+    @staticmethod
+    def capture_processes():
+        """No capture processes to supervise."""
+        return {}
+
+
+class Fleet:
+    """Simulated pis running against one backend."""
+
+    def __init__(self, backend, count, capture_dir, seed=0, **options):
+        """Create count pis, options are passed on to PiSniffer.
+
+        status_update_interval in options replaces the pis' 5 s interval.
+        """
+        self.backend = backend
+        self.rng = random.Random(seed)
+        interval = options.pop("status_update_interval", None)
+        self.pis = []
+        for index in range(count):
+            pi = PiSniffer(
+                None,
+                None,
+                None,
+                "fleet-token",
+                backend.url,
+                capture_dir=os.path.join(capture_dir, str(index)),
+                wifi=SimulatedWiFi(index, seed),
+                autorun=False,
+                **options,
+            )
+            if interval:
+                pi.status_update_interval = interval
+            self.pis.append(pi)
+        self.threads = []
+        self.stopping = threading.Event()
+        self.issued = 0
+
+    def start(self):
+        """Run every pi in its own thread, starting spread over a status interval."""
+        for pi in self.pis:
+            delay = self.rng.uniform(0, pi.status_update_interval)
+            thread = threading.Thread(target=self._run, args=(pi, delay), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _run(self, pi, delay):
+        if not self.stopping.wait(delay):
+            pi.run()
+
+    def issue(self):
+        """Issue the next instruction to a random pi done with its last one.
+
+        Returns the code, None if every pi is still busy.
+        """
+        idle = [pi for pi in self.pis if not self.backend.issued_at.get(pi.mac)]
+        if not idle:
+            return None
+        pi = self.rng.choice(idle)
+        code = self.rng.choice(NEXT_CODES[pi.state])
+        self.backend.issue(code, mac=pi.mac)
+        self.issued += 1
+        return code
+
+    def stop(self, timeout=10):
+        """Stop every pi and wait for them to clean up."""
+        self.stopping.set()
+        deadline = time.monotonic() + timeout
+        for pi, thread in zip(self.pis, self.threads):
+            # A pi only stops once its loop runs, keep asking until it's gone.
+            while thread.is_alive() and time.monotonic() < deadline:
+                pi.runtime.stop()
+                thread.join(0.1)
+
+
+def run_fleet(pis, duration, instruction_rate, seed=0, **options):
+    """Run a fleet for duration seconds, issuing instruction_rate instructions/s.
+
+    Returns the report as a dict.
+    """
+    backend = FakeBackend(keep_uploads=False)
+    try:
+        with tempfile.TemporaryDirectory() as capture_dir:
+            fleet = Fleet(backend, pis, capture_dir, seed, **options)
+            fleet.start()
+            started = time.monotonic()
+            next_issue = started
+            while time.monotonic() - started < duration:
+                if instruction_rate and time.monotonic() >= next_issue:
+                    fleet.issue()
+                    next_issue += fleet.rng.expovariate(instruction_rate)
+                time.sleep(0.01)
+            elapsed = time.monotonic() - started
+            fleet.stop()
+        return report(backend, fleet.issued, elapsed)
+    finally:
+        backend.close()
+
+
+def report(backend, issued, elapsed):
+    """Return request rate, bytes and instruction latency seen by backend."""
+    requests_per_path = {}
+    for method, path in list(backend.requests):
+        requests_per_path[(method, path)] = requests_per_path.get((method, path), 0) + 1
+    latencies = [latency for _, _, latency in backend.latencies]
+    return {
+        "seconds": elapsed,
+        "endpoints": {
+            f"{method} {path}": {
+                "requests": count,
+                "rate": count / elapsed,
+                "bytes_in": backend.bytes_in[path],
+                "bytes_out": backend.bytes_out[path],
+            }
+            for (method, path), count in sorted(requests_per_path.items())
+        },
+        "requests": sum(requests_per_path.values()),
+        "issued": issued,
+        "executed": len(latencies),
+        "latency": percentiles(latencies),
+        "latency_max": max(latencies, default=None),
+    }
+
+
+def print_report(result):
+    """Print report table."""
+    seconds = result["seconds"]
+    print(f"{'endpoint':<40} {'requests':>8} {'req/s':>8} {'KB in':>9} {'KB out':>9}")
+    for name, stats in result["endpoints"].items():
+        print(
+            f"{name:<40} {stats['requests']:>8} {stats['rate']:>8.1f} "
+            f"{stats['bytes_in'] / 1024:>9.1f} {stats['bytes_out'] / 1024:>9.1f}"
+        )
+    total_in = sum(stats["bytes_in"] for stats in result["endpoints"].values())
+    total_out = sum(stats["bytes_out"] for stats in result["endpoints"].values())
+    print(
+        f"{'total':<40} {result['requests']:>8} {result['requests'] / seconds:>8.1f} "
+        f"{total_in / 1024:>9.1f} {total_out / 1024:>9.1f}"
+    )
+    print(f"instructions: {result['issued']} issued, {result['executed']} acknowledged")
+    if result["executed"]:
+        latency = result["latency"]
+        print(
+            "issue to acknowledgement: p50 {:.2f}s p95 {:.2f}s p99 {:.2f}s max {:.2f}s".format(
+                latency[0.5], latency[0.95], latency[0.99], result["latency_max"]
+            )
+        )
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pis", type=int, default=200, help="Simulated pis.")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to run.")
+    parser.add_argument(
+        "--instruction_rate",
+        type=float,
+        default=2,
+        help="Instructions issued per second over the whole fleet.",
+    )
+    parser.add_argument(
+        "--status_interval", type=float, default=5, help="Seconds between status updates."
+    )
+    parser.add_argument("--control_plane", choices=["legacy", "batched"], default="legacy")
+    parser.add_argument("--status_reporting", choices=["full", "delta"], default="full")
+    parser.add_argument("--instruction_channel", choices=["poll", "sse"], default="poll")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(
+        f"fleet: {args.pis} pis, {args.duration:.0f}s, {args.control_plane} control plane, "
+        f"{args.status_reporting} status, {args.instruction_channel} instructions"
+    )
+    result = run_fleet(
+        args.pis,
+        args.duration,
+        args.instruction_rate,
+        seed=args.seed,
+        status_update_interval=args.status_interval,
+        control_plane=args.control_plane,
+        status_reporting=args.status_reporting,
+        instruction_channel=args.instruction_channel,
+    )
+    print_report(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark probe request coverage against the number of radios.
+
+Simulates phones sending probe requests on random channels while one to
+``--radios`` monitor interfaces hop their share of the channels as planned
+by ``HopScheduler.split``, and reports the share of probe requests heard.
+Channel switches take ``--switch_ms``, during which nothing is heard.
+
+    python -m bench.bench_multi_radio
+    python -m bench.bench_multi_radio --radios 6 --channels all --dwell 2
+"""
+import argparse
+import bisect
+import random
+
+from src.hop_scheduler import HopScheduler, make_policy, parse_channels
+
+
+def timeline(scheduler, duration, switch):
+    """Return (starts, ends, channels) of the dwells of a radio over duration."""
+    starts, ends, channels = [], [], []
+    now = 0.0
+    for channel, dwell in scheduler.hops():
+        if now >= duration:
+            break
+        starts.append(now + switch)
+        ends.append(now + switch + dwell)
+        channels.append(channel)
+        now += switch + dwell
+    return starts, ends, channels
+
+
+def coverage(args, radios, probes):
+    """Return the share of probes (time, channel) heard with radios."""
+    scheduler = HopScheduler(
+        parse_channels(args.channels),
+        make_policy(args.policy, dwell=args.dwell, cycle=args.cycle),
+    )
+    schedulers = scheduler.split(radios) if radios > 1 else [scheduler]
+    timelines = [timeline(radio, args.duration, args.switch_ms / 1000) for radio in schedulers]
+    heard = 0
+    for timestamp, channel in probes:
+        for starts, ends, channels in timelines:
+            index = bisect.bisect_right(starts, timestamp) - 1
+            if index >= 0 and timestamp < ends[index] and channels[index] == channel:
+                heard += 1
+                break
+    return heard / len(probes)
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--radios", type=int, default=4, help="Most radios to try.")
+    parser.add_argument("--channels", default="2.4", help="Channels hopped, as hop_channels.")
+    parser.add_argument("--policy", default="fixed", help="Hop policy.")
+    parser.add_argument("--dwell", type=float, default=10, help="Seconds per channel, fixed.")
+    parser.add_argument("--cycle", type=float, default=30, help="Seconds per cycle.")
+    parser.add_argument("--switch_ms", type=float, default=5, help="Channel switch time.")
+    parser.add_argument("--duration", type=float, default=3600, help="Simulated seconds.")
+    parser.add_argument("--probes", type=int, default=100000, help="Probe requests sent.")
+    args = parser.parse_args()
+    rng = random.Random(0)
+    channels = parse_channels(args.channels)
+    probes = [(rng.uniform(0, args.duration), rng.choice(channels)) for _ in range(args.probes)]
+    print(f"{len(channels)} channels, {args.policy} hopping, {args.probes} probe requests")
+    print(f"{'radios':>6} {'heard':>7} {'vs 1':>6}")
+    single = None
+    for radios in range(1, args.radios + 1):
+        heard = coverage(args, radios, probes)
+        single = single or heard
+        print(f"{radios:>6} {heard:>7.1%} {heard / single:>6.2f}")
+
+
+if __name__ == "__main__":
+    main()
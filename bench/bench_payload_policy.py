@@ -0,0 +1,83 @@
+"""
+Benchmark hotspot payload policies on a capture.
+
+Applies each payload policy to a capture (synthetic unless one is given) and
+reports the bytes each keeps, raw and gzip compressed, and the CPU seconds
+per MB the headers rewrite takes on the Pi.
+
+    python -m bench.bench_payload_policy
+    python -m bench.bench_payload_policy --capture x.pcapng --flow_bytes 512
+"""
+import argparse
+import gzip
+import io
+import shutil
+import tempfile
+import time
+
+from bench.synthetic import PcapngWriter, TrafficGenerator
+from src.metrics import Registry
+from src.payload_policy import MODES, PayloadPolicy
+from src.probe_extractor import PcapngReader
+
+
+def truncated(path, policy):
+    """Return (pcapng bytes, gzip bytes, CPU seconds) kept by policy."""
+    output = io.BytesIO()
+    started = time.process_time()
+    if policy.mode == "headers":
+        with tempfile.TemporaryDirectory() as tempdir:
+            copy = shutil.copy(path, tempdir)
+            policy.apply(copy)
+            with open(copy, "rb") as rewritten:
+                content = rewritten.read()
+    else:
+        # What dumpcap -s does, done here to the whole capture.
+        writer = PcapngWriter(output)
+        snaplen = policy.dumpcap_snaplen()
+        with open(path, "rb") as capture:
+            for _, timestamp, data in PcapngReader(capture).packets():
+                writer.write_packet(data[:snaplen], timestamp or 0.0)
+        content = output.getvalue()
+    seconds = time.process_time() - started
+    return len(content), len(gzip.compress(content, 6)), seconds
+
+
+def run(path, snaplen, flow_bytes):
+    """Print benchmark table for path."""
+    print(f"capture: {path}, snaplen {snaplen}, flow_bytes {flow_bytes}")
+    print(f"{'policy':<8} {'MB':>7} {'ratio':>6} {'gzip MB':>8} {'ratio':>6} {'CPU s/MB':>9}")
+    baseline = None
+    for mode in MODES:
+        policy = PayloadPolicy(mode, snaplen, flow_bytes, metrics=Registry())
+        size, compressed, seconds = truncated(path, policy)
+        if baseline is None:
+            baseline = (size, compressed)
+        print(
+            f"{mode:<8} {size / 1048576:>7.2f} {baseline[0] / size:>6.1f} "
+            f"{compressed / 1048576:>8.2f} {baseline[1] / compressed:>6.1f} "
+            f"{seconds / (baseline[0] / 1048576):>9.3f}"
+        )
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--capture", help="Capture to benchmark, synthetic if unset.")
+    parser.add_argument("--size_mb", type=float, default=20, help="Synthetic size.")
+    parser.add_argument("--snaplen", type=int, default=256, help="Snap length of snaplen.")
+    parser.add_argument(
+        "--flow_bytes", type=int, default=1024, help="Payload kept per flow by headers."
+    )
+    args = parser.parse_args()
+    if args.capture:
+        run(args.capture, args.snaplen, args.flow_bytes)
+        return
+    with tempfile.NamedTemporaryFile(suffix=".pcapng") as capture:
+        TrafficGenerator().write_size(capture, int(args.size_mb * 1024 * 1024))
+        capture.flush()
+        run(capture.name, args.snaplen, args.flow_bytes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Benchmark the hotspot capture upload pipeline end to end.
+
+Synthetic traffic is written live into rotating ring files like dumpcap
+does, a DumpcapObserver picks them up and uploads them to a local stand-in
+backend that can add latency, limit bandwidth and fail uploads. Reports
+files/s, MB/s, the time from a file being rotated to the backend
+acknowledging it, and peak RSS of the capture side. The backend runs in a
+separate process so its memory isn't counted.
+
+    python -m bench.bench_pipeline
+    python -m bench.bench_pipeline --duration 60 --rotate 2 --bandwidth_mbps 2
+    python -m bench.bench_pipeline --error_rate 0.2 --latency_ms 300 --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import requests
+
+from bench.synthetic import RotatingWriter, TrafficGenerator
+from src.compression import resolve_encoding
+from src.dumpcap_observer import DumpcapObserver
+from test.fake_backend import FakeBackend
+
+
+def serve_backend(conn, options):
+    """Run a FakeBackend until told to stop, then send back its acks."""
+    backend = FakeBackend(keep_uploads=False, **options)
+    conn.send(backend.url)
+    conn.recv()
+    conn.send(
+        {
+            "acked": dict(backend.acked),
+            "errors": backend.upload_errors,
+            "bytes": backend.upload_bytes,
+        }
+    )
+    backend.close()
+
+
+def percentiles(values, points=(0.5, 0.95, 0.99)):
+    """Return {point: value} for sorted values, None when empty."""
+    ordered = sorted(values)
+    return {
+        point: ordered[min(int(point * len(ordered)), len(ordered) - 1)]
+        if ordered
+        else None
+        for point in points
+    }
+
+
+def peak_rss_mb():
+    """Return peak resident set size of this process in MB."""
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(args):
+    """Run one benchmark and return the results dict."""
+    options = dict(
+        upload_latency=args.latency_ms / 1000,
+        upload_bandwidth=args.bandwidth_mbps * 1024 * 1024 if args.bandwidth_mbps else None,
+        upload_error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    conn, child_conn = multiprocessing.Pipe()
+    backend = multiprocessing.Process(
+        target=serve_backend, args=(child_conn, options), daemon=True
+    )
+    backend.start()
+    url = conn.recv()
+
+    generator = TrafficGenerator(
+        probe_rate=args.probe_rate,
+        beacon_rate=args.beacon_rate,
+        data_rate=args.data_rate,
+        seed=args.seed,
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        observer = DumpcapObserver(
+            requests.Session(),
+            1,
+            "00:00:00:00:00:00",
+            url + "ap/analyze/",
+            path=directory,
+            max_workers=args.workers,
+            max_spool_bytes=args.spool_max_mb * 1024 * 1024,
+            compression=resolve_encoding(args.compression),
+        )
+        observer.uploader.backoff_base = args.backoff
+        writer = RotatingWriter(
+            os.path.join(directory, "1_bench_ap.pcapng"), generator, args.rotate
+        )
+        started = time.time()
+        observer.start_observer()
+        files = writer.run(args.duration)
+        time.sleep(0.2)  # Let the watcher see the last file being created.
+        observer.shutdown_observer()
+        observer.uploader.shutdown(wait=True)
+        finished = time.time()
+        stats = observer.stats()
+        observer.spool.close()
+
+    conn.send("stop")
+    backend_stats = conn.recv()
+    backend.join()
+
+    latencies = [
+        backend_stats["acked"][path] - writer.rotated[path]
+        for path in files
+        if path in backend_stats["acked"]
+    ]
+    elapsed = finished - started
+    megabytes = writer.bytes_written / (1024 * 1024)
+    return {
+        "files": len(files),
+        "acked": len(latencies),
+        "capture_mb": megabytes,
+        "sent_mb": stats["bytes_sent"] / (1024 * 1024),
+        "frames": writer.frames,
+        "elapsed": elapsed,
+        "files_per_second": len(latencies) / elapsed,
+        "mb_per_second": stats["bytes_uploaded"] / (1024 * 1024) / elapsed,
+        "latency": percentiles(latencies),
+        "latency_max": max(latencies, default=None),
+        "retries": stats["retries"],
+        "failed": stats["failed"],
+        "backend_errors": backend_stats["errors"],
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def report(results):
+    """Print results."""
+
+    def seconds(value):
+        return "-" if value is None else f"{value:.3f}s"
+
+    print(
+        f"files: {results['acked']}/{results['files']} acked, "
+        f"{results['capture_mb']:.1f} MB captured, {results['sent_mb']:.1f} MB sent, "
+        f"{results['frames']} frames in {results['elapsed']:.1f}s"
+    )
+    print(
+        f"throughput: {results['files_per_second']:.2f} files/s, "
+        f"{results['mb_per_second']:.2f} MB/s"
+    )
+    latency = results["latency"]
+    print(
+        f"rotation to ack: p50 {seconds(latency[0.5])} p95 {seconds(latency[0.95])} "
+        f"p99 {seconds(latency[0.99])} max {seconds(results['latency_max'])}"
+    )
+    print(
+        f"retries: {results['retries']}, failed: {results['failed']}, "
+        f"backend errors: {results['backend_errors']}"
+    )
+    print(f"peak RSS: {results['peak_rss_mb']:.1f} MB")
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--duration", type=float, default=20, help="Capture seconds.")
+    parser.add_argument("--rotate", type=float, default=2, help="Ring file seconds.")
+    parser.add_argument("--probe_rate", type=float, default=20, help="Frames/s.")
+    parser.add_argument("--beacon_rate", type=float, default=150, help="Frames/s.")
+    parser.add_argument("--data_rate", type=float, default=1000, help="Frames/s.")
+    parser.add_argument("--workers", type=int, default=2, help="Upload workers.")
+    parser.add_argument("--compression", default="none", help="none, gzip or zstd.")
+    parser.add_argument("--latency_ms", type=float, default=0, help="Backend latency.")
+    parser.add_argument("--bandwidth_mbps", type=float, default=0, help="MB/s, 0 is unlimited.")
+    parser.add_argument("--error_rate", type=float, default=0, help="Share of 503s.")
+    parser.add_argument("--backoff", type=float, default=0.2, help="Retry backoff base.")
+    parser.add_argument("--spool_max_mb", type=int, default=64, help="Spool budget.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    report(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Benchmark peak memory of uploading capture files of growing size.
+
+Each file is uploaded from a fresh process to a local sink that discards
+the body, once streamed with the multipart encoder and once the way
+requests builds the body with ``files=``, and the peak RSS of the uploading
+process is reported. Streaming should stay flat as the file grows, the
+``files=`` baseline grows with it and is skipped above --baseline_max_mb.
+
+    python -m bench.bench_upload_memory
+    python -m bench.bench_upload_memory --sizes_mb 1,64,1024 --compression gzip
+    python -m bench.bench_upload_memory --dir /mnt/usb
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from bench.synthetic import TrafficGenerator
+from src.compression import resolve_encoding
+from src.multipart import multipart_upload
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+    """Reads and discards request bodies."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Keep output quiet."""
+
+    def discard(self, length):
+        """Read and drop length bytes of the body."""
+        while length:
+            chunk = self.rfile.read(min(1024 * 1024, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Discard the body, 411 if it has neither length nor chunked encoding."""
+        length = self.headers.get("Content-Length")
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            # Compressed bodies are sent chunked.
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                self.discard(size)
+                self.rfile.readline()
+                if not size:
+                    break
+            self.send_response(200)
+        elif length is None:
+            self.send_response(411)
+        else:
+            self.discard(int(length))
+            self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def serve_sink(conn):
+    """Run the sink until told to stop."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SinkHandler)
+    server.daemon_threads = True
+    conn.send(f"http://127.0.0.1:{server.server_address[1]}/")
+    server.timeout = 0.1
+    while not conn.poll():
+        server.handle_request()
+    server.server_close()
+
+
+def upload(url, path, method, compression, conn):
+    """Upload path once and send back (status code, peak RSS in MB)."""
+    data = {"mac": "MY MAC", "name": os.path.basename(path), "session_id": 1}
+    session = requests.Session()
+    if method == "stream":
+        body, headers = multipart_upload(path, data, compression)
+        with body:
+            response = session.post(url, data=body, headers=headers)
+    else:
+        with open(path, "rb") as data_file:
+            response = session.post(url, data=data, files={"data": data_file})
+    # ru_maxrss is in kilobytes on Linux.
+    conn.send((response.status_code, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def measure(context, url, path, method, compression):
+    """Return (status code, peak RSS in MB) of an upload in a fresh process."""
+    conn, child_conn = context.Pipe()
+    process = context.Process(
+        target=upload, args=(url, path, method, compression, child_conn)
+    )
+    process.start()
+    result = conn.recv()
+    process.join()
+    return result
+
+
+def write_capture(path, size):
+    """Write a synthetic capture of size bytes, repeating a 4 MB sample."""
+    with tempfile.TemporaryFile() as sample_file:
+        TrafficGenerator().write_size(sample_file, min(size, 4 * 1024 * 1024))
+        sample_file.seek(0)
+        sample = sample_file.read()
+    with open(path, "wb") as capture:
+        written = 0
+        while written < size:
+            written += capture.write(sample[: size - written])
+
+
+def run(args):
+    """Print peak RSS for every size and method."""
+    context = multiprocessing.get_context("spawn")
+    conn, child_conn = context.Pipe()
+    sink = context.Process(target=serve_sink, args=(child_conn,), daemon=True)
+    sink.start()
+    url = conn.recv()
+    compression = resolve_encoding(args.compression)
+    print(f"compression: {compression or 'none'}")
+    print(f"{'size MB':>8} {'stream RSS MB':>14} {'files= RSS MB':>14}")
+    try:
+        for size_mb in args.sizes_mb:
+            with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+                path = os.path.join(directory, "1_probe.pcapng")
+                write_capture(path, int(size_mb * 1024 * 1024))
+                status, stream_rss = measure(context, url, path, "stream", compression)
+                assert status == 200, status
+                baseline = "skipped"
+                if size_mb <= args.baseline_max_mb:
+                    _, files_rss = measure(context, url, path, "files", None)
+                    baseline = f"{files_rss:.1f}"
+                print(f"{size_mb:>8g} {stream_rss:>14.1f} {baseline:>14}")
+    finally:
+        conn.send("stop")
+        sink.join(5)
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes_mb",
+        type=lambda value: [float(size) for size in value.split(",")],
+        default=[1, 16, 128, 1024],
+        help="Comma separated file sizes.",
+    )
+    parser.add_argument(
+        "--baseline_max_mb",
+        type=float,
+        default=256,
+        help="Largest file to upload the files= way, it needs RAM for the whole body.",
+    )
+    parser.add_argument("--compression", default="none", help="none, gzip or zstd.")
+    parser.add_argument(
+        "--dir", default=None, help="Directory for the files, not tmpfs for 1 GB."
+    )
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Synthetic 802.11 captures for benchmarks.
+
+Builds pcapng files with radiotap headers that look like what the external
+adapter produces in monitor mode: beacons from neighbouring networks, probe
+requests from passing phones, and data frames (with incompressible, i.e.
+encrypted, payloads) plus ACKs from clients of the hotspot.
+
+``RotatingWriter`` writes that traffic live into a ring of files the way
+``dumpcap -b duration:N`` does.
+"""
+import os
+import random
+import struct
+import threading
+import time
+
+LINKTYPE_IEEE802_11_RADIOTAP = 127
+
+# Supported rates, HT capabilities, extended capabilities and a WPS vendor
+# element, roughly what a phone sends in a probe request.
+PHONE_IES = (
+    b"\x01\x08\x02\x04\x0b\x16\x0c\x12\x18\x24"
+    + b"\x2d\x1a" + bytes(range(26))
+    + b"\x7f\x08\x00\x00\x08\x80\x00\x00\x00\x40"
+    + b"\xdd\x1e\x00\x50\xf2\x08" + bytes(26)
+)
+
+
+def block(block_type, body):
+    """Build a little endian pcapng block."""
+    body += b"\x00" * (-len(body) % 4)
+    length = len(body) + 12
+    return struct.pack("<II", block_type, length) + body + struct.pack("<I", length)
+
+
+class PcapngWriter:
+    """Minimal pcapng writer with a single radiotap interface."""
+
+    def __init__(self, fileobj, linktype=LINKTYPE_IEEE802_11_RADIOTAP):
+        """Write section header and interface description to fileobj."""
+        self.fileobj = fileobj
+        self.bytes_written = 0
+        self._write(block(0x0A0D0D0A, struct.pack("<IHHq", 0x1A2B3C4D, 1, 0, -1)))
+        self._write(block(1, struct.pack("<HHI", linktype, 0, 65535)))
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self.bytes_written += len(data)
+
+    def write_packet(self, data, timestamp):
+        """Write an enhanced packet block, timestamp in seconds."""
+        micros = int(timestamp * 1e6)
+        header = struct.pack(
+            "<IIIII", 0, micros >> 32, micros & 0xFFFFFFFF, len(data), len(data)
+        )
+        self._write(block(6, header + data))
+
+
+def radiotap(frequency=2437, rssi=-60):
+    """Radiotap header with TSFT, flags, rate, channel, signal, antenna, RX flags."""
+    present = 0
+    for bit in (0, 1, 2, 3, 5, 11, 14):
+        present |= 1 << bit
+    fields = struct.pack("<QBBHHbBH", 0, 0, 2, frequency, 0xA0, rssi, 1, 0)
+    return struct.pack("<BBHI", 0, 0, 8 + len(fields), present) + fields
+
+
+def channel_frequency(channel):
+    """Return centre frequency of a 2.4/5 GHz channel."""
+    if channel == 14:
+        return 2484
+    if channel < 14:
+        return 2407 + 5 * channel
+    return 5000 + 5 * channel
+
+
+def random_mac(rng):
+    """Return a random locally administered unicast MAC."""
+    mac = bytearray(rng.getrandbits(8) for _ in range(6))
+    mac[0] = (mac[0] & 0xFC) | 0x02
+    return bytes(mac)
+
+
+def probe_request(src, seq, ssid=b""):
+    """Broadcast probe request frame."""
+    header = struct.pack("<HH", 0x0040, 0) + b"\xff" * 6 + src + b"\xff" * 6
+    header += struct.pack("<H", (seq & 0xFFF) << 4)
+    return header + bytes([0, len(ssid)]) + ssid + PHONE_IES
+
+
+def beacon(bssid, seq, ssid, channel):
+    """Beacon frame."""
+    header = struct.pack("<HH", 0x0080, 0) + b"\xff" * 6 + bssid + bssid
+    header += struct.pack("<H", (seq & 0xFFF) << 4)
+    body = struct.pack("<QHH", seq * 102400, 100, 0x0431)
+    body += bytes([0, len(ssid)]) + ssid + b"\x01\x08\x82\x84\x8b\x96\x0c\x12\x18\x24"
+    body += bytes([3, 1, channel]) + b"\x05\x04\x00\x01\x00\x00"
+    body += b"\x30\x14\x01\x00\x00\x0f\xac\x04\x01\x00\x00\x0f\xac\x04"
+    body += b"\x01\x00\x00\x0f\xac\x02\x0c\x00"
+    return header + body
+
+
+def data_frame(src, dst, bssid, seq, payload, to_ds=True):
+    """Protected QoS data frame carrying payload."""
+    flags = 0x41 if to_ds else 0x42
+    addr1, addr2, addr3 = (bssid, src, dst) if to_ds else (dst, bssid, src)
+    header = struct.pack("<BBH", 0x88, flags, 44) + addr1 + addr2 + addr3
+    header += struct.pack("<HH", (seq & 0xFFF) << 4, 0)
+    return header + bytes(8) + payload
+
+
+def ack(dst):
+    """ACK control frame."""
+    return struct.pack("<BBH", 0xD4, 0, 0) + dst
+
+
+class TrafficGenerator:  # pylint: disable=too-many-instance-attributes
+    """Generate a mix of probe request and hotspot traffic."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        probe_rate=20.0,
+        beacon_rate=150.0,
+        data_rate=100.0,
+        devices=200,
+        networks=15,
+        clients=5,
+        channels=(1, 6, 11),
+        seed=0,
+        neighbour_data_rate=0.0,
+    ):
+        """Initialize generator, rates are frames per second.
+
+        neighbour_data_rate adds data frames between clients of the
+        neighbouring networks.
+        """
+        self.rng = random.Random(seed)
+        self.rates = [
+            ("probe", probe_rate),
+            ("beacon", beacon_rate),
+            ("data", data_rate),
+            ("neighbour", neighbour_data_rate),
+        ]
+        self.devices = [random_mac(self.rng) for _ in range(devices)]
+        self.networks = [
+            (random_mac(self.rng), f"network-{i}".encode(), self.rng.choice(channels))
+            for i in range(networks)
+        ]
+        self.clients = [random_mac(self.rng) for _ in range(clients)]
+        self.bssid = random_mac(self.rng)
+        self.channels = channels
+        self.seq = 0
+
+    def frames(self, duration, start=1_600_000_000.0):
+        """Yield (timestamp, packet) for duration seconds of traffic."""
+        total_rate = sum(rate for _, rate in self.rates)
+        if total_rate <= 0:
+            return
+        timestamp = start
+        while timestamp < start + duration:
+            timestamp += self.rng.expovariate(total_rate)
+            kind = self.rng.choices(
+                [name for name, _ in self.rates], [rate for _, rate in self.rates]
+            )[0]
+            for packet in self.packets(kind):
+                yield timestamp, packet
+
+    def packets(self, kind):
+        """Return packets for one event of kind."""
+        self.seq += 1
+        rssi = self.rng.randint(-90, -30)
+        if kind == "probe":
+            channel = self.rng.choice(self.channels)
+            src = self.rng.choice(self.devices)
+            ssid = self.rng.choice([b"", b"", b"eduroam", b"HomeWiFi"])
+            frame = probe_request(src, self.seq, ssid)
+            return [radiotap(channel_frequency(channel), rssi) + frame]
+        if kind == "beacon":
+            bssid, ssid, channel = self.rng.choice(self.networks)
+            frame = beacon(bssid, self.seq, ssid, channel)
+            return [radiotap(channel_frequency(channel), rssi) + frame]
+        client = self.rng.choice(self.clients)
+        bssid = self.bssid
+        if kind == "neighbour":
+            client = self.rng.choice(self.devices)
+            bssid = self.rng.choice(self.networks)[0]
+        size = self.rng.choice([40, 52, 80, 120, 400, 1200, 1460, 1460])
+        payload = self.rng.randbytes(size)
+        frame = data_frame(client, random_mac(self.rng), bssid, self.seq, payload)
+        return [radiotap(2437, rssi) + frame, radiotap(2437, rssi) + ack(client)]
+
+    def write(self, fileobj, duration, start=1_600_000_000.0):
+        """Write duration seconds of traffic as pcapng. Returns frame count."""
+        writer = PcapngWriter(fileobj)
+        count = 0
+        for timestamp, packet in self.frames(duration, start):
+            writer.write_packet(packet, timestamp)
+            count += 1
+        return count
+
+    def write_size(self, fileobj, size, start=1_600_000_000.0):
+        """Write traffic until about size bytes of pcapng. Returns frame count."""
+        writer = PcapngWriter(fileobj)
+        count = 0
+        for timestamp, packet in self.frames(float("inf"), start):
+            writer.write_packet(packet, timestamp)
+            count += 1
+            if writer.bytes_written >= size:
+                break
+        return count
+
+
+class RotatingWriter:  # pylint: disable=too-many-instance-attributes
+    """Write live traffic into files rotated every duration seconds.
+
+    Files are named like dumpcap names ring files, output ``x.pcapng``
+    becomes ``x_00001_20240101120000.pcapng``, ``x_00002_...`` and so on.
+    The previous file is closed before the next one is created.
+    """
+
+    def __init__(self, output, generator, duration=15, tick=0.05):
+        """Initialize writer for output path with a TrafficGenerator."""
+        self.base, self.extension = os.path.splitext(output)
+        self.generator = generator
+        self.duration = duration
+        self.tick = tick
+        self.stopping = threading.Event()
+        self.rotated = {}
+        self.frames = 0
+        self.bytes_written = 0
+
+    def stop(self):
+        """Stop writing, the current file is closed."""
+        self.stopping.set()
+
+    def run(self, total):
+        """Write for total seconds. Returns list of files written."""
+        started = time.time()
+        index = 0
+        while not self.stopping.is_set() and time.time() - started < total:
+            index += 1
+            path = "{}_{:05d}_{}{}".format(
+                self.base, index, time.strftime("%Y%m%d%H%M%S"), self.extension
+            )
+            end = min(time.time() + self.duration, started + total)
+            with open(path, "wb") as capture:
+                self.write_until(capture, end)
+            self.rotated[path] = time.time()
+        return list(self.rotated)
+
+    def write_until(self, capture, end):
+        """Write traffic to capture in real time until end."""
+        writer = PcapngWriter(capture)
+        last = time.time()
+        while not self.stopping.is_set():
+            now = time.time()
+            for timestamp, packet in self.generator.frames(now - last, last):
+                writer.write_packet(packet, timestamp)
+                self.frames += 1
+            last = now
+            capture.flush()
+            if now >= end:
+                break
+            self.stopping.wait(min(self.tick, end - now))
+        self.bytes_written += writer.bytes_written
@@ -9,19 +9,48 @@
 - 6: Start sticky hotspot mode and start capturing data.
 
 """
-import time
+import asyncio
 import json
 import enum
 import urllib
 import threading
 import os
 import datetime
+import functools
+import time
 import configargparse
 import requests
 from src.wifi import WiFiHandler
+from src.capture_filter import PROFILES
+from src.compression import resolve_encoding
 from src.dumpcap_observer import DumpcapObserver
+from src.hop_scheduler import HopScheduler, POLICIES, make_policy, parse_channels
+from src.instruction_channel import InstructionChannel
+from src.metrics import REGISTRY, MetricsServer
+from src.multi_radio import RADIO_OUTPUTS, merge_captures, parse_interfaces
+from src.multipart import multipart_upload
+from src.payload_policy import MODES, PayloadPolicy, make_payload_policy
+from src.probe_aggregator import (
+    AGGREGATE_FORMAT,
+    CaptureFollower,
+    MultiCaptureFollower,
+    ProbeAggregator,
+)
+from src.probe_extractor import extract_probe_records, PcapngError, RECORD_FORMAT
+from src.rotation import ROTATIONS, RotationController, make_rotation
+from src.runtime import Runtime, Wakeup
+from src.status_reporter import StatusReporter
+from src.storage import STORAGE_POLICIES, StorageManager
+from src.spool import Spool, SPOOL_NAME
+from src.startup import StartupTimer
+from src.uploader import Uploader
 
 EXT_IFACE = 'wlan1'
+CAPTURE_DIR = "/tmp/pi_sniffer_data"
+# Seconds to wait on the backend for a probe capture upload.
+PROBE_UPLOAD_TIMEOUT = 60
+# Seconds to wait on the backend for status and instruction calls.
+CONTROL_TIMEOUT = 20
 
 parser = configargparse.ArgumentParser(description="Start pi data collector.")
 parser.add_argument(
@@ -37,6 +66,211 @@ parser.add_argument("--ext_iface", required=True, help="External WiFi interface.
 parser.add_argument("--auth_code", required=True, help="Authentication code.")
 parser.add_argument("--server_url", required=True, help="Server URL.")
 parser.add_argument("--wifi_ap_password", required=True, help="Wifi AP Password.")
+parser.add_argument(
+    "--probe_upload_format",
+    required=False,
+    choices=["pcapng", "records", "aggregate"],
+    default="pcapng",
+    help="Upload probe captures as raw pcapng, compact probe request records "
+    "or probe requests aggregated per time window.",
+)
+parser.add_argument(
+    "--probe_window",
+    required=False,
+    type=float,
+    default=60,
+    help="Seconds per aggregation window, aggregates are uploaded as windows close.",
+)
+parser.add_argument(
+    "--upload_workers",
+    required=False,
+    type=int,
+    default=2,
+    help="Number of parallel hotspot capture uploads.",
+)
+parser.add_argument(
+    "--spool_max_mb",
+    required=False,
+    type=int,
+    default=64,
+    help="Pause hotspot capture when pending uploads exceed this many MB.",
+)
+parser.add_argument(
+    "--spool_max_files",
+    required=False,
+    type=int,
+    default=100,
+    help="Pause hotspot capture when more files than this are pending upload.",
+)
+parser.add_argument(
+    "--ap_rotation",
+    required=False,
+    choices=sorted(ROTATIONS),
+    default="fixed",
+    help="Rotate hotspot capture files every 15s, or adapt rotation to the "
+    "capture rate and uplink throughput.",
+)
+parser.add_argument(
+    "--ap_rotation_target_mb",
+    required=False,
+    type=float,
+    default=4,
+    help="File size the adaptive rotation aims for.",
+)
+parser.add_argument(
+    "--ap_rotation_max_latency",
+    required=False,
+    type=int,
+    default=60,
+    help="Longest the adaptive rotation keeps a capture file open, in seconds.",
+)
+parser.add_argument(
+    "--ap_capture_filter",
+    required=False,
+    choices=sorted(PROFILES),
+    default="all",
+    help="Capture filter profile in hotspot mode, unless the session sets one.",
+)
+parser.add_argument(
+    "--ap_payload_policy",
+    required=False,
+    choices=MODES,
+    default="full",
+    help="Capture whole frames in hotspot mode, truncate them to ap_snaplen "
+    "bytes, or keep headers and the first ap_flow_bytes of each flow, unless "
+    "the session sets a policy.",
+)
+parser.add_argument(
+    "--ap_snaplen",
+    required=False,
+    type=int,
+    default=256,
+    help="Bytes kept of each frame with the snaplen payload policy.",
+)
+parser.add_argument(
+    "--ap_flow_bytes",
+    required=False,
+    type=int,
+    default=1024,
+    help="Payload bytes kept of each flow with the headers payload policy.",
+)
+parser.add_argument(
+    "--capture_dir",
+    required=False,
+    default=CAPTURE_DIR,
+    help="Directory captures are written to before upload, tmpfs or e.g. a USB disk.",
+)
+parser.add_argument(
+    "--storage_budget_mb",
+    required=False,
+    type=int,
+    default=0,
+    help="Most MB captures may take up in capture_dir, 0 for no budget.",
+)
+parser.add_argument(
+    "--storage_policy",
+    required=False,
+    choices=sorted(STORAGE_POLICIES),
+    default="oldest",
+    help="What to evict over the storage budget: the oldest files, nothing "
+    "pending upload, or the oldest files of the session using the most.",
+)
+parser.add_argument(
+    "--instruction_channel",
+    required=False,
+    choices=["poll", "sse"],
+    default="poll",
+    help="Only poll for instructions, or also listen on the backend's push stream.",
+)
+parser.add_argument(
+    "--control_plane",
+    required=False,
+    choices=["legacy", "batched"],
+    default="legacy",
+    help="Fetch instruction, session and AP with separate calls or one control/sync/ call.",
+)
+parser.add_argument(
+    "--status_reporting",
+    required=False,
+    choices=["full", "delta"],
+    default="full",
+    help="Send the full status every update or only what changed.",
+)
+parser.add_argument(
+    "--status_full_every",
+    required=False,
+    type=int,
+    default=12,
+    help="With delta status reporting, send the full status every this many updates.",
+)
+parser.add_argument(
+    "--upload_compression",
+    required=False,
+    choices=["none", "gzip", "zstd"],
+    default="none",
+    help="Compress capture uploads on the fly (zstd needs the zstandard package).",
+)
+parser.add_argument(
+    "--upload_compression_level",
+    required=False,
+    type=int,
+    default=None,
+    help="Compression level, defaults to 6 for gzip and 3 for zstd.",
+)
+parser.add_argument(
+    "--hop_policy",
+    required=False,
+    choices=sorted(POLICIES),
+    default="fixed",
+    help="How probe mode divides listening time over channels.",
+)
+parser.add_argument(
+    "--hop_channels",
+    required=False,
+    default="2.4",
+    help="Channels hopped in probe mode: 2.4, 5, all or a list like 1,6,11,36.",
+)
+parser.add_argument(
+    "--hop_dwell",
+    required=False,
+    type=float,
+    default=10,
+    help="Seconds on each channel with the fixed hop policy.",
+)
+parser.add_argument(
+    "--hop_cycle",
+    required=False,
+    type=float,
+    default=30,
+    help="Seconds per pass over all channels with the weighted and adaptive policies.",
+)
+parser.add_argument(
+    "--monitor_ifaces",
+    required=False,
+    default="",
+    help="Extra monitor interfaces capturing probe requests, e.g. wlan2,wlan3. "
+    "The hop channels are split over ext_iface and these.",
+)
+parser.add_argument(
+    "--radio_output",
+    required=False,
+    choices=RADIO_OUTPUTS,
+    default="merged",
+    help="Merge the captures of the radios into one upload or upload one per radio.",
+)
+parser.add_argument(
+    "--metrics_port",
+    required=False,
+    type=int,
+    default=0,
+    help="Serve metrics on http://127.0.0.1:<port>/metrics, 0 to disable.",
+)
+parser.add_argument(
+    "--metrics_in_status",
+    required=False,
+    action="store_true",
+    help="Send a metrics snapshot along with every status update.",
+)
 parser.add_argument('-v', required=False, help='verbose', action='store_true')
 
 
@@ -52,16 +286,75 @@ class PiSniffer:  # pylint: disable=too-many-instance-attributes
     """Pi sniffer class."""
 
     def __init__(
-        self, ext_iface, int_iface, wifi_ap_password, token, server_url, verbose=False,
+        self,
+        ext_iface,
+        int_iface,
+        wifi_ap_password,
+        token,
+        server_url,
+        verbose=False,
+        probe_upload_format="pcapng",
+        probe_window=60,
+        upload_workers=2,
+        spool_max_mb=64,
+        spool_max_files=100,
+        ap_rotation="fixed",
+        ap_rotation_target_mb=4,
+        ap_rotation_max_latency=60,
+        ap_capture_filter="all",
+        ap_payload_policy="full",
+        ap_snaplen=256,
+        ap_flow_bytes=1024,
+        capture_dir=CAPTURE_DIR,
+        storage_budget_mb=0,
+        storage_policy="oldest",
+        instruction_channel="poll",
+        control_plane="legacy",
+        status_reporting="full",
+        status_full_every=12,
+        upload_compression=None,
+        upload_compression_level=None,
+        hop_policy="fixed",
+        hop_channels="2.4",
+        hop_dwell=10,
+        hop_cycle=30,
+        monitor_ifaces="",
+        radio_output="merged",
+        metrics_port=0,
+        metrics_in_status=False,
+        wifi=None,
+        autorun=True,
     ):  # pylint: disable=too-many-arguments
-        """Initialize pi sniffer object."""
-        self.wifi = WiFiHandler(ext_iface, int_iface, wifi_ap_password)
+        """Initialize pi sniffer object.
+
+        wifi replaces the WiFiHandler of ext_iface, e.g. with a simulated one
+        for load tests. With autorun the pi runs until stopped once
+        initialized, otherwise run is left to the caller.
+        """
+        self.startup = StartupTimer(metrics=REGISTRY)
+        self.wifi = wifi or self.startup.step(
+            "wifi",
+            WiFiHandler,
+            ext_iface,
+            int_iface,
+            wifi_ap_password,
+            monitor_ifaces=parse_interfaces(monitor_ifaces),
+        )
         self.mac = self.wifi.get_device_mac()
         self.ip_address = self.wifi.get_external_ip()
         self.state = WiFiState.NoState
         self.status_update_interval = 5
         self.server_url = server_url
         self.is_instruction_available = None
+        self.instruction_event = Wakeup()
+        self.status_wakeup = Wakeup()
+        self.runtime = Runtime(metrics=REGISTRY)
+        self.control_plane = control_plane
+        self.status_reporter = None
+        if status_reporting == "delta":
+            self.status_reporter = StatusReporter(full_every=status_full_every)
+        self.executed_code = None
+        self.pending_access_point = None
         self.session_id = None
         self.data_file = None
         self.access_point = dict(channel=None, ssid=None, sticky_ap=0)
@@ -69,12 +362,83 @@ class PiSniffer:  # pylint: disable=too-many-instance-attributes
         self.req_session.headers.update({"token": token})
         self.observer = None
         self.verbose = verbose
-        self.wifi.nm_disable()
+        self.probe_upload_format = probe_upload_format
+        self.probe_window = probe_window
+        self.probe_follower = None
+        self.probe_uploader = None
+        self.probe_lock = threading.Lock()
+        self.upload_workers = upload_workers
+        self.spool_max_bytes = spool_max_mb * 1024 * 1024
+        self.spool_max_files = spool_max_files
+        self.rotation = RotationController(
+            make_rotation(
+                ap_rotation,
+                duration=self.wifi.dumpcap_file_generation_duration,
+                target_mb=ap_rotation_target_mb,
+                max_latency=ap_rotation_max_latency,
+            )
+        )
+        self.ap_capture_filter = ap_capture_filter
+        self.session_capture_filter = None
+        self.payload_policy = PayloadPolicy(ap_payload_policy, ap_snaplen, ap_flow_bytes)
+        self.session_payload_policy = None
+        self.upload_compression = resolve_encoding(upload_compression)
+        self.upload_compression_level = upload_compression_level
+        # Kept across probe sessions so observed channel rates carry over.
+        self.hop_scheduler = HopScheduler(
+            parse_channels(hop_channels),
+            make_policy(hop_policy, dwell=hop_dwell, cycle=hop_cycle),
+        )
+        self.radio_output = radio_output
+        self.metrics = REGISTRY
+        self.metrics_in_status = metrics_in_status
+        self.metrics_server = None
+        if metrics_port:
+            self.metrics_server = MetricsServer(self.metrics, metrics_port)
+            self.metrics_server.start()
+        self.instruction_noticed_at = None
         self._create_urls()
-        self.set_wifi_state()
-        self.start_updates()
+        self.capture_dir = capture_dir
+        # Setting up the interfaces and resuming uploads don't depend on
+        # each other.
+        self.startup.concurrently(
+            self.init_network,
+            functools.partial(self.startup.step, "resume_uploads", self.resume_uploads),
+        )
+        self.storage = None
+        if storage_budget_mb:
+            self.storage = StorageManager(
+                self.capture_dir,
+                self.spool,
+                storage_budget_mb * 1024 * 1024,
+                storage_policy,
+                metrics=self.metrics,
+            )
+        self.channel = None
+        if instruction_channel == "sse":
+            self.start_instruction_channel(token)
+        self.startup.finish()
+        print(self.startup.report())
+
+        if autorun:
+            self.run()
 
-        self.fetch_and_execute_instructions()
+    def run(self):
+        """Run status updates and instructions until stopped, then clean up."""
+        try:
+            # Each loop is restarted on its own if it fails.
+            self.runtime.run(
+                status=self.status_loop,
+                instructions=self.instruction_loop,
+                supervisor=functools.partial(
+                    self.runtime.supervise, self.wifi.capture_processes
+                ),
+                aggregation=self.aggregation_loop,
+                rotation=self.rotation_loop,
+                storage=self.storage_loop,
+            )
+        finally:
+            self.clean_up()
 
     def _create_urls(self):
         """Create URLs during initialization."""
@@ -88,96 +452,272 @@ class PiSniffer:  # pylint: disable=too-many-instance-attributes
             session_fetch=urllib.parse.urljoin(self.server_url, "session/latest/"),
             ap_analyze=urllib.parse.urljoin(self.server_url, "ap/analyze/"),
             ap_fetch=urllib.parse.urljoin(self.server_url, "session/ap/"),
+            instruction_stream=urllib.parse.urljoin(
+                self.server_url, "instructions/stream/"
+            ),
+            control_sync=urllib.parse.urljoin(self.server_url, "control/sync/"),
+        )
+
+    def init_network(self):
+        """Hand the interfaces over from NetworkManager, then set the wifi state."""
+        self.startup.step("nm_disable", self.wifi.nm_disable)
+        self.startup.step("wifi_state", self.set_wifi_state)
+
+    def resume_uploads(self):
+        """Queue hotspot captures left pending by a previous run."""
+        os.makedirs(self.capture_dir, exist_ok=True)
+        self.spool = Spool(os.path.join(self.capture_dir, SPOOL_NAME))
+        for path in self.spool.untracked(self.capture_dir, "*_ap_*.pcapng"):
+            # Ring files are named <session id>_<time>_ap_<n>_<time>.pcapng
+            session_id = os.path.basename(path).split("_")[0]
+            self.spool.add(
+                path,
+                self.urls["ap_analyze"],
+                {"mac": self.mac, "name": path, "session_id": session_id},
+            )
+        self.resume_uploader = Uploader(
+            self.req_session,
+            self.urls["ap_analyze"],
+            max_workers=self.upload_workers,
+            spool=self.spool,
+            compression=self.upload_compression,
+            compression_level=self.upload_compression_level,
+            metrics=self.metrics,
         )
+        print(f"Resuming {self.resume_uploader.resume()} pending uploads")
+        self.resume_uploader.shutdown(wait=False)
+        resumed = self.probe_batch_uploader().resume()
+        if resumed:
+            print(f"Resuming {resumed} pending probe batches")
+
+    def probe_batch_uploader(self):
+        """Return the uploader for aggregated probe request batches."""
+        if self.probe_uploader is None:
+            self.probe_uploader = Uploader(
+                self.req_session,
+                self.urls["probe"],
+                max_workers=1,
+                spool=self.spool,
+                compression=self.upload_compression,
+                compression_level=self.upload_compression_level,
+                metrics=self.metrics,
+            )
+        return self.probe_uploader
 
     def set_wifi_state(self, mode=None):
         """Set wifi state as per state of object."""
         self.state = mode if mode else self.state
+        started = time.monotonic()
         if self.state == WiFiState.HostAP:
             self.wifi.set_hostap_mode()
         else:
             self.wifi.set_probe_req_mode()
+        elapsed = time.monotonic() - started
+        self.metrics.histogram(
+            "pi_mode_switch_seconds", "Time to switch the interface mode."
+        ).observe(elapsed, state=self.state.name)
+        print(f"Switched to {self.state.name} in {elapsed:.2f}s")
 
     # Commnication with backend
+    def status_payload(self, executed_code=None):
+        """Return the status update payload, acknowledging executed_code."""
+        connected_users = (
+            self.wifi.get_connected_users()
+            if self.state == WiFiState.HostAP
+            else None
+        )
+        ap_details = {
+            "access_point": self.access_point,
+            "connected_users": connected_users,
+        }
+        payload = {
+            "mac": self.mac,
+            "ip": self.ip_address,
+            "state": str(self.state),
+            "ap_details": ap_details,
+        }
+        if executed_code is not None:
+            # Acknowledge last instruction along with the status update.
+            payload["executed"] = {"code": executed_code}
+        if self.metrics_in_status:
+            payload["metrics"] = self.metrics.snapshot()
+        return payload
+
     def send_status_update(self):
-        """Send regular status update."""
-        while True:
-            connected_users = (
-                self.wifi.get_connected_users()
-                if self.state == WiFiState.HostAP
-                else None
+        """Send a status update and note whether an instruction is available."""
+        executed_code = self.executed_code
+        payload = self.status_payload(executed_code)
+        if self.verbose:
+            print(json.dumps(payload))
+        headers = None
+        if self.status_reporter:
+            data, headers = self.status_reporter.encode(
+                self.status_reporter.build(payload)
             )
-            ap_details = {
-                "access_point": self.access_point,
-                "connected_users": connected_users,
-            }
-            payload = {
-                "mac": self.mac,
-                "ip": self.ip_address,
-                "state": str(self.state),
-                "ap_details": ap_details,
-            }
-            if self.verbose:
-                print(json.dumps(payload))
-            try:
-                response = self.req_session.post(
-                    self.urls["status_update"], data=json.dumps(payload), timeout=20
-                ).json()
-                if self.verbose:
-                    print(response)
-                self.is_instruction_available = response["is_instruction_available"]
-            except requests.ConnectionError as error:
-                print(error)
-            time.sleep(self.status_update_interval)
-
-    def start_updates(self):
-        """Start status updates in a thread."""
-        self.status_update_thread = threading.Thread(
-            target=self.send_status_update, args=()
+        else:
+            data = json.dumps(payload)
+        started = time.monotonic()
+        try:
+            response = self.req_session.post(
+                self.urls["status_update"], data=data, headers=headers, timeout=CONTROL_TIMEOUT
+            ).json()
+        except (requests.RequestException, ValueError) as error:
+            self.metrics.counter(
+                "pi_status_update_errors_total", "Status updates that failed."
+            ).inc()
+            if self.status_reporter:
+                self.status_reporter.reset()
+            print(error)
+            return
+        if self.status_reporter:
+            self.status_reporter.acknowledge(response)
+        self.metrics.histogram(
+            "pi_status_update_seconds", "Status update round trip time."
+        ).observe(time.monotonic() - started)
+        if self.verbose:
+            print(response)
+        if executed_code is not None and self.executed_code == executed_code:
+            self.executed_code = None
+        self.is_instruction_available = response["is_instruction_available"]
+        if self.is_instruction_available:
+            self.notice_instruction()
+            self.instruction_event.set()
+
+    async def status_loop(self):
+        """Send status updates every status_update_interval or when woken up."""
+        while True:
+            await self.runtime.call(self.send_status_update)
+            await self.status_wakeup.wait(self.status_update_interval)
+            self.status_wakeup.clear()
+
+    def start_instruction_channel(self, token):
+        """Listen for pushed instructions on a separate connection."""
+        stream_session = requests.Session()
+        stream_session.headers.update({"token": token})
+        self.channel = InstructionChannel(
+            stream_session,
+            self.urls["instruction_stream"],
+            self.mac,
+            self.on_instruction_pushed,
         )
-        self.status_update_thread.daemon = True  # Daemonize thread
-        self.status_update_thread.start()  # Start the execution
+        self.channel.start()
+
+    def on_instruction_pushed(self, event):
+        """Wake up the instruction loop for a pushed instruction."""
+        if self.verbose:
+            print(f"Instruction pushed: {event}")
+        self.is_instruction_available = 1
+        self.notice_instruction()
+        self.instruction_event.set()
+
+    def notice_instruction(self):
+        """Remember when an instruction was first seen to be available."""
+        if self.instruction_noticed_at is None:
+            self.instruction_noticed_at = time.monotonic()
 
-    def fetch_and_execute_instructions(self):
-        """Fetch and run instruction if available."""
+    async def instruction_loop(self):
+        """Fetch and run instructions one at a time as they become available."""
         while True:
             if self.is_instruction_available:
-                instruction = self.fetch_instruction()
-                self.fetch_and_set_session_id()
-                if self.session_id:
-                    self.execute_instruction(instruction)
-                else:
-                    self.execute_instruction(5)
-                self.req_session.post(
-                    self.urls["executed"], data={"mac": self.mac, "code": instruction}
-                )
-                self.is_instruction_available = 0
-            else:
                 try:
-                    time.sleep(self.status_update_interval // 2)
-                except KeyboardInterrupt:
-                    self.clean_up()
+                    await self.runtime.call(self.handle_instruction)
+                finally:
+                    # Even if the ack failed, the restarted loop must not run
+                    # the instruction again, the next status update tells.
+                    self.is_instruction_available = 0
+            else:
+                await self.instruction_event.wait(self.status_update_interval // 2)
+                self.instruction_event.clear()
+
+    def handle_instruction(self):
+        """Fetch, execute and acknowledge the available instruction."""
+        started = self.instruction_noticed_at or time.monotonic()
+        self.instruction_noticed_at = None
+        instruction = None
+        if self.control_plane == "batched":
+            instruction = self.sync_control_plane()
+        if instruction is None:
+            instruction = self.fetch_instruction()
+            self.fetch_and_set_session_id()
+        if self.session_id:
+            self.execute_instruction(instruction)
+        else:
+            self.execute_instruction(5)
+        self.pending_access_point = None
+        if self.control_plane == "batched":
+            # Ack rides on the status update, sent right away.
+            self.executed_code = instruction
+            self.status_wakeup.set()
+        else:
+            self.req_session.post(
+                self.urls["executed"],
+                data={"mac": self.mac, "code": instruction},
+                timeout=CONTROL_TIMEOUT,
+            )
+        self.metrics.histogram(
+            "pi_instruction_latency_seconds",
+            "Time from an instruction being available to it being executed.",
+        ).observe(time.monotonic() - started, code=instruction)
+        return instruction
+
+    def sync_control_plane(self):
+        """Fetch instruction, session id and AP in one request.
+
+        Returns the instruction code, or None if the backend doesn't support
+        the batched control plane, in which case we fall back to legacy calls.
+        The legacy calls are also used if the request fails.
+        """
+        try:
+            response = self.req_session.get(
+                self.urls["control_sync"],
+                params={"mac": self.mac},
+                timeout=CONTROL_TIMEOUT,
+            )
+        except requests.RequestException as error:
+            print(f"control/sync/ failed, using legacy calls: {error}")
+            return None
+        if response.status_code == 404:
+            print("Backend has no control/sync/ endpoint, using legacy calls")
+            self.control_plane = "legacy"
+            return None
+        sync = response.json()
+        self.session_id = sync["session_id"] if sync["session_id"] != 0 else None
+        self.session_capture_filter = sync.get("capture_filter")
+        self.pending_access_point = sync.get("access_point")
+        return int(sync["code"])
 
     def fetch_instruction(self):
         """Fetch instructions for the pi."""
         response = self.req_session.get(
-            self.urls["instruction_fetch"], params={"mac": self.mac}
+            self.urls["instruction_fetch"],
+            params={"mac": self.mac},
+            timeout=CONTROL_TIMEOUT,
         ).json()
         return int(response["code"])
 
     def fetch_and_set_session_id(self):
         """Fetch and set session id."""
-        resp = self.req_session.get(self.urls["session_fetch"]).json()
+        resp = self.req_session.get(
+            self.urls["session_fetch"], timeout=CONTROL_TIMEOUT
+        ).json()
         if resp["id"] != 0:
             self.session_id = resp["id"]
         else:
             self.session_id = None
+        # Sessions may pick the hotspot capture filter profile.
+        self.session_capture_filter = resp.get("capture_filter")
 
     def fetch_and_set_ap(self, sticky_ap):
         """Fetch and set access point."""
-        access_point = self.req_session.get(
-            self.urls["ap_fetch"], params={"sticky": sticky_ap}
-        ).json()
+        access_point = self.pending_access_point
+        if not access_point:
+            access_point = self.req_session.get(
+                self.urls["ap_fetch"],
+                params={"sticky": sticky_ap},
+                timeout=CONTROL_TIMEOUT,
+            ).json()
+        # Sessions may pick how much of each frame the hotspot capture keeps.
+        self.session_payload_policy = access_point.get("payload_policy")
         self.set_access_point(access_point["ssid"], access_point["channel"], sticky_ap)
 
     def execute_instruction(self, code):
@@ -213,29 +753,184 @@ class PiSniffer:  # pylint: disable=too-many-instance-attributes
     def start_collecting_probe(self):
         """Start collecting probe request data."""
         self.set_wifi_state(WiFiState.ProbeReq)
-        self.data_file = "/tmp/pi_sniffer_data/{}_{}_probe.pcapng".format(
+        self.data_file = self.capture_dir + "/{}_{}_probe.pcapng".format(
             self.session_id, datetime.datetime.now().strftime("%d%m%Y%H%M%S")
         )
         os.makedirs(os.path.split(self.data_file)[0], exist_ok=True)
-        self.wifi.start_collecting_data(self.data_file, probe_req_only=True)
+        self.wifi.start_collecting_data(
+            self.data_file, probe_req_only=True, scheduler=self.hop_scheduler
+        )
+        if self.probe_upload_format == "aggregate":
+            captures = self.probe_captures()
+            if len(captures) > 1:
+                # One aggregator for all radios, so groups heard twice are one row.
+                self.probe_follower = MultiCaptureFollower(
+                    list(captures.values()), ProbeAggregator(self.probe_window)
+                )
+            else:
+                self.probe_follower = CaptureFollower(
+                    self.data_file, ProbeAggregator(self.probe_window)
+                )
+
+    def probe_captures(self):
+        """Return the probe capture file of each radio, data_file first."""
+        captures = {None: self.data_file}
+        for interface, path in self.wifi.probe_outputs.items():
+            if path != self.data_file:
+                captures[interface] = path
+        return captures
 
     def stop_collecting_probe(self):
         """Stop collecting probe request data and send."""
         self.wifi.stop_collecting_data()
         self.set_wifi_state(WiFiState.NoState)
-        response = self.req_session.post(
-            self.urls["probe"],
-            data={
-                "mac": self.mac,
-                "name": self.data_file.split("/")[-1],
-                "session_id": self.session_id,
-            },
-            files={"data": open(self.data_file, "rb")},
-        )
-        if response.status_code == 200:
-            os.remove(self.data_file)
+        print(f"Probe frames per channel: {self.hop_scheduler.summary()}")
+        if self.probe_upload_format == "aggregate":
+            self.finish_probe_aggregation()
+            return
+        captures = self.probe_captures()
+        if len(captures) > 1 and self.radio_output == "merged":
+            self.merge_probe_captures(list(captures.values()))
+            captures = {None: self.data_file}
+        uploaded = [
+            self.upload_probe_capture(path, radio)
+            for radio, path in captures.items()
+        ]
+        if all(uploaded):
             self.data_file = None
 
+    def merge_probe_captures(self, paths):
+        """Merge the radio captures at paths into data_file, the first of them."""
+        merged_file = self.data_file + ".merged"
+        try:
+            packets = merge_captures(paths, merged_file)
+        except (OSError, PcapngError) as error:
+            # Upload what the external interface captured rather than nothing.
+            print(f"Cannot merge radio captures: {error}")
+            return
+        os.replace(merged_file, self.data_file)
+        for path in paths[1:]:
+            if os.path.exists(path):
+                os.remove(path)
+        print(f"Merged {len(paths)} radio captures, {packets} packets")
+
+    def upload_probe_capture(self, capture_file, radio=None):
+        """Upload a probe capture, removing it once acknowledged.
+
+        radio names the extra monitor interface of a per radio capture.
+        Returns whether the upload was acknowledged, True if there was no
+        capture to upload, e.g. as tshark never wrote one.
+        """
+        if not os.path.exists(capture_file):
+            print(f"No probe capture at {capture_file}, nothing to upload")
+            return True
+        data = {
+            "mac": self.mac,
+            "name": capture_file.split("/")[-1],
+            "session_id": self.session_id,
+        }
+        if radio is not None:
+            data["radio"] = radio
+        upload_file = capture_file
+        if self.probe_upload_format == "records":
+            try:
+                upload_file = extract_probe_records(capture_file)
+            except (PcapngError, OSError) as error:
+                print(f"Uploading {capture_file} as is, no records: {error}")
+            else:
+                data["name"] = upload_file.split("/")[-1]
+                data["format"] = RECORD_FORMAT
+        body, headers = multipart_upload(
+            upload_file, data, self.upload_compression, self.upload_compression_level
+        )
+        try:
+            self.metrics.counter(
+                "pi_capture_bytes_total", "Bytes of finished capture files."
+            ).inc(os.path.getsize(capture_file), mode="probe")
+        except OSError:
+            pass
+        try:
+            with body:
+                response = self.req_session.post(
+                    self.urls["probe"],
+                    data=body,
+                    headers=headers,
+                    timeout=PROBE_UPLOAD_TIMEOUT,
+                )
+        except (requests.RequestException, OSError) as error:
+            print(f"Upload of {capture_file} failed: {error}")
+            return False
+        outcome = "acked" if response.status_code == 200 else "failed"
+        self.metrics.counter(f"pi_upload_files_{outcome}_total").inc(
+            endpoint=urllib.parse.urlparse(self.urls["probe"]).path
+        )
+        if response.status_code != 200:
+            return False
+        if upload_file != capture_file:
+            os.remove(upload_file)
+        os.remove(capture_file)
+        return True
+
+    async def aggregation_loop(self):
+        """Upload probe request aggregates as their windows close."""
+        while True:
+            await asyncio.sleep(self.probe_window)
+            if self.probe_follower is not None:
+                await self.runtime.call(self.flush_probe_batch)
+
+    def flush_probe_batch(self, final=False):
+        """Aggregate new probe requests and queue finished groups for upload.
+
+        With final, every group is uploaded and aggregation ends. Returns the
+        path of the queued batch, None if there was nothing to upload.
+        """
+        with self.probe_lock:
+            follower = self.probe_follower
+            if follower is None:
+                return None
+            follower.poll()
+            aggregator = follower.aggregator
+            frames, dropped = aggregator.frames, aggregator.dropped
+            rows = aggregator.flush(closed_only=not final)
+            if final:
+                follower.close()
+                self.probe_follower = None
+            if not rows:
+                return None
+            path = self.capture_dir + "/{}_{}_probe_agg.ndjson".format(
+                self.session_id, datetime.datetime.now().strftime("%d%m%Y%H%M%S%f")
+            )
+            with open(path, "w") as batch:
+                aggregator.write_batch(rows, batch)
+        self.metrics.counter(
+            "pi_probe_frames_total", "Probe requests aggregated."
+        ).inc(frames)
+        self.metrics.counter(
+            "pi_probe_frames_dropped_total", "Probe requests dropped, buffer full."
+        ).inc(dropped)
+        data = {
+            "mac": self.mac,
+            "name": os.path.basename(path),
+            "session_id": self.session_id,
+            "format": AGGREGATE_FORMAT,
+        }
+        self.spool.add(path, self.urls["probe"], data)
+        self.probe_batch_uploader().submit(path, data)
+        return path
+
+    def finish_probe_aggregation(self):
+        """Upload the remaining aggregates and drop the capture."""
+        self.flush_probe_batch(final=True)
+        for path in self.probe_captures().values():
+            try:
+                self.metrics.counter(
+                    "pi_capture_bytes_total", "Bytes of finished capture files."
+                ).inc(os.path.getsize(path), mode="probe")
+                os.remove(path)
+            except OSError:
+                pass
+        self.data_file = None
+
     def set_access_point(self, ssid, channel, sticky_ap):
         """Set access point for the pi."""
         self.access_point["channel"] = channel
@@ -245,20 +940,96 @@ class PiSniffer:  # pylint: disable=too-many-instance-attributes
 
     def start_collecting_ap(self):
         """Start collecting access point data."""
-        self.data_file = "/tmp/pi_sniffer_data/{}_{}_ap.pcapng".format(
+        self.data_file = self.capture_dir + "/{}_{}_ap.pcapng".format(
             self.session_id, datetime.datetime.now().strftime("%d%m%Y%H%M%S")
         )
+        try:
+            payload_policy = make_payload_policy(
+                self.session_payload_policy, self.payload_policy
+            )
+        except (ValueError, TypeError, AttributeError) as error:
+            print(f"Invalid session payload policy, using the default: {error}")
+            payload_policy = self.payload_policy
         # initialise observer to send files every 10 seconds
         self.observer = DumpcapObserver(
             self.req_session,
             self.session_id,
             self.mac,
             self.urls["ap_analyze"],
-            path="/tmp/pi_sniffer_data",
+            path=self.capture_dir,
+            max_workers=self.upload_workers,
+            spool=self.spool,
+            max_spool_bytes=self.spool_max_bytes,
+            max_spool_files=self.spool_max_files,
+            on_backpressure=self.wifi.pause_collecting_ap_data,
+            compression=self.upload_compression,
+            compression_level=self.upload_compression_level,
+            rotation=self.rotation,
+            storage=self.storage,
+            payload_policy=payload_policy if payload_policy.mode == "headers" else None,
+            metrics=self.metrics,
         )
         self.observer.start_observer()
         # start collecting data
-        self.wifi.start_collecting_ap_data(self.data_file)
+        self.wifi.start_collecting_ap_data(
+            self.data_file,
+            self.capture_ring(self.rotation.current),
+            capture_filter=self.session_capture_filter or self.ap_capture_filter,
+            snaplen=payload_policy.dumpcap_snaplen(),
+        )
+
+    def capture_ring(self, ring):
+        """Return ring bounded by the storage budget, if there is one."""
+        if self.storage is None:
+            return ring
+        return self.storage.ring(ring, self.session_id)
+
+    async def rotation_loop(self):
+        """Re-arm dumpcap when the rotation controller picks new ring parameters."""
+        while True:
+            await asyncio.sleep(self.rotation.min_interval / 4)
+            await self.runtime.call(self.update_rotation)
+
+    def update_rotation(self):
+        """Re-arm a running hotspot capture if the ring parameters changed.
+
+        Returns the new ring, None if dumpcap was left as is.
+        """
+        if self.state != WiFiState.HostAP or self.observer is None:
+            return None
+        if self.observer.paused:
+            # Restarting dumpcap would resume a capture paused for backpressure.
+            return None
+        ring = self.rotation.update()
+        if ring is None:
+            return None
+        self.data_file = self.capture_dir + "/{}_{}_ap.pcapng".format(
+            self.session_id, datetime.datetime.now().strftime("%d%m%Y%H%M%S")
+        )
+        self.wifi.rearm_collecting_ap_data(self.data_file, self.capture_ring(ring))
+        self.metrics.counter(
+            "pi_capture_rotation_changes_total", "Times dumpcap was re-armed."
+        ).inc()
+        print(f"Capture rotation: {self.rotation.stats()}")
+        return ring
+
+    async def storage_loop(self):
+        """Keep the capture directory within the storage budget."""
+        while True:
+            await asyncio.sleep(self.status_update_interval * 2)
+            if self.storage is not None:
+                await self.runtime.call(self.enforce_storage)
+
+    def enforce_storage(self):
+        """Evict captures over the storage budget.
+
+        While capturing in hotspot mode the observer does it along with
+        pausing capture, as it does for its spool budget.
+        """
+        if self.state == WiFiState.HostAP and self.observer is not None:
+            self.observer.check_backpressure()
+        else:
+            self.storage.enforce()
 
     def stop_collecting_ap(self, change_state=True):
         """Stop collecting access point data."""
@@ -289,6 +1060,13 @@ class PiSniffer:  # pylint: disable=too-many-instance-attributes
 
     def clean_up(self):
         """Clean up function"""
+        if self.channel:
+            self.channel.stop()
+        if self.metrics_server:
+            self.metrics_server.stop()
+        if self.probe_uploader:
+            self.probe_uploader.shutdown(wait=False)
+        self.runtime.shutdown()
         self.wifi.stop_hostap()
 
 
@@ -304,6 +1082,35 @@ if __name__ == "__main__":
             args.auth_code,
             args.server_url,
             args.v,
+            probe_upload_format=args.probe_upload_format,
+            probe_window=args.probe_window,
+            upload_workers=args.upload_workers,
+            spool_max_mb=args.spool_max_mb,
+            spool_max_files=args.spool_max_files,
+            ap_rotation=args.ap_rotation,
+            ap_rotation_target_mb=args.ap_rotation_target_mb,
+            ap_rotation_max_latency=args.ap_rotation_max_latency,
+            ap_capture_filter=args.ap_capture_filter,
+            ap_payload_policy=args.ap_payload_policy,
+            ap_snaplen=args.ap_snaplen,
+            ap_flow_bytes=args.ap_flow_bytes,
+            capture_dir=args.capture_dir,
+            storage_budget_mb=args.storage_budget_mb,
+            storage_policy=args.storage_policy,
+            instruction_channel=args.instruction_channel,
+            control_plane=args.control_plane,
+            status_reporting=args.status_reporting,
+            status_full_every=args.status_full_every,
+            upload_compression=args.upload_compression,
+            upload_compression_level=args.upload_compression_level,
+            hop_policy=args.hop_policy,
+            hop_channels=args.hop_channels,
+            hop_dwell=args.hop_dwell,
+            hop_cycle=args.hop_cycle,
+            monitor_ifaces=args.monitor_ifaces,
+            radio_output=args.radio_output,
+            metrics_port=args.metrics_port,
+            metrics_in_status=args.metrics_in_status,
         )
     except KeyboardInterrupt as error:
         if PI_SNIFFER:
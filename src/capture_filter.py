@@ -0,0 +1,141 @@
+"""
+Capture filter profiles for hotspot capture.
+
+In hotspot mode dumpcap listens on the monitor interface, so without a
+capture filter it writes every frame on the channel: beacons and probe
+requests of neighbouring networks and ACKs as well as the traffic of our own
+clients. A profile picks a BPF capture filter to cut that down before it
+takes up tmpfs and uplink:
+
+- all: no filter (the original behaviour)
+- bssid: frames to, from or about our BSSID only
+- data: data frames only
+- no_control: everything but control frames (ACK, RTS, CTS, block ACK)
+- bssid_data: data frames of our BSSID only
+
+Profiles are selected by name, from the command line or per session by the
+backend, never as raw filter text, as the filter ends up on a shell command
+line. The expression is compiled by ``dumpcap -d`` before capture starts so a
+filter the interface's link type doesn't support is caught up front.
+
+``FilterProfile.matches`` applies the same filter to a raw 802.11 frame in
+Python, for benchmarking profiles on captures without libpcap.
+"""
+import re
+import struct
+import subprocess
+
+MAC_RE = re.compile(r"^[0-9a-f]{2}(:[0-9a-f]{2}){5}$")
+
+# 802.11 frame types.
+MGMT, CTRL, DATA = 0, 1, 2
+# Control frame subtypes carrying only a receiver address.
+CTRL_RA_ONLY = (12, 13)  # CTS, ACK
+
+
+class CaptureFilterError(ValueError):
+    """Raised for unknown profiles and filters dumpcap rejects."""
+
+
+def frame_addresses(frame):
+    """Return (type, [addresses]) of a raw 802.11 frame."""
+    if len(frame) < 10:
+        return None, []
+    frame_control = struct.unpack_from("<H", frame)[0]
+    frame_type = (frame_control >> 2) & 3
+    subtype = (frame_control >> 4) & 15
+    count = 3
+    if frame_type == CTRL:
+        count = 1 if subtype in CTRL_RA_ONLY else 2
+    addresses = [
+        frame[4 + 6 * i:10 + 6 * i]
+        for i in range(count)
+        if len(frame) >= 10 + 6 * i
+    ]
+    return frame_type, addresses
+
+
+class FilterProfile:
+    """Named capture filter."""
+
+    def __init__(self, name, types=None, bssid_only=False):
+        """Initialize profile keeping frame types (all if None), of our BSSID only."""
+        self.name = name
+        self.types = types
+        self.bssid_only = bssid_only
+
+    def bpf(self, bssid=None):
+        """Return the BPF capture filter, None to capture everything."""
+        parts = []
+        if self.types is not None:
+            names = {MGMT: "type mgt", CTRL: "type ctl", DATA: "type data"}
+            excluded = [names[kind] for kind in (MGMT, CTRL, DATA) if kind not in self.types]
+            included = [names[kind] for kind in self.types]
+            if len(included) == 1:
+                parts.append(included[0])
+            else:
+                parts.append(" and ".join(f"not {name}" for name in excluded))
+        if self.bssid_only:
+            bssid = (bssid or "").lower()
+            if not MAC_RE.match(bssid):
+                raise CaptureFilterError(f"Invalid BSSID {bssid!r} for profile {self.name}")
+            parts.append(
+                f"(wlan addr1 {bssid} or wlan addr2 {bssid} or wlan addr3 {bssid})"
+            )
+        return " and ".join(parts) or None
+
+    def matches(self, frame, bssid=None):
+        """Return whether the filter keeps a raw 802.11 frame."""
+        frame_type, addresses = frame_addresses(frame)
+        if frame_type is None:
+            return False
+        if self.types is not None and frame_type not in self.types:
+            return False
+        if self.bssid_only:
+            return bytes.fromhex(bssid.replace(":", "")) in addresses
+        return True
+
+
+PROFILES = {
+    profile.name: profile
+    for profile in (
+        FilterProfile("all"),
+        FilterProfile("bssid", bssid_only=True),
+        FilterProfile("data", types=(DATA,)),
+        FilterProfile("no_control", types=(MGMT, DATA)),
+        FilterProfile("bssid_data", types=(DATA,), bssid_only=True),
+    )
+}
+
+
+def get_profile(name):
+    """Return the profile called name."""
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise CaptureFilterError(f"Unknown capture filter profile {name!r}") from None
+
+
+def validate_filter(expression, interface, dumpcap_bin="dumpcap", timeout=10):
+    """Compile expression for interface with dumpcap, raise CaptureFilterError if invalid."""
+    try:
+        result = subprocess.run(
+            [dumpcap_bin, "-i", interface, "-f", expression, "-d"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            timeout=timeout,
+            check=False,
+        )
+    except (OSError, subprocess.TimeoutExpired) as error:
+        raise CaptureFilterError(f"Cannot validate capture filter: {error}") from error
+    if result.returncode != 0:
+        message = result.stderr.decode(errors="replace").strip()
+        raise CaptureFilterError(f"Invalid capture filter {expression!r}: {message}")
+
+
+def resolve_filter(name, interface, bssid, dumpcap_bin="dumpcap"):
+    """Return the validated BPF filter of profile name, None for no filter."""
+    expression = get_profile(name).bpf(bssid)
+    if expression is not None:
+        validate_filter(expression, interface, dumpcap_bin)
+    return expression
@@ -0,0 +1,114 @@
+"""
+Channel hopper thread for probe request capture.
+
+Hops the monitor interface through the channels planned by a
+``HopScheduler`` in a daemon thread that can be stopped at any point, also in
+the middle of a dwell. Frames appended to the capture file are counted per
+channel after every dwell and fed back to the scheduler.
+
+The time each channel switch takes is recorded, so slow or failing switches
+show up in ``stats``.
+"""
+import threading
+import time
+
+from .hop_scheduler import CaptureTail
+from .nl80211 import NetlinkError
+from .wificommon import WiFiControlError
+
+
+def percentile(values, fraction):
+    """Return the value at fraction (0-1) of the sorted values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class ChannelHopper:  # pylint: disable=too-many-instance-attributes
+    """Cancellable channel hopping thread."""
+
+    def __init__(self, set_channel, scheduler, capture_file=None, max_latencies=1000):
+        """Initialize hopper.
+
+        set_channel is called with a channel number to tune the interface.
+        Only the last max_latencies switch times are kept.
+        """
+        self.set_channel = set_channel
+        self.scheduler = scheduler
+        self.capture_file = capture_file
+        self.max_latencies = max_latencies
+        self.stopping = threading.Event()
+        self.thread = None
+        self.channel = None
+        self.switches = 0
+        self.failures = 0
+        self.latencies = []
+
+    def start(self):
+        """Start hopping in a daemon thread."""
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        """Stop hopping and wait for the thread to finish."""
+        self.stopping.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+        self.thread = None
+
+    def is_running(self):
+        """Return True while the hopping thread is alive."""
+        return self.thread is not None and self.thread.is_alive()
+
+    def run(self):
+        """Hop until stopped."""
+        capture = CaptureTail(self.capture_file) if self.capture_file else None
+        try:
+            for channel, dwell in self.scheduler.hops():
+                if self.stopping.is_set():
+                    break
+                if not self.switch(channel):
+                    # Don't spin on a channel the driver refuses.
+                    self.stopping.wait(min(dwell, 1))
+                    continue
+                started = time.monotonic()
+                self.stopping.wait(dwell)
+                self.scheduler.record(channel, time.monotonic() - started)
+                if capture:
+                    for seen_on, frames in capture.read(channel).items():
+                        self.scheduler.record(seen_on, frames=frames)
+        finally:
+            if capture:
+                capture.close()
+
+    def switch(self, channel):
+        """Tune to channel, returns False if that failed."""
+        started = time.monotonic()
+        try:
+            self.set_channel(channel)
+        except (NetlinkError, OSError, WiFiControlError) as error:
+            # WiFiControlError when tuning falls back to iwconfig.
+            self.failures += 1
+            print(f"Switching to channel {channel} failed: {error}")
+            return False
+        self.latencies.append(time.monotonic() - started)
+        del self.latencies[:-self.max_latencies]
+        self.switches += 1
+        self.channel = channel
+        return True
+
+    def stats(self):
+        """Return switch counts and latencies in milliseconds."""
+        def millis(value):
+            return None if value is None else round(value * 1000, 3)
+
+        return {
+            "channel": self.channel,
+            "switches": self.switches,
+            "failures": self.failures,
+            "latency_ms_p50": millis(percentile(self.latencies, 0.5)),
+            "latency_ms_p95": millis(percentile(self.latencies, 0.95)),
+            "latency_ms_max": millis(max(self.latencies, default=None)),
+        }
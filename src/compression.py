@@ -0,0 +1,88 @@
+"""
+Streaming compression for capture uploads.
+
+802.11 captures compress well (repeated beacons, radiotap headers, padding),
+so files can be compressed on the fly while they are read for upload instead
+of writing a compressed copy to tmpfs first. gzip is always available, zstd
+is used when the optional ``zstandard`` package is installed.
+
+The encoding is announced to the backend with an ``encoding`` form field and
+a matching suffix on the uploaded file name.
+"""
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def available_encodings():
+    """Return encodings usable on this system."""
+    return [
+        encoding
+        for encoding in DEFAULT_LEVELS
+        if encoding != "zstd" or zstandard is not None
+    ]
+
+
+def resolve_encoding(encoding):
+    """Return encoding to use for the requested one, None for no compression."""
+    if not encoding or encoding == "none":
+        return None
+    if encoding == "zstd" and zstandard is None:
+        print("zstandard is not installed, compressing uploads with gzip")
+        return "gzip"
+    if encoding not in DEFAULT_LEVELS:
+        raise ValueError(f"Unknown compression {encoding}")
+    return encoding
+
+
+def make_compressor(encoding, level=None):
+    """Return an object with compress() and flush() for encoding."""
+    level = DEFAULT_LEVELS[encoding] if level is None else level
+    if encoding == "gzip":
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    raise ValueError(f"Unknown compression {encoding}")
+
+
+class CompressedReader:
+    """File-like object returning the compressed contents of another file."""
+
+    def __init__(self, fileobj, encoding="gzip", level=None, chunk_size=64 * 1024):
+        """Initialize reader compressing fileobj."""
+        self.fileobj = fileobj
+        self.encoding = encoding
+        self.compressor = make_compressor(encoding, level)
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.eof = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def read(self, size=-1):
+        """Read up to size compressed bytes, everything if size is negative."""
+        while not self.eof and (size is None or size < 0 or len(self.buffer) < size):
+            chunk = self.fileobj.read(self.chunk_size)
+            if chunk:
+                self.bytes_in += len(chunk)
+                self.buffer += self.compressor.compress(chunk)
+            else:
+                self.buffer += self.compressor.flush()
+                self.eof = True
+        if size is None or size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.bytes_out += len(data)
+        return data
+
+    def close(self):
+        """Close the underlying file."""
+        self.fileobj.close()
+
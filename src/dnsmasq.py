@@ -11,11 +11,17 @@
     + iptables --table nat --append POSTROUTING --out-interface wlan0
       -j MASQUERADE
     + iptables --append FORWARD --in-interface wlan1 -j ACCEPT
+
+Setup steps already done, e.g. by a previous run before a restart, are
+skipped.
 """
 import subprocess
 
+from netifaces import ifaddresses, AF_INET  # pylint: disable=no-name-in-module
 from .wificommon import WiFi, WiFiControlError
 
+IP_FORWARD = "/proc/sys/net/ipv4/ip_forward"
+
 
 class DNSMasq(WiFi):
     """DNSMasq controller."""
@@ -45,12 +51,12 @@ class DNSMasq(WiFi):
         self.initialize_dnsmasq()
 
     def set_dnsmasq_conf(self):
-        """Set dnsmasq conf."""
+        """Set dnsmasq conf, the file is left alone if it's up to date."""
         try:
             with open(self.dnsmasq_config_defaults, "r") as defaults:
-                self.write(defaults.read(), self.dnsmasq_config)
+                self.update(defaults.read(), self.dnsmasq_config)
         except FileNotFoundError:
-            self.write(self.get_dnsmasq_conf(), self.dnsmasq_config)
+            self.update(self.get_dnsmasq_conf(), self.dnsmasq_config)
 
     def get_dnsmasq_conf(self):
         """Set the dnsmasq conf."""
@@ -67,11 +73,6 @@ class DNSMasq(WiFi):
         ]
         return "\n".join(dnsmasq_conf_rules)
 
-    @staticmethod
-    def dnsmasq_control(action):
-        """Control dnsmasq service."""
-        return f"systemctl {action} dnsmasq.service && sleep 2"
-
     def initialize_dnsmasq(self):
         """Initialize dnsmasq setup on machine for easy routing."""
         try:
@@ -86,40 +87,62 @@ class DNSMasq(WiFi):
             subnet = "192.168.1.0"
             gateway = "192.168.1.1"
 
-        try:
-            self.execute_command(f"ip route delete {subnet}/24")
-        except (subprocess.CalledProcessError, WiFiControlError) as error:
-            print(f"Error: {error}")
+        if gateway not in self.get_addresses():
+            try:
+                self.execute_command(f"ip route delete {subnet}/24")
+            except (subprocess.CalledProcessError, WiFiControlError) as error:
+                print(f"Error: {error}")
 
-        self.execute_command(
-            f"ifconfig {self.ext_iface} up {gateway} netmask 255.255.255." "0"
-        )
-        self.execute_command(
-            f"route add -net {subnet} netmask 255.255.255.0" f" gw {gateway}"
-        )
+            self.execute_command(
+                f"ifconfig {self.ext_iface} up {gateway} netmask 255.255.255." "0"
+            )
+            self.execute_command(
+                f"route add -net {subnet} netmask 255.255.255.0" f" gw {gateway}"
+            )
 
         # Code below sets up Packet Forwarding from wlan1 (antenna) to wlan0
         # (raspi's wifi nic)
-        self.execute_command("echo 1 > /proc/sys/net/ipv4/ip_forward")
-        self.execute_command(
-            f"iptables -A FORWARD -i {self.int_iface} -o {self.ext_iface} -m state "
+        if not self.forwarding_enabled():
+            self.execute_command(f"echo 1 > {IP_FORWARD}")
+        self.add_rule(
+            f"FORWARD -i {self.int_iface} -o {self.ext_iface} -m state "
             f"--state ESTABLISHED,RELATED -j ACCEPT"
         )
-        self.execute_command(
-            f"iptables -A FORWARD -i {self.ext_iface} -o {self.int_iface} -j ACCEPT"
-        )
-        self.execute_command(
-            f"iptables -t nat -A POSTROUTING -o {self.int_iface} -j MASQUERADE"
-        )
+        self.add_rule(f"FORWARD -i {self.ext_iface} -o {self.int_iface} -j ACCEPT")
+        self.add_rule(f"POSTROUTING -o {self.int_iface} -j MASQUERADE", table="nat")
+
+    def get_addresses(self):
+        """Return the IPv4 addresses of the interface."""
+        try:
+            return [address["addr"] for address in ifaddresses(self.ext_iface)[AF_INET]]
+        except (KeyError, ValueError):
+            return []
+
+    @staticmethod
+    def forwarding_enabled():
+        """Return True if the kernel forwards IPv4 packets."""
+        try:
+            with open(IP_FORWARD, "r") as ip_forward:
+                return ip_forward.read().strip() == "1"
+        except OSError:
+            return False
+
+    def add_rule(self, rule, table=None):
+        """Append an iptables rule unless the chain already has it."""
+        iptables = f"iptables -t {table}" if table else "iptables"
+        try:
+            self.execute_command(f"{iptables} -C {rule}")
+        except WiFiControlError:
+            self.execute_command(f"{iptables} -A {rule}")
 
     def start(self):
         """Start dnsmasq service."""
-        self.execute_command(self.dnsmasq_control("start"))
+        self.services.start("dnsmasq.service")
 
     def stop(self):
         """Stop dnsmasq service."""
-        self.execute_command(self.dnsmasq_control("stop"))
+        self.services.stop("dnsmasq.service")
 
     def restart(self):
         """Restart hostapd service."""
-        self.execute_command(self.dnsmasq_control("restart"))
+        self.services.restart("dnsmasq.service")
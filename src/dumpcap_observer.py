@@ -2,16 +2,39 @@
 An observer to upload any new files produced by dumpcap
 """
 import os
-from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
 from watchdog.events import PatternMatchingEventHandler
 from watchdog.observers import Observer
+from .metrics import REGISTRY
+from .spool import Spool, SPOOL_NAME
+from .uploader import Uploader
+
+# Capture resumes once the spool has drained below this share of its budget.
+RESUME_RATIO = 0.8
 
 
 class DumpcapObserver:  # pylint: disable=too-many-instance-attributes
     """Dumpcap output observer"""
 
     def __init__(  # pylint: disable=too-many-arguments
-        self, req_session, session_id, mac, ap_analyze_path, path="/tmp/pi_sniffer_data"
+        self,
+        req_session,
+        session_id,
+        mac,
+        ap_analyze_path,
+        path="/tmp/pi_sniffer_data",
+        max_workers=2,
+        spool=None,
+        max_spool_bytes=64 * 1024 * 1024,
+        max_spool_files=100,
+        on_backpressure=None,
+        compression=None,
+        compression_level=None,
+        rotation=None,
+        storage=None,
+        payload_policy=None,
+        metrics=REGISTRY,
     ):
 
         try:
@@ -20,7 +43,14 @@ class DumpcapObserver:  # pylint: disable=too-many-instance-attributes
             print("Creation of the directory %s failed" % path)
 
         patterns = "*"  # Need this to be the correct pattern for the file.
-        ignore_patterns = ""
+        # Skip the spool database and probe files sharing the directory, and
+        # the temporary files the payload policy rewrites ring files into.
+        ignore_patterns = [
+            "*/" + SPOOL_NAME + "*",
+            "*_probe.*",
+            "*_probe_agg.*",
+            "*.tmp",
+        ]
         ignore_directories = True
         case_sensitive = True
         self.my_event_handler = PatternMatchingEventHandler(
@@ -34,9 +64,38 @@ class DumpcapObserver:  # pylint: disable=too-many-instance-attributes
         self.my_observer.schedule(self.my_event_handler, path)
 
         self.finished_file = None
+        self.created_at = None
+        self.rotation = rotation
+        self.storage = storage
+        self.payload_policy = payload_policy
+        self.uploaded = (0, 0.0)
         self.req_session = req_session
 
-        self.queue = ThreadPoolExecutor(max_workers=1)
+        self.spool = spool if spool else Spool(os.path.join(path, SPOOL_NAME))
+        self.max_spool_bytes = max_spool_bytes
+        self.max_spool_files = max_spool_files
+        self.on_backpressure = on_backpressure
+        self.paused = False
+        self.stopped = False
+        self.pause_lock = threading.Lock()
+        self.uploader = Uploader(
+            req_session,
+            ap_analyze_path,
+            max_workers=max_workers,
+            spool=self.spool,
+            on_complete=self.on_upload_complete,
+            compression=compression,
+            compression_level=compression_level,
+            metrics=metrics,
+        )
+        self.captured_bytes = metrics.counter(
+            "pi_capture_bytes_total", "Bytes of finished capture files."
+        )
+        self.spool_files = metrics.gauge("pi_spool_files", "Files pending upload.")
+        self.spool_bytes = metrics.gauge("pi_spool_bytes", "Bytes pending upload.")
+        self.capture_paused = metrics.gauge(
+            "pi_capture_paused", "1 while capture is paused for backpressure."
+        )
         self.mac = mac
         self.session_id = session_id
         self.ap_analyze_path = ap_analyze_path
@@ -46,17 +105,79 @@ class DumpcapObserver:  # pylint: disable=too-many-instance-attributes
         # File created - add name to a temp variable
         # if name in temp variable - push name onto queue
         # put new name in temp variable.
+        now = time.monotonic()
         if self.finished_file is not None:
+            # Measured before the upload can remove or truncate the file.
+            if self.rotation:
+                self.observe_capture(self.finished_file, now - self.created_at)
             self.push_to_queue(self.finished_file)
         self.finished_file = event.src_path
+        self.created_at = now
+        self.check_backpressure()
 
         # print(f"hey, {event.src_path} has been created!")
 
+    def on_upload_complete(self, path, acked):
+        """Handle an upload worker finishing with a file"""
+        if acked and self.rotation:
+            self.observe_uplink()
+        if not acked and self.paused and not self.stopped and os.path.exists(path):
+            # Capture is paused until the backlog drains, so keep trying.
+            try:
+                self.uploader.submit(path, self.form_data(path))
+            except RuntimeError:
+                pass  # Shut down in the meantime, picked up on next start.
+        self.check_backpressure()
+
+    def observe_capture(self, finished_file, seconds):
+        """Feed the capture rate of a finished ring file to the rotation"""
+        try:
+            self.rotation.observe_file(os.path.getsize(finished_file), seconds)
+        except OSError:
+            pass
+
+    def observe_uplink(self):
+        """Feed the uplink rate of the uploads since the last call to the rotation"""
+        stats = self.uploader.stats()
+        sent, seconds = stats["bytes_sent"], stats["transfer_seconds"]
+        with self.pause_lock:
+            previous_sent, previous_seconds = self.uploaded
+            self.uploaded = (sent, seconds)
+        self.rotation.observe_upload(sent - previous_sent, seconds - previous_seconds)
+
+    def check_backpressure(self):
+        """Pause capture while the spool is over budget, resume once drained
+
+        With a storage manager, files are evicted as its policy allows first
+        and capture is also paused while the directory stays over budget.
+        """
+        files, size = self.spool.usage()
+        self.spool_files.set(files)
+        self.spool_bytes.set(size)
+        over = files > self.max_spool_files or size > self.max_spool_bytes
+        drained = (
+            files <= self.max_spool_files * RESUME_RATIO
+            and size <= self.max_spool_bytes * RESUME_RATIO
+        )
+        if self.storage:
+            self.storage.enforce()
+            over = over or self.storage.over_budget()
+            drained = drained and not self.storage.over_budget(RESUME_RATIO)
+        with self.pause_lock:
+            if not self.paused and over:
+                self.paused = True
+            elif self.paused and drained:
+                self.paused = False
+            else:
+                return
+            print(f"Spool at {files} files, {size} bytes, paused: {self.paused}")
+            self.capture_paused.set(int(self.paused))
+            if self.on_backpressure:
+                self.on_backpressure(self.paused)
+
     @staticmethod
     def on_deleted(event):
         """Handle deletion of a file"""
-        # TODO: Might want to keep track of number of created files vs deleted: if created -
-        #  deleted > ~100 might want to stop capturing.
 
     @staticmethod
     def on_modified(event):
@@ -75,31 +196,44 @@ class DumpcapObserver:  # pylint: disable=too-many-instance-attributes
         """Stop observation of directory"""
         self.my_observer.stop()
         self.my_observer.join()
+        # stop_collecting_ap_data waits for dumpcap to exit before the
+        # observer is shut down, so the last ring file is complete too.
+        if self.finished_file is not None:
+            self.push_to_queue(self.finished_file)
+            self.finished_file = None
+        self.stopped = True
+        self.uploader.shutdown(wait=False)
 
     def push_to_queue(self, finished_file):
-        """Enqueue file for upload"""
-        self.queue.submit(self.post_data, finished_file)
+        """Record file in the spool and enqueue it for upload"""
+        data = self.form_data(finished_file)
+        if self.payload_policy:
+            self.payload_policy.apply(finished_file)
+        try:
+            self.captured_bytes.inc(os.path.getsize(finished_file), mode="ap")
+        except OSError:
+            pass
+        self.spool.add(finished_file, self.ap_analyze_path, data)
+        self.uploader.submit(finished_file, data)
+
+    def form_data(self, finished_file):
+        """Form fields sent along with a file"""
+        return {
+            "mac": self.mac,
+            "name": finished_file,
+            "session_id": self.session_id,
+        }
 
     def post_data(self, finished_file):
-        """Upload file to backend"""
+        """Upload file to backend, deleting it once acknowledged"""
         print("Posting data")
-        try:
-            response = self.req_session.post(
-                self.ap_analyze_path,
-                data={
-                    "mac": self.mac,
-                    "name": finished_file,
-                    "session_id": self.session_id,
-                },
-                files={"data": open(finished_file, "rb")},
-            )
-            print("Response was: " + str(response))
-        except FileNotFoundError as error:
-            print("Error: " + str(error))
-        # if response.status_code == 200:
-        #    os.remove(finished_file)
-        # print("Removing file: " + str(finished_file))
-        os.remove(finished_file)
+        acked = self.uploader.upload(finished_file, self.form_data(finished_file))
+        print(f"Upload of {finished_file} acknowledged: {acked}, {self.stats()}")
+        return acked
+
+    def stats(self):
+        """Upload queue depth and throughput"""
+        return self.uploader.stats()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,310 @@
+"""
+Channel hop scheduling for probe request capture.
+
+A monitor interface only hears one channel at a time, so probe mode hops
+through a set of channels. How long it dwells on each channel is decided by
+a policy:
+
+- fixed: the same dwell on every channel (the original behaviour)
+- weighted: dwell proportional to static per channel weights, by default
+  favouring the non-overlapping 2.4 GHz channels 1, 6 and 11
+- adaptive: dwell proportional to the probe request rate recently observed
+  on each channel, with a minimum dwell so quiet channels are still sampled
+
+Observed frames are fed back from the capture file itself with
+``CaptureTail``, which also gives the frames-per-channel statistics.
+
+With several monitor interfaces the channels are partitioned over the radios
+with ``HopScheduler.split``, each radio hopping only its own share, so the
+time each channel is listened to grows with the number of radios.
+"""
+import collections
+import os
+import struct
+
+from .probe_extractor import (
+    LINKTYPE_IEEE802_11_RADIOTAP,
+    PcapngError,
+    PcapngReader,
+    frequency_to_channel,
+    parse_radiotap,
+)
+
+CHANNELS_2GHZ = list(range(1, 12))
+# Non-DFS 5 GHz channels, usable without radar detection.
+CHANNELS_5GHZ = [36, 40, 44, 48, 149, 153, 157, 161, 165]
+CHANNEL_SETS = {
+    "2.4": CHANNELS_2GHZ,
+    "5": CHANNELS_5GHZ,
+    "all": CHANNELS_2GHZ + CHANNELS_5GHZ,
+}
+DEFAULT_WEIGHTS = {1: 3, 6: 3, 11: 3}
+
+
+def parse_channels(spec):
+    """Parse a channel set name or comma separated channel list."""
+    if spec in CHANNEL_SETS:
+        return list(CHANNEL_SETS[spec])
+    channels = []
+    for part in str(spec).split(","):
+        part = part.strip()
+        if part in CHANNEL_SETS:
+            channels.extend(CHANNEL_SETS[part])
+        elif part:
+            channels.append(int(part))
+    if not channels:
+        raise ValueError(f"No channels in {spec!r}")
+    return list(dict.fromkeys(channels))
+
+
+def partition_channels(channels, count):
+    """Split channels over count radios, as evenly as possible.
+
+    Channels are dealt out in turn, so the non-overlapping 1, 6 and 11 end up
+    on different radios. Radios beyond the number of channels get none.
+    """
+    return [list(channels[index::count]) for index in range(count)]
+
+
+def share_dwell(channels, shares, cycle, min_dwell):
+    """Split cycle seconds over channels proportionally to shares.
+
+    Every channel gets at least min_dwell. Channels without a share split the
+    remainder evenly when no channel has one.
+    """
+    spare = max(cycle - min_dwell * len(channels), 0)
+    total = sum(shares.get(channel, 0) for channel in channels)
+    dwell = {}
+    for channel in channels:
+        if total > 0:
+            extra = spare * shares.get(channel, 0) / total
+        else:
+            extra = spare / len(channels)
+        dwell[channel] = min_dwell + extra
+    return dwell
+
+
+class FixedPolicy:
+    """Same dwell time on every channel."""
+
+    name = "fixed"
+
+    def __init__(self, dwell=10):
+        """Initialize policy with dwell seconds per channel."""
+        self.dwell = dwell
+
+    def dwell_times(self, channels, _rates):
+        """Return dwell seconds per channel for the next cycle."""
+        return {channel: self.dwell for channel in channels}
+
+
+class WeightedPolicy:
+    """Dwell time proportional to static channel weights."""
+
+    name = "weighted"
+
+    def __init__(self, weights=None, cycle=30, min_dwell=1, default_weight=1):
+        """Initialize policy.
+
+        weights maps channel to weight, channels not in it get default_weight.
+        """
+        self.weights = DEFAULT_WEIGHTS if weights is None else weights
+        self.default_weight = default_weight
+        self.cycle = cycle
+        self.min_dwell = min_dwell
+
+    def dwell_times(self, channels, _rates):
+        """Return dwell seconds per channel for the next cycle."""
+        shares = {
+            channel: self.weights.get(channel, self.default_weight)
+            for channel in channels
+        }
+        return share_dwell(channels, shares, self.cycle, self.min_dwell)
+
+
+class AdaptivePolicy:
+    """Dwell time proportional to recently observed probe request rates."""
+
+    name = "adaptive"
+
+    def __init__(self, cycle=30, min_dwell=1):
+        """Initialize policy.
+
+        min_dwell is kept on every channel so devices showing up on quiet
+        channels are still noticed.
+        """
+        self.cycle = cycle
+        self.min_dwell = min_dwell
+
+    def dwell_times(self, channels, rates):
+        """Return dwell seconds per channel for the next cycle."""
+        return share_dwell(channels, rates, self.cycle, self.min_dwell)
+
+
+POLICIES = {
+    policy.name: policy for policy in (FixedPolicy, WeightedPolicy, AdaptivePolicy)
+}
+
+
+def make_policy(name, dwell=10, cycle=30, min_dwell=1):
+    """Build a policy by name from the command line options."""
+    if name == "fixed":
+        return FixedPolicy(dwell)
+    if name == "weighted":
+        return WeightedPolicy(cycle=cycle, min_dwell=min_dwell)
+    if name == "adaptive":
+        return AdaptivePolicy(cycle=cycle, min_dwell=min_dwell)
+    raise ValueError(f"Unknown hop policy {name}")
+
+
+class HopScheduler:
+    """Decides which channel to listen on and for how long."""
+
+    def __init__(self, channels=None, policy=None, smoothing=0.3):
+        """Initialize scheduler.
+
+        smoothing is the weight of the last cycle in the per channel rate
+        estimate, the rest comes from earlier cycles.
+        """
+        self.channels = list(channels or CHANNELS_2GHZ)
+        self.policy = policy or FixedPolicy()
+        self.smoothing = smoothing
+        self.rates = {}
+        self.frames = collections.Counter()
+        self.dwell = collections.Counter()
+        self.cycle_frames = collections.Counter()
+        self.cycle_dwell = collections.Counter()
+        self.cycles = 0
+        self.radios = []
+
+    def plan(self):
+        """Return [(channel, dwell seconds)] for the next cycle."""
+        dwell = self.policy.dwell_times(self.channels, self.rates)
+        return [(channel, dwell[channel]) for channel in self.channels]
+
+    def hops(self):
+        """Yield (channel, dwell seconds) forever, re-planning every cycle."""
+        while True:
+            for hop in self.plan():
+                yield hop
+            self.end_cycle()
+
+    def record(self, channel, dwell=0.0, frames=0):
+        """Record time spent on channel and frames seen on it."""
+        self.dwell[channel] += dwell
+        self.cycle_dwell[channel] += dwell
+        self.frames[channel] += frames
+        self.cycle_frames[channel] += frames
+
+    def end_cycle(self):
+        """Fold the finished cycle into the per channel rate estimates."""
+        for channel, dwell in self.cycle_dwell.items():
+            if dwell <= 0:
+                continue
+            rate = self.cycle_frames[channel] / dwell
+            previous = self.rates.get(channel)
+            if previous is None:
+                self.rates[channel] = rate
+            else:
+                self.rates[channel] = (
+                    self.smoothing * rate + (1 - self.smoothing) * previous
+                )
+        self.cycle_frames.clear()
+        self.cycle_dwell.clear()
+        self.cycles += 1
+
+    def split(self, count):
+        """Return a scheduler per radio over a partition of the channels.
+
+        The radio schedulers are kept, so their rates carry over to the next
+        split into as many radios, and their frames and dwell are included in
+        the stats of this one. Radios left without a channel get no scheduler.
+        """
+        subsets = [subset for subset in partition_channels(self.channels, count) if subset]
+        if [radio.channels for radio in self.radios] != subsets:
+            self.radios = []
+            for subset in subsets:
+                radio = HopScheduler(subset, self.policy, self.smoothing)
+                radio.rates = {
+                    channel: rate for channel, rate in self.rates.items() if channel in subset
+                }
+                self.radios.append(radio)
+        return self.radios
+
+    def stats(self):
+        """Return frames, dwell and rate per channel, of every radio."""
+        frames = collections.Counter(self.frames)
+        dwell = collections.Counter(self.dwell)
+        rates = dict(self.rates)
+        for radio in self.radios:
+            frames.update(radio.frames)
+            dwell.update(radio.dwell)
+            rates.update(radio.rates)
+        return {
+            channel: {
+                "frames": frames[channel],
+                "dwell": round(dwell[channel], 1),
+                "rate": round(rates.get(channel, 0.0), 3),
+            }
+            for channel in sorted(set(self.channels) | set(frames))
+        }
+
+    def summary(self):
+        """Return one line of frames per channel for logging."""
+        return " ".join(
+            f"ch{channel}:{stats['frames']}/{stats['dwell']:.0f}s"
+            for channel, stats in self.stats().items()
+        )
+
+
+def channel_of(linktype, data):
+    """Return channel a packet was captured on from its radiotap header."""
+    if linktype != LINKTYPE_IEEE802_11_RADIOTAP:
+        return None
+    try:
+        _, fields = parse_radiotap(data)
+    except (PcapngError, struct.error):
+        return None
+    if "frequency" not in fields:
+        return None
+    return frequency_to_channel(fields["frequency"])
+
+
+class CaptureTail:
+    """Count frames per channel appended to a growing pcapng capture."""
+
+    def __init__(self, path):
+        """Initialize tail of path, the file may not exist yet."""
+        self.path = path
+        self.fileobj = None
+        self.reader = None
+        self.failed = False
+
+    def read(self, default_channel=None):
+        """Return Counter of channel to frames captured since last call.
+
+        Frames without a radiotap channel are counted for default_channel.
+        """
+        counts = collections.Counter()
+        if self.failed:
+            return counts
+        if self.reader is None:
+            if not os.path.exists(self.path):
+                return counts
+            self.fileobj = open(self.path, "rb")  # pylint: disable=consider-using-with
+            self.reader = PcapngReader(self.fileobj)
+        try:
+            for linktype, _, data in self.reader.packets():
+                counts[channel_of(linktype, data) or default_channel] += 1
+        except PcapngError as error:
+            print(f"Cannot follow capture {self.path}: {error}")
+            self.failed = True
+            self.close()
+        return counts
+
+    def close(self):
+        """Close the capture file."""
+        if self.fileobj:
+            self.fileobj.close()
+        self.fileobj = None
+        self.reader = None
@@ -10,6 +10,10 @@ Required controls
 - get connected devices
 """
 import os
+import time
+from .hostapd_ctrl import HostapdCtrl, HostapdCtrlError
+from .nl80211 import NL80211, NetlinkError
+from .station_tracker import StationTracker
 from .wificommon import WiFi
 
 
@@ -24,6 +28,7 @@ class HostAP(WiFi):  # pylint: disable=too-many-instance-attributes
         hostapd_config="/etc/hostapd/hostapd.conf",
         hostname_config="/etc/hostname",
         wifi_ap_password="123456789",
+        ctrl_dir="/var/run/hostapd",
     ):
         """Initialize HostAP."""
 
@@ -37,6 +42,12 @@ class HostAP(WiFi):  # pylint: disable=too-many-instance-attributes
         self.channel = channel
         self.ext_iface = ext_iface
         self.wifi_ap_password = wifi_ap_password
+        self.nl80211 = None
+        self.nl80211_available = True
+        self.ctrl_dir = ctrl_dir
+        self.ctrl_path = os.path.join(ctrl_dir, ext_iface)
+        self.ctrl = None
+        self.tracker = None
 
         if b"bin/hostapd" not in self.execute_command("whereis hostapd"):
             raise OSError("No HOSTAPD service")
@@ -45,8 +56,8 @@ class HostAP(WiFi):  # pylint: disable=too-many-instance-attributes
         self.set_hostap_conf()
 
     def set_hostap_conf(self):
-        """Set hostapd conf."""
-        self.write(self.get_hostapd_conf(), self.hostapd_path)
+        """Set hostapd conf, the file is left alone if it's up to date."""
+        self.update(self.get_hostapd_conf(), self.hostapd_path)
         if not os.path.exists(self.mac_deny_path):
             self.deny_mac([])
 
@@ -60,6 +71,7 @@ class HostAP(WiFi):  # pylint: disable=too-many-instance-attributes
             f"channel={self.channel}",
             "macaddr_acl=0",
             "ignore_broadcast_ssid=0",
+            f"ctrl_interface={self.ctrl_dir}",
             "logger_syslog=1",
             "logger_syslog_level=2",
             "ap_max_inactivity=3600",
@@ -73,22 +85,100 @@ class HostAP(WiFi):  # pylint: disable=too-many-instance-attributes
         ]
         return "\n".join(hostapd_conf_rules)
 
-    @staticmethod
-    def hostapd_control(action):
-        """Control hostapd service."""
-        return f"systemctl {action} hostapd.service && sleep 2"
-
     def start(self):
         """Start hostapd service."""
-        self.execute_command(self.hostapd_control("start"))
+        self.services.start("hostapd.service", ready=self.is_enabled)
+        self.start_tracking()
 
     def stop(self):
         """Stop hostapd service."""
-        self.execute_command(self.hostapd_control("stop"))
+        self.stop_tracking()
+        self.close_control()
+        self.services.stop("hostapd.service")
 
     def restart(self):
         """Restart hostapd service."""
-        self.execute_command(self.hostapd_control("restart"))
+        self.close_control()
+        self.services.restart("hostapd.service", ready=self.is_enabled)
+
+    def start_tracking(self):
+        """Follow stations joining and leaving from hostapd events."""
+        if self.tracker is None:
+            self.tracker = StationTracker(self.ctrl_path)
+            self.tracker.start()
+
+    def stop_tracking(self):
+        """Stop following station events."""
+        if self.tracker is not None:
+            self.tracker.stop()
+            self.tracker = None
+
+    def session_durations(self):
+        """Return seconds each client has been connected, by MAC."""
+        return self.tracker.session_durations() if self.tracker else {}
+
+    def control(self):
+        """Return a connection to the hostapd control socket, None if it's down."""
+        if self.ctrl is not None and not self.ctrl.ping():
+            # hostapd restarted and recreated its socket.
+            self.close_control()
+        if self.ctrl is None:
+            if not os.path.exists(self.ctrl_path):
+                return None
+            try:
+                self.ctrl = HostapdCtrl(self.ctrl_path)
+            except OSError as error:
+                print(f"hostapd control socket unavailable: {error}")
+                return None
+        return self.ctrl
+
+    def close_control(self):
+        """Close the control socket connection."""
+        if self.ctrl is not None:
+            self.ctrl.close()
+            self.ctrl = None
+
+    def reconfigure(self):
+        """Apply ssid and channel to the running hostapd over its control socket.
+
+        A channel change is announced to associated clients, which follow the
+        access point instead of being dropped. Returns False if hostapd
+        couldn't be reached or refused a change, restart it in that case.
+        """
+        started = time.monotonic()
+        try:
+            ctrl = self.control()
+            if ctrl is None:
+                return False
+            status = ctrl.status()
+            if status.get("state") != "ENABLED":
+                return False
+            if status.get("ssid[0]") != self.ssid:
+                ctrl.set_ssid(self.ssid)
+            if status.get("channel") != str(self.channel):
+                ctrl.switch_channel(int(self.channel))
+        except (HostapdCtrlError, OSError, ValueError) as error:
+            print(f"hostapd reconfiguration failed: {error}")
+            self.close_control()
+            return False
+        print(f"hostapd reconfigured in {time.monotonic() - started:.2f}s")
+        return True
+
+    def is_enabled(self):
+        """Return True once hostapd runs the interface as an access point."""
+        if self.nl80211_available:
+            try:
+                if self.nl80211 is None:
+                    self.nl80211 = NL80211()
+                return self.nl80211.get_interface(self.ext_iface)["type"] == "AP"
+            except NetlinkError:
+                self.nl80211_available = False
+            except OSError:
+                if self.nl80211:
+                    self.nl80211.close()
+                self.nl80211 = None
+                raise
+        return b"type AP" in self.execute_command(f"iw dev {self.ext_iface} info")
 
     def get_hostap_ssid(self):
         """Get name of the hostapd."""
@@ -145,9 +235,40 @@ class HostAP(WiFi):  # pylint: disable=too-many-instance-attributes
                 connected_mac.append(components[3])
         return connected_mac
 
+    def get_stations(self):
+        """Get per station details of the interface over nl80211."""
+        if self.nl80211 is None:
+            self.nl80211 = NL80211()
+        try:
+            return self.nl80211.get_stations(self.ext_iface)
+        except OSError:
+            # Reopen the socket on the next call.
+            self.nl80211.close()
+            self.nl80211 = None
+            raise
+
     def get_connected_users_advanced(self):
         """Get mac addresses of connected users in a list."""
+        if self.tracker is not None and self.tracker.connected:
+            return self.tracker.get_connected_users()
         inactive_threshold = 10000  # in ms
+        if self.nl80211_available:
+            try:
+                return [
+                    station["mac"]
+                    for station in self.get_stations()
+                    if station["inactive_time"] is not None
+                    and station["inactive_time"] < inactive_threshold
+                ]
+            except NetlinkError as error:
+                print(f"nl80211 unavailable ({error}), using iw station dump")
+                self.nl80211_available = False
+            except OSError as error:
+                print(f"nl80211 station dump failed: {error}")
+        return self.get_connected_users_iw(inactive_threshold)
+
+    def get_connected_users_iw(self, inactive_threshold):
+        """Get mac addresses of connected users from iw station dump."""
         output = (
             self.execute_command(f"iw dev {self.ext_iface} station dump")
             .decode("utf8")
@@ -170,8 +291,18 @@ class HostAP(WiFi):  # pylint: disable=too-many-instance-attributes
         return connected_mac
 
     def deny_mac(self, mac_list):
-        """Write mac list to a file."""
+        """Write mac list to a file and apply it to the running hostapd."""
         self.write("\n".join(mac_list), self.mac_deny_path)
+        try:
+            ctrl = self.control()
+            if ctrl is not None:
+                ctrl.deny_clear()
+                for mac in mac_list:
+                    ctrl.deny_add(mac)
+        except (HostapdCtrlError, OSError) as error:
+            # The file is read again when hostapd restarts.
+            print(f"Couldn't update hostapd deny list: {error}")
+            self.close_control()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,180 @@
+"""
+Client for the hostapd control interface.
+
+hostapd listens on a UNIX datagram socket per interface (``ctrl_interface``
+in hostapd.conf, e.g. /var/run/hostapd/wlan1) and answers text commands, the
+protocol ``hostapd_cli`` and ``wpa_ctrl`` use. The client binds its own
+socket so hostapd has an address to reply to.
+
+Used to reconfigure a running access point without restarting the service,
+which would drop every associated client:
+
+- SET ssid + RELOAD to rename the network
+- CHAN_SWITCH to move to another channel with a channel switch announcement
+- DENY_ACL to edit the deny list
+
+A connection can also ATTACH as a monitor to receive events such as
+AP-STA-CONNECTED. Requests are best sent on a separate connection then.
+A thread waiting for events can be woken up with ``shutdown``.
+"""
+import itertools
+import os
+import select
+import socket
+import tempfile
+import threading
+
+from .nl80211 import channel_to_frequency
+
+_COUNTER = itertools.count()
+
+
+class HostapdCtrlError(Exception):
+    """hostapd refused a command or didn't answer."""
+
+
+class HostapdCtrl:
+    """Connection to a hostapd control socket."""
+
+    def __init__(self, path, timeout=2.0, local_dir=None):
+        """Connect to the control socket at path."""
+        self.path = path
+        self.local_path = os.path.join(
+            local_dir or tempfile.gettempdir(),
+            f"pi_sniffer_hostapd_{os.getpid()}_{next(_COUNTER)}",
+        )
+        self.lock = threading.Lock()
+        self.wakeup = None
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            if os.path.exists(self.local_path):
+                os.unlink(self.local_path)
+            self.sock.bind(self.local_path)
+            self.sock.connect(path)
+            self.sock.settimeout(timeout)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        """Close the connection."""
+        self.sock.close()
+        if self.wakeup is not None:
+            for wakeup in self.wakeup:
+                wakeup.close()
+        try:
+            os.unlink(self.local_path)
+        except OSError:
+            pass
+
+    def shutdown(self):
+        """Make receive_event raise OSError, now and in a waiting thread."""
+        # Shutting the socket down doesn't wake up a receive with a timeout.
+        if self.wakeup is not None:
+            self.wakeup[1].send(b"\x00")
+
+    def request(self, command):
+        """Send command and return the reply text."""
+        with self.lock:
+            self.sock.send(command.encode())
+            while True:
+                try:
+                    reply = self.sock.recv(4096).decode(errors="replace")
+                except socket.timeout as error:
+                    raise HostapdCtrlError(f"No reply to {command}") from error
+                # Unsolicited events start with a <level> prefix.
+                if not reply.startswith("<"):
+                    return reply
+
+    def command(self, command):
+        """Send a command that answers OK, raise HostapdCtrlError otherwise."""
+        reply = self.request(command).strip()
+        if reply != "OK":
+            raise HostapdCtrlError(f"{command.split()[0]} failed: {reply}")
+
+    def ping(self):
+        """Return True if hostapd answers."""
+        try:
+            return self.request("PING").strip() == "PONG"
+        except (HostapdCtrlError, OSError):
+            return False
+
+    def status(self):
+        """Return STATUS as a dict."""
+        status = {}
+        for line in self.request("STATUS").splitlines():
+            key, sep, value = line.partition("=")
+            if sep:
+                status[key] = value
+        return status
+
+    def attach(self):
+        """Receive hostapd events on this connection from now on."""
+        self.command("ATTACH")
+        if self.wakeup is None:
+            self.wakeup = socket.socketpair()
+
+    def detach(self):
+        """Stop receiving events."""
+        self.command("DETACH")
+
+    def receive_event(self):
+        """Return the next event without its <level> prefix, None on timeout."""
+        with self.lock:
+            readable, _, _ = select.select(
+                [self.sock, self.wakeup[0]], [], [], self.sock.gettimeout()
+            )
+            if self.wakeup[0] in readable:
+                raise OSError("Connection shut down")
+            if not readable:
+                return None
+            try:
+                message = self.sock.recv(4096).decode(errors="replace")
+            except socket.timeout:
+                return None
+        if message.startswith("<"):
+            message = message.partition(">")[2]
+        return message.strip()
+
+    def stations(self):
+        """Return details of every associated station, keyed by MAC."""
+        stations = {}
+        reply = self.request("STA-FIRST")
+        while reply.strip() and not reply.startswith("FAIL"):
+            mac, *lines = reply.strip().splitlines()
+            stations[mac] = dict(
+                line.split("=", 1) for line in lines if "=" in line
+            )
+            reply = self.request(f"STA-NEXT {mac}")
+        return stations
+
+    def set_ssid(self, ssid):
+        """Rename the network and reload it."""
+        if "\n" in ssid or not 0 < len(ssid.encode()) <= 32:
+            raise HostapdCtrlError(f"Invalid SSID {ssid!r}")
+        self.command(f"SET ssid {ssid}")
+        self.command("RELOAD")
+
+    def switch_channel(self, channel, beacon_count=5):
+        """Move to channel, announced for beacon_count beacons."""
+        self.command(f"CHAN_SWITCH {beacon_count} {channel_to_frequency(channel)}")
+
+    def deny_add(self, mac):
+        """Add mac to the deny list, disconnecting it."""
+        self.command(f"DENY_ACL ADD_MAC {mac}")
+
+    def deny_remove(self, mac):
+        """Remove mac from the deny list."""
+        self.command(f"DENY_ACL DEL_MAC {mac}")
+
+    def deny_clear(self):
+        """Empty the deny list."""
+        self.command("DENY_ACL CLEAR")
+
+    def deny_list(self):
+        """Return MACs on the deny list."""
+        return [
+            line.split()[0]
+            for line in self.request("DENY_ACL SHOW").splitlines()
+            if line.strip()
+        ]
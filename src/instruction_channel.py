@@ -0,0 +1,112 @@
+"""
+Push channel for instructions.
+
+The backend can push instructions over a server-sent events stream as soon as
+they are issued, instead of the pi discovering them on its next status update.
+The channel runs in a daemon thread and reconnects with a delay when the
+stream drops. While it is down the regular status update polling keeps working
+as before, so the channel only ever makes instructions arrive sooner.
+"""
+import json
+import threading
+
+import requests
+
+# How long to wait before retrying when the backend has no stream endpoint.
+NOT_SUPPORTED_RETRY_INTERVAL = 300
+
+
+def iter_events(lines):
+    """Yield (event, data) pairs from server-sent event stream lines."""
+    event, data = "message", []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf8")
+        if not line:
+            if data:
+                yield event, "\n".join(data)
+            event, data = "message", []
+        elif line.startswith(":"):
+            continue
+        else:
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "event":
+                event = value
+            elif field == "data":
+                data.append(value)
+
+
+class InstructionChannel:  # pylint: disable=too-many-instance-attributes
+    """Server-sent events instruction channel."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        req_session,
+        url,
+        mac,
+        on_instruction,
+        retry_interval=5,
+        read_timeout=90,
+    ):
+        """Initialize channel.
+
+        on_instruction is called with the decoded event payload for every
+        instruction event.
+        """
+        self.req_session = req_session
+        self.url = url
+        self.mac = mac
+        self.on_instruction = on_instruction
+        self.retry_interval = retry_interval
+        self.read_timeout = read_timeout
+        self.connected = False
+        self.stopping = threading.Event()
+        self.thread = None
+        self.response = None
+
+    def start(self):
+        """Start listening in a daemon thread."""
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop listening."""
+        self.stopping.set()
+        if self.response is not None:
+            self.response.close()
+
+    def run(self):
+        """Keep the stream open until stopped."""
+        while not self.stopping.is_set():
+            delay = self.retry_interval
+            try:
+                delay = self.listen()
+            except (requests.RequestException, ValueError) as error:
+                print(f"Instruction channel error: {error}")
+            self.connected = False
+            self.stopping.wait(delay)
+
+    def listen(self):
+        """Read events from one stream connection. Returns retry delay."""
+        with self.req_session.get(
+            self.url,
+            params={"mac": self.mac},
+            stream=True,
+            timeout=(10, self.read_timeout),
+        ) as response:
+            if response.status_code == 404:
+                return NOT_SUPPORTED_RETRY_INTERVAL
+            if response.status_code != 200:
+                return self.retry_interval
+            self.response = response
+            self.connected = True
+            # Small chunks so events aren't held back waiting for a full buffer.
+            for event, data in iter_events(response.iter_lines(chunk_size=1)):
+                if self.stopping.is_set():
+                    break
+                if event == "instruction":
+                    self.on_instruction(json.loads(data))
+            self.response = None
+        return self.retry_interval
@@ -0,0 +1,279 @@
+"""
+Metrics registry and local metrics endpoint.
+
+Counters, gauges and histograms are kept in a registry and can be served in
+the Prometheus text format on ``/metrics`` by ``MetricsServer``, or sent
+along with status updates as a compact dict from ``Registry.snapshot``.
+
+Components take a ``metrics`` registry argument and default to the module
+level ``REGISTRY``, so code without access to an instance (like the static
+``WiFi.execute_command``) reports into the same place.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def format_labels(labels):
+    """Format a sorted label tuple as {name="value",...}."""
+    if not labels:
+        return ""
+    escaped = (
+        '{}="{}"'.format(
+            name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        for name, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def format_value(value):
+    """Format a sample value."""
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Base class for metrics with optional labels."""
+
+    kind = None
+
+    def __init__(self, name, documentation=""):
+        """Initialize metric."""
+        self.name = name
+        self.documentation = documentation
+        self.lock = threading.Lock()
+        self.values = {}
+
+    @staticmethod
+    def key(labels):
+        """Return hashable key for a labels dict."""
+        return tuple(sorted(labels.items()))
+
+    def samples(self):
+        """Return list of (suffix, labels, value)."""
+        with self.lock:
+            return [("", key, value) for key, value in self.values.items()]
+
+
+class Counter(Metric):
+    """Monotonically increasing value."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        """Increase counter by amount."""
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        """Return current value."""
+        with self.lock:
+            return self.values.get(self.key(labels), 0)
+
+
+class Gauge(Metric):
+    """Value that can go up and down, or is read from a function."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation=""):
+        """Initialize gauge."""
+        super().__init__(name, documentation)
+        self.functions = {}
+
+    def set(self, value, **labels):
+        """Set gauge to value, replacing a function set for it."""
+        key = self.key(labels)
+        with self.lock:
+            self.functions.pop(key, None)
+            self.values[key] = value
+
+    def set_function(self, function, **labels):
+        """Read the gauge from function whenever it is collected."""
+        with self.lock:
+            self.functions[self.key(labels)] = function
+
+    def get(self, **labels):
+        """Return current value."""
+        key = self.key(labels)
+        with self.lock:
+            function = self.functions.get(key)
+            if function is None:
+                return self.values.get(key, 0)
+        return function()
+
+    def samples(self):
+        """Return list of (suffix, labels, value)."""
+        with self.lock:
+            values = dict(self.values)
+            functions = dict(self.functions)
+        for key, function in functions.items():
+            try:
+                values[key] = function()
+            except Exception:  # pylint: disable=broad-except
+                continue
+        return [("", key, value) for key, value in values.items()]
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation="", buckets=DEFAULT_BUCKETS):
+        """Initialize histogram with upper bucket bounds."""
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """Record an observation."""
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the with block takes."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def get(self, **labels):
+        """Return (count, sum) of observations."""
+        with self.lock:
+            counts, total = self.values.get(self.key(labels), ([0], 0.0))
+        return sum(counts), total
+
+    def samples(self):
+        """Return list of (suffix, labels, value)."""
+        with self.lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self.values.items()}
+        samples = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = (("le", format_value(bound)),)
+                samples.append(("_bucket", key + le, cumulative))
+            samples.append(("_sum", key, total))
+            samples.append(("_count", key, cumulative))
+        return samples
+
+
+class Registry:
+    """Collection of named metrics."""
+
+    def __init__(self):
+        """Initialize empty registry."""
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get(self, cls, name, documentation, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, documentation, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"{name} is already registered as a {metric.kind}")
+        return metric
+
+    def counter(self, name, documentation=""):
+        """Return counter name, creating it if needed."""
+        return self._get(Counter, name, documentation)
+
+    def gauge(self, name, documentation=""):
+        """Return gauge name, creating it if needed."""
+        return self._get(Gauge, name, documentation)
+
+    def histogram(self, name, documentation="", buckets=DEFAULT_BUCKETS):
+        """Return histogram name, creating it if needed."""
+        return self._get(Histogram, name, documentation, buckets=buckets)
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(
+                    f"{metric.name}{suffix}{format_labels(labels)} {format_value(value)}"
+                )
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Return compact {sample: value} dict, histograms as count and sum."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        snapshot = {}
+        for metric in metrics:
+            for suffix, labels, value in metric.samples():
+                if suffix == "_bucket":
+                    continue
+                name = metric.name + suffix + format_labels(labels)
+                snapshot[name] = round(value, 6) if isinstance(value, float) else value
+        return snapshot
+
+
+REGISTRY = Registry()
+
+
+class MetricsServer:
+    """HTTP server exposing a registry on /metrics."""
+
+    def __init__(self, registry=REGISTRY, port=9100, host="127.0.0.1"):
+        """Initialize server, port 0 picks a free port."""
+        self.registry = registry
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = None
+
+    def start(self):
+        """Serve in a daemon thread."""
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop serving."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        """Build request handler class bound to this registry."""
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            """Request handler."""
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                """Keep the log for the capture pipeline."""
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Serve metrics."""
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
@@ -0,0 +1,109 @@
+"""
+Probe request capture on several radios.
+
+A monitor interface only hears one channel at a time, so with one adapter
+probe mode misses the probe requests sent on every other channel. Extra
+monitor interfaces each run their own capture process, hopping their own
+share of the channels (see ``HopScheduler.split``), and write to their own
+file next to the one of the external interface:
+
+    <session id>_<time>_probe.pcapng         external interface
+    <session id>_<time>_probe_wlan2.pcapng   extra radio wlan2
+
+When capture stops the radio files are either merged into the first one,
+packets in timestamp order with an interface description per radio, so the
+backend gets a single capture as before, or uploaded one by one.
+
+Virtual radios for testing are created with ``modprobe mac80211_hwsim
+radios=N``.
+"""
+import heapq
+import os
+import struct
+
+from .probe_extractor import (
+    BLOCK_EPB,
+    BLOCK_IDB,
+    BLOCK_SHB,
+    BYTE_ORDER_MAGIC,
+    PcapngError,
+    PcapngReader,
+)
+
+RADIO_OUTPUTS = ("merged", "per_radio")
+
+
+def radio_output(output, interface):
+    """Return the capture file of an extra radio capturing along with output."""
+    base, extension = os.path.splitext(output)
+    return f"{base}_{interface}{extension}"
+
+
+def parse_interfaces(spec):
+    """Parse a comma separated list of interface names."""
+    if not spec:
+        return []
+    return [name.strip() for name in spec.split(",") if name.strip()]
+
+
+def capture_packets(path, source):
+    """Yield (timestamp, source, interface id, EPB body) of the capture at path."""
+    with open(path, "rb") as capture:
+        reader = PcapngReader(capture)
+        for block_type, body in reader.blocks():
+            if block_type == BLOCK_SHB and reader.endian != "<":
+                raise PcapngError(f"Cannot merge big endian capture {path}")
+            if block_type != BLOCK_EPB:
+                continue
+            interface_id, ts_high, ts_low = struct.unpack("<III", body[:12])
+            if interface_id >= len(reader.interfaces):
+                continue
+            resolution = reader.interfaces[interface_id][1]
+            yield ((ts_high << 32) | ts_low) * resolution, source, interface_id, body
+
+
+def capture_interfaces(path):
+    """Return the interface description block bodies of the capture at path."""
+    interfaces = []
+    with open(path, "rb") as capture:
+        reader = PcapngReader(capture)
+        for block_type, body in reader.blocks():
+            if block_type == BLOCK_SHB and interfaces:
+                raise PcapngError(f"Cannot merge multi section capture {path}")
+            if block_type == BLOCK_IDB:
+                interfaces.append(body)
+    return interfaces
+
+
+def write_block(output, block_type, body):
+    """Write a little endian pcapng block."""
+    length = 12 + len(body)
+    output.write(struct.pack("<II", block_type, length) + body + struct.pack("<I", length))
+
+
+def merge_captures(paths, output):
+    """Merge the pcapng captures at paths into output.
+
+    Interfaces of every capture are described in turn and packets are
+    interleaved by timestamp, reading the captures in one pass. Captures
+    that don't exist, e.g. of a radio that never started, are skipped.
+    Returns the number of packets written.
+    """
+    paths = [path for path in paths if os.path.exists(path)]
+    interfaces = [capture_interfaces(path) for path in paths]
+    # Interface ids of each capture start after those of the ones before.
+    offsets = [sum(map(len, interfaces[:source])) for source in range(len(paths))]
+    packets = 0
+    with open(output, "wb") as merged:
+        write_block(merged, BLOCK_SHB, struct.pack("<IHHq", BYTE_ORDER_MAGIC, 1, 0, -1))
+        for bodies in interfaces:
+            for body in bodies:
+                write_block(merged, BLOCK_IDB, body)
+        streams = [capture_packets(path, source) for source, path in enumerate(paths)]
+        for _, source, interface_id, body in heapq.merge(
+            *streams, key=lambda packet: (packet[0], packet[1])
+        ):
+            body = struct.pack("<I", offsets[source] + interface_id) + body[4:]
+            write_block(merged, BLOCK_EPB, body)
+            packets += 1
+    return packets
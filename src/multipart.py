@@ -0,0 +1,148 @@
+"""
+Streaming multipart/form-data bodies for file uploads.
+
+Passing ``files=`` to requests builds the whole multipart body in memory,
+which for a probe capture of a long session is hundreds of MB on a Pi. The
+encoder here is handed to requests as the request body instead: it yields
+the form fields, then the file read in fixed size chunks, then the closing
+boundary, so memory use doesn't depend on the file size.
+
+An uncompressed body has a known length and is sent with Content-Length.
+The size of a compressed body is only known once the file has been
+compressed, so it is sent with chunked transfer encoding instead, and the
+file is compressed once, while it is sent, without writing a compressed
+copy to tmpfs.
+"""
+import os
+import uuid
+
+from .compression import SUFFIXES, CompressedReader
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _quote(value):
+    """Quote a value for a Content-Disposition parameter."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+class MultipartEncoder:  # pylint: disable=too-many-instance-attributes
+    """Multipart body with form fields and one file, read while it is sent."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        fields,
+        path,
+        field_name="data",
+        filename=None,
+        encoding=None,
+        level=None,
+        chunk_size=CHUNK_SIZE,
+    ):
+        """Initialize body uploading path as field_name along with fields.
+
+        With encoding the file is compressed while it is read. The body then
+        has no length and file_size is only set once the file part was sent.
+        """
+        self.fields = fields
+        self.path = path
+        self.encoding = encoding
+        self.level = level
+        self.chunk_size = chunk_size
+        self.boundary = uuid.uuid4().hex
+        self.file = None
+        filename = filename or os.path.basename(path)
+        preamble = b"".join(
+            self._part_header(name) + str(value).encode() + b"\r\n"
+            for name, value in fields.items()
+        )
+        self.preamble = preamble + self._part_header(
+            field_name,
+            filename=filename,
+            content_type="application/octet-stream",
+        )
+        self.epilogue = f"\r\n--{self.boundary}--\r\n".encode()
+        # requests sends a body with a len as is, without one chunked.
+        self.file_size = None
+        self.len = None
+        if not encoding:
+            self.file_size = os.path.getsize(path)
+            self.len = len(self.preamble) + self.file_size + len(self.epilogue)
+
+    def _part_header(self, name, filename=None, content_type=None):
+        """Return boundary and headers of a part."""
+        disposition = f'form-data; name="{_quote(name)}"'
+        if filename is not None:
+            disposition += f'; filename="{_quote(filename)}"'
+        header = f"--{self.boundary}\r\nContent-Disposition: {disposition}\r\n"
+        if content_type:
+            header += f"Content-Type: {content_type}\r\n"
+        return (header + "\r\n").encode()
+
+    @property
+    def content_type(self):
+        """Return the Content-Type header value."""
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __iter__(self):
+        """Yield the body in chunks, reading the file from the start."""
+        self.close()
+        yield self.preamble
+        self.file = open(self.path, "rb")  # pylint: disable=consider-using-with
+        try:
+            if self.encoding:
+                yield from self._compressed_chunks()
+            else:
+                yield from self._file_chunks()
+        finally:
+            self.close()
+        yield self.epilogue
+
+    def _file_chunks(self):
+        """Yield file_size bytes of the file."""
+        remaining = self.file_size
+        while remaining:
+            chunk = self.file.read(min(self.chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+        # Sending less than Content-Length would corrupt the body.
+        if remaining:
+            raise IOError(f"{self.path} changed during upload")
+
+    def _compressed_chunks(self):
+        """Yield the file compressed, setting file_size once done."""
+        reader = CompressedReader(self.file, self.encoding, self.level, self.chunk_size)
+        size = 0
+        while True:
+            chunk = reader.read(self.chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            yield chunk
+        self.file_size = size
+
+    def close(self):
+        """Close the file if a read is in progress."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        """Return self, the file is closed on exit."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Close the file."""
+        self.close()
+
+
+def multipart_upload(path, data, encoding=None, level=None):
+    """Return the body and headers to post path as the data field with form data."""
+    filename = os.path.basename(path)
+    if encoding:
+        filename += SUFFIXES[encoding]
+        data = dict(data, encoding=encoding)
+    body = MultipartEncoder(data, path, filename=filename, encoding=encoding, level=level)
+    return body, {"Content-Type": body.content_type}
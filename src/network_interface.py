@@ -1,7 +1,8 @@
 """Network interface manager."""
-import asyncio
-import itertools
-from .wificommon import WiFi
+import re
+
+from .nl80211 import NL80211, NetlinkError
+from .wificommon import WiFi, WiFiControlError
 
 
 class NetworkInterface(WiFi):
@@ -15,6 +16,8 @@ class NetworkInterface(WiFi):
         self.interface = interface
         self.current_mode = None
         self.network_manager_conf = network_manager_conf
+        self.nl80211 = None
+        self.nl80211_available = True
 
     def init_network(self):
         """Initialize network manager setup."""
@@ -37,7 +40,15 @@ class NetworkInterface(WiFi):
         self.execute_command(f"ifconfig {self.interface} {action}")
 
     def change_interface_mode(self, mode):
-        """Change mode at which interface operates."""
+        """Change mode at which interface operates.
+
+        An interface already in mode is only brought up if it's down.
+        """
+        if self.get_mode() == mode:
+            if not self.is_up():
+                self.switch_network(1)
+            self.current_mode = mode
+            return
         self.switch_network(0)
         self.execute_command(f"iwconfig {self.interface} mode {mode}")
         self.switch_network(1)
@@ -57,14 +68,54 @@ class NetworkInterface(WiFi):
         ]
         return "\n".join(network_conf)
 
+    def get_mode(self):
+        """Return the type the interface runs as, e.g. monitor, None if unknown."""
+        if self.netlink() is not None:
+            try:
+                return self.nl80211.get_interface(self.interface)["type"]
+            except NetlinkError:
+                pass
+            except OSError:
+                # Reopen the socket on the next call.
+                self.nl80211.close()
+                self.nl80211 = None
+        try:
+            info = self.execute_command(f"iw dev {self.interface} info")
+        except WiFiControlError:
+            return None
+        match = re.search(rb"^\s*type (\S+)", info, re.MULTILINE)
+        return match.group(1).decode() if match else None
+
+    def is_up(self):
+        """Return True if the interface is administratively up."""
+        try:
+            with open(f"/sys/class/net/{self.interface}/flags", "r") as flags:
+                return bool(int(flags.read(), 16) & 1)
+        except (OSError, ValueError):
+            return False
+
+    def netlink(self):
+        """Return the nl80211 client, None if the kernel doesn't have it."""
+        if self.nl80211 is None and self.nl80211_available:
+            try:
+                self.nl80211 = NL80211()
+            except (NetlinkError, OSError) as error:
+                print(f"nl80211 unavailable ({error}), using iwconfig")
+                self.nl80211_available = False
+        return self.nl80211
+
     def set_channel(self, channel):
-        """Set channel of interface."""
-        self.execute_command(f"iwconfig {self.interface} channel {channel}")
-
-    def circular_channel_switching(self, time_interval):
-        """Async function to cycle through channels."""
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        for i in itertools.cycle(range(1, 12)):
-            self.set_channel(i)
-            loop.run_until_complete(asyncio.sleep(time_interval))
+        """Set channel of interface, over nl80211 when the kernel has it.
+
+        Raises NetlinkError if the driver refuses the channel.
+        """
+        if self.netlink() is None:
+            self.execute_command(f"iwconfig {self.interface} channel {channel}")
+            return
+        try:
+            self.nl80211.set_channel(self.interface, channel)
+        except OSError:
+            # Reopen the socket on the next call.
+            self.nl80211.close()
+            self.nl80211 = None
+            raise
@@ -0,0 +1,282 @@
+"""
+Minimal nl80211 client over generic netlink.
+
+Keeps one netlink socket open and talks to the kernel's nl80211 family
+directly instead of forking ``iw`` and parsing its text output:
+
+- get_stations: dump the stations associated with an interface, with MAC,
+  inactive time, signal and rx/tx byte counters
+- get_interface: type (AP, monitor, ...) and frequency of an interface
+- set_channel: tune an interface (e.g. a monitor interface) to a channel
+
+Station changes between dumps are followed through hostapd's control
+interface instead, see ``StationTracker``.
+
+Netlink uses host byte order. Only the attributes we use are decoded. Message
+parsing is kept in plain functions so it can be tested against captured
+messages without a radio.
+"""
+import errno
+import os
+import socket
+import struct
+import sys
+import threading
+
+NETLINK_GENERIC = 16
+
+NLM_F_REQUEST = 0x01
+NLM_F_ACK = 0x04
+NLM_F_DUMP = 0x300
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+NLA_TYPE_MASK = 0x3FFF
+
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+CTRL_ATTR_MCAST_GROUPS = 7
+CTRL_ATTR_MCAST_GRP_NAME = 1
+CTRL_ATTR_MCAST_GRP_ID = 2
+
+NL80211_CMD_SET_WIPHY = 2
+NL80211_CMD_GET_INTERFACE = 5
+NL80211_CMD_NEW_INTERFACE = 7
+NL80211_CMD_GET_STATION = 17
+NL80211_CMD_NEW_STATION = 19
+
+NL80211_ATTR_IFINDEX = 3
+NL80211_ATTR_IFNAME = 4
+NL80211_ATTR_IFTYPE = 5
+NL80211_ATTR_MAC = 6
+NL80211_ATTR_STA_INFO = 21
+NL80211_ATTR_WIPHY_FREQ = 38
+NL80211_ATTR_WIPHY_CHANNEL_TYPE = 39
+
+NL80211_CHAN_NO_HT = 0
+
+NL80211_IFTYPE_STATION = 2
+NL80211_IFTYPE_AP = 3
+NL80211_IFTYPE_MONITOR = 6
+IFTYPE_NAMES = {
+    NL80211_IFTYPE_STATION: "managed",
+    NL80211_IFTYPE_AP: "AP",
+    NL80211_IFTYPE_MONITOR: "monitor",
+}
+
+NL80211_STA_INFO_INACTIVE_TIME = 1
+NL80211_STA_INFO_RX_BYTES = 2
+NL80211_STA_INFO_TX_BYTES = 3
+NL80211_STA_INFO_SIGNAL = 7
+NL80211_STA_INFO_CONNECTED_TIME = 16
+NL80211_STA_INFO_RX_BYTES64 = 23
+NL80211_STA_INFO_TX_BYTES64 = 24
+
+class NetlinkError(Exception):
+    """Error reported by netlink."""
+
+    def __init__(self, code, message=None):
+        """Initialize from a (positive) errno code."""
+        super().__init__(message or os.strerror(code))
+        self.code = code
+
+
+def pack_attr(attr_type, payload):
+    """Pack a netlink attribute, padded to 4 bytes."""
+    length = 4 + len(payload)
+    return struct.pack("=HH", length, attr_type) + payload + b"\x00" * (-length % 4)
+
+
+def parse_attrs(data):
+    """Parse netlink attributes into a dict of type to raw payload."""
+    attrs = {}
+    offset = 0
+    while offset + 4 <= len(data):
+        length, attr_type = struct.unpack("=HH", data[offset:offset + 4])
+        if length < 4:
+            break
+        attrs[attr_type & NLA_TYPE_MASK] = data[offset + 4:offset + length]
+        offset += length + (-length % 4)
+    return attrs
+
+
+def pack_message(msg_type, flags, seq, cmd, attrs=b"", version=1):
+    """Pack a generic netlink message."""
+    payload = struct.pack("=BBH", cmd, version, 0) + attrs
+    return struct.pack("=IHHII", 16 + len(payload), msg_type, flags, seq, 0) + payload
+
+
+def parse_messages(data):
+    """Split a netlink datagram into (type, flags, seq, payload) tuples."""
+    messages = []
+    offset = 0
+    while offset + 16 <= len(data):
+        length, msg_type, flags, seq, _ = struct.unpack(
+            "=IHHII", data[offset:offset + 16]
+        )
+        if length < 16:
+            break
+        messages.append((msg_type, flags, seq, data[offset + 16:offset + length]))
+        offset += length + (-length % 4)
+    return messages
+
+
+def parse_genl(payload):
+    """Split generic netlink payload into (cmd, attrs)."""
+    return payload[0], parse_attrs(payload[4:])
+
+
+def channel_to_frequency(channel):
+    """Return centre frequency in MHz of a 2.4 or 5 GHz channel."""
+    if channel == 14:
+        return 2484
+    if 1 <= channel < 14:
+        return 2407 + 5 * channel
+    if 32 <= channel <= 177:
+        return 5000 + 5 * channel
+    raise ValueError(f"Unknown channel {channel}")
+
+
+def _unpack_int(data, signed=False):
+    """Unpack a host byte order integer of len(data) bytes."""
+    return int.from_bytes(data, sys.byteorder, signed=signed)
+
+
+def parse_station(attrs):
+    """Build a station dict from nl80211 station attributes."""
+    info = parse_attrs(attrs.get(NL80211_ATTR_STA_INFO, b""))
+    station = {
+        "mac": ":".join(f"{byte:02x}" for byte in attrs.get(NL80211_ATTR_MAC, b"")),
+        "inactive_time": None,
+        "connected_time": None,
+        "signal": None,
+        "rx_bytes": None,
+        "tx_bytes": None,
+    }
+    if NL80211_STA_INFO_INACTIVE_TIME in info:
+        station["inactive_time"] = _unpack_int(info[NL80211_STA_INFO_INACTIVE_TIME])
+    if NL80211_STA_INFO_CONNECTED_TIME in info:
+        station["connected_time"] = _unpack_int(info[NL80211_STA_INFO_CONNECTED_TIME])
+    if NL80211_STA_INFO_SIGNAL in info:
+        station["signal"] = _unpack_int(info[NL80211_STA_INFO_SIGNAL][:1], signed=True)
+    for key, attr32, attr64 in (
+        ("rx_bytes", NL80211_STA_INFO_RX_BYTES, NL80211_STA_INFO_RX_BYTES64),
+        ("tx_bytes", NL80211_STA_INFO_TX_BYTES, NL80211_STA_INFO_TX_BYTES64),
+    ):
+        if attr64 in info:
+            station[key] = _unpack_int(info[attr64])
+        elif attr32 in info:
+            station[key] = _unpack_int(info[attr32])
+    return station
+
+
+class NL80211:
+    """Persistent nl80211 netlink client."""
+
+    def __init__(self, sock=None):
+        """Open netlink socket and resolve the nl80211 family."""
+        if sock is None:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_GENERIC)
+            sock.bind((0, 0))
+        self.sock = sock
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.family_id, self.groups = self.resolve_family("nl80211")
+
+    def close(self):
+        """Close the socket."""
+        self.sock.close()
+
+    def request(self, msg_type, cmd, attrs=b"", dump=False):
+        """Send a request and return list of (cmd, attrs) replies."""
+        with self.lock:
+            self.seq += 1
+            flags = NLM_F_REQUEST | NLM_F_ACK | (NLM_F_DUMP if dump else 0)
+            self.sock.send(pack_message(msg_type, flags, self.seq, cmd, attrs))
+            replies = []
+            while True:
+                for reply_type, _, seq, payload in parse_messages(
+                    self.sock.recv(65536)
+                ):
+                    if seq != self.seq:
+                        continue  # Late ack of an earlier request.
+                    if reply_type == NLMSG_ERROR:
+                        (code,) = struct.unpack("=i", payload[:4])
+                        if code:
+                            raise NetlinkError(-code)
+                        return replies
+                    if reply_type == NLMSG_DONE:
+                        return replies
+                    replies.append(parse_genl(payload))
+
+    def resolve_family(self, name):
+        """Return (family id, {multicast group name: id}) for a genl family."""
+        replies = self.request(
+            GENL_ID_CTRL,
+            CTRL_CMD_GETFAMILY,
+            pack_attr(CTRL_ATTR_FAMILY_NAME, name.encode() + b"\x00"),
+        )
+        if not replies:
+            raise NetlinkError(errno.ENOENT, f"No generic netlink family {name}")
+        _, attrs = replies[0]
+        family_id = _unpack_int(attrs[CTRL_ATTR_FAMILY_ID][:2])
+        groups = {}
+        for group in parse_attrs(attrs.get(CTRL_ATTR_MCAST_GROUPS, b"")).values():
+            group_attrs = parse_attrs(group)
+            group_name = group_attrs[CTRL_ATTR_MCAST_GRP_NAME].rstrip(b"\x00").decode()
+            groups[group_name] = _unpack_int(group_attrs[CTRL_ATTR_MCAST_GRP_ID])
+        return family_id, groups
+
+    def get_stations(self, ifname):
+        """Return list of station dicts associated with interface ifname."""
+        ifindex = socket.if_nametoindex(ifname)
+        replies = self.request(
+            self.family_id,
+            NL80211_CMD_GET_STATION,
+            pack_attr(NL80211_ATTR_IFINDEX, struct.pack("=I", ifindex)),
+            dump=True,
+        )
+        return [
+            parse_station(attrs)
+            for cmd, attrs in replies
+            if cmd == NL80211_CMD_NEW_STATION
+        ]
+
+    def get_interface(self, ifname):
+        """Return dict with name, type and frequency of interface ifname."""
+        ifindex = socket.if_nametoindex(ifname)
+        replies = self.request(
+            self.family_id,
+            NL80211_CMD_GET_INTERFACE,
+            pack_attr(NL80211_ATTR_IFINDEX, struct.pack("=I", ifindex)),
+        )
+        for cmd, attrs in replies:
+            if cmd != NL80211_CMD_NEW_INTERFACE:
+                continue
+            iftype = _unpack_int(attrs.get(NL80211_ATTR_IFTYPE, b"\x00"))
+            frequency = attrs.get(NL80211_ATTR_WIPHY_FREQ)
+            return {
+                "ifname": attrs.get(NL80211_ATTR_IFNAME, b"").rstrip(b"\x00").decode(),
+                "type": IFTYPE_NAMES.get(iftype, str(iftype)),
+                "frequency": _unpack_int(frequency) if frequency else None,
+            }
+        raise NetlinkError(errno.ENODEV, f"No interface {ifname}")
+
+    def set_channel(self, ifname, channel):
+        """Tune interface ifname to a 20 MHz channel."""
+        ifindex = socket.if_nametoindex(ifname)
+        self.request(
+            self.family_id,
+            NL80211_CMD_SET_WIPHY,
+            pack_attr(NL80211_ATTR_IFINDEX, struct.pack("=I", ifindex))
+            + pack_attr(
+                NL80211_ATTR_WIPHY_FREQ,
+                struct.pack("=I", channel_to_frequency(channel)),
+            )
+            + pack_attr(
+                NL80211_ATTR_WIPHY_CHANNEL_TYPE, struct.pack("=I", NL80211_CHAN_NO_HT)
+            ),
+        )
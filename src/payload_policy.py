@@ -0,0 +1,251 @@
+"""
+Payload policies for hotspot capture.
+
+Most of what clients of the hotspot send is encrypted TLS the backend can't
+use, so captures can be cut down to what it can:
+
+- full: frames are captured whole (the original behaviour)
+- snaplen: dumpcap truncates every frame to ``snaplen`` bytes
+- headers: every finished ring file is rewritten to keep the link, IP and
+  transport headers of each frame plus the first ``flow_bytes`` bytes of
+  payload of each flow (both directions together)
+
+With headers, DNS and mDNS messages, TLS handshake records and QUIC long
+header packets (which carry the SNI) and EAPOL frames are always kept
+whole, as are management and control frames. Truncated frames keep their
+original length in the pcapng block, so flow sizes and timing are intact
+and the file is a normal capture with a short snap length for the observer,
+the upload path and the backend.
+
+Captured over the air from a protected network, data frames are encrypted
+and their IP headers can't be read. Those are kept up to the CCMP header,
+plus the first ``flow_bytes`` of each pair of stations, which only the
+backend can decrypt, with the handshake kept whole.
+"""
+import collections
+import os
+import struct
+
+from .metrics import REGISTRY
+from .probe_extractor import (
+    BLOCK_EPB,
+    LINKTYPE_IEEE802_11,
+    LINKTYPE_IEEE802_11_RADIOTAP,
+    PcapngError,
+    PcapngReader,
+    parse_radiotap,
+)
+
+MODES = ("full", "snaplen", "headers")
+
+LINKTYPE_ETHERNET = 1
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = 0x8100
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+# DNS and mDNS are kept whole.
+FULL_PORTS = (53, 5353)
+TLS_HANDSHAKE = 0x16
+LLC_SNAP = b"\xaa\xaa\x03"
+# 802.11 frame control.
+WLAN_DATA = 2
+WLAN_FLAG_PROTECTED = 0x40
+WLAN_FLAG_ORDER = 0x80
+CCMP_HEADER = 8
+
+
+class PayloadPolicy:  # pylint: disable=too-many-instance-attributes
+    """How much of each frame a hotspot capture keeps."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, mode="full", snaplen=256, flow_bytes=1024, max_flows=65536, metrics=REGISTRY
+    ):
+        """Initialize policy.
+
+        The first flow_bytes of payload are kept for at most max_flows flows
+        at a time, the least recently seen flows are forgotten first.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown payload policy {mode!r}")
+        self.mode = mode
+        self.snaplen = int(snaplen)
+        self.flow_bytes = int(flow_bytes)
+        self.max_flows = max_flows
+        self.flows = collections.OrderedDict()
+        self.metrics = metrics
+        self.removed_bytes = metrics.counter(
+            "pi_payload_removed_bytes_total", "Capture bytes removed by the payload policy."
+        )
+
+    def dumpcap_snaplen(self):
+        """Return the snap length to pass dumpcap, None to capture whole frames."""
+        return self.snaplen if self.mode == "snaplen" else None
+
+    def apply(self, path):
+        """Rewrite the capture at path with the headers policy.
+
+        Returns (bytes before, bytes after), the same if nothing was done.
+        """
+        size = os.path.getsize(path)
+        if self.mode != "headers":
+            return size, size
+        temp_path = path + ".tmp"
+        try:
+            with open(path, "rb") as capture, open(temp_path, "wb") as output:
+                self.rewrite(capture, output)
+            stat = os.stat(path)
+            os.replace(temp_path, path)
+            # Eviction goes by age, the rewritten file is as old as the capture.
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        except (OSError, PcapngError) as error:
+            print(f"Uploading {path} whole: {error}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return size, size
+        truncated = os.path.getsize(path)
+        self.removed_bytes.inc(size - truncated, mode=self.mode)
+        return size, truncated
+
+    def rewrite(self, capture, output):
+        """Copy pcapng blocks from capture to output, truncating packets."""
+        reader = PcapngReader(capture)
+        for block_type, body in reader.blocks():
+            if block_type == BLOCK_EPB:
+                body = self.truncate_epb(reader, body)
+            length = 12 + len(body)
+            header = struct.pack(reader.endian + "II", block_type, length)
+            output.write(header + body + struct.pack(reader.endian + "I", length))
+
+    def truncate_epb(self, reader, body):
+        """Return enhanced packet block body with the packet truncated."""
+        interface_id, ts_high, ts_low, captured_len, orig_len = struct.unpack(
+            reader.endian + "IIIII", body[:20]
+        )
+        if interface_id >= len(reader.interfaces):
+            return body
+        data = body[20:20 + captured_len]
+        options = body[20 + captured_len + (-captured_len % 4):]
+        keep = min(self.keep(reader.interfaces[interface_id][0], data), captured_len)
+        if keep == captured_len:
+            return body
+        return (
+            struct.pack(reader.endian + "IIIII", interface_id, ts_high, ts_low, keep, orig_len)
+            + data[:keep]
+            + b"\x00" * (-keep % 4)
+            + options
+        )
+
+    def keep(self, linktype, data):
+        """Return how many bytes of a packet to keep."""
+        try:
+            if linktype == LINKTYPE_ETHERNET:
+                return self._keep_ethernet(data)
+            if linktype in (LINKTYPE_IEEE802_11_RADIOTAP, LINKTYPE_IEEE802_11):
+                return self._keep_wlan(linktype, data)
+        except (IndexError, struct.error, PcapngError):
+            pass
+        return len(data)
+
+    def _keep_ethernet(self, data):
+        """Return bytes to keep of an Ethernet frame."""
+        (ethertype,) = struct.unpack_from("!H", data, 12)
+        offset = 14
+        if ethertype == ETHERTYPE_VLAN:
+            (ethertype,) = struct.unpack_from("!H", data, 16)
+            offset = 18
+        return self._keep_network(data, offset, ethertype)
+
+    def _keep_wlan(self, linktype, data):
+        """Return bytes to keep of an 802.11 frame."""
+        offset = 0
+        if linktype == LINKTYPE_IEEE802_11_RADIOTAP:
+            offset, _ = parse_radiotap(data)
+        frame_control, flags = data[offset], data[offset + 1]
+        subtype = frame_control >> 4
+        # Management, control and null data frames carry no payload to cut.
+        if (frame_control >> 2) & 3 != WLAN_DATA or subtype & 4:
+            return len(data)
+        header = 24
+        if flags & 3 == 3:
+            header += 6
+        if subtype & 8:
+            header += 2
+            if flags & WLAN_FLAG_ORDER:
+                header += 4
+        start = offset + header
+        if flags & WLAN_FLAG_PROTECTED:
+            stations = sorted((data[offset + 4:offset + 10], data[offset + 10:offset + 16]))
+            return self._flow_keep(("wlan", *stations), start + CCMP_HEADER, len(data))
+        if data[start:start + 3] != LLC_SNAP:
+            return len(data)
+        (ethertype,) = struct.unpack_from("!H", data, start + 6)
+        return self._keep_network(data, start + 8, ethertype)
+
+    def _keep_network(self, data, offset, ethertype):
+        """Return bytes to keep of a packet with network layer at offset."""
+        if ethertype == ETHERTYPE_IPV4:
+            header = (data[offset] & 0xF) * 4
+            protocol = data[offset + 9]
+            source, destination = data[offset + 12:offset + 16], data[offset + 16:offset + 20]
+            # Later fragments have no transport header.
+            (fragment,) = struct.unpack_from("!H", data, offset + 6)
+            if fragment & 0x1FFF:
+                key = ("ip", protocol, *sorted((source, destination)))
+                return self._flow_keep(key, offset + header, len(data))
+        elif ethertype == ETHERTYPE_IPV6:
+            header = 40
+            protocol = data[offset + 6]
+            source, destination = data[offset + 8:offset + 24], data[offset + 24:offset + 40]
+        else:
+            # EAPOL, ARP and anything else not IP is kept whole.
+            return len(data)
+        transport = offset + header
+        if protocol == IPPROTO_TCP:
+            ports = struct.unpack_from("!HH", data, transport)
+            payload = transport + (data[transport + 12] >> 4) * 4
+        elif protocol == IPPROTO_UDP:
+            ports = struct.unpack_from("!HH", data, transport)
+            payload = transport + 8
+        else:
+            key = ("ip", protocol, *sorted((source, destination)))
+            return self._flow_keep(key, transport, len(data))
+        if set(ports) & set(FULL_PORTS):
+            return len(data)
+        if payload < len(data) and protocol == IPPROTO_TCP:
+            # TLS handshake record, the ClientHello carries the SNI.
+            if data[payload] == TLS_HANDSHAKE and data[payload + 1:payload + 2] == b"\x03":
+                return len(data)
+        if payload < len(data) and protocol == IPPROTO_UDP and 443 in ports:
+            # QUIC long header packets, the Initial carries the SNI.
+            if data[payload] & 0xC0 == 0xC0:
+                return len(data)
+        key = (protocol, *sorted(((source, ports[0]), (destination, ports[1]))))
+        return self._flow_keep(key, payload, len(data))
+
+    def _flow_keep(self, key, payload, length):
+        """Return bytes to keep of a packet of flow key with payload at offset payload."""
+        used = self.flows.pop(key, 0)
+        take = max(min(length - payload, self.flow_bytes - used), 0)
+        self.flows[key] = used + take
+        if len(self.flows) > self.max_flows:
+            self.flows.popitem(last=False)
+        return min(payload + take, length)
+
+
+def make_payload_policy(spec, default):
+    """Return the policy for a session's spec, default if it has none.
+
+    spec is a mode name or a dict with mode and optionally snaplen and
+    flow_bytes, as the backend sends it along with the access point.
+    """
+    if not spec:
+        return default
+    if isinstance(spec, str):
+        spec = {"mode": spec}
+    return PayloadPolicy(
+        spec.get("mode", "full"),
+        snaplen=spec.get("snaplen", default.snaplen),
+        flow_bytes=spec.get("flow_bytes", default.flow_bytes),
+        metrics=default.metrics,
+    )
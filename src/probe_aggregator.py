@@ -0,0 +1,237 @@
+"""
+Aggregate probe requests on the pi.
+
+Phones send bursts of nearly identical probe requests, on every channel they
+scan. Instead of uploading every frame, probe requests are grouped by
+(source MAC, SSID, IE digest) per time window of ``window`` seconds and each
+group is uploaded as one row:
+
+- first and last time seen
+- source MAC, SSID and IE digest
+- number of probe requests
+- RSSI minimum, maximum and mean
+
+Groups are stored column-wise in ``array`` buffers, with MACs and digests as
+integers and SSIDs interned, so the memory used grows with the number of
+groups, not frames, and is capped by ``max_rows``. Probe requests opening a
+new group once the buffer is full are counted as dropped.
+
+Batches are written as NDJSON like probe records: a header line naming the
+format and fields followed by one JSON array per group.
+"""
+import json
+from array import array
+
+from .probe_extractor import PcapngError, PcapngReader, iter_probe_records
+
+AGGREGATE_FIELDS = [
+    "first_seen",
+    "last_seen",
+    "mac",
+    "ssid",
+    "ie_digest",
+    "count",
+    "rssi_min",
+    "rssi_max",
+    "rssi_mean",
+]
+AGGREGATE_FORMAT = "probe-aggregate-v1"
+
+# Typecode and initial value of each column.
+COLUMNS = {
+    "window": ("q", 0),
+    "mac": ("Q", 0),
+    "ssid": ("I", 0),
+    "digest": ("Q", 0),
+    "first_seen": ("d", 0.0),
+    "last_seen": ("d", 0.0),
+    "count": ("I", 0),
+    "rssi_min": ("b", 127),
+    "rssi_max": ("b", -128),
+    "rssi_sum": ("q", 0),
+    "rssi_count": ("I", 0),
+}
+
+
+class ProbeAggregator:  # pylint: disable=too-many-instance-attributes
+    """Column-wise probe request groups per time window."""
+
+    def __init__(self, window=60, max_rows=50000):
+        """Initialize aggregator grouping probe requests per window seconds."""
+        self.window = window
+        self.max_rows = max_rows
+        self.columns = {name: array(code) for name, (code, _) in COLUMNS.items()}
+        self.index = {}
+        self.ssids = {}
+        self.ssid_names = []
+        self.latest = 0.0
+        self.frames = 0
+        self.dropped = 0
+
+    def __len__(self):
+        """Return number of groups."""
+        return len(self.index)
+
+    def add(self, record):
+        """Add a probe request record. Returns False if it was dropped."""
+        timestamp = record["ts"] if record["ts"] is not None else self.latest
+        self.latest = max(self.latest, timestamp)
+        ssid = self.ssids.get(record["ssid"])
+        if ssid is None:
+            ssid = self.ssids[record["ssid"]] = len(self.ssid_names)
+            self.ssid_names.append(record["ssid"])
+        key = (
+            int(timestamp // self.window),
+            int(record["mac"].replace(":", ""), 16),
+            ssid,
+            int(record["ie_digest"], 16),
+        )
+        columns = self.columns
+        row = self.index.get(key)
+        if row is None:
+            if len(self.index) >= self.max_rows:
+                self.dropped += 1
+                return False
+            row = self.index[key] = len(columns["count"])
+            for name, (_, initial) in COLUMNS.items():
+                columns[name].append(initial)
+            columns["window"][row], columns["mac"][row] = key[0], key[1]
+            columns["ssid"][row], columns["digest"][row] = ssid, key[3]
+            columns["first_seen"][row] = timestamp
+        self.frames += 1
+        columns["count"][row] += 1
+        columns["last_seen"][row] = max(columns["last_seen"][row], timestamp)
+        columns["first_seen"][row] = min(columns["first_seen"][row], timestamp)
+        rssi = record["rssi"]
+        if rssi is not None:
+            columns["rssi_min"][row] = min(columns["rssi_min"][row], rssi)
+            columns["rssi_max"][row] = max(columns["rssi_max"][row], rssi)
+            columns["rssi_sum"][row] += rssi
+            columns["rssi_count"][row] += 1
+        return True
+
+    def row(self, row):
+        """Return group row as a list of AGGREGATE_FIELDS values."""
+        columns = self.columns
+        rssi_count = columns["rssi_count"][row]
+        mac = f"{columns['mac'][row]:012x}"
+        return [
+            round(columns["first_seen"][row], 6),
+            round(columns["last_seen"][row], 6),
+            ":".join(mac[i:i + 2] for i in range(0, 12, 2)),
+            self.ssid_names[columns["ssid"][row]],
+            f"{columns['digest'][row]:016x}",
+            columns["count"][row],
+            columns["rssi_min"][row] if rssi_count else None,
+            columns["rssi_max"][row] if rssi_count else None,
+            round(columns["rssi_sum"][row] / rssi_count, 1) if rssi_count else None,
+        ]
+
+    def flush(self, closed_only=False):
+        """Remove groups and return them as rows.
+
+        With closed_only, groups of the window the latest probe request falls
+        in are kept, as more probe requests may still join them.
+        """
+        current = int(self.latest // self.window)
+        windows = self.columns["window"]
+        flushed, kept = [], []
+        for row in range(len(windows)):
+            if closed_only and windows[row] >= current:
+                kept.append(row)
+            else:
+                flushed.append(self.row(row))
+        columns = {name: array(code) for name, (code, _) in COLUMNS.items()}
+        for name, column in self.columns.items():
+            columns[name].extend(column[row] for row in kept)
+        # Intern only the SSIDs of the groups kept.
+        ssid_names = self.ssid_names
+        self.ssids, self.ssid_names = {}, []
+        for row, ssid in enumerate(columns["ssid"]):
+            name = ssid_names[ssid]
+            if name not in self.ssids:
+                self.ssids[name] = len(self.ssid_names)
+                self.ssid_names.append(name)
+            columns["ssid"][row] = self.ssids[name]
+        self.columns = columns
+        self.index = {
+            (
+                columns["window"][row],
+                columns["mac"][row],
+                columns["ssid"][row],
+                columns["digest"][row],
+            ): row
+            for row in range(len(kept))
+        }
+        return flushed
+
+    def write_batch(self, rows, output):
+        """Write rows as an NDJSON batch to a text file object."""
+        header = {
+            "format": AGGREGATE_FORMAT,
+            "fields": AGGREGATE_FIELDS,
+            "window": self.window,
+            "frames": self.frames,
+            "dropped": self.dropped,
+        }
+        output.write(json.dumps(header, separators=(",", ":")) + "\n")
+        for row in rows:
+            output.write(json.dumps(row, separators=(",", ":")) + "\n")
+        self.frames = self.dropped = 0
+
+
+class CaptureFollower:
+    """Feeds probe requests appended to a growing capture to an aggregator."""
+
+    def __init__(self, path, aggregator):
+        """Initialize follower of the pcapng capture at path."""
+        self.path = path
+        self.aggregator = aggregator
+        self.capture = None
+        self.reader = None
+        self.failed = False
+
+    def poll(self):
+        """Add probe requests written since the last call. Returns their number."""
+        if self.failed:
+            return 0
+        if self.capture is None:
+            try:
+                self.capture = open(self.path, "rb")  # pylint: disable=consider-using-with
+            except FileNotFoundError:
+                return 0
+            self.reader = PcapngReader(self.capture)
+        added = 0
+        try:
+            for record in iter_probe_records(self.reader):
+                self.aggregator.add(record)
+                added += 1
+        except PcapngError as error:
+            print(f"Stopped following {self.path}: {error}")
+            self.failed = True
+            self.close()
+        return added
+
+    def close(self):
+        """Close the capture."""
+        if self.capture is not None:
+            self.capture.close()
+        self.capture = None
+
+
+class MultiCaptureFollower:
+    """Feeds probe requests appended to several captures, one per radio, to one aggregator."""
+
+    def __init__(self, paths, aggregator):
+        """Initialize followers of the pcapng captures at paths."""
+        self.followers = [CaptureFollower(path, aggregator) for path in paths]
+        self.aggregator = aggregator
+
+    def poll(self):
+        """Add probe requests written since the last call. Returns their number."""
+        return sum(follower.poll() for follower in self.followers)
+
+    def close(self):
+        """Close the captures."""
+        for follower in self.followers:
+            follower.close()
@@ -0,0 +1,341 @@
+"""Extract compact probe request records from pcapng captures.
+
+The tshark capture started in probe request mode writes every frame with its
+full radiotap header. The backend only needs a handful of fields per probe
+request, so this module streams over the capture and emits one compact record
+per probe request:
+
+- timestamp (seconds since epoch)
+- source MAC
+- RSSI (dBm, from radiotap)
+- channel (from radiotap, falling back to the DS parameter set element)
+- SSID
+- sequence number
+- information element digest (fingerprint of the IEs, minus SSID and channel)
+
+Records are written as NDJSON: a header line naming the fields followed by one
+JSON array per probe request.
+"""
+import hashlib
+import json
+import os
+import struct
+
+BLOCK_SHB = 0x0A0D0D0A
+BLOCK_IDB = 0x00000001
+BLOCK_SPB = 0x00000003
+BLOCK_EPB = 0x00000006
+BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+LINKTYPE_IEEE802_11 = 105
+LINKTYPE_IEEE802_11_RADIOTAP = 127
+
+IDB_OPTION_TSRESOL = 9
+
+RECORD_FIELDS = ["ts", "mac", "rssi", "channel", "ssid", "seq", "ie_digest"]
+RECORD_FORMAT = "probe-ndjson-v1"
+
+# Radiotap fields in the default namespace: bit -> (alignment, size).
+RADIOTAP_FIELDS = {
+    0: (8, 8),  # TSFT
+    1: (1, 1),  # Flags
+    2: (1, 1),  # Rate
+    3: (2, 4),  # Channel
+    4: (1, 2),  # FHSS
+    5: (1, 1),  # dBm antenna signal
+    6: (1, 1),  # dBm antenna noise
+    7: (2, 2),  # Lock quality
+    8: (2, 2),  # TX attenuation
+    9: (2, 2),  # dB TX attenuation
+    10: (1, 1),  # dBm TX power
+    11: (1, 1),  # Antenna
+    12: (1, 1),  # dB antenna signal
+    13: (1, 1),  # dB antenna noise
+    14: (2, 2),  # RX flags
+    15: (2, 2),  # TX flags
+    16: (1, 1),  # RTS retries
+    17: (1, 1),  # Data retries
+    18: (4, 8),  # XChannel
+    19: (1, 3),  # MCS
+    20: (4, 8),  # A-MPDU status
+    21: (2, 12),  # VHT
+    22: (8, 12),  # Timestamp
+    23: (2, 12),  # HE
+    24: (2, 12),  # HE-MU
+    25: (2, 6),  # HE-MU-other-user
+    26: (1, 1),  # 0-length PSDU
+    27: (2, 4),  # L-SIG
+}
+RADIOTAP_NS_RADIOTAP = 29
+RADIOTAP_NS_VENDOR = 30
+RADIOTAP_EXT = 31
+RADIOTAP_FLAG_FCS = 0x10
+
+IE_SSID = 0
+IE_DS_PARAMETER = 3
+# Elements that change per channel or per network and so don't fingerprint
+# the device.
+DIGEST_EXCLUDED_IES = (IE_SSID, IE_DS_PARAMETER)
+
+
+class PcapngError(Exception):
+    """Error while reading a pcapng capture."""
+
+
+class PcapngReader:
+    """Stream packets out of a pcapng file.
+
+    The reader only consumes complete blocks. If the capture is still being
+    written, a partial trailing block is left in place so ``packets`` can be
+    called again later to continue from where it stopped.
+    """
+
+    def __init__(self, fileobj):
+        """Initialize reader over a binary file object."""
+        self.fileobj = fileobj
+        self.endian = "<"
+        self.interfaces = []
+        self.offset = fileobj.tell()
+
+    def blocks(self):
+        """Yield (block_type, body) of complete blocks, tracking interfaces."""
+        while True:
+            block = self._read_block()
+            if block is None:
+                return
+            block_type, body = block
+            if block_type == BLOCK_SHB:
+                self.interfaces = []
+            elif block_type == BLOCK_IDB:
+                self.interfaces.append(self._parse_idb(body))
+            yield block_type, body
+
+    def packets(self):
+        """Yield (linktype, timestamp, data) tuples for complete packets."""
+        for block_type, body in self.blocks():
+            if block_type == BLOCK_EPB:
+                packet = self._parse_epb(body)
+                if packet:
+                    yield packet
+            elif block_type == BLOCK_SPB and self.interfaces:
+                (orig_len,) = struct.unpack(self.endian + "I", body[:4])
+                linktype, _ = self.interfaces[0]
+                yield linktype, None, body[4:4 + orig_len]
+
+    def _read_block(self):
+        """Read next complete block, rewinding over a partial one."""
+        self.fileobj.seek(self.offset)
+        header = self.fileobj.read(12)
+        if len(header) < 12:
+            return None
+        (block_type,) = struct.unpack(self.endian + "I", header[:4])
+        if block_type == BLOCK_SHB:
+            (magic,) = struct.unpack("<I", header[8:12])
+            if magic == BYTE_ORDER_MAGIC:
+                self.endian = "<"
+            elif magic == struct.unpack(">I", struct.pack("<I", BYTE_ORDER_MAGIC))[0]:
+                self.endian = ">"
+            else:
+                raise PcapngError("Invalid section header byte order magic")
+        (total_length,) = struct.unpack(self.endian + "I", header[4:8])
+        if total_length < 12 or total_length % 4:
+            raise PcapngError(f"Invalid block length {total_length}")
+        rest = self.fileobj.read(total_length - 12)
+        if len(rest) < total_length - 12:
+            return None
+        self.offset += total_length
+        return block_type, header[8:] + rest[:-4]
+
+    def _parse_idb(self, body):
+        """Parse interface description block into (linktype, resolution)."""
+        linktype, _, _ = struct.unpack(self.endian + "HHI", body[:8])
+        resolution = 1e-6
+        for code, value in self._options(body[8:]):
+            if code == IDB_OPTION_TSRESOL and value:
+                tsresol = value[0]
+                if tsresol & 0x80:
+                    resolution = 2.0 ** -(tsresol & 0x7F)
+                else:
+                    resolution = 10.0 ** -tsresol
+        return linktype, resolution
+
+    def _parse_epb(self, body):
+        """Parse enhanced packet block."""
+        interface_id, ts_high, ts_low, captured_len, _ = struct.unpack(
+            self.endian + "IIIII", body[:20]
+        )
+        if interface_id >= len(self.interfaces):
+            return None
+        linktype, resolution = self.interfaces[interface_id]
+        timestamp = ((ts_high << 32) | ts_low) * resolution
+        return linktype, timestamp, body[20:20 + captured_len]
+
+    def _options(self, data):
+        """Yield (code, value) pairs from an options area."""
+        offset = 0
+        while offset + 4 <= len(data):
+            code, length = struct.unpack(self.endian + "HH", data[offset:offset + 4])
+            if code == 0:
+                return
+            yield code, data[offset + 4:offset + 4 + length]
+            offset += 4 + length + (-length % 4)
+
+
+def frequency_to_channel(frequency):
+    """Convert a frequency in MHz to an 802.11 channel number."""
+    if frequency == 2484:
+        return 14
+    if 2412 <= frequency < 2484:
+        return (frequency - 2407) // 5
+    if 5000 <= frequency <= 5925:
+        return (frequency - 5000) // 5
+    return None
+
+
+def parse_radiotap(data):
+    """Parse radiotap header.
+
+    Returns (header_length, fields) where fields holds the ``flags``,
+    ``frequency`` and ``rssi`` values that are present.
+    """
+    if len(data) < 8:
+        raise PcapngError("Truncated radiotap header")
+    _, _, length = struct.unpack("<BBH", data[:4])
+    present_words = []
+    offset = 4
+    while True:
+        (word,) = struct.unpack("<I", data[offset:offset + 4])
+        present_words.append(word)
+        offset += 4
+        if not word & (1 << RADIOTAP_EXT):
+            break
+        if offset + 4 > length:
+            raise PcapngError("Truncated radiotap present bitmap")
+
+    fields = {}
+    base = 0
+    for word in present_words:
+        for bit in range(29):
+            if not word & (1 << bit):
+                continue
+            if base + bit not in RADIOTAP_FIELDS:
+                # Unknown field size, the rest of the header can't be walked.
+                return length, fields
+            align, size = RADIOTAP_FIELDS[base + bit]
+            offset += -offset % align
+            value = data[offset:offset + size]
+            offset += size
+            if base + bit == 1 and "flags" not in fields:
+                fields["flags"] = value[0]
+            elif base + bit == 3 and "frequency" not in fields:
+                fields["frequency"] = struct.unpack("<H", value[:2])[0]
+            elif base + bit == 5 and "rssi" not in fields:
+                fields["rssi"] = struct.unpack("<b", value)[0]
+        if word & (1 << RADIOTAP_NS_VENDOR):
+            return length, fields
+        # The radiotap namespace bit restarts field numbering at 0, otherwise
+        # the next bitmap word continues with the following 32 fields.
+        base = 0 if word & (1 << RADIOTAP_NS_RADIOTAP) else base + 32
+    return length, fields
+
+
+def format_mac(data):
+    """Format 6 bytes as a colon separated MAC address."""
+    return ":".join(f"{byte:02x}" for byte in data)
+
+
+def parse_probe_request(frame, rssi=None, channel=None):
+    """Parse 802.11 frame and return probe request record or None."""
+    if len(frame) < 24:
+        return None
+    (frame_control,) = struct.unpack("<H", frame[:2])
+    frame_type = (frame_control >> 2) & 0x3
+    subtype = (frame_control >> 4) & 0xF
+    if frame_type != 0 or subtype != 4:
+        return None
+    (sequence_control,) = struct.unpack("<H", frame[22:24])
+
+    ssid = ""
+    digest = hashlib.blake2b(digest_size=8)
+    offset = 24
+    while offset + 2 <= len(frame):
+        element_id, length = frame[offset], frame[offset + 1]
+        value = frame[offset + 2:offset + 2 + length]
+        if len(value) < length:
+            break
+        if element_id == IE_SSID:
+            ssid = value.decode("utf8", errors="backslashreplace")
+        elif element_id == IE_DS_PARAMETER and channel is None and value:
+            channel = value[0]
+        if element_id not in DIGEST_EXCLUDED_IES:
+            digest.update(bytes([element_id, length]) + value)
+        offset += 2 + length
+
+    return {
+        "mac": format_mac(frame[10:16]),
+        "rssi": rssi,
+        "channel": channel,
+        "ssid": ssid,
+        "seq": sequence_control >> 4,
+        "ie_digest": digest.hexdigest(),
+    }
+
+
+def parse_packet(linktype, data):
+    """Parse a captured packet into a probe request record or None."""
+    rssi = channel = None
+    if linktype == LINKTYPE_IEEE802_11_RADIOTAP:
+        header_length, fields = parse_radiotap(data)
+        frame = data[header_length:]
+        if fields.get("flags", 0) & RADIOTAP_FLAG_FCS:
+            frame = frame[:-4]
+        rssi = fields.get("rssi")
+        if "frequency" in fields:
+            channel = frequency_to_channel(fields["frequency"])
+    elif linktype == LINKTYPE_IEEE802_11:
+        frame = data
+    else:
+        return None
+    return parse_probe_request(frame, rssi=rssi, channel=channel)
+
+
+def iter_probe_records(reader):
+    """Yield probe request records from a pcapng reader."""
+    for linktype, timestamp, data in reader.packets():
+        try:
+            record = parse_packet(linktype, data)
+        except (PcapngError, struct.error):
+            continue
+        if record:
+            record["ts"] = round(timestamp, 6) if timestamp is not None else None
+            yield record
+
+
+def write_records(records, output):
+    """Write records as NDJSON to a text file object. Returns record count."""
+    header = {"format": RECORD_FORMAT, "fields": RECORD_FIELDS}
+    output.write(json.dumps(header, separators=(",", ":")) + "\n")
+    count = 0
+    for record in records:
+        row = [record[field] for field in RECORD_FIELDS]
+        output.write(json.dumps(row, separators=(",", ":")) + "\n")
+        count += 1
+    return count
+
+
+def extract_probe_records(capture_file, output_file=None):
+    """Extract probe request records from capture_file into output_file.
+
+    Returns path of the written NDJSON file. If the capture can't be read,
+    e.g. raising PcapngError, the partial output is removed.
+    """
+    if output_file is None:
+        output_file = capture_file.rsplit(".", 1)[0] + ".ndjson"
+    try:
+        with open(capture_file, "rb") as capture, open(output_file, "w") as output:
+            write_records(iter_probe_records(PcapngReader(capture)), output)
+    except (PcapngError, OSError):
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        raise
+    return output_file
@@ -0,0 +1,207 @@
+"""
+Ring buffer rotation for hotspot captures.
+
+dumpcap writes hotspot traffic to a ring of files and each file is uploaded
+once dumpcap has moved on to the next. When it moves on is decided by a
+policy:
+
+- fixed: a new file every ``duration`` seconds (the original behaviour)
+- adaptive: files of about ``target_mb``, rotated on size with the duration
+  stretched or shortened to match the capture rate, so quiet periods don't
+  produce a stream of tiny files and busy periods don't produce huge ones
+
+The adaptive policy bounds both ends: no file is kept open longer than
+``max_latency`` seconds, so traffic reaches the backend in time, and a file
+is made smaller when the uplink couldn't upload it in ``upload_seconds``.
+
+``RotationController`` feeds the capture and uplink rates measured from
+finished files and uploads to the policy, and only reports new ring
+parameters when they differ enough from the current ones, as applying them
+means restarting dumpcap.
+"""
+import threading
+import time
+
+# dumpcap counts filesize in kB of 1000 bytes.
+KB = 1000
+MIN_FILESIZE_KB = 64
+
+
+class Ring:
+    """dumpcap ring buffer parameters."""
+
+    def __init__(self, duration, filesize_kb=None, files=None):
+        """Initialize ring rotating every duration seconds or filesize_kb kB.
+
+        With files, dumpcap deletes the oldest file to keep at most that many.
+        """
+        self.duration = duration
+        self.filesize_kb = filesize_kb
+        self.files = files
+
+    def args(self):
+        """Return the dumpcap ring buffer options."""
+        args = f"-b duration:{self.duration}"
+        if self.filesize_kb:
+            args += f" -b filesize:{self.filesize_kb}"
+        if self.files:
+            args += f" -b files:{self.files}"
+        return args
+
+    def differs(self, other, tolerance):
+        """Return whether other is more than tolerance times off from this ring."""
+        if (self.filesize_kb is None) != (other.filesize_kb is None):
+            return True
+        pairs = [(self.duration, other.duration)]
+        if self.filesize_kb is not None:
+            pairs.append((self.filesize_kb, other.filesize_kb))
+        return any(max(a, b) > (1 + tolerance) * min(a, b) for a, b in pairs)
+
+    def __eq__(self, other):
+        """Return whether other has the same parameters."""
+        return (self.duration, self.filesize_kb, self.files) == (
+            other.duration,
+            other.filesize_kb,
+            other.files,
+        )
+
+    def __repr__(self):
+        """Return the parameters for logging."""
+        return (
+            f"Ring(duration={self.duration}, filesize_kb={self.filesize_kb}, "
+            f"files={self.files})"
+        )
+
+
+class FixedRotation:
+    """New file every duration seconds, whatever the traffic."""
+
+    name = "fixed"
+
+    def __init__(self, duration=15):
+        """Initialize policy rotating every duration seconds."""
+        self.duration = duration
+
+    def ring(self, _capture_rate, _uplink_rate):
+        """Return the ring for the measured rates in bytes per second."""
+        return Ring(self.duration)
+
+
+class AdaptiveRotation:
+    """Files of about target_mb, within latency and uplink bounds."""
+
+    name = "adaptive"
+
+    def __init__(self, target_mb=4, max_latency=60, min_duration=5, upload_seconds=10):
+        """Initialize policy.
+
+        Files are rotated after at most max_latency and at least min_duration
+        seconds, and are made smaller than target_mb when the uplink needs
+        more than upload_seconds for them.
+        """
+        self.target_bytes = target_mb * 1024 * 1024
+        self.max_latency = max_latency
+        self.min_duration = min_duration
+        self.upload_seconds = upload_seconds
+
+    def ring(self, capture_rate, uplink_rate):
+        """Return the ring for the measured rates in bytes per second.
+
+        Rates are None until measured.
+        """
+        size = self.target_bytes
+        if uplink_rate:
+            size = min(size, uplink_rate * self.upload_seconds)
+        size = max(size, MIN_FILESIZE_KB * KB)
+        duration = self.max_latency
+        if capture_rate:
+            duration = min(max(size / capture_rate, self.min_duration), self.max_latency)
+        return Ring(int(round(duration)), int(size // KB))
+
+
+ROTATIONS = {
+    policy.name: policy for policy in (FixedRotation, AdaptiveRotation)
+}
+
+
+def make_rotation(name, duration=15, target_mb=4, max_latency=60):
+    """Build a rotation policy by name from the command line options."""
+    if name == "fixed":
+        return FixedRotation(duration)
+    if name == "adaptive":
+        return AdaptiveRotation(target_mb=target_mb, max_latency=max_latency)
+    raise ValueError(f"Unknown rotation policy {name}")
+
+
+class RotationController:  # pylint: disable=too-many-instance-attributes
+    """Tracks capture and uplink rates and decides when to re-arm dumpcap."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        policy=None,
+        smoothing=0.3,
+        tolerance=0.5,
+        min_interval=60,
+        clock=time.monotonic,
+    ):
+        """Initialize controller.
+
+        smoothing is the weight of the latest measurement in the rate
+        estimates. The ring is only changed when the new one is more than
+        tolerance times off and min_interval seconds after the last change.
+        """
+        self.policy = policy or FixedRotation()
+        self.smoothing = smoothing
+        self.tolerance = tolerance
+        self.min_interval = min_interval
+        self.clock = clock
+        self.capture_rate = None
+        self.uplink_rate = None
+        self.current = self.policy.ring(None, None)
+        self.changed_at = clock()
+        self.changes = 0
+        # Rates are measured from the observer and upload worker threads.
+        self.lock = threading.Lock()
+
+    def _smooth(self, previous, rate):
+        """Return the rate estimate updated with rate."""
+        if previous is None:
+            return rate
+        return self.smoothing * rate + (1 - self.smoothing) * previous
+
+    def observe_file(self, size, seconds):
+        """Record a finished capture file of size bytes written over seconds."""
+        if seconds > 0:
+            with self.lock:
+                self.capture_rate = self._smooth(self.capture_rate, size / seconds)
+
+    def observe_upload(self, size, seconds):
+        """Record an upload of size bytes that took seconds."""
+        if seconds > 0:
+            with self.lock:
+                self.uplink_rate = self._smooth(self.uplink_rate, size / seconds)
+
+    def update(self):
+        """Return the ring to re-arm dumpcap with, None to keep the current one."""
+        with self.lock:
+            ring = self.policy.ring(self.capture_rate, self.uplink_rate)
+        now = self.clock()
+        if now - self.changed_at < self.min_interval:
+            return None
+        if not self.current.differs(ring, self.tolerance):
+            return None
+        self.current = ring
+        self.changed_at = now
+        self.changes += 1
+        return ring
+
+    def stats(self):
+        """Return rates, current ring and number of changes."""
+        return {
+            "policy": self.policy.name,
+            "capture_rate": self.capture_rate,
+            "uplink_rate": self.uplink_rate,
+            "duration": self.current.duration,
+            "filesize_kb": self.current.filesize_kb,
+            "changes": self.changes,
+        }
@@ -0,0 +1,183 @@
+"""
+Single asyncio event loop running the pi's control work.
+
+Status updates, instruction handling and capture process supervision run as
+tasks on one loop in the main thread instead of a status thread next to a
+sleeping main loop. The pi's state is only changed from that loop, or from
+the one worker running the current instruction, so the two no longer race.
+Blocking work (HTTP requests, systemctl, netlink) runs in a shared
+executor with a thread per task, so a slow call of one task doesn't hold
+up the others. Tasks given as coroutine functions are restarted when they
+fail, one failing loop doesn't take the others down. Stopping the runtime,
+on SIGTERM or SIGINT, cancels every task at its next await.
+"""
+import asyncio
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import REGISTRY
+
+
+class Wakeup:
+    """Event that can be set from any thread and awaited on the loop."""
+
+    def __init__(self):
+        """Initialize cleared."""
+        self.flag = threading.Event()
+        self.loop = None
+        self.waiter = None
+
+    def set(self):
+        """Set the event, waking up a waiting task."""
+        self.flag.set()
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:
+                pass  # Loop closed in the meantime.
+
+    def _wake(self):
+        if self.waiter is not None:
+            self.waiter.set()
+
+    def is_set(self):
+        """Return True if the event is set."""
+        return self.flag.is_set()
+
+    def clear(self):
+        """Clear the event."""
+        self.flag.clear()
+
+    async def wait(self, timeout=None):
+        """Wait until set or timeout seconds passed. Returns True if set."""
+        self.loop = asyncio.get_running_loop()
+        if self.flag.is_set():
+            return True
+        self.waiter = asyncio.Event()
+        try:
+            await asyncio.wait_for(self.waiter.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self.flag.is_set()
+        finally:
+            self.waiter = None
+
+
+class Runtime:
+    """Runs named coroutines as tasks on one event loop."""
+
+    def __init__(self, max_workers=None, metrics=REGISTRY, restart_delay=1.0):
+        """Initialize runtime with max_workers threads for blocking calls.
+
+        By default there is one thread per task run. Failed tasks are
+        restarted after restart_delay seconds.
+        """
+        self.max_workers = max_workers
+        self.executor = None
+        self.restart_delay = restart_delay
+        self.loop = None
+        self.tasks = {}
+        self.process_exits = metrics.counter(
+            "pi_process_exits_total", "Capture processes that exited on their own."
+        )
+        self.task_restarts = metrics.counter(
+            "pi_task_restarts_total", "Runtime tasks restarted after failing."
+        )
+
+    async def call(self, func, *args):
+        """Run blocking func(*args) in the executor and return its result."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, func, *args
+        )
+
+    def run(self, **coroutines):
+        """Run coroutines as tasks until one ends or the runtime is stopped.
+
+        A coroutine function is called to start its task and called again
+        to restart it whenever it raises. An exception raised by a task
+        given as a coroutine is re-raised once the other tasks are
+        cancelled.
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.max_workers or max(len(coroutines), 1),
+                thread_name_prefix="pi_runtime",
+            )
+        coroutines = {
+            name: self._restarting(name, coroutine) if callable(coroutine) else coroutine
+            for name, coroutine in coroutines.items()
+        }
+        asyncio.run(self._main(coroutines))
+
+    async def _restarting(self, name, function):
+        """Run function() until it returns, restarting it when it raises."""
+        while True:
+            try:
+                return await function()
+            except Exception as error:  # pylint: disable=broad-except
+                self.task_restarts.inc(task=name)
+                print(f"Task {name} failed, restarting: {error!r}")
+            await asyncio.sleep(self.restart_delay)
+
+    async def _main(self, coroutines):
+        self.loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                self.loop.add_signal_handler(signum, self.cancel)
+            except (ValueError, RuntimeError, NotImplementedError):
+                pass  # Not the main thread, stop() still works.
+        self.tasks = {
+            name: asyncio.create_task(coroutine, name=name)
+            for name, coroutine in coroutines.items()
+        }
+        try:
+            done, _ = await asyncio.wait(
+                self.tasks.values(), return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            self.cancel()
+            await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+            self.loop = None
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                print(f"Task {task.get_name()} failed: {task.exception()!r}")
+                raise task.exception()
+
+    def cancel(self):
+        """Cancel every task, call on the loop."""
+        for task in self.tasks.values():
+            task.cancel()
+
+    def stop(self):
+        """Stop the runtime, callable from any thread."""
+        loop = self.loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self.cancel)
+            except RuntimeError:
+                pass  # Already finished.
+
+    def shutdown(self):
+        """Release the executor threads."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def supervise(self, processes, interval=1.0):
+        """Report capture processes that exit without being stopped.
+
+        processes returns a dict mapping a name to the running Popen object,
+        each exit is reported once.
+        """
+        reported = set()
+        while True:
+            for name, process in processes().items():
+                if process is None or process.pid in reported:
+                    continue
+                returncode = process.poll()
+                if returncode is not None:
+                    reported.add(process.pid)
+                    self.process_exits.inc(process=name)
+                    print(f"{name} exited unexpectedly with {returncode}")
+            await asyncio.sleep(interval)
@@ -0,0 +1,101 @@
+"""
+Start, stop and restart systemd services and wait until they are ready.
+
+``systemctl`` already blocks until the start or stop job has finished, so
+instead of sleeping a fixed time after every call the controller checks the
+unit's state over D-Bus (``SystemdManager.is_active``) and, where a service
+needs more than running to be usable, a service specific readiness check
+such as hostapd having brought the interface up in AP mode. Every step is
+timed, so a slow service shows up in the log and in the metrics.
+"""
+import time
+
+from .metrics import REGISTRY
+
+
+class ServiceController:  # pylint: disable=too-many-instance-attributes
+    """Readiness aware systemd service control."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        sysdmanager,
+        run,
+        timeout=10,
+        poll_interval=0.05,
+        metrics=REGISTRY,
+        max_steps=100,
+    ):
+        """Initialize controller.
+
+        run executes a shell command, sysdmanager is a SystemdManager used to
+        check unit states. Waiting for readiness gives up after timeout
+        seconds. The last max_steps steps are kept in ``steps``.
+        """
+        self.sysdmanager = sysdmanager
+        self.run = run
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.max_steps = max_steps
+        self.steps = []
+        self.duration = metrics.histogram(
+            "pi_service_control_seconds",
+            "Time for a service action until the service is ready.",
+        )
+        self.timeouts = metrics.counter(
+            "pi_service_control_timeouts_total",
+            "Service actions where the service wasn't ready in time.",
+        )
+
+    def start(self, unit, ready=None):
+        """Start unit and wait until it is active and ready()."""
+        return self.control("start", unit, ready)
+
+    def stop(self, unit):
+        """Stop unit and wait until it is no longer active."""
+        return self.control("stop", unit)
+
+    def restart(self, unit, ready=None):
+        """Restart unit and wait until it is active and ready()."""
+        return self.control("restart", unit, ready)
+
+    def control(self, action, unit, ready=None):
+        """Run systemctl action on unit and wait. Returns False on timeout."""
+        started = time.monotonic()
+        self.run(f"systemctl {action} {unit}")
+        if action == "stop":
+            done = self.wait_for(lambda: not self.is_active(unit))
+        else:
+            done = self.wait_for(
+                lambda: self.is_active(unit) and (ready is None or ready())
+            )
+        elapsed = time.monotonic() - started
+        self.steps.append((unit, action, elapsed, done))
+        del self.steps[:-self.max_steps]
+        self.duration.observe(elapsed, unit=unit, action=action)
+        if done:
+            print(f"{unit} {action}: ready in {elapsed:.2f}s")
+        else:
+            self.timeouts.inc(unit=unit, action=action)
+            print(f"{unit} {action}: not ready after {elapsed:.2f}s, continuing")
+        return done
+
+    def is_active(self, unit):
+        """Return True if systemd reports unit as active."""
+        return bool(self.sysdmanager.is_active(unit))
+
+    def wait_for(self, condition):
+        """Poll condition until it holds or the timeout passes."""
+        deadline = time.monotonic() + self.timeout
+        error = None
+        while True:
+            try:
+                if condition():
+                    return True
+            except Exception as check_error:  # pylint: disable=broad-except
+                # D-Bus or netlink hiccup, keep polling until the deadline.
+                error = check_error
+            if time.monotonic() >= deadline:
+                if error is not None:
+                    print(f"Readiness check failed: {error}")
+                return False
+            time.sleep(self.poll_interval)
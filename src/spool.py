@@ -0,0 +1,132 @@
+"""
+Crash-safe index of capture files waiting for upload.
+
+Every ring file handed to the uploader is recorded in a small SQLite database
+that lives next to the captures, together with the endpoint and form data it
+has to be posted with. A file moves through the states
+
+- captured: closed by dumpcap, waiting for upload
+- queued: handed to an uploader, waiting for a worker
+- uploading: picked up by an upload worker
+- acked: acknowledged by the backend and removed from disk
+
+so after a restart or a backend outage anything that is not acked can be
+queued again. The spool also reports how many bytes and files are pending,
+which is used to apply backpressure on the capture.
+"""
+import fnmatch
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SPOOL_NAME = ".spool.db"
+
+CAPTURED = "captured"
+QUEUED = "queued"
+UPLOADING = "uploading"
+ACKED = "acked"
+
+
+class Spool:
+    """SQLite backed upload spool."""
+
+    def __init__(self, db_path):
+        """Open (or create) the spool database at db_path."""
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, state TEXT NOT NULL, size INTEGER NOT NULL, "
+                "url TEXT NOT NULL, form TEXT NOT NULL, attempts INTEGER NOT NULL, "
+                "updated_at REAL NOT NULL)"
+            )
+            # Anything that was queued or uploading when we went down has to
+            # go again.
+            self.conn.execute(
+                "UPDATE files SET state = ? WHERE state IN (?, ?)",
+                (CAPTURED, QUEUED, UPLOADING),
+            )
+            self.conn.execute("DELETE FROM files WHERE state = ?", (ACKED,))
+
+    def add(self, path, url, form):
+        """Record a finished capture file."""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO files VALUES (?, ?, ?, ?, ?, 0, ?)",
+                (path, CAPTURED, size, url, json.dumps(form), time.time()),
+            )
+
+    def set_state(self, path, state):
+        """Move path to state."""
+        attempts = 1 if state == UPLOADING else 0
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE files SET state = ?, attempts = attempts + ?, updated_at = ? "
+                "WHERE path = ?",
+                (state, attempts, time.time(), path),
+            )
+
+    def forget(self, path):
+        """Stop tracking path, e.g. because it disappeared from disk."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def state(self, path):
+        """Return state of path or None if it isn't tracked."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT state FROM files WHERE path = ?", (path,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def states(self):
+        """Return state of every tracked path."""
+        with self.lock:
+            return dict(self.conn.execute("SELECT path, state FROM files"))
+
+    def pending(self, url=None):
+        """Return (path, form) of files waiting for upload, oldest first."""
+        query = "SELECT path, form FROM files WHERE state = ?"
+        params = [CAPTURED]
+        if url is not None:
+            query += " AND url = ?"
+            params.append(url)
+        with self.lock:
+            rows = self.conn.execute(query + " ORDER BY rowid", params).fetchall()
+        return [(path, json.loads(form)) for path, form in rows]
+
+    def usage(self):
+        """Return (files, bytes) of files not yet acked."""
+        with self.lock:
+            files, size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files WHERE state != ?",
+                (ACKED,),
+            ).fetchone()
+        return files, size
+
+    def untracked(self, directory, pattern="*"):
+        """Return files in directory matching pattern the spool doesn't know."""
+        with self.lock:
+            known = {row[0] for row in self.conn.execute("SELECT path FROM files")}
+        found = []
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if fnmatch.fnmatch(name, pattern) and path not in known:
+                if os.path.isfile(path):
+                    found.append(path)
+        return found
+
+    def close(self):
+        """Close the database."""
+        with self.lock:
+            self.conn.close()
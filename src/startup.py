@@ -0,0 +1,70 @@
+"""
+Timed startup.
+
+Starting the pi takes a series of steps: handing the interfaces over from
+NetworkManager, switching the interface mode, resuming pending uploads and
+so on. ``StartupTimer`` times each step, runs steps that don't depend on
+each other in parallel threads and prints a report once the pi is ready,
+so a slow step shows up in the log and in the metrics after every
+(re)start.
+"""
+import concurrent.futures
+import threading
+import time
+
+from .metrics import REGISTRY
+
+
+class StartupTimer:
+    """Time startup steps."""
+
+    def __init__(self, metrics=REGISTRY, clock=time.monotonic):
+        """Initialize timer, startup is timed from now."""
+        self.clock = clock
+        self.started = clock()
+        self.elapsed = None
+        self.steps = []
+        self.lock = threading.Lock()
+        self.step_duration = metrics.histogram(
+            "pi_startup_step_seconds", "Time taken by each startup step."
+        )
+        self.duration = metrics.gauge(
+            "pi_startup_seconds", "Time from start until the pi was ready."
+        )
+
+    def step(self, name, function, *args, **kwargs):
+        """Run function as step name and return its result."""
+        started = self.clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = self.clock() - started
+            with self.lock:
+                self.steps.append((name, started - self.started, elapsed))
+            self.step_duration.observe(elapsed, step=name)
+
+    def concurrently(self, *functions):
+        """Run functions in parallel threads and return their results.
+
+        Waits for all of them, the first error raised is raised again.
+        """
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(functions), thread_name_prefix="startup"
+        ) as executor:
+            futures = [executor.submit(function) for function in functions]
+        return [future.result() for future in futures]
+
+    def finish(self):
+        """Mark startup done, return seconds since start."""
+        self.elapsed = self.clock() - self.started
+        self.duration.set(self.elapsed)
+        return self.elapsed
+
+    def report(self):
+        """Return the timing report, one line per step in start order."""
+        lines = [f"{'startup step':<20} {'start':>8} {'seconds':>8}"]
+        for name, offset, elapsed in sorted(self.steps, key=lambda step: step[1]):
+            lines.append(f"{name:<20} {offset:>8.3f} {elapsed:>8.3f}")
+        if self.elapsed is not None:
+            lines.append(f"{'ready':<20} {'':>8} {self.elapsed:>8.3f}")
+        return "\n".join(lines)
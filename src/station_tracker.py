@@ -0,0 +1,202 @@
+"""
+Connected stations tracked from hostapd events.
+
+Instead of dumping every station and filtering by inactivity on each status
+update, the tracker attaches to hostapd's control socket as a monitor and
+keeps a table of associated stations up to date from AP-STA-CONNECTED and
+AP-STA-DISCONNECTED events. The table is read without talking to hostapd.
+Traffic counters are refreshed on demand with STA-FIRST/STA-NEXT, which is
+also how the table is filled when the tracker (re)connects.
+
+Finished sessions are kept, so the time each client stayed connected can be
+reported.
+"""
+import collections
+import threading
+import time
+
+from .hostapd_ctrl import HostapdCtrl, HostapdCtrlError
+
+# Seconds to wait for the event thread once woken up to stop.
+STOP_TIMEOUT = 1
+
+
+def parse_event(event):
+    """Return (name, mac) of a station event, None for other events."""
+    parts = event.split()
+    if len(parts) >= 2 and parts[0] in ("AP-STA-CONNECTED", "AP-STA-DISCONNECTED"):
+        return parts[0], parts[1].lower()
+    return None
+
+
+class StationTracker:  # pylint: disable=too-many-instance-attributes
+    """Table of associated stations kept current from hostapd events."""
+
+    def __init__(self, ctrl_path, clock=time.time, check_interval=5, history=1000):
+        """Initialize tracker for the hostapd control socket at ctrl_path.
+
+        The monitor connection is checked every check_interval seconds
+        without events, the last history finished sessions are kept.
+        """
+        self.ctrl_path = ctrl_path
+        self.clock = clock
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.stations = {}
+        self.sessions = collections.deque(maxlen=history)
+        self.ctrl = None
+        self.monitor = None
+        self.connected = False
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Attach to hostapd and follow events in a daemon thread."""
+        self.stopping.clear()
+        self.connect()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop following events."""
+        self.stopping.set()
+        # Wake up the event thread rather than wait out its receive timeout.
+        if self.monitor is not None:
+            self.monitor.shutdown()
+        if self.thread is not None:
+            self.thread.join(STOP_TIMEOUT)
+            self.thread = None
+        self.disconnect()
+
+    def connect(self):
+        """Open the monitor and request connections and load current stations."""
+        self.disconnect()
+        try:
+            self.monitor = HostapdCtrl(self.ctrl_path, timeout=self.check_interval)
+            self.monitor.attach()
+            self.ctrl = HostapdCtrl(self.ctrl_path)
+            self.sync()
+        except (HostapdCtrlError, OSError) as error:
+            print(f"Station tracking unavailable: {error}")
+            self.disconnect()
+            return False
+        self.connected = True
+        return True
+
+    def disconnect(self):
+        """Close connections to hostapd."""
+        self.connected = False
+        for connection in (self.monitor, self.ctrl):
+            if connection is not None:
+                connection.close()
+        self.monitor = self.ctrl = None
+
+    def run(self):
+        """Apply events until stopped, reconnecting when hostapd restarts."""
+        while not self.stopping.is_set():
+            if not self.connected:
+                if not self.connect():
+                    self.stopping.wait(self.check_interval)
+                continue
+            try:
+                event = self.monitor.receive_event()
+                if event is None:
+                    # Quiet for a while, check hostapd is still there.
+                    if not self.ctrl.ping():
+                        self.connected = False
+                    continue
+            except OSError:
+                if self.stopping.is_set():
+                    return
+                self.connected = False
+                continue
+            self.handle_event(event)
+
+    def handle_event(self, event, now=None):
+        """Apply a hostapd event to the table."""
+        parsed = parse_event(event)
+        if parsed is None:
+            return
+        name, mac = parsed
+        now = self.clock() if now is None else now
+        with self.lock:
+            if name == "AP-STA-CONNECTED":
+                if mac not in self.stations:
+                    self.stations[mac] = {
+                        "mac": mac,
+                        "connected_at": now,
+                        "last_seen": now,
+                        "rx_bytes": 0,
+                        "tx_bytes": 0,
+                    }
+            else:
+                station = self.stations.pop(mac, None)
+                if station is not None:
+                    self.sessions.append((mac, station["connected_at"], now))
+
+    def replay(self, events):
+        """Apply recorded (time, event) pairs."""
+        for now, event in events:
+            self.handle_event(event, now)
+
+    def sync(self):
+        """Load the stations hostapd has associated, replacing the table."""
+        now = self.clock()
+        stations = self.ctrl.stations()
+        with self.lock:
+            previous = self.stations
+            self.stations = {}
+            for mac, details in stations.items():
+                mac = mac.lower()
+                station = previous.get(mac) or {
+                    "mac": mac,
+                    "connected_at": now - int(details.get("connected_time", 0)),
+                }
+                self.stations[mac] = self.update(station, details, now)
+            for mac in previous.keys() - self.stations.keys():
+                self.sessions.append((mac, previous[mac]["connected_at"], now))
+
+    @staticmethod
+    def update(station, details, now):
+        """Update station with counters from hostapd STA details."""
+        station["rx_bytes"] = int(details.get("rx_bytes", 0))
+        station["tx_bytes"] = int(details.get("tx_bytes", 0))
+        station["last_seen"] = now - int(details.get("inactive_msec", 0)) / 1000
+        return station
+
+    def refresh(self):
+        """Refresh traffic counters and last activity from hostapd."""
+        if self.connected:
+            try:
+                self.sync()
+            except (HostapdCtrlError, OSError) as error:
+                print(f"Station refresh failed: {error}")
+
+    def is_connected(self, mac):
+        """Return True if mac is associated."""
+        return mac.lower() in self.stations
+
+    def get_connected_users(self):
+        """Return MACs of associated stations."""
+        with self.lock:
+            return list(self.stations)
+
+    def get_stations(self):
+        """Return a copy of every station's details."""
+        with self.lock:
+            return [dict(station) for station in self.stations.values()]
+
+    def session_durations(self):
+        """Return seconds each client has been connected, by MAC.
+
+        Finished sessions are included, a client that connected several
+        times gets the sum.
+        """
+        now = self.clock()
+        durations = collections.Counter()
+        with self.lock:
+            for mac, connected_at, disconnected_at in self.sessions:
+                durations[mac] += disconnected_at - connected_at
+            for mac, station in self.stations.items():
+                durations[mac] += now - station["connected_at"]
+        return dict(durations)
@@ -0,0 +1,120 @@
+"""
+Change tracked status reports.
+
+A status update used to carry the full status every time even though it
+rarely changes between two updates. The reporter sends:
+
+- ``full``: the whole status, when the backend has none yet, when something
+  other than the connected users changed, and every ``full_every`` reports
+  so a missed update can't leave the backend out of sync for long
+- ``delta``: the MACs that joined and left the access point, when only the
+  connected users changed
+- ``heartbeat``: just the MAC, when nothing changed
+
+Every report has a ``seq`` number, deltas and heartbeats name the report
+they build on as ``base``. A backend that doesn't hold that report answers
+with ``resync`` and gets a full report next. The state a report describes
+only becomes the base once the backend acknowledged it.
+
+Fields that aren't part of the status (the executed instruction, metrics)
+are passed through unchanged. Bodies of gzip_min_size bytes or more are
+sent gzip compressed.
+"""
+import gzip
+import json
+
+from .metrics import REGISTRY
+
+# Status fields tracked for changes, everything else is passed through.
+TRACKED = ("ip", "state", "ap_details")
+
+
+class StatusReporter:  # pylint: disable=too-many-instance-attributes
+    """Builds status reports relative to what the backend acknowledged."""
+
+    def __init__(self, full_every=12, deltas=True, gzip_min_size=1024, metrics=REGISTRY):
+        """Initialize reporter."""
+        self.full_every = full_every
+        self.deltas = deltas
+        self.gzip_min_size = gzip_min_size
+        self.seq = 0
+        self.acked = None
+        self.acked_seq = None
+        self.since_full = 0
+        self.pending = None
+        self.reports = metrics.counter(
+            "pi_status_reports_total", "Status reports sent by kind."
+        )
+        self.sent_bytes = metrics.counter(
+            "pi_status_report_bytes_total", "Bytes of status report bodies sent."
+        )
+
+    def build(self, payload):
+        """Return the report for the full status payload."""
+        status = {key: payload.get(key) for key in TRACKED}
+        kind = self.kind(status)
+        self.seq += 1
+        report = {"mac": payload["mac"], "report": kind, "seq": self.seq}
+        if kind == "full":
+            report.update(status)
+        else:
+            report["base"] = self.acked_seq
+        if kind == "delta":
+            old = set(self.acked["ap_details"]["connected_users"])
+            new = set(status["ap_details"]["connected_users"])
+            report["connected_users_added"] = sorted(new - old)
+            report["connected_users_removed"] = sorted(old - new)
+        for key, value in payload.items():
+            if key not in TRACKED and key != "mac":
+                report[key] = value
+        self.pending = (self.seq, status, kind)
+        return report
+
+    def kind(self, status):
+        """Return the kind of report needed to bring the backend to status."""
+        if self.acked is None or self.since_full >= self.full_every:
+            return "full"
+        if status == self.acked:
+            return "heartbeat"
+        if self.deltas and self.only_users_changed(status):
+            return "delta"
+        return "full"
+
+    def only_users_changed(self, status):
+        """Return True if status differs from the acked one in connected users only."""
+        old, new = self.acked["ap_details"], status["ap_details"]
+        return (
+            all(status[key] == self.acked[key] for key in TRACKED if key != "ap_details")
+            and old["access_point"] == new["access_point"]
+            and old["connected_users"] is not None
+            and new["connected_users"] is not None
+        )
+
+    def encode(self, report):
+        """Return body and headers for report."""
+        body = json.dumps(report).encode()
+        headers = {"Content-Type": "application/json"}
+        if self.gzip_min_size is not None and len(body) >= self.gzip_min_size:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        self.reports.inc(report=report["report"])
+        self.sent_bytes.inc(len(body))
+        return body, headers
+
+    def acknowledge(self, response):
+        """Make the last report the base once the backend answered response."""
+        if self.pending is None:
+            return
+        seq, status, kind = self.pending
+        self.pending = None
+        if response.get("resync"):
+            self.reset()
+            return
+        self.acked, self.acked_seq = status, seq
+        self.since_full = 0 if kind == "full" else self.since_full + 1
+
+    def reset(self):
+        """Send a full report next, e.g. after an update failed."""
+        self.pending = None
+        self.acked = None
+        self.acked_seq = None
@@ -0,0 +1,211 @@
+"""
+Byte budget for the capture directory.
+
+Captures are written to a directory that is RAM backed tmpfs by default, so
+if the backend stays unreachable pending uploads would fill memory until the
+Pi falls over. ``StorageManager`` keeps the directory within a byte budget by
+evicting files pending upload, chosen by a policy:
+
+- oldest: the oldest files first, whatever session they belong to
+- acked_only: nothing pending upload is evicted, only leftovers of
+  acknowledged uploads; capture is paused while over budget instead
+- fair_share: the budget is split evenly over the sessions with files on
+  disk and the oldest files of the session furthest over its share go first
+
+Only files the spool tracks as captured or acked are evicted, files being
+written or uploaded are left alone. dumpcap is also given a matching ring
+buffer, ``-b files:N`` with files of a bounded size, so it never writes more
+than the budget (or the session's share) itself. With acked_only dumpcap
+keeps every file.
+"""
+import collections
+import os
+import threading
+
+from .metrics import REGISTRY
+from .rotation import KB, MIN_FILESIZE_KB, Ring
+from .spool import ACKED, CAPTURED, QUEUED, SPOOL_NAME
+
+# Ring files per budget when the rotation doesn't bound their size.
+RING_FILES = 16
+MIN_RING_FILES = 2
+
+StoredFile = collections.namedtuple("StoredFile", "path size mtime session state")
+
+
+def session_of(path):
+    """Return the session id a capture file name starts with."""
+    return os.path.basename(path).split("_")[0]
+
+
+class OldestFirst:
+    """Evict the oldest files first."""
+
+    name = "oldest"
+    ring_limit = True
+
+    @staticmethod
+    def share(budget, _sessions):
+        """Return the bytes a session's ring may use."""
+        return budget
+
+    @staticmethod
+    def victims(files, excess, _budget):
+        """Return files to evict to free excess bytes, files are oldest first."""
+        victims = []
+        for entry in files:
+            if excess <= 0:
+                break
+            victims.append(entry)
+            excess -= entry.size
+        return victims
+
+
+class AckedOnly:
+    """Never evict files pending upload."""
+
+    name = "acked_only"
+    ring_limit = False
+
+    @staticmethod
+    def share(budget, _sessions):
+        """Return the bytes a session's ring may use."""
+        return budget
+
+    @staticmethod
+    def victims(files, _excess, _budget):
+        """Return files to evict, every acked leftover."""
+        return [entry for entry in files if entry.state == ACKED]
+
+
+class FairShare:
+    """Evict from the session furthest over an even share of the budget."""
+
+    name = "fair_share"
+    ring_limit = True
+
+    @staticmethod
+    def share(budget, sessions):
+        """Return the bytes a session's ring may use."""
+        return budget // max(len(sessions), 1)
+
+    def victims(self, files, excess, budget):
+        """Return files to evict to free excess bytes, files are oldest first."""
+        per_session = collections.defaultdict(list)
+        for entry in files:
+            per_session[entry.session].append(entry)
+        used = {
+            session: sum(entry.size for entry in entries)
+            for session, entries in per_session.items()
+        }
+        share = self.share(budget, per_session)
+        victims = []
+        while excess > 0 and any(per_session.values()):
+            session = max(
+                (session for session in per_session if per_session[session]),
+                key=lambda session: used[session] - share,
+            )
+            entry = per_session[session].pop(0)
+            victims.append(entry)
+            used[session] -= entry.size
+            excess -= entry.size
+        return victims
+
+
+STORAGE_POLICIES = {
+    policy.name: policy for policy in (OldestFirst, AckedOnly, FairShare)
+}
+
+
+class StorageManager:  # pylint: disable=too-many-instance-attributes
+    """Keeps the capture directory within a byte budget."""
+
+    def __init__(self, directory, spool, budget_bytes, policy="oldest", metrics=REGISTRY):
+        """Initialize manager of directory, evicting files the spool tracks."""
+        self.directory = directory
+        self.spool = spool
+        self.budget = budget_bytes
+        self.policy = STORAGE_POLICIES[policy]()
+        self.lock = threading.Lock()
+        self.used = 0
+        self.evicted_files = metrics.counter(
+            "pi_storage_evicted_files_total", "Capture files evicted over budget."
+        )
+        self.evicted_bytes = metrics.counter(
+            "pi_storage_evicted_bytes_total", "Bytes of capture files evicted."
+        )
+        self.used_bytes = metrics.gauge(
+            "pi_storage_bytes", "Bytes used in the capture directory."
+        )
+        metrics.gauge(
+            "pi_storage_budget_bytes", "Byte budget of the capture directory."
+        ).set(budget_bytes)
+
+    def files(self):
+        """Return (bytes used by captures, files that may be evicted oldest first)."""
+        states = self.spool.states()
+        used = 0
+        files = []
+        for entry in os.scandir(self.directory):
+            # The spool database and its journal aren't captures.
+            if not entry.is_file() or entry.name.startswith(SPOOL_NAME):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            used += stat.st_size
+            state = states.get(entry.path)
+            if state in (CAPTURED, QUEUED, ACKED):
+                files.append(
+                    StoredFile(
+                        entry.path, stat.st_size, stat.st_mtime, session_of(entry.path), state
+                    )
+                )
+        files.sort(key=lambda entry: entry.mtime)
+        return used, files
+
+    def enforce(self):
+        """Evict files as the policy allows while over budget.
+
+        Returns (bytes used afterwards, evicted paths).
+        """
+        with self.lock:
+            used, files = self.files()
+            evicted = []
+            if used > self.budget:
+                for entry in self.policy.victims(files, used - self.budget, self.budget):
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+                    self.spool.forget(entry.path)
+                    used -= entry.size
+                    evicted.append(entry.path)
+                    self.evicted_files.inc(policy=self.policy.name, state=entry.state)
+                    self.evicted_bytes.inc(entry.size, policy=self.policy.name)
+            if evicted:
+                print(f"Evicted {len(evicted)} capture files, {used} bytes used")
+            self.used = used
+            self.used_bytes.set(used)
+            return used, evicted
+
+    def over_budget(self, ratio=1.0):
+        """Return whether the last enforce left more than ratio of the budget used."""
+        return self.used > self.budget * ratio
+
+    def ring(self, ring, session_id):
+        """Return ring bounded to the bytes session_id may use.
+
+        Files are limited to a share of the budget when the rotation doesn't
+        bound their size, and dumpcap keeps as many as fit.
+        """
+        if not self.policy.ring_limit:
+            return ring
+        _, files = self.files()
+        sessions = {entry.session for entry in files} | {str(session_id)}
+        share = self.policy.share(self.budget, sessions)
+        filesize_kb = ring.filesize_kb or share // RING_FILES // KB
+        filesize_kb = max(min(filesize_kb, share // MIN_RING_FILES // KB), MIN_FILESIZE_KB)
+        files = max(share // (filesize_kb * KB), MIN_RING_FILES)
+        return Ring(ring.duration, filesize_kb, files)
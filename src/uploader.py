@@ -0,0 +1,235 @@
+"""
+Upload engine for capture files.
+
+Files are uploaded by a pool of workers. Failed uploads are retried with
+exponential backoff and full jitter, and a file is only removed once the
+backend has acknowledged it with a 2xx response. Every file carries an
+idempotency key derived from its identity, so a retry of an upload the backend
+already stored can be recognised as a duplicate.
+
+Files can be compressed on the fly while they are uploaded, see
+``compression``. When given a spool, the uploader records each file's state in it so pending
+uploads survive a restart, see ``resume``.
+"""
+import hashlib
+import os
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .metrics import REGISTRY
+from .multipart import multipart_upload
+from .spool import ACKED, CAPTURED, QUEUED, UPLOADING
+
+# Client errors that are worth retrying, everything else 4xx is permanent.
+RETRYABLE_STATUS_CODES = (408, 425, 429)
+
+
+def idempotency_key(path, data):
+    """Return a stable idempotency key for uploading path with form data."""
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        size = 0
+    identity = "{}:{}:{}:{}".format(
+        data.get("mac"), data.get("session_id"), os.path.basename(path), size
+    )
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+
+class Uploader:  # pylint: disable=too-many-instance-attributes
+    """Concurrent, retrying, acknowledgement-aware file uploader."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        req_session,
+        url,
+        max_workers=2,
+        max_attempts=6,
+        backoff_base=1.0,
+        backoff_max=60.0,
+        timeout=60,
+        spool=None,
+        on_complete=None,
+        compression=None,
+        compression_level=None,
+        metrics=REGISTRY,
+    ):
+        """Initialize uploader posting files to url.
+
+        on_complete is called with (path, acked) after each queued upload.
+        Metrics are reported to the metrics registry labelled with the url
+        path as endpoint.
+        """
+        self.req_session = req_session
+        self.url = url
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.spool = spool
+        self.on_complete = on_complete
+        self.compression = compression
+        self.compression_level = compression_level
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.queued = 0
+        self.in_flight = 0
+        self.acked = 0
+        self.failed = 0
+        self.retries = 0
+        self.bytes_uploaded = 0
+        self.bytes_sent = 0
+        self.transfer_seconds = 0.0
+        self.endpoint = urllib.parse.urlparse(url).path
+        self.metrics = dict(
+            queued=metrics.counter(
+                "pi_upload_files_queued_total", "Files queued for upload."
+            ),
+            acked=metrics.counter(
+                "pi_upload_files_acked_total", "Files acknowledged by the backend."
+            ),
+            failed=metrics.counter(
+                "pi_upload_files_failed_total", "Files given up on after retries."
+            ),
+            retries=metrics.counter("pi_upload_retries_total", "Upload retries."),
+            bytes=metrics.counter(
+                "pi_upload_bytes_total", "Capture bytes acknowledged by the backend."
+            ),
+            sent=metrics.counter(
+                "pi_upload_sent_bytes_total", "Bytes sent for acknowledged uploads."
+            ),
+            latency=metrics.histogram(
+                "pi_upload_latency_seconds", "Time from queueing a file to its ack."
+            ),
+        )
+
+    def submit(self, path, data):
+        """Queue path for upload with the given form data."""
+        if self.spool:
+            # Keeps resume from queueing it a second time.
+            self.spool.set_state(path, QUEUED)
+        with self.lock:
+            self.queued += 1
+        self.metrics["queued"].inc(endpoint=self.endpoint)
+        return self.executor.submit(self._run, path, data, time.monotonic())
+
+    def resume(self):
+        """Queue every file the spool still has pending for this url.
+
+        Files another uploader has queued or is uploading are not pending, so
+        run this once per process, before any other uploader for the url.
+        """
+        pending = self.spool.pending(self.url)
+        for path, data in pending:
+            self.submit(path, data)
+        return len(pending)
+
+    def _run(self, path, data, queued_at=None):
+        """Worker entry point, moves the file from queued to in flight."""
+        with self.lock:
+            self.queued -= 1
+            self.in_flight += 1
+        if self.spool:
+            self.spool.set_state(path, UPLOADING)
+        acked = False
+        try:
+            acked = self.upload(path, data)
+            if acked and queued_at is not None:
+                self.metrics["latency"].observe(
+                    time.monotonic() - queued_at, endpoint=self.endpoint
+                )
+            return acked
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+            if self.spool and not acked and not os.path.exists(path):
+                self.spool.forget(path)
+            elif self.spool:
+                self.spool.set_state(path, ACKED if acked else CAPTURED)
+            if self.on_complete:
+                self.on_complete(path, acked)
+
+    def backoff_delay(self, attempt):
+        """Return delay before retry number attempt (full jitter)."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def upload(self, path, data):
+        """Upload path, retrying until acknowledged. Returns True on ack."""
+        headers = {"Idempotency-Key": idempotency_key(path, data)}
+        for attempt in range(self.max_attempts):
+            if attempt:
+                with self.lock:
+                    self.retries += 1
+                self.metrics["retries"].inc(endpoint=self.endpoint)
+                if self.stopping.wait(self.backoff_delay(attempt)):
+                    break
+            try:
+                size = os.path.getsize(path)
+                body, body_headers = multipart_upload(
+                    path, data, self.compression, self.compression_level
+                )
+                started = time.monotonic()
+                with body:
+                    response = self.req_session.post(
+                        self.url,
+                        data=body,
+                        headers=dict(headers, **body_headers),
+                        timeout=self.timeout,
+                    )
+            except FileNotFoundError as error:
+                print("Error: " + str(error))
+                break
+            except (requests.RequestException, OSError) as error:
+                print(f"Upload of {path} failed: {error}")
+                continue
+            if 200 <= response.status_code < 300:
+                os.remove(path)
+                with self.lock:
+                    self.acked += 1
+                    self.bytes_uploaded += size
+                    sent = body.file_size
+                    self.bytes_sent += sent
+                    self.transfer_seconds += time.monotonic() - started
+                self.metrics["acked"].inc(endpoint=self.endpoint)
+                self.metrics["bytes"].inc(size, endpoint=self.endpoint)
+                self.metrics["sent"].inc(sent, endpoint=self.endpoint)
+                return True
+            print(f"Upload of {path} rejected: {response.status_code}")
+            if 400 <= response.status_code < 500 and (
+                response.status_code not in RETRYABLE_STATUS_CODES
+            ):
+                break
+        with self.lock:
+            self.failed += 1
+        self.metrics["failed"].inc(endpoint=self.endpoint)
+        return False
+
+    def stats(self):
+        """Return queue depth and throughput statistics."""
+        with self.lock:
+            elapsed = max(time.monotonic() - self.started_at, 1e-9)
+            return {
+                "queue_depth": self.queued,
+                "in_flight": self.in_flight,
+                "acked": self.acked,
+                "failed": self.failed,
+                "retries": self.retries,
+                "bytes_uploaded": self.bytes_uploaded,
+                "bytes_sent": self.bytes_sent,
+                "files_per_second": self.acked / elapsed,
+                "bytes_per_second": self.bytes_uploaded / elapsed,
+                "transfer_seconds": self.transfer_seconds,
+            }
+
+    def shutdown(self, wait=False, cancel_retries=False):
+        """Stop accepting uploads, optionally waiting for queued ones."""
+        if cancel_retries:
+            self.stopping.set()
+        self.executor.shutdown(wait=wait)
@@ -1,16 +1,27 @@
 """Testing file."""
 
-import asyncio
 import dbus
 import os
+import shlex
 import subprocess
 import signal
+import threading
+import time
 from netifaces import ifaddresses, AF_INET  # pylint: disable=no-name-in-module
 from .hostapd import HostAP
+from .capture_filter import CaptureFilterError, resolve_filter
+from .channel_hopper import ChannelHopper
 from .dnsmasq import DNSMasq
+from .hop_scheduler import FixedPolicy, HopScheduler
+from .metrics import REGISTRY
+from .multi_radio import radio_output
 from .network_interface import NetworkInterface
+from .rotation import Ring
 from .wificommon import WiFi
 
+# Seconds a capture process gets to write out its file once asked to stop.
+CAPTURE_STOP_TIMEOUT = 5
+
 
 class WiFiHandler(WiFi):  # pylint: disable=too-many-instance-attributes
     """Handles WiFi interface."""
@@ -23,21 +34,60 @@ class WiFiHandler(WiFi):  # pylint: disable=too-many-instance-attributes
         tshark_bin="/usr/bin/tshark",
         dumpcap_bin="dumpcap",
         dumpcap_file_generation_duration=15,
+        monitor_ifaces=(),
+        metrics=REGISTRY,
     ):
-        """Initialize WiFi handler."""
+        """Initialize WiFi handler.
+
+        monitor_ifaces are extra adapters capturing probe requests along with
+        the external interface. hostapd and dnsmasq are set up when the
+        hotspot is first used.
+        """
 
         super(WiFiHandler, self).__init__(ext_iface)
         self.ext_iface = ext_iface
         self.int_iface = int_iface
-        self.hotspot = HostAP(self.ext_iface, wifi_ap_password=wifi_ap_password)
-        self.dns_server = DNSMasq(self.ext_iface, self.int_iface)
+        self.wifi_ap_password = wifi_ap_password
+        self._hotspot = None
+        self._dns_server = None
+        self.hotspot_lock = threading.Lock()
         self.network_interface = NetworkInterface(self.ext_iface)
+        self.monitor_interfaces = [NetworkInterface(iface) for iface in monitor_ifaces]
         self.data_collector_process = None
+        # Capture processes, hoppers and files of the extra radios.
+        self.radio_processes = {}
+        self.radio_hoppers = []
+        self.probe_outputs = {}
         self.ap_data_collector_process = None
-        self.loop = None
+        self.hopper = None
         self.dumpcap_bin = dumpcap_bin
         self.dumpcap_file_generation_duration = dumpcap_file_generation_duration
+        self.ap_capture_filter = None
+        self.ap_snaplen = None
         self.tshark_bin = tshark_bin
+        self.capture_running = metrics.gauge(
+            "pi_capture_running", "1 while the capture process is alive."
+        )
+        self.capture_running.set(0, process="tshark")
+        self.capture_running.set(0, process="dumpcap")
+
+    @property
+    def hotspot(self):
+        """hostapd controller, set up on first use."""
+        with self.hotspot_lock:
+            if self._hotspot is None:
+                self._hotspot = HostAP(
+                    self.ext_iface, wifi_ap_password=self.wifi_ap_password
+                )
+            return self._hotspot
+
+    @property
+    def dns_server(self):
+        """dnsmasq controller, set up on first use."""
+        with self.hotspot_lock:
+            if self._dns_server is None:
+                self._dns_server = DNSMasq(self.ext_iface, self.int_iface)
+            return self._dns_server
 
     def init_wifi(self):
         """Initialize wifi."""
@@ -46,7 +96,7 @@ class WiFiHandler(WiFi):  # pylint: disable=too-many-instance-attributes
     def restart_opennds(self):
         """Restart opennds so authenticated devices are forgotten."""
         print("restarting opennds")
-        self.execute_command("systemctl restart opennds.service")
+        self.services.restart("opennds.service")
 
     def set_hostap_mode(self):
         """Set network interface host ap mode."""
@@ -59,74 +109,222 @@ class WiFiHandler(WiFi):  # pylint: disable=too-many-instance-attributes
         print(f"Hostap ssid: {ssid} channel: {channel}")
         self.hotspot.set_hostap_ssid(ssid)
         self.hotspot.set_hostap_channel(channel)
+        # Keep the file current for the next start, apply the change live.
         self.hotspot.set_hostap_conf()
-        self.hotspot.restart()
+        if not self.hotspot.reconfigure():
+            self.hotspot.restart()
 
     def stop_hostap(self):
-        """Stop host access point."""
-        self.hotspot.stop()
-        self.dns_server.stop()
+        """Stop host access point, if it was ever set up."""
+        if self._hotspot is not None:
+            self.hotspot.stop()
+        if self._dns_server is not None:
+            self.dns_server.stop()
 
     def restart_opennds(self):
         """Restart opennds so authenticated devices are forgotten."""
         print("restarting opennds")
-        self.execute_command("systemctl restart opennds.service")
+        self.services.restart("opennds.service")
 
     def set_probe_req_mode(self):
-        """Set network interface in probe req mode."""
+        """Set network interface and extra radios in probe req mode."""
         self.network_interface.set_probe_req_mode()
+        for interface in self.monitor_interfaces:
+            interface.set_probe_req_mode()
 
     def start_collecting_data(
-        self, output, probe_req_only=True, time_interval_channel=10
+        self, output, probe_req_only=True, time_interval_channel=10, scheduler=None
     ):
-        """Start collecting data."""
-        tshark_cmd = f"{self.tshark_bin} -i {self.ext_iface} -w {output}"
+        """Start collecting data.
+
+        Channels are hopped as planned by scheduler, by default every channel
+        from 1 to 11 for time_interval_channel seconds. With extra monitor
+        interfaces the channels are split over the radios, each capturing to
+        its own file, see probe_outputs.
+        """
+        self.probe_outputs = {self.ext_iface: output}
+        if probe_req_only:
+            if scheduler is None:
+                scheduler = HopScheduler(policy=FixedPolicy(time_interval_channel))
+            self.stop_hopping()
+            radios = [self.network_interface] + self.monitor_interfaces
+            schedulers = scheduler.split(len(radios)) if len(radios) > 1 else [scheduler]
+            for interface, radio_scheduler in zip(radios, schedulers):
+                path = output
+                if interface is not self.network_interface:
+                    path = radio_output(output, interface.interface)
+                    self.probe_outputs[interface.interface] = path
+                hopper = ChannelHopper(interface.set_channel, radio_scheduler, path)
+                hopper.start()
+                if interface is self.network_interface:
+                    self.hopper = hopper
+                else:
+                    self.radio_hoppers.append(hopper)
+                    self.radio_processes[interface.interface] = self.start_tshark(
+                        interface.interface, path, probe_req_only
+                    )
+            for interface in radios[len(schedulers):]:
+                print(f"No channel left for {interface.interface}, not capturing on it")
+        self.data_collector_process = self.start_tshark(self.ext_iface, output, probe_req_only)
+
+    def start_tshark(self, interface, output, probe_req_only=True):
+        """Start tshark capturing on interface to output."""
+        tshark_cmd = f"{self.tshark_bin} -i {interface} -w {output}"
         if probe_req_only:
-            self.loop = asyncio.get_event_loop()
-            self.loop.run_in_executor(
-                None,
-                self.network_interface.circular_channel_switching,
-                time_interval_channel,
-            )
             tshark_cmd += " -f 'wlan subtype probereq'"
-        self.data_collector_process = (
-            subprocess.Popen(  # pylint: disable=subprocess-popen-preexec-fn
-                tshark_cmd, shell=True, preexec_fn=os.setpgrp, stdout=subprocess.PIPE
-            )
+        process = subprocess.Popen(  # pylint: disable=subprocess-popen-preexec-fn
+            tshark_cmd, shell=True, preexec_fn=os.setpgrp, stdout=subprocess.PIPE
         )
+        name = "tshark" if interface == self.ext_iface else f"tshark_{interface}"
+        self.watch_process(process, name)
+        return process
+
+    def stop_hopping(self):
+        """Stop the channel hoppers if they are running."""
+        for hopper in [self.hopper] + self.radio_hoppers:
+            if hopper:
+                hopper.stop()
+                print(f"Channel hopper: {hopper.stats()}")
+        self.hopper = None
+        self.radio_hoppers = []
 
     def stop_collecting_data(self):
         """Stop collecting data."""
-        if self.loop:
-            self.loop.stop()
-            self.loop = None
+        self.stop_hopping()
 
-        if self.data_collector_process:
-            os.killpg(os.getpgid(self.data_collector_process.pid), signal.SIGTERM)
+        for process in [self.data_collector_process] + list(self.radio_processes.values()):
+            if process:
+                self.stop_process(process)
 
         self.data_collector_process = None
+        for interface in self.radio_processes:
+            self.capture_running.set(0, process=f"tshark_{interface}")
+        self.radio_processes = {}
+
+    def start_collecting_ap_data(
+        self, output, ring=None, capture_filter="all", snaplen=None
+    ):
+        """Start collecting data.
+
+        dumpcap rotates files as set by ring, by default every
+        dumpcap_file_generation_duration seconds, only captures frames kept
+        by the capture_filter profile and truncates them to snaplen bytes.
+        """
+        self.ap_capture_filter = self.capture_filter(capture_filter)
+        self.ap_snaplen = snaplen
+        self.start_dumpcap(output, ring)
 
-    def start_collecting_ap_data(self, output):
-        """Start collecting data."""
+    def start_dumpcap(self, output, ring=None):
+        """Start dumpcap writing to output with the current capture filter."""
         print("Attempting to start dumpcap")
-        dumpcap_cmd = "{} -i {} -b duration:{} -w {}".format(
+        if ring is None:
+            ring = Ring(self.dumpcap_file_generation_duration)
+        dumpcap_cmd = "{} -i {} {} -w {}".format(
             self.dumpcap_bin,
             self.ext_iface,
-            self.dumpcap_file_generation_duration,
+            ring.args(),
             output,
         )
+        if self.ap_snaplen:
+            dumpcap_cmd += " -s {}".format(int(self.ap_snaplen))
+        if self.ap_capture_filter:
+            dumpcap_cmd += " -f " + shlex.quote(self.ap_capture_filter)
 
         self.ap_data_collector_process = (
             subprocess.Popen(  # pylint: disable=subprocess-popen-preexec-fn
                 dumpcap_cmd, shell=True, preexec_fn=os.setpgrp, stdout=subprocess.PIPE
             )
         )
+        self.watch_process(self.ap_data_collector_process, "dumpcap")
+
+    def capture_filter(self, profile):
+        """Return the validated capture filter of profile, None to capture everything.
+
+        An invalid filter is logged and capture runs unfiltered rather than
+        not at all.
+        """
+        try:
+            return resolve_filter(
+                profile, self.ext_iface, self.get_device_mac(), self.dumpcap_bin
+            )
+        except CaptureFilterError as error:
+            print(f"Capturing without filter: {error}")
+            return None
+
+    def capture_processes(self):
+        """Return the capture processes by name, None if not running."""
+        processes = {
+            "tshark": self.data_collector_process,
+            "dumpcap": self.ap_data_collector_process,
+        }
+        for interface, process in self.radio_processes.items():
+            processes[f"tshark_{interface}"] = process
+        return processes
+
+    def watch_process(self, process, name):
+        """Report liveness of a capture process in the metrics."""
+        self.capture_running.set_function(
+            lambda: int(process.poll() is None), process=name
+        )
+
+    @staticmethod
+    def stop_process(process, timeout=CAPTURE_STOP_TIMEOUT):
+        """Terminate a capture process group and wait until it has exited.
+
+        The capture runs under a shell, so the whole group is waited for,
+        not only the shell. Whatever still runs after timeout seconds is
+        killed. Returns False if it had to be killed.
+        """
+        try:
+            pgid = os.getpgid(process.pid)
+            os.killpg(pgid, signal.SIGTERM)
+            # A paused capture only acts on SIGTERM once continued.
+            os.killpg(pgid, signal.SIGCONT)
+        except ProcessLookupError:
+            return True
+        deadline = time.monotonic() + timeout
+        while True:
+            # Reap the shell so it doesn't linger in the group as a zombie.
+            process.poll()
+            try:
+                os.killpg(pgid, 0)
+            except ProcessLookupError:
+                return True
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(0.05)
+        print(f"Capture process {process.pid} didn't stop in {timeout}s, killing it")
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+        return False
 
     def stop_collecting_ap_data(self):
-        """Stop collecting data."""
+        """Stop collecting data, once dumpcap has written out its last file."""
         if self.ap_data_collector_process:
-            os.killpg(os.getpgid(self.ap_data_collector_process.pid), signal.SIGTERM)
+            self.stop_process(self.ap_data_collector_process)
         self.ap_data_collector_process = None
+        self.capture_running.set(0, process="dumpcap")
+
+    def rearm_collecting_ap_data(self, output, ring):
+        """Restart dumpcap writing to output with new ring parameters.
+
+        The old dumpcap has exited before the new one starts, so its last
+        ring file is complete and the two never capture at once.
+        """
+        print(f"Re-arming dumpcap with {ring}")
+        self.stop_collecting_ap_data()
+        self.start_dumpcap(output, ring)
+
+    def pause_collecting_ap_data(self, paused=True):
+        """Pause or resume the running dumpcap process."""
+        if self.ap_data_collector_process:
+            os.killpg(
+                os.getpgid(self.ap_data_collector_process.pid),
+                signal.SIGSTOP if paused else signal.SIGCONT,
+            )
 
     def get_connected_users(self):
         """Get mac addresses of connected users in a list."""
@@ -140,13 +338,23 @@ class WiFiHandler(WiFi):  # pylint: disable=too-many-instance-attributes
             return "127.0.0.1"
 
     def nm_disable(self):
-        """Disable network manager for external interface"""
+        """Disable network manager for external interface and extra radios
+
+        Devices are looked up by interface name and left alone if they're
+        already unmanaged.
+        """
+        interfaces = [self.ext_iface] + [iface.interface for iface in self.monitor_interfaces]
         bus = dbus.SystemBus()
         nm_proxy = bus.get_object('org.freedesktop.NetworkManager', '/org/freedesktop/NetworkManager')
         nm = dbus.Interface(nm_proxy, dbus_interface='org.freedesktop.NetworkManager')
 
-        for device_obj_path in nm.GetDevices():
+        for interface in interfaces:
+            try:
+                device_obj_path = nm.GetDeviceByIpIface(interface)
+            except dbus.exceptions.DBusException:
+                # Not a device NetworkManager knows.
+                continue
             device_proxy = bus.get_object('org.freedesktop.NetworkManager', device_obj_path)
             device = dbus.Interface(device_proxy, dbus_interface='org.freedesktop.DBus.Properties')
-            if device.Get('org.freedesktop.NetworkManager.Device', 'Interface') == self.ext_iface:
+            if device.Get('org.freedesktop.NetworkManager.Device', 'Managed'):
                 device.Set('org.freedesktop.NetworkManager.Device', 'Managed', False)
@@ -38,9 +38,19 @@
 import os
 import re
 import subprocess
+import time
 
 from netifaces import ifaddresses, AF_INET, AF_LINK  # pylint: disable=no-name-in-module
 from sysdmanager import SystemdManager  # pylint: disable=import-error
+from .metrics import REGISTRY
+from .service_control import ServiceController
+
+COMMAND_DURATION = REGISTRY.histogram(
+    "pi_command_duration_seconds", "Duration of shell commands by executable."
+)
+COMMAND_FAILURES = REGISTRY.counter(
+    "pi_command_failures_total", "Shell commands exiting with an error by executable."
+)
 
 
 class WiFiControlError(Exception):
@@ -50,7 +60,6 @@ class WiFiControlError(Exception):
 class WiFi:
     """WiFi Object that defines basic functions required."""
 
-    restart_mdns = "systemctl restart mdns.service && sleep 2"
     rfkill_wifi_control = lambda self, action: f"rfkill {action} wifi"
 
     def __init__(self, ext_iface):
@@ -61,10 +70,11 @@ class WiFi:
         """
         self.ext_iface = ext_iface
         self.sysdmanager = SystemdManager()
+        self.services = ServiceController(self.sysdmanager, self.execute_command)
 
     def restart_dns(self):
         """Restart dns service."""
-        self.execute_command(self.restart_mdns)
+        self.services.restart("mdns.service")
 
     def block(self):
         """Block wifi interface."""
@@ -116,16 +126,35 @@ class WiFi:
             data_file.flush()
             os.fsync(data_file)
 
+    def update(self, data, file):
+        """Write data to the file unless it already holds it.
+
+        Returns whether the file was written.
+        """
+        try:
+            with open(file, "r") as data_file:
+                if data_file.read() == data:
+                    return False
+        except FileNotFoundError:
+            pass
+        self.write(data, file)
+        return True
+
     @staticmethod
     def execute_command(args):
         """Execute a certain command."""
+        command = os.path.basename(args.split()[0]) if args.strip() else ""
+        started = time.monotonic()
         try:
             return subprocess.check_output(args, stderr=subprocess.PIPE, shell=True)
         except subprocess.CalledProcessError as error:
+            COMMAND_FAILURES.inc(command=command)
             error_message = "WiFiControl: subprocess call error\n"
             error_message += f"Return code: {error.returncode}\n"
             error_message += f"Command: {args}"
             raise WiFiControlError(error_message)
+        finally:
+            COMMAND_DURATION.observe(time.monotonic() - started, command=command)
 
 
 if __name__ == "__main__":
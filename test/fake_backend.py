@@ -0,0 +1,335 @@
+"""
+Local stand-in for the backend endpoints the pi talks to.
+
+Runs a threaded HTTP server on localhost that implements just enough of the
+backend API for tests: status updates, instruction fetch/ack, session and AP
+lookup, the batched control/sync/ call, capture uploads and the instruction
+event stream.
+
+Status reports (full, delta and heartbeat, optionally gzip compressed) are
+applied to ``pi_status`` so tests can check the state the backend ends up
+with.
+
+Uploads can be slowed down and made to fail to exercise the upload path,
+see ``upload_latency``, ``upload_bandwidth`` and ``upload_error_rate``.
+
+Instructions can be issued to one pi by MAC, for a fleet of pis sharing the
+backend. The time from issuing such an instruction to the pi acknowledging
+it is kept in ``latencies``, and request and response bytes per endpoint in
+``bytes_in`` and ``bytes_out``.
+"""
+import collections
+import gzip
+import json
+import queue
+import random
+import threading
+import time
+import urllib.parse
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def parse_multipart(content_type, body):
+    """Parse a multipart/form-data body into a dict of field name to bytes."""
+    message = BytesParser(policy=HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+    )
+    return {
+        part.get_param("name", header="content-disposition"): part.get_payload(
+            decode=True
+        )
+        for part in message.iter_parts()
+    }
+
+
+class FakeBackend:  # pylint: disable=too-many-instance-attributes
+    """In-process backend stand-in."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        session_id=1,
+        access_point=None,
+        stream_enabled=True,
+        batched=True,
+        upload_latency=0.0,
+        upload_bandwidth=None,
+        upload_error_rate=0.0,
+        keep_uploads=True,
+        seed=None,
+        capture_filter=None,
+    ):
+        """Initialize backend state and start serving on a free port.
+
+        Uploads are answered after upload_latency seconds, their bodies are
+        read at no more than upload_bandwidth bytes per second and a share
+        upload_error_rate of them is answered with a 503. With keep_uploads
+        off only the time each file was acknowledged is kept. capture_filter
+        is the session's capture filter profile, left out if None.
+        """
+        self.session_id = session_id
+        self.capture_filter = capture_filter
+        self.access_point = access_point or {"ssid": "MY SSID", "channel": 6}
+        self.stream_enabled = stream_enabled
+        self.batched = batched
+        self.instructions = queue.Queue()
+        self.pi_instructions = collections.defaultdict(queue.Queue)
+        self.issued_at = collections.defaultdict(collections.deque)
+        self.latencies = []
+        self.bytes_in = collections.Counter()
+        self.bytes_out = collections.Counter()
+        self.subscribers = []
+        self.requests = []
+        self.status_updates = []
+        self.pi_status = {}
+        self.executed = []
+        self.uploads = []
+        self.upload_latency = upload_latency
+        self.upload_bandwidth = upload_bandwidth
+        self.upload_error_rate = upload_error_rate
+        self.keep_uploads = keep_uploads
+        self.rng = random.Random(seed)
+        self.acked = {}
+        self.upload_errors = 0
+        self.upload_bytes = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:{}/".format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def issue(self, code, mac=None):
+        """Issue an instruction, pushing it to stream subscribers.
+
+        With mac, only the pi with that MAC gets it.
+        """
+        with self.lock:
+            if mac is None:
+                self.instructions.put(code)
+            else:
+                self.issued_at[mac].append(time.monotonic())
+                self.pi_instructions[mac].put(code)
+            for subscriber_mac, subscriber in self.subscribers:
+                if mac is None or subscriber_mac == mac:
+                    subscriber.put(code)
+
+    def next_instruction(self, mac):
+        """Return the next instruction for the pi with mac, 5 if there is none."""
+        for instructions in (self.pi_instructions.get(mac), self.instructions):
+            try:
+                if instructions is not None:
+                    return instructions.get_nowait()
+            except queue.Empty:
+                pass
+        return 5
+
+    def has_instruction(self, mac):
+        """Return whether an instruction is waiting for the pi with mac."""
+        instructions = self.pi_instructions.get(mac)
+        return not self.instructions.empty() or (
+            instructions is not None and not instructions.empty()
+        )
+
+    def acknowledge(self, mac, code):
+        """Record the pi with mac executing code."""
+        with self.lock:
+            self.executed.append(code)
+            issued = self.issued_at.get(mac)
+            if issued:
+                self.latencies.append((mac, code, time.monotonic() - issued.popleft()))
+
+    def close(self):
+        """Stop serving."""
+        with self.lock:
+            for _, subscriber in self.subscribers:
+                subscriber.put(None)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def apply_status(self, status):
+        """Apply a status report to pi_status, False if its base is unknown."""
+        report = status.get("report", "full")
+        current = self.pi_status.get(status["mac"])
+        if report != "full":
+            if current is None or current["seq"] != status["base"]:
+                return False
+            if report == "delta":
+                users = set(current["ap_details"]["connected_users"])
+                users |= set(status["connected_users_added"])
+                users -= set(status["connected_users_removed"])
+                current["ap_details"]["connected_users"] = sorted(users)
+            current["seq"] = status["seq"]
+            return True
+        self.pi_status[status["mac"]] = {
+            "seq": status.get("seq"),
+            "ip": status["ip"],
+            "state": status["state"],
+            "ap_details": status["ap_details"],
+        }
+        return True
+
+    def _handler(self):
+        """Build request handler class bound to this backend."""
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Request handler."""
+
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                """Keep test output quiet."""
+
+            def _send_json(self, payload, status=200):
+                body = json.dumps(payload).encode()
+                with backend.lock:
+                    backend.bytes_out[urllib.parse.urlparse(self.path).path] += len(body)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _chunks(self):
+                """Yield the request body as it is read."""
+                if self.headers.get("Transfer-Encoding") == "chunked":
+                    while True:
+                        size = int(self.rfile.readline().split(b";")[0], 16)
+                        if not size:
+                            self.rfile.readline()
+                            return
+                        yield self.rfile.read(size)
+                        self.rfile.readline()
+                remaining = int(self.headers.get("Content-Length", 0))
+                while remaining:
+                    chunk = self.rfile.read(min(64 * 1024, remaining))
+                    if not chunk:
+                        return
+                    remaining -= len(chunk)
+                    yield chunk
+
+            def _body(self, bandwidth=None):
+                body = bytearray()
+                started = time.monotonic()
+                for chunk in self._chunks():
+                    body += chunk
+                    if bandwidth:
+                        ahead = len(body) / bandwidth - (time.monotonic() - started)
+                        if ahead > 0:
+                            time.sleep(ahead)
+                with backend.lock:
+                    backend.bytes_in[urllib.parse.urlparse(self.path).path] += len(body)
+                return bytes(body)
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Handle GET requests."""
+                url = urllib.parse.urlparse(self.path)
+                path = url.path
+                mac = urllib.parse.parse_qs(url.query).get("mac", [None])[0]
+                backend.requests.append(("GET", path))
+                if path == "/instructions/get_for_execution/":
+                    self._send_json({"code": backend.next_instruction(mac)})
+                elif path == "/control/sync/" and backend.batched:
+                    code = backend.next_instruction(mac)
+                    access_point = backend.access_point if code in (3, 6) else None
+                    sync = {
+                        "code": code,
+                        "session_id": backend.session_id,
+                        "access_point": access_point,
+                    }
+                    if backend.capture_filter:
+                        sync["capture_filter"] = backend.capture_filter
+                    self._send_json(sync)
+                elif path == "/session/latest/":
+                    session = {"id": backend.session_id}
+                    if backend.capture_filter:
+                        session["capture_filter"] = backend.capture_filter
+                    self._send_json(session)
+                elif path == "/session/ap/":
+                    self._send_json(backend.access_point)
+                elif path == "/instructions/stream/" and backend.stream_enabled:
+                    self._stream(mac)
+                else:
+                    self._send_json({"detail": "Not found."}, status=404)
+
+            def _stream(self, mac):
+                subscriber = (mac, queue.Queue())
+                with backend.lock:
+                    backend.subscribers.append(subscriber)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    self.wfile.write(b": connected\n\n")
+                    self.wfile.flush()
+                    while True:
+                        try:
+                            code = subscriber[1].get(timeout=1)
+                        except queue.Empty:
+                            self.wfile.write(b": keepalive\n\n")
+                            self.wfile.flush()
+                            continue
+                        if code is None:
+                            return
+                        event = "event: instruction\ndata: {}\n\n".format(
+                            json.dumps({"code": code})
+                        )
+                        self.wfile.write(event.encode())
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    with backend.lock:
+                        backend.subscribers.remove(subscriber)
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """Handle POST requests."""
+                path = urllib.parse.urlparse(self.path).path
+                backend.requests.append(("POST", path))
+                if path == "/status/update/":
+                    body = self._body()
+                    if self.headers.get("Content-Encoding") == "gzip":
+                        body = gzip.decompress(body)
+                    status = json.loads(body)
+                    backend.status_updates.append(status)
+                    if "executed" in status:
+                        backend.acknowledge(status["mac"], status["executed"]["code"])
+                    response = {
+                        "is_instruction_available": int(backend.has_instruction(status["mac"]))
+                    }
+                    if not backend.apply_status(status):
+                        response["resync"] = True
+                    self._send_json(response)
+                elif path == "/instructions/executed/":
+                    fields = urllib.parse.parse_qs(self._body().decode())
+                    backend.acknowledge(fields["mac"][0], int(fields["code"][0]))
+                    self._send_json({})
+                elif path in ("/ap/analyze/", "/probe/analyze/"):
+                    self._upload(path)
+                else:
+                    self._send_json({"detail": "Not found."}, status=404)
+
+            def _upload(self, path):
+                body = self._body(backend.upload_bandwidth)
+                if backend.upload_latency:
+                    time.sleep(backend.upload_latency)
+                with backend.lock:
+                    failed = backend.rng.random() < backend.upload_error_rate
+                    if failed:
+                        backend.upload_errors += 1
+                if failed:
+                    self._send_json({"detail": "Unavailable."}, status=503)
+                    return
+                form = parse_multipart(self.headers["Content-Type"], body)
+                with backend.lock:
+                    backend.acked[form["name"].decode()] = time.time()
+                    backend.upload_bytes += len(body)
+                    if backend.keep_uploads:
+                        backend.uploads.append((path, form))
+                self._send_json({})
+
+        return Handler
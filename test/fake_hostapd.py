@@ -0,0 +1,145 @@
+"""
+Local stand-in for a hostapd control socket.
+
+Answers the control interface commands the pi uses (PING, STATUS, SET,
+RELOAD, CHAN_SWITCH, DENY_ACL, STA-FIRST/STA-NEXT, ATTACH) on a UNIX
+datagram socket and records every command it received. Stations joining and
+leaving are announced to attached monitors like hostapd does.
+"""
+import os
+import socket
+import tempfile
+import threading
+
+
+class FakeHostapd:
+    """In-process hostapd control socket."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, ssid="rpi", channel=6, unsupported=(), interface="wlan1", directory=None
+    ):
+        """Start serving, commands in unsupported are answered with FAIL.
+
+        The socket is created in directory, a new temporary one by default.
+        """
+        self.owns_directory = directory is None
+        self.directory = directory or tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, interface)
+        self.ssid = ssid
+        self.pending_ssid = ssid
+        self.channel = channel
+        self.state = "ENABLED"
+        self.deny = []
+        self.unsupported = set(unsupported)
+        self.commands = []
+        self.events = []
+        self.stations = {}
+        self.monitors = []
+        self.closed = False
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """Stop serving."""
+        self.closed = True
+        try:
+            # Wakes up the serving thread blocked in recvfrom.
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.thread.join()
+        self.sock.close()
+        os.unlink(self.path)
+        if self.owns_directory:
+            os.rmdir(self.directory)
+
+    def connect(self, mac, **details):
+        """Associate a station and announce it."""
+        self.stations[mac] = {"connected_time": 0, "inactive_msec": 0, **details}
+        self.emit(f"<3>AP-STA-CONNECTED {mac}")
+
+    def disconnect(self, mac):
+        """Disassociate a station and announce it."""
+        del self.stations[mac]
+        self.emit(f"<3>AP-STA-DISCONNECTED {mac}")
+
+    def emit(self, event):
+        """Send event to attached monitors."""
+        for address in self.monitors:
+            self.sock.sendto(event.encode(), address)
+
+    def serve(self):
+        """Answer commands until closed."""
+        while True:
+            try:
+                data, address = self.sock.recvfrom(4096)
+            except OSError:
+                return
+            if self.closed:
+                return
+            command = data.decode()
+            self.commands.append(command)
+            for event in self.events:
+                self.sock.sendto(event.encode(), address)
+            self.events = []
+            if command == "ATTACH":
+                self.monitors.append(address)
+            elif command == "DETACH" and address in self.monitors:
+                self.monitors.remove(address)
+            self.sock.sendto(self.handle(command).encode(), address)
+
+    def handle(self, command):
+        """Return reply to command."""
+        name, _, args = command.partition(" ")
+        if name in self.unsupported:
+            return "FAIL\n"
+        if name in ("ATTACH", "DETACH"):
+            return "OK\n"
+        if name in ("STA-FIRST", "STA-NEXT"):
+            macs = list(self.stations)
+            if name == "STA-NEXT":
+                macs = macs[macs.index(args) + 1:] if args in macs else []
+            if not macs:
+                return ""
+            details = self.stations[macs[0]]
+            return macs[0] + "\n" + "".join(f"{k}={v}\n" for k, v in details.items())
+        if name == "PING":
+            return "PONG\n"
+        if name == "STATUS":
+            return (
+                f"state={self.state}\nphy=phy0\nfreq=2437\nchannel={self.channel}\n"
+                f"bss[0]={os.path.basename(self.path)}\nssid[0]={self.ssid}\n"
+                "num_sta[0]=2\n"
+            )
+        if name == "SET":
+            key, _, value = args.partition(" ")
+            if key == "ssid":
+                self.pending_ssid = value
+                return "OK\n"
+            return "FAIL\n"
+        if name == "RELOAD":
+            self.ssid = self.pending_ssid
+            return "OK\n"
+        if name == "CHAN_SWITCH":
+            frequency = int(args.split()[1])
+            if frequency == 2484:
+                self.channel = 14
+            elif frequency < 5000:
+                self.channel = (frequency - 2407) // 5
+            else:
+                self.channel = (frequency - 5000) // 5
+            return "OK\n"
+        if name == "DENY_ACL":
+            action, _, mac = args.partition(" ")
+            if action == "ADD_MAC":
+                self.deny.append(mac)
+            elif action == "DEL_MAC":
+                self.deny.remove(mac)
+            elif action == "CLEAR":
+                self.deny = []
+            elif action == "SHOW":
+                return "".join(f"{mac} VLAN_ID=0\n" for mac in self.deny)
+            return "OK\n"
+        return "UNKNOWN COMMAND\n"
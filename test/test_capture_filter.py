@@ -0,0 +1,83 @@
+"""
+Tests for capture filter
+"""
+import os
+import stat
+import tempfile
+
+import pytest
+
+from bench.synthetic import ack, beacon, data_frame, probe_request
+from src.capture_filter import (
+    CaptureFilterError,
+    PROFILES,
+    get_profile,
+    resolve_filter,
+    validate_filter,
+)
+
+BSSID = "02:aa:bb:cc:dd:ee"
+OUR_BSSID = bytes.fromhex("02aabbccddee")
+CLIENT = bytes.fromhex("02112233445f")
+OTHER = bytes.fromhex("02998877665a")
+
+FRAMES = {
+    "our_data": data_frame(CLIENT, OTHER, OUR_BSSID, 1, b"x" * 100),
+    "their_data": data_frame(CLIENT, OTHER, OTHER, 1, b"x" * 100),
+    "our_beacon": beacon(OUR_BSSID, 1, b"MY SSID", 6),
+    "their_beacon": beacon(OTHER, 1, b"NEIGHBOUR", 6),
+    "probe": probe_request(CLIENT, 1),
+    "ack": ack(CLIENT),
+}
+
+KEPT = {
+    "all": set(FRAMES),
+    "bssid": {"our_data", "our_beacon"},
+    "data": {"our_data", "their_data"},
+    "no_control": set(FRAMES) - {"ack"},
+    "bssid_data": {"our_data"},
+}
+
+
+def fake_dumpcap(directory):
+    """Write a dumpcap stand-in that rejects filters containing 'bogus'."""
+    path = os.path.join(directory, "dumpcap")
+    with open(path, "w") as script:
+        script.write(
+            "#!/bin/sh\n"
+            'case "$4" in *bogus*) echo "syntax error" >&2; exit 2;; esac\n'
+            'echo "(000) ret #262144"\n'
+        )
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+def test_bpf_expressions():
+    assert PROFILES["all"].bpf(BSSID) is None
+    assert PROFILES["data"].bpf() == "type data"
+    assert PROFILES["no_control"].bpf() == "not type ctl"
+    assert PROFILES["bssid_data"].bpf(BSSID.upper()) == (
+        f"type data and (wlan addr1 {BSSID} or wlan addr2 {BSSID} or wlan addr3 {BSSID})"
+    )
+    with pytest.raises(CaptureFilterError):
+        PROFILES["bssid"].bpf("02:aa:bb; rm -rf /")
+    with pytest.raises(CaptureFilterError):
+        get_profile("everything")
+
+
+@pytest.mark.parametrize("name", sorted(KEPT))
+def test_profiles_match_frames(name):
+    profile = PROFILES[name]
+    kept = {kind for kind, frame in FRAMES.items() if profile.matches(frame, BSSID)}
+    assert kept == KEPT[name]
+
+
+def test_filters_validated_with_dumpcap():
+    with tempfile.TemporaryDirectory() as tempdir:
+        dumpcap = fake_dumpcap(tempdir)
+        assert resolve_filter("data", "wlan1", BSSID, dumpcap) == "type data"
+        assert resolve_filter("all", "wlan1", BSSID, dumpcap) is None
+        with pytest.raises(CaptureFilterError, match="syntax error"):
+            validate_filter("bogus", "wlan1", dumpcap)
+        with pytest.raises(CaptureFilterError):
+            validate_filter("type data", "wlan1", os.path.join(tempdir, "missing"))
@@ -0,0 +1,84 @@
+"""
+Tests for channel hopper
+"""
+import sys
+import time
+from unittest.mock import MagicMock
+
+sys.modules["sysdmanager"] = MagicMock()
+# pylint: disable=wrong-import-position
+from src.channel_hopper import ChannelHopper, percentile
+from src.hop_scheduler import FixedPolicy, HopScheduler
+from src.nl80211 import NetlinkError
+from src.wificommon import WiFiControlError
+
+
+def test_hops_through_channels_until_stopped():
+    tuned = []
+    scheduler = HopScheduler([1, 6, 11], FixedPolicy(0.01))
+    hopper = ChannelHopper(tuned.append, scheduler)
+    hopper.start()
+    while len(tuned) < 7:
+        time.sleep(0.01)
+    hopper.stop()
+    assert not hopper.is_running()
+    assert tuned[:6] == [1, 6, 11, 1, 6, 11]
+    count = len(tuned)
+    time.sleep(0.05)
+    assert len(tuned) == count
+    stats = hopper.stats()
+    assert stats["switches"] == count
+    assert stats["failures"] == 0
+    assert stats["latency_ms_p50"] is not None
+    assert scheduler.stats()[1]["dwell"] >= 0
+
+
+def test_stop_interrupts_long_dwell():
+    hopper = ChannelHopper(lambda channel: None, HopScheduler([1], FixedPolicy(60)))
+    hopper.start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    hopper.stop()
+    assert time.monotonic() - started < 1
+    assert not hopper.is_running()
+
+
+def test_refused_channel_counted_and_skipped():
+    tuned = []
+
+    def set_channel(channel):
+        if channel == 36:
+            raise NetlinkError(22)
+        tuned.append(channel)
+
+    hopper = ChannelHopper(set_channel, HopScheduler([1, 36], FixedPolicy(0.01)))
+    hopper.start()
+    while len(tuned) < 3:
+        time.sleep(0.01)
+    hopper.stop()
+    assert set(tuned) == {1}
+    assert hopper.stats()["failures"] >= 2
+    assert hopper.stats()["channel"] == 1
+
+
+def test_iwconfig_failure_doesnt_stop_hopping():
+    tuned = []
+
+    def set_channel(channel):
+        if channel == 13:
+            raise WiFiControlError("iwconfig wlan1 channel 13 failed")
+        tuned.append(channel)
+
+    hopper = ChannelHopper(set_channel, HopScheduler([1, 13], FixedPolicy(0.01)))
+    hopper.start()
+    while len(tuned) < 3:
+        time.sleep(0.01)
+    assert hopper.is_running()
+    hopper.stop()
+    assert hopper.stats()["failures"] >= 2
+
+
+def test_percentile():
+    assert percentile([], 0.5) is None
+    assert percentile([3, 1, 2], 0.5) == 2
+    assert percentile(list(range(100)), 0.95) == 95
@@ -0,0 +1,67 @@
+"""
+Tests for compression
+"""
+import gzip
+import io
+import os
+import tempfile
+from unittest.mock import patch
+
+import pytest
+import requests
+
+from src.compression import CompressedReader, resolve_encoding
+from src.uploader import Uploader
+from test.fake_backend import FakeBackend
+
+DATA = b"\x00" * 10000 + b"beacon" * 5000 + os.urandom(1000)
+
+
+def test_gzip_stream_round_trip_in_chunks():
+    reader = CompressedReader(io.BytesIO(DATA), "gzip", level=1, chunk_size=1024)
+    chunks = []
+    while True:
+        chunk = reader.read(100)
+        if not chunk:
+            break
+        assert len(chunk) <= 100
+        chunks.append(chunk)
+    compressed = b"".join(chunks)
+    assert gzip.decompress(compressed) == DATA
+    assert reader.bytes_in == len(DATA)
+    assert reader.bytes_out == len(compressed) < len(DATA) / 5
+
+
+def test_read_all():
+    reader = CompressedReader(io.BytesIO(DATA), "gzip")
+    assert gzip.decompress(reader.read()) == DATA
+    assert reader.read() == b""
+
+
+def test_resolve_encoding():
+    assert resolve_encoding("none") is None
+    assert resolve_encoding(None) is None
+    assert resolve_encoding("gzip") == "gzip"
+    with patch("src.compression.zstandard", None):
+        assert resolve_encoding("zstd") == "gzip"
+    with pytest.raises(ValueError):
+        resolve_encoding("brotli")
+
+
+def test_compressed_upload_received_by_backend():
+    backend = FakeBackend()
+    uploader = Uploader(
+        requests.Session(), backend.url + "ap/analyze/", compression="gzip"
+    )
+    try:
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "1_ap_00001.pcapng")
+            with open(path, "wb") as data_file:
+                data_file.write(DATA)
+            assert uploader.upload(path, {"mac": "MY MAC", "name": path, "session_id": 1})
+        _, form = backend.uploads[0]
+        assert form["encoding"] == b"gzip"
+        assert gzip.decompress(form["data"]) == DATA
+        assert uploader.stats()["bytes_sent"] < len(DATA) / 5
+    finally:
+        backend.close()
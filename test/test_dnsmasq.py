@@ -1,12 +1,15 @@
 """
 Tests for dnsmasq
 """
+import os
 import sys
-from unittest.mock import MagicMock, patch, call, ANY
+import tempfile
+from unittest.mock import MagicMock, patch, call
 
 mock_sysdmanager = MagicMock()
 sys.modules["sysdmanager"] = mock_sysdmanager
 from src.dnsmasq import DNSMasq
+from src.wificommon import WiFiControlError
 
 
 def mock_init(self, ext_iface, int_iface):
@@ -15,18 +18,58 @@ def mock_init(self, ext_iface, int_iface):
     self.int_iface = int_iface
 
 
+def missing_rules(command):
+    """execute_command stand-in for a machine without our iptables rules."""
+    if " -C " in command:
+        raise WiFiControlError(command)
+    return b""
+
+
 @patch.object(DNSMasq, "__init__", mock_init)
-@patch("src.dnsmasq.DNSMasq.execute_command", autospec=True)
-def test_initialization(mock_execute):
+@patch.object(DNSMasq, "forwarding_enabled", return_value=False)
+@patch.object(DNSMasq, "get_addresses", return_value=[])
+@patch("src.dnsmasq.DNSMasq.execute_command", side_effect=missing_rules)
+def test_initialization(mock_execute, _addresses, _forwarding):
     mock_dnsmasq = DNSMasq("wlan0", "wlan1")
     mock_dnsmasq.initialize_dnsmasq()
-    print(mock_execute.mock_calls)
     mock_execute.assert_has_calls([
-        call(ANY, "ip route delete 192.168.1.0/24"),
-        call(ANY, "ifconfig wlan0 up 192.168.1.1 netmask 255.255.255.0"),
-        call(ANY, 'route add -net 192.168.1.0 netmask 255.255.255.0 gw 192.168.1.1'),
-        call(ANY, 'echo 1 > /proc/sys/net/ipv4/ip_forward'),
-        call(ANY, 'iptables -A FORWARD -i wlan1 -o wlan0 -m state --state ESTABLISHED,RELATED -j ACCEPT'),
-        call(ANY, 'iptables -A FORWARD -i wlan0 -o wlan1 -j ACCEPT'),
-        call(ANY, 'iptables -t nat -A POSTROUTING -o wlan1 -j MASQUERADE'),
+        call("ip route delete 192.168.1.0/24"),
+        call("ifconfig wlan0 up 192.168.1.1 netmask 255.255.255.0"),
+        call('route add -net 192.168.1.0 netmask 255.255.255.0 gw 192.168.1.1'),
+        call('echo 1 > /proc/sys/net/ipv4/ip_forward'),
+        call('iptables -C FORWARD -i wlan1 -o wlan0 -m state --state ESTABLISHED,RELATED -j ACCEPT'),
+        call('iptables -A FORWARD -i wlan1 -o wlan0 -m state --state ESTABLISHED,RELATED -j ACCEPT'),
+        call('iptables -C FORWARD -i wlan0 -o wlan1 -j ACCEPT'),
+        call('iptables -A FORWARD -i wlan0 -o wlan1 -j ACCEPT'),
+        call('iptables -t nat -C POSTROUTING -o wlan1 -j MASQUERADE'),
+        call('iptables -t nat -A POSTROUTING -o wlan1 -j MASQUERADE'),
     ])
+
+
+@patch.object(DNSMasq, "__init__", mock_init)
+@patch.object(DNSMasq, "forwarding_enabled", return_value=True)
+@patch.object(DNSMasq, "get_addresses", return_value=["192.168.1.1"])
+@patch("src.dnsmasq.DNSMasq.execute_command", return_value=b"")
+def test_initialization_skips_what_is_set_up(mock_execute, _addresses, _forwarding):
+    mock_dnsmasq = DNSMasq("wlan0", "wlan1")
+    mock_dnsmasq.initialize_dnsmasq()
+    # Only the rule checks, no address, route, forwarding or rule changes.
+    assert [args[0] for args, _ in mock_execute.call_args_list] == [
+        'iptables -C FORWARD -i wlan1 -o wlan0 -m state --state ESTABLISHED,RELATED -j ACCEPT',
+        'iptables -C FORWARD -i wlan0 -o wlan1 -j ACCEPT',
+        'iptables -t nat -C POSTROUTING -o wlan1 -j MASQUERADE',
+    ]
+
+
+@patch.object(DNSMasq, "__init__", mock_init)
+def test_conf_only_written_when_changed():
+    with tempfile.TemporaryDirectory() as tempdir:
+        mock_dnsmasq = DNSMasq("wlan0", "wlan1")
+        mock_dnsmasq.dnsmasq_config_defaults = os.path.join(tempdir, "missing.conf")
+        mock_dnsmasq.dnsmasq_config = os.path.join(tempdir, "dnsmasq.conf")
+        with patch.object(DNSMasq, "write", wraps=DNSMasq.write) as mock_write:
+            mock_dnsmasq.set_dnsmasq_conf()
+            mock_dnsmasq.set_dnsmasq_conf()
+        mock_write.assert_called_once()
+        with open(mock_dnsmasq.dnsmasq_config) as conf:
+            assert conf.read() == mock_dnsmasq.get_dnsmasq_conf()
@@ -12,6 +12,7 @@ from src.dumpcap_observer import DumpcapObserver
 
 def test_data_posted_when_new_file_created():
     mock_session = MagicMock()
+    mock_session.post.return_value.status_code = 200
     with tempfile.TemporaryDirectory() as tempdir:
         with patch("src.dumpcap_observer.os.mkdir"):
             observer = DumpcapObserver(
@@ -44,21 +45,96 @@ def test_data_posted_when_new_file_created():
                 [
                     call(
                         "http://localhost:8000/ap/analyze",
-                        data={
-                            "mac": "MY MAC",
-                            "name": file1.name,
-                            "session_id": 0,
-                        },
-                        files={"data": ANY},
-                    ),
-                    call(
-                        "http://localhost:8000/ap/analyze",
-                        data={
-                            "mac": "MY MAC",
-                            "name": file2.name,
-                            "session_id": 0,
-                        },
-                        files={"data": ANY},
-                    ),
+                        data=ANY,
+                        headers={"Idempotency-Key": ANY, "Content-Type": ANY},
+                        timeout=60,
+                    )
                 ]
+                * 2
             )
+            # Bodies are streamed from the files with the form fields.
+            assert [c.kwargs["data"].fields for c in mock_session.post.call_args_list] == [
+                {"mac": "MY MAC", "name": file1.name, "session_id": 0},
+                {"mac": "MY MAC", "name": file2.name, "session_id": 0},
+            ]
+            # Acknowledged files are removed
+            assert not os.path.exists(file1.name)
+            assert os.path.exists(file3.name)
+
+
+def test_last_file_uploaded_on_shutdown():
+    mock_session = MagicMock()
+    mock_session.post.return_value.status_code = 200
+    with tempfile.TemporaryDirectory() as tempdir:
+        observer = DumpcapObserver(
+            mock_session, 0, "MY MAC", "http://localhost:8000/ap/analyze", path=tempdir
+        )
+        observer.finished_file = tempdir + "/file1"
+        with open(observer.finished_file, "w") as file1:
+            file1.write("Data1\n")
+
+        observer.start_observer()
+        observer.shutdown_observer()
+        observer.uploader.executor.shutdown(wait=True)
+
+        mock_session.post.assert_called_once()
+        assert observer.stats()["acked"] == 1
+
+
+def test_capture_paused_when_spool_over_budget():
+    mock_session = MagicMock()
+    mock_session.post.return_value.status_code = 500
+    on_backpressure = MagicMock()
+    with tempfile.TemporaryDirectory() as tempdir:
+        observer = DumpcapObserver(
+            mock_session,
+            0,
+            "MY MAC",
+            "http://localhost:8000/ap/analyze",
+            path=tempdir,
+            max_workers=1,
+            max_spool_files=2,
+            on_backpressure=on_backpressure,
+        )
+        observer.uploader.backoff_base = 0.01
+        for i in range(4):
+            path = f"{tempdir}/file{i}"
+            with open(path, "w") as data_file:
+                data_file.write("Data\n")
+            observer.on_created(MagicMock(src_path=path))
+        on_backpressure.assert_called_once_with(True)
+
+        # Backend recovers, the backlog drains and capture resumes.
+        mock_session.post.return_value.status_code = 200
+        for _ in range(50):
+            if on_backpressure.call_count == 2:
+                break
+            sleep(0.1)
+        on_backpressure.assert_called_with(False)
+        observer.stopped = True
+        observer.uploader.shutdown(wait=True, cancel_retries=True)
+
+
+def test_rates_fed_to_rotation():
+    mock_session = MagicMock()
+    mock_session.post.return_value.status_code = 200
+    rotation = MagicMock()
+    with tempfile.TemporaryDirectory() as tempdir:
+        observer = DumpcapObserver(
+            mock_session,
+            0,
+            "MY MAC",
+            "http://localhost:8000/ap/analyze",
+            path=tempdir,
+            rotation=rotation,
+        )
+        for i in range(2):
+            path = f"{tempdir}/file{i}"
+            with open(path, "w") as data_file:
+                data_file.write("Data" * 100)
+            observer.on_created(MagicMock(src_path=path))
+        observer.uploader.shutdown(wait=True)
+        rotation.observe_file.assert_called_once_with(400, ANY)
+        rotation.observe_upload.assert_called_once()
+        sent, seconds = rotation.observe_upload.call_args.args
+        assert sent == 400 and seconds > 0
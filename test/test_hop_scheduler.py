@@ -0,0 +1,123 @@
+"""
+Tests for hop scheduler
+"""
+import os
+import tempfile
+
+import pytest
+
+from bench.synthetic import PcapngWriter, channel_frequency, probe_request, radiotap
+from src.hop_scheduler import (
+    AdaptivePolicy,
+    CaptureTail,
+    FixedPolicy,
+    HopScheduler,
+    WeightedPolicy,
+    parse_channels,
+    partition_channels,
+)
+
+SRC_MAC = bytes.fromhex("a4b1c2d3e4f5")
+
+
+def test_parse_channels():
+    assert parse_channels("2.4") == list(range(1, 12))
+    assert parse_channels("1,6,11,36") == [1, 6, 11, 36]
+    assert parse_channels("2.4,5")[-1] == 165
+    with pytest.raises(ValueError):
+        parse_channels("")
+
+
+def test_partition_channels():
+    radios = partition_channels(list(range(1, 12)), 3)
+    assert radios == [[1, 4, 7, 10], [2, 5, 8, 11], [3, 6, 9]]
+    # The non-overlapping channels are heard at the same time.
+    assert sorted(i for i, radio in enumerate(radios) for c in (1, 6, 11) if c in radio) == [
+        0, 1, 2
+    ]
+    assert partition_channels([1, 6], 3) == [[1], [6], []]
+
+
+def test_split_over_radios():
+    scheduler = HopScheduler(policy=AdaptivePolicy(cycle=30, min_dwell=1))
+    scheduler.rates = {1: 5.0, 2: 1.0}
+    radios = scheduler.split(2)
+    assert [radio.channels for radio in radios] == [[1, 3, 5, 7, 9, 11], [2, 4, 6, 8, 10]]
+    assert radios[0].rates == {1: 5.0} and radios[1].rates == {2: 1.0}
+    # Each radio covers its share of the channels in a whole cycle.
+    assert sum(dict(radios[1].plan()).values()) == pytest.approx(30)
+    radios[0].record(1, dwell=10, frames=40)
+    radios[1].record(2, dwell=10, frames=5)
+    # Kept across sessions, and counted in the scheduler's stats.
+    assert scheduler.split(2) == radios
+    stats = scheduler.stats()
+    assert (stats[1]["frames"], stats[2]["frames"], stats[3]["frames"]) == (40, 5, 0)
+    assert len(scheduler.split(12)) == 11
+
+
+def test_fixed_policy_matches_original_cycle():
+    scheduler = HopScheduler(policy=FixedPolicy(10))
+    hops = scheduler.hops()
+    assert [next(hops) for _ in range(12)] == [
+        (channel, 10) for channel in list(range(1, 12)) + [1]
+    ]
+
+
+def test_weighted_policy_favours_busy_channels():
+    scheduler = HopScheduler([1, 2, 6], WeightedPolicy(cycle=16, min_dwell=1))
+    assert dict(scheduler.plan()) == pytest.approx(
+        {1: 1 + 13 * 3 / 7, 2: 1 + 13 / 7, 6: 1 + 13 * 3 / 7}
+    )
+
+
+def test_adaptive_policy_follows_observed_rates():
+    scheduler = HopScheduler([1, 6, 36], AdaptivePolicy(cycle=30, min_dwell=2))
+    # Nothing observed yet, time is split evenly.
+    assert dict(scheduler.plan()) == {1: 10, 6: 10, 36: 10}
+    for channel, frames in ((1, 10), (6, 50), (36, 0)):
+        scheduler.record(channel, dwell=10, frames=frames)
+    scheduler.end_cycle()
+    dwell = dict(scheduler.plan())
+    assert dwell[36] == 2
+    assert dwell[6] == pytest.approx(2 + 24 * 5 / 6)
+    assert sum(dwell.values()) == pytest.approx(30)
+
+    # Rates are smoothed, a single quiet cycle doesn't drop a busy channel.
+    for channel in (1, 6, 36):
+        scheduler.record(channel, dwell=10, frames=0)
+    scheduler.end_cycle()
+    assert scheduler.rates[6] == pytest.approx(0.7 * 5)
+    assert dict(scheduler.plan())[6] > 20
+
+
+def test_stats_report_frames_per_channel():
+    scheduler = HopScheduler([1, 6])
+    scheduler.record(1, dwell=10)
+    scheduler.record(1, frames=4)
+    scheduler.record(6, dwell=10, frames=7)
+    stats = scheduler.stats()
+    assert stats[1] == {"frames": 4, "dwell": 10, "rate": 0.0}
+    assert stats[6]["frames"] == 7
+    assert scheduler.summary() == "ch1:4/10s ch6:7/10s"
+
+
+def test_capture_tail_counts_new_frames_per_channel():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "probe.pcapng")
+        tail = CaptureTail(path)
+        assert not tail.read(1)
+
+        with open(path, "wb") as capture:
+            writer = PcapngWriter(capture)
+            for seq, channel in enumerate((1, 1, 6)):
+                frame = probe_request(SRC_MAC, seq)
+                writer.write_packet(radiotap(channel_frequency(channel)) + frame, seq)
+            capture.flush()
+            assert tail.read(1) == {1: 2, 6: 1}
+
+            writer.write_packet(radiotap(channel_frequency(36)) + frame, 4)
+            capture.write(b"\x06\x00\x00\x00")  # Partial block still being written.
+            capture.flush()
+            assert tail.read(1) == {36: 1}
+            assert not tail.read(1)
+        tail.close()
@@ -2,3 +2,219 @@
 Tests for hostapd
 """
 
+import os
+import sys
+import tempfile
+from unittest.mock import MagicMock, patch
+
+sys.modules["sysdmanager"] = MagicMock()
+from src.hostapd import HostAP  # pylint: disable=wrong-import-position
+from src.hostapd_ctrl import HostapdCtrl  # pylint: disable=wrong-import-position
+from src.nl80211 import NetlinkError  # pylint: disable=wrong-import-position
+from .fake_hostapd import FakeHostapd  # pylint: disable=wrong-import-position
+
+STATION_DUMP = b"""Station a4:b1:c2:d3:e4:f5 (on wlan1)
+\tinactive time:\t340 ms
+\trx bytes:\t5000
+Station 02:11:22:33:44:ff (on wlan1)
+\tinactive time:\t25000 ms
+\trx bytes:\t1500
+"""
+
+
+def mock_init(self, ext_iface):
+    self.ext_iface = ext_iface
+    self.nl80211 = None
+    self.nl80211_available = True
+    self.ctrl_path = "/nonexistent/hostapd/" + ext_iface
+    self.ctrl = None
+    self.tracker = None
+
+
+@patch.object(HostAP, "__init__", mock_init)
+@patch("src.hostapd.NL80211")
+def test_connected_users_from_nl80211(mock_nl80211):
+    mock_nl80211.return_value.get_stations.return_value = [
+        {"mac": "a4:b1:c2:d3:e4:f5", "inactive_time": 340},
+        {"mac": "02:11:22:33:44:ff", "inactive_time": 25000},
+    ]
+    hostap = HostAP("wlan1")
+    assert hostap.get_connected_users_advanced() == ["a4:b1:c2:d3:e4:f5"]
+    assert hostap.get_connected_users_advanced() == ["a4:b1:c2:d3:e4:f5"]
+    mock_nl80211.assert_called_once_with()
+
+
+@patch.object(HostAP, "__init__", mock_init)
+@patch("src.hostapd.HostAP.execute_command", return_value=STATION_DUMP)
+@patch("src.hostapd.NL80211", side_effect=NetlinkError(2))
+def test_connected_users_falls_back_to_iw(mock_nl80211, mock_execute):
+    hostap = HostAP("wlan1")
+    assert hostap.get_connected_users_advanced() == ["a4:b1:c2:d3:e4:f5"]
+    assert hostap.get_connected_users_advanced() == ["a4:b1:c2:d3:e4:f5"]
+    mock_nl80211.assert_called_once_with()
+    mock_execute.assert_called_with("iw dev wlan1 station dump")
+
+
+@patch.object(HostAP, "__init__", mock_init)
+@patch("src.hostapd.NL80211")
+def test_socket_reopened_after_error(mock_nl80211):
+    client = MagicMock()
+    client.get_stations.side_effect = [OSError("gone"), []]
+    mock_nl80211.return_value = client
+    hostap = HostAP("wlan1")
+    with patch.object(HostAP, "get_connected_users_iw", return_value=[]):
+        hostap.get_connected_users_advanced()
+    assert hostap.nl80211 is None
+    assert hostap.get_connected_users_advanced() == []
+    assert mock_nl80211.call_count == 2
+
+
+@patch.object(HostAP, "__init__", mock_init)
+@patch("src.hostapd.NL80211")
+def test_enabled_once_interface_in_ap_mode(mock_nl80211):
+    mock_nl80211.return_value.get_interface.side_effect = [
+        {"ifname": "wlan1", "type": "monitor", "frequency": 2412},
+        {"ifname": "wlan1", "type": "AP", "frequency": 2437},
+    ]
+    hostap = HostAP("wlan1")
+    assert not hostap.is_enabled()
+    assert hostap.is_enabled()
+
+
+@patch.object(HostAP, "__init__", mock_init)
+@patch("src.hostapd.HostAP.execute_command", return_value=b"Interface wlan1\n\ttype AP\n")
+@patch("src.hostapd.NL80211", side_effect=NetlinkError(2))
+def test_enabled_falls_back_to_iw(_, mock_execute):
+    hostap = HostAP("wlan1")
+    assert hostap.is_enabled()
+    mock_execute.assert_called_once_with("iw dev wlan1 info")
+
+
+@patch.object(HostAP, "__init__", mock_init)
+def test_reconfigure_over_control_socket():
+    hostapd = FakeHostapd(ssid="rpi", channel=6)
+    try:
+        hostap = HostAP("wlan1")
+        hostap.ctrl_path = hostapd.path
+        hostap.ssid, hostap.channel = "CAFE", 11
+        assert hostap.reconfigure()
+        assert (hostapd.ssid, hostapd.channel) == ("CAFE", 11)
+        assert "CHAN_SWITCH 5 2462" in hostapd.commands
+        hostap.close_control()
+    finally:
+        hostapd.close()
+
+
+@patch.object(HostAP, "__init__", mock_init)
+def test_reconfigure_skips_unchanged_settings():
+    hostapd = FakeHostapd(ssid="rpi", channel=6)
+    try:
+        hostap = HostAP("wlan1")
+        hostap.ctrl_path = hostapd.path
+        hostap.ssid, hostap.channel = "rpi", 6
+        assert hostap.reconfigure()
+        assert hostapd.commands == ["STATUS"]
+        hostap.close_control()
+    finally:
+        hostapd.close()
+
+
+@patch.object(HostAP, "__init__", mock_init)
+def test_reconfigure_refused_falls_back():
+    hostapd = FakeHostapd(channel=6, unsupported={"CHAN_SWITCH"})
+    try:
+        hostap = HostAP("wlan1")
+        hostap.ctrl_path = hostapd.path
+        hostap.ssid, hostap.channel = "rpi", 36
+        assert not hostap.reconfigure()
+        assert hostap.ctrl is None
+    finally:
+        hostapd.close()
+
+
+@patch.object(HostAP, "__init__", mock_init)
+def test_reconfigure_without_control_socket():
+    hostap = HostAP("wlan1")
+    hostap.ssid, hostap.channel = "CAFE", 11
+    assert not hostap.reconfigure()
+
+
+@patch.object(HostAP, "__init__", mock_init)
+def test_control_reconnects_after_hostapd_restart():
+    hostapd = FakeHostapd()
+    hostap = HostAP("wlan1")
+    hostap.ctrl_path = hostapd.path
+    first = hostap.control()
+    hostapd.close()
+    assert hostap.control() is None
+    restarted = FakeHostapd()
+    try:
+        hostap.ctrl_path = restarted.path
+        assert hostap.control() not in (None, first)
+        hostap.close_control()
+    finally:
+        restarted.close()
+
+
+@patch.object(HostAP, "__init__", mock_init)
+@patch("src.hostapd.HostAP.write")
+def test_deny_mac_applied_live(mock_write):
+    hostapd = FakeHostapd()
+    hostapd.deny = ["00:00:00:00:00:01"]
+    try:
+        hostap = HostAP("wlan1")
+        hostap.ctrl_path = hostapd.path
+        hostap.mac_deny_path = "/etc/hostapd/hostapd.deny"
+        hostap.deny_mac(["a4:b1:c2:d3:e4:f5", "02:11:22:33:44:ff"])
+        mock_write.assert_called_once_with(
+            "a4:b1:c2:d3:e4:f5\n02:11:22:33:44:ff", "/etc/hostapd/hostapd.deny"
+        )
+        assert hostap.ctrl.deny_list() == ["a4:b1:c2:d3:e4:f5", "02:11:22:33:44:ff"]
+        hostap.close_control()
+    finally:
+        hostapd.close()
+
+
+def test_ctrl_skips_unsolicited_events():
+    hostapd = FakeHostapd()
+    hostapd.events = ["<3>AP-STA-CONNECTED a4:b1:c2:d3:e4:f5"]
+    try:
+        ctrl = HostapdCtrl(hostapd.path)
+        assert ctrl.ping()
+        assert ctrl.status()["ssid[0]"] == "rpi"
+        ctrl.close()
+    finally:
+        hostapd.close()
+
+
+@patch.object(HostAP, "__init__", mock_init)
+@patch("src.hostapd.NL80211")
+def test_connected_users_from_tracker(mock_nl80211):
+    hostap = HostAP("wlan1")
+    hostap.tracker = MagicMock(connected=True)
+    hostap.tracker.get_connected_users.return_value = ["a4:b1:c2:d3:e4:f5"]
+    assert hostap.get_connected_users_advanced() == ["a4:b1:c2:d3:e4:f5"]
+    mock_nl80211.assert_not_called()
+    hostap.tracker.connected = False
+    mock_nl80211.return_value.get_stations.return_value = []
+    assert hostap.get_connected_users_advanced() == []
+
+
+@patch.object(HostAP, "__init__", mock_init)
+def test_conf_only_written_when_changed():
+    with tempfile.TemporaryDirectory() as tempdir:
+        hostap = HostAP("wlan1")
+        hostap.ssid, hostap.channel = "rpi", 6
+        hostap.ctrl_dir = "/var/run/hostapd"
+        hostap.wifi_ap_password = "123456789"
+        hostap.hostapd_path = os.path.join(tempdir, "hostapd.conf")
+        hostap.mac_deny_path = os.path.join(tempdir, "hostapd.deny")
+        with patch.object(HostAP, "write", wraps=HostAP.write) as mock_write:
+            hostap.set_hostap_conf()
+            hostap.set_hostap_conf()
+            assert mock_write.call_count == 2  # conf and deny file
+            hostap.set_hostap_channel(11)
+            hostap.set_hostap_conf()
+            assert mock_write.call_count == 3
+        with open(hostap.hostapd_path) as conf:
+            assert "channel=11" in conf.read().split("\n")
@@ -0,0 +1,68 @@
+"""
+Tests for instruction channel
+"""
+import threading
+
+import requests
+
+from src.instruction_channel import InstructionChannel, iter_events
+from test.fake_backend import FakeBackend
+
+
+def test_iter_events_parses_stream():
+    lines = [
+        ": keepalive",
+        "",
+        "event: instruction",
+        'data: {"code": 3}',
+        "",
+        "data: first",
+        "data:second",
+        "",
+    ]
+    assert list(iter_events(lines)) == [
+        ("instruction", '{"code": 3}'),
+        ("message", "first\nsecond"),
+    ]
+
+
+def test_pushed_instruction_delivered():
+    backend = FakeBackend()
+    received = []
+    delivered = threading.Event()
+
+    def on_instruction(event):
+        received.append(event)
+        delivered.set()
+
+    channel = InstructionChannel(
+        requests.Session(),
+        backend.url + "instructions/stream/",
+        "MY MAC",
+        on_instruction,
+    )
+    try:
+        channel.start()
+        for _ in range(50):
+            if backend.subscribers:
+                break
+            threading.Event().wait(0.05)
+        assert channel.connected
+        backend.issue(3)
+        assert delivered.wait(5)
+        assert received == [{"code": 3}]
+    finally:
+        channel.stop()
+        backend.close()
+
+
+def test_channel_backs_off_when_backend_has_no_stream():
+    backend = FakeBackend(stream_enabled=False)
+    channel = InstructionChannel(
+        requests.Session(), backend.url + "instructions/stream/", "MY MAC", print
+    )
+    try:
+        assert channel.listen() == 300
+        assert not channel.connected
+    finally:
+        backend.close()
@@ -0,0 +1,80 @@
+"""
+Tests for metrics
+"""
+import urllib.error
+import urllib.request
+
+import pytest
+
+from src.metrics import MetricsServer, Registry
+
+
+def test_counter_and_gauge_rendered():
+    metrics = Registry()
+    counter = metrics.counter("pi_files_total", "Files.")
+    counter.inc(endpoint="/ap/analyze/")
+    counter.inc(2, endpoint="/ap/analyze/")
+    metrics.gauge("pi_spool_bytes", "Bytes.").set(1024)
+    metrics.gauge("pi_capture_running", "Alive.").set_function(
+        lambda: 1, process="dumpcap"
+    )
+    assert metrics.counter("pi_files_total") is counter
+    assert metrics.render() == (
+        "# HELP pi_capture_running Alive.\n"
+        "# TYPE pi_capture_running gauge\n"
+        'pi_capture_running{process="dumpcap"} 1\n'
+        "# HELP pi_files_total Files.\n"
+        "# TYPE pi_files_total counter\n"
+        'pi_files_total{endpoint="/ap/analyze/"} 3\n'
+        "# HELP pi_spool_bytes Bytes.\n"
+        "# TYPE pi_spool_bytes gauge\n"
+        "pi_spool_bytes 1024\n"
+    )
+
+
+def test_gauge_set_replaces_function():
+    gauge = Registry().gauge("pi_capture_running")
+    gauge.set_function(lambda: 1, process="tshark")
+    gauge.set(0, process="tshark")
+    assert gauge.get(process="tshark") == 0
+
+
+def test_histogram_buckets_cumulative():
+    metrics = Registry()
+    histogram = metrics.histogram("pi_latency_seconds", "Latency.", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.7, 3):
+        histogram.observe(value, code=1)
+    lines = metrics.render().splitlines()
+    assert lines[2:] == [
+        'pi_latency_seconds_bucket{code="1",le="0.1"} 1',
+        'pi_latency_seconds_bucket{code="1",le="1"} 3',
+        'pi_latency_seconds_bucket{code="1",le="+Inf"} 4',
+        'pi_latency_seconds_sum{code="1"} 4.25',
+        'pi_latency_seconds_count{code="1"} 4',
+    ]
+    assert metrics.snapshot() == {
+        'pi_latency_seconds_sum{code="1"}': 4.25,
+        'pi_latency_seconds_count{code="1"}': 4,
+    }
+
+
+def test_name_registered_once_per_kind():
+    metrics = Registry()
+    metrics.counter("pi_files_total")
+    with pytest.raises(ValueError):
+        metrics.gauge("pi_files_total")
+
+
+def test_metrics_served_over_http():
+    metrics = Registry()
+    metrics.counter("pi_files_total", "Files.").inc()
+    server = MetricsServer(metrics, port=0)
+    server.start()
+    try:
+        url = f"http://127.0.0.1:{server.port}"
+        with urllib.request.urlopen(url + "/metrics") as response:
+            assert b"pi_files_total 1\n" in response.read()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + "/other")
+    finally:
+        server.stop()
@@ -0,0 +1,117 @@
+"""
+Tests for multi radio probe capture
+"""
+import os
+import stat
+import sys
+import tempfile
+import time
+from unittest.mock import MagicMock, patch
+
+sys.modules["sysdmanager"] = MagicMock()
+# pylint: disable=wrong-import-position
+from bench.synthetic import PcapngWriter, channel_frequency, probe_request, radiotap
+from src.hop_scheduler import FixedPolicy, HopScheduler
+from src.metrics import Registry
+from src.multi_radio import merge_captures, parse_interfaces, radio_output
+from src.network_interface import NetworkInterface
+from src.probe_extractor import PcapngReader, iter_probe_records
+from src.wifi import WiFiHandler
+
+SRC_MAC = bytes.fromhex("a4b1c2d3e4f5")
+
+
+def write_probes(path, channel, timestamps):
+    """Write a capture of probe requests heard on channel at timestamps."""
+    with open(path, "wb") as capture:
+        writer = PcapngWriter(capture)
+        for seq, timestamp in enumerate(timestamps):
+            frame = radiotap(channel_frequency(channel)) + probe_request(SRC_MAC, seq)
+            writer.write_packet(frame, timestamp)
+
+
+def fake_tshark(directory):
+    """Write a tshark stand-in that records its arguments next to its output."""
+    path = os.path.join(directory, "tshark")
+    with open(path, "w") as script:
+        script.write('#!/bin/sh\necho "$@" > "$4.args"\nexec sleep 30\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+def test_radio_files():
+    assert radio_output("/tmp/1_probe.pcapng", "wlan2") == "/tmp/1_probe_wlan2.pcapng"
+    assert parse_interfaces("wlan2, wlan3,") == ["wlan2", "wlan3"]
+    assert parse_interfaces("") == []
+
+
+def test_merge_captures_interleaves_radios():
+    with tempfile.TemporaryDirectory() as tempdir:
+        first, second = os.path.join(tempdir, "1.pcapng"), os.path.join(tempdir, "2.pcapng")
+        write_probes(first, 1, [100.0, 100.2, 100.4])
+        write_probes(second, 6, [100.1, 100.3])
+        merged = os.path.join(tempdir, "merged.pcapng")
+        missing = os.path.join(tempdir, "never_started.pcapng")
+        assert merge_captures([first, second, missing], merged) == 5
+        with open(merged, "rb") as capture:
+            reader = PcapngReader(capture)
+            records = list(iter_probe_records(reader))
+            assert len(reader.interfaces) == 2
+        assert [record["ts"] for record in records] == [100.0, 100.1, 100.2, 100.3, 100.4]
+        assert [record["channel"] for record in records] == [1, 6, 1, 6, 1]
+
+
+@patch("src.wifi.DNSMasq")
+@patch("src.wifi.HostAP")
+@patch.object(NetworkInterface, "set_probe_req_mode")
+def test_radios_hop_their_own_channels(mode, _hostap, _dnsmasq):
+    tuned = []
+
+    def set_channel(interface, channel):
+        tuned.append((interface.interface, channel))
+
+    with tempfile.TemporaryDirectory() as tempdir, patch.object(
+        NetworkInterface, "set_channel", autospec=True, side_effect=set_channel
+    ):
+        wifi = WiFiHandler(
+            "wlan1",
+            "wlan0",
+            "password",
+            tshark_bin=fake_tshark(tempdir),
+            monitor_ifaces=["wlan2", "wlan3"],
+            metrics=Registry(),
+        )
+        wifi.set_probe_req_mode()
+        assert mode.call_count == 3
+        scheduler = HopScheduler(policy=FixedPolicy(0.01))
+        output = os.path.join(tempdir, "1_probe.pcapng")
+        wifi.start_collecting_data(output, scheduler=scheduler)
+        assert wifi.probe_outputs == {
+            "wlan1": output,
+            "wlan2": radio_output(output, "wlan2"),
+            "wlan3": radio_output(output, "wlan3"),
+        }
+        assert set(wifi.capture_processes()) == {
+            "tshark", "dumpcap", "tshark_wlan2", "tshark_wlan3"
+        }
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and not all(
+            os.path.exists(path + ".args") for path in wifi.probe_outputs.values()
+        ):
+            time.sleep(0.05)
+        time.sleep(0.2)
+        wifi.stop_collecting_data()
+        for interface, path in wifi.probe_outputs.items():
+            with open(path + ".args") as args:
+                assert args.read().split()[:4] == ["-i", interface, "-w", path]
+        assert "tshark_wlan2" not in wifi.capture_processes()
+    channels = {}
+    for interface, channel in tuned:
+        channels.setdefault(interface, set()).add(channel)
+    assert channels == {
+        "wlan1": {1, 4, 7, 10},
+        "wlan2": {2, 5, 8, 11},
+        "wlan3": {3, 6, 9},
+    }
+    # Frames and dwell of the radios show up in the scheduler shared across sessions.
+    assert all(stats["dwell"] > 0 for stats in scheduler.stats().values())
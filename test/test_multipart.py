@@ -0,0 +1,115 @@
+"""
+Tests for multipart
+"""
+import gzip
+import os
+import tempfile
+from unittest.mock import patch
+
+import pytest
+import requests
+
+from src.compression import CompressedReader
+from src.multipart import MultipartEncoder, multipart_upload
+from test.fake_backend import FakeBackend, parse_multipart
+
+DATA = b"\x00" * 100000 + b"beacon" * 50000 + os.urandom(10000)
+
+
+@pytest.fixture(name="capture")
+def fixture_capture():
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "1_probe.pcapng")
+        with open(path, "wb") as data_file:
+            data_file.write(DATA)
+        yield path
+
+
+def test_body_parses_and_matches_length(capture):
+    body = MultipartEncoder({"mac": "MY MAC", "session_id": 1}, capture, chunk_size=4096)
+    content = b"".join(body)
+    assert len(content) == body.len
+    assert max(len(chunk) for chunk in body) <= max(4096, len(body.preamble))
+    form = parse_multipart(body.content_type, content)
+    assert form == {"mac": b"MY MAC", "session_id": b"1", "data": DATA}
+    assert body.file is None
+    # Iterating again for a retry sends the same body.
+    assert b"".join(body)[-len(DATA) - 100:] == content[-len(DATA) - 100:]
+
+
+def test_compressed_body(capture):
+    body, headers = multipart_upload(capture, {"mac": "MY MAC"}, "gzip")
+    # Sent chunked, the size is only known once the file was compressed.
+    assert body.len is None and body.file_size is None
+    content = b"".join(body)
+    assert len(content) == len(body.preamble) + body.file_size + len(body.epilogue)
+    assert headers["Content-Type"] == body.content_type
+    form = parse_multipart(body.content_type, content)
+    assert form["encoding"] == b"gzip"
+    assert gzip.decompress(form["data"]) == DATA
+    assert body.file_size < len(DATA) / 5
+
+
+def test_compressed_once_per_send(capture):
+    with patch("src.multipart.CompressedReader", wraps=CompressedReader) as reader:
+        body, _ = multipart_upload(capture, {}, "gzip")
+        reader.assert_not_called()
+        first = b"".join(body)
+        assert reader.call_count == 1
+        # A retry sends the same body again.
+        assert b"".join(body)[-100:] == first[-100:]
+        assert reader.call_count == 2
+
+
+def test_file_closed_when_upload_interrupted(capture):
+    body = MultipartEncoder({}, capture, chunk_size=1024)
+    chunks = iter(body)
+    next(chunks)
+    next(chunks)
+    assert body.file is not None
+    with body:
+        pass
+    assert body.file is None
+
+
+def test_file_changed_during_upload(capture):
+    body = MultipartEncoder({}, capture)
+    with open(capture, "r+b") as data_file:
+        data_file.truncate(1000)
+    with pytest.raises(IOError):
+        b"".join(body)
+    assert body.file is None
+
+
+def test_streamed_upload_received_by_backend(capture):
+    backend = FakeBackend()
+    try:
+        body, headers = multipart_upload(capture, {"mac": "MY MAC", "name": "1_probe.pcapng"})
+        with body:
+            response = requests.post(
+                backend.url + "probe/analyze/", data=body, headers=headers
+            )
+        assert response.status_code == 200
+        _, form = backend.uploads[0]
+        assert form["data"] == DATA
+        assert form["name"] == b"1_probe.pcapng"
+    finally:
+        backend.close()
+
+
+def test_compressed_upload_sent_chunked(capture):
+    backend = FakeBackend()
+    try:
+        body, headers = multipart_upload(capture, {"name": "1_probe.pcapng"}, "gzip")
+        with body:
+            response = requests.post(
+                backend.url + "probe/analyze/", data=body, headers=headers
+            )
+        assert response.status_code == 200
+        assert response.request.headers["Transfer-Encoding"] == "chunked"
+        assert "Content-Length" not in response.request.headers
+        _, form = backend.uploads[0]
+        assert len(form["data"]) == body.file_size
+        assert gzip.decompress(form["data"]) == DATA
+    finally:
+        backend.close()
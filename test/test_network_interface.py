@@ -0,0 +1,86 @@
+"""
+Tests for network interface setup
+"""
+import sys
+from unittest.mock import MagicMock, patch
+
+sys.modules["sysdmanager"] = MagicMock()
+# pylint: disable=wrong-import-position
+from src.metrics import Registry
+from src.network_interface import NetworkInterface
+from src.nl80211 import NetlinkError
+from src.wifi import WiFiHandler
+from src.wificommon import WiFiControlError
+
+
+def interface(mode, up=True):
+    """NetworkInterface of wlan1 running as mode, iw only."""
+    network_interface = NetworkInterface("wlan1")
+    network_interface.nl80211_available = False
+    network_interface.is_up = MagicMock(return_value=up)
+    info = f"Interface wlan1\n\ttype {mode}\n".encode()
+    network_interface.execute_command = MagicMock(
+        side_effect=lambda command: info if command.startswith("iw dev") else b""
+    )
+    return network_interface
+
+
+def commands(network_interface):
+    """Return the commands network_interface ran."""
+    return [args[0] for args, _ in network_interface.execute_command.call_args_list]
+
+
+def test_mode_changed():
+    network_interface = interface("managed")
+    network_interface.set_probe_req_mode()
+    assert commands(network_interface) == [
+        "iw dev wlan1 info",
+        "ifconfig wlan1 down",
+        "iwconfig wlan1 mode monitor",
+        "ifconfig wlan1 up",
+    ]
+    assert network_interface.current_mode == "monitor"
+
+
+def test_mode_change_skipped_when_already_in_mode():
+    network_interface = interface("monitor")
+    network_interface.set_probe_req_mode()
+    assert commands(network_interface) == ["iw dev wlan1 info"]
+    assert network_interface.current_mode == "monitor"
+
+    network_interface = interface("monitor", up=False)
+    network_interface.set_probe_req_mode()
+    assert commands(network_interface) == ["iw dev wlan1 info", "ifconfig wlan1 up"]
+
+
+def test_mode_from_nl80211_and_iw():
+    network_interface = NetworkInterface("wlan1")
+    network_interface.nl80211 = MagicMock()
+    network_interface.nl80211.get_interface.return_value = {"type": "monitor"}
+    network_interface.execute_command = MagicMock(return_value=b"\ttype managed\n")
+    assert network_interface.get_mode() == "monitor"
+    network_interface.execute_command.assert_not_called()
+
+    network_interface.nl80211.get_interface.side_effect = NetlinkError(19)
+    assert network_interface.get_mode() == "managed"
+    network_interface.execute_command.side_effect = WiFiControlError("No such device")
+    assert network_interface.get_mode() is None
+
+
+@patch("src.wifi.DNSMasq")
+@patch("src.wifi.HostAP")
+def test_hotspot_set_up_on_first_use(mock_hostap, mock_dnsmasq):
+    wifi = WiFiHandler("wlan1", "wlan0", "password", metrics=Registry())
+    wifi.stop_hostap()
+    mock_hostap.assert_not_called()
+    mock_dnsmasq.assert_not_called()
+
+    with patch.object(NetworkInterface, "set_hostap_mode"):
+        wifi.set_hostap_mode()
+    mock_hostap.assert_called_once_with("wlan1", wifi_ap_password="password")
+    mock_dnsmasq.assert_called_once_with("wlan1", "wlan0")
+    mock_hostap.return_value.start.assert_called_once()
+    wifi.stop_hostap()
+    assert wifi.hotspot is mock_hostap.return_value
+    mock_hostap.assert_called_once()
+    mock_dnsmasq.return_value.stop.assert_called_once()
@@ -0,0 +1,126 @@
+"""
+Tests for nl80211 client, using netlink messages laid out as the kernel
+sends them on a little endian host, for interface index 4.
+"""
+import sys
+from unittest.mock import patch
+
+import pytest
+
+from src.nl80211 import (
+    NL80211,
+    NetlinkError,
+    parse_attrs,
+    parse_messages,
+)
+
+pytestmark = pytest.mark.skipif(
+    sys.byteorder != "little", reason="fixtures are little endian"
+)
+
+FAMILY_REPLY = bytes.fromhex(
+    "5c000000100000000100000000000000010200000c0002006e6c383032313100"
+    "060001001c000000340007801800010008000200050000000b000100636f6e66"
+    "69670000180002000800020007000000090001006d6c6d650000000024000000"
+    "0200000001000000000000000000000014000000100005000100000000000000"
+)
+STATION_DUMP = bytes.fromhex(
+    "6c0000001c00020002000000000000001301000008000300040000000a000600"
+    "a4b1c2d3e4f500004400158008000100540100000800020000f2052a08000300"
+    "c0d4010005000700cc000000080010003d0000000c00170000f2052a01000000"
+    "0c001800c0d40100000000006c0000001c000200020000000000000013010000"
+    "08000300040000000a0006000211223344ff00004400158008000100a8610000"
+    "08000200dc050000080003008403000005000700b0000000080010002c010000"
+    "0c001700dc050000000000000c00180084030000000000001400000003000200"
+    "020000000000000000000000"
+)
+ENODEV_REPLY = bytes.fromhex(
+    "24000000020000000200000000000000edffffff140000001c0005030200000000000000"
+)
+
+
+class FakeSocket:
+    """Netlink socket replaying queued datagrams."""
+
+    def __init__(self, *datagrams):
+        self.datagrams = list(datagrams)
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(data)
+
+    def recv(self, _):
+        if not self.datagrams:
+            raise OSError("closed")
+        return self.datagrams.pop(0)
+
+    def close(self):
+        pass
+
+
+def test_family_and_multicast_groups_resolved():
+    client = NL80211(FakeSocket(FAMILY_REPLY))
+    assert client.family_id == 0x1C
+    assert client.groups == {"config": 5, "mlme": 7}
+    ((msg_type, flags, seq, _),) = parse_messages(client.sock.sent[0])
+    assert (msg_type, flags, seq) == (0x10, 0x05, 1)
+
+
+@patch("src.nl80211.socket.if_nametoindex", return_value=4)
+def test_station_dump_parsed(_):
+    client = NL80211(FakeSocket(FAMILY_REPLY, STATION_DUMP))
+    stations = client.get_stations("wlan1")
+    assert stations == [
+        {
+            "mac": "a4:b1:c2:d3:e4:f5",
+            "inactive_time": 340,
+            "connected_time": 61,
+            "signal": -52,
+            "rx_bytes": 5_000_000_000,
+            "tx_bytes": 120_000,
+        },
+        {
+            "mac": "02:11:22:33:44:ff",
+            "inactive_time": 25000,
+            "connected_time": 300,
+            "signal": -80,
+            "rx_bytes": 1500,
+            "tx_bytes": 900,
+        },
+    ]
+    ((msg_type, flags, seq, payload),) = parse_messages(client.sock.sent[1])
+    assert (msg_type, flags, seq, payload[0]) == (0x1C, 0x305, 2, 17)
+
+
+@patch("src.nl80211.socket.if_nametoindex", return_value=4)
+def test_netlink_error_raised(_):
+    client = NL80211(FakeSocket(FAMILY_REPLY, ENODEV_REPLY))
+    with pytest.raises(NetlinkError) as error:
+        client.get_stations("wlan1")
+    assert error.value.code == 19
+
+
+@patch("src.nl80211.socket.if_nametoindex", return_value=4)
+def test_set_channel_request(_):
+    ack = bytes.fromhex("24000000020000000200000000000000000000002c0000001c00050302000000")
+    client = NL80211(FakeSocket(FAMILY_REPLY, ack + bytes(4)))
+    client.set_channel("wlan1", 36)
+    ((msg_type, flags, seq, payload),) = parse_messages(client.sock.sent[1])
+    assert (msg_type, flags, seq, payload[0]) == (0x1C, 0x05, 2, 2)
+    attrs = parse_attrs(payload[4:])
+    assert attrs == {3: b"\x04\x00\x00\x00", 38: b"\x3c\x14\x00\x00", 39: bytes(4)}
+
+
+@patch("src.nl80211.socket.if_nametoindex", return_value=4)
+def test_get_interface(_):
+    reply = bytes.fromhex(
+        "380000001c00000002000000000000000701000008000300040000000a000400"
+        "776c616e31000000080005000300000008002600850900002400000002000000"
+        "020000000000000000000000140000001c0005000200000000000000"
+    )
+    client = NL80211(FakeSocket(FAMILY_REPLY, reply))
+    assert client.get_interface("wlan1") == {
+        "ifname": "wlan1",
+        "type": "AP",
+        "frequency": 2437,
+    }
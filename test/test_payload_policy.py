@@ -0,0 +1,198 @@
+"""
+Tests for payload policy
+"""
+import os
+import random
+import struct
+import tempfile
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from bench.synthetic import PcapngWriter, ack, beacon, data_frame, radiotap
+from src.dumpcap_observer import DumpcapObserver
+from src.metrics import Registry
+from src.payload_policy import LINKTYPE_ETHERNET, PayloadPolicy, make_payload_policy
+from src.probe_extractor import BLOCK_EPB, LINKTYPE_IEEE802_11_RADIOTAP, PcapngReader
+
+CLIENT = bytes([192, 168, 4, 20])
+SERVER = bytes([93, 184, 216, 34])
+HEADERS = 14 + 20 + 20
+
+
+def ethernet(payload, ethertype=0x0800):
+    return b"\x02" * 6 + b"\x04" * 6 + struct.pack("!H", ethertype) + payload
+
+
+def ipv4(protocol, source, destination, payload):
+    header = struct.pack("!BBHHHBBH", 0x45, 0, 20 + len(payload), 0, 0, 64, protocol, 0)
+    return header + source + destination + payload
+
+
+def tcp(sport, dport, payload, source=CLIENT, destination=SERVER):
+    header = struct.pack("!HHIIBBHHH", sport, dport, 0, 0, 5 << 4, 0x18, 65535, 0, 0)
+    return ethernet(ipv4(6, source, destination, header + payload))
+
+
+def udp(sport, dport, payload):
+    header = struct.pack("!HHHH", sport, dport, 8 + len(payload), 0)
+    return ethernet(ipv4(17, CLIENT, SERVER, header + payload))
+
+
+CLIENT_HELLO = b"\x16\x03\x01\x02\x00\x01" + bytes(600)
+DNS_QUERY = bytes(12) + b"\x07example\x03com\x00\x00\x01\x00\x01" + bytes(300)
+
+
+def write_capture(path, packets, linktype=LINKTYPE_ETHERNET):
+    with open(path, "wb") as capture:
+        writer = PcapngWriter(capture, linktype)
+        for i, packet in enumerate(packets):
+            writer.write_packet(packet, 1_600_000_000 + i / 100)
+
+
+def read_epbs(path):
+    """Return (captured length, original length) of every packet."""
+    with open(path, "rb") as capture:
+        reader = PcapngReader(capture)
+        return [
+            struct.unpack("<II", body[12:20])
+            for block_type, body in reader.blocks()
+            if block_type == BLOCK_EPB
+        ]
+
+
+def test_first_bytes_of_each_flow_kept():
+    policy = PayloadPolicy("headers", flow_bytes=1024, metrics=Registry())
+    download = [tcp(443, 50000, bytes(1400), SERVER, CLIENT) for _ in range(5)]
+    assert policy.keep(LINKTYPE_ETHERNET, download[0]) == HEADERS + 1024
+    assert policy.keep(LINKTYPE_ETHERNET, download[1]) == HEADERS
+    # Both directions share the flow, a new flow starts over.
+    assert policy.keep(LINKTYPE_ETHERNET, tcp(50000, 443, bytes(100))) == HEADERS
+    assert policy.keep(LINKTYPE_ETHERNET, tcp(50001, 443, bytes(100))) == HEADERS + 100
+
+
+@pytest.mark.parametrize(
+    "packet",
+    [
+        tcp(50000, 443, CLIENT_HELLO),
+        udp(50000, 53, DNS_QUERY),
+        udp(50000, 443, b"\xc3" + bytes(1200)),
+        ethernet(bytes(100), ethertype=0x888E),
+        ethernet(bytes(28), ethertype=0x0806),
+    ],
+    ids=["tls_client_hello", "dns", "quic_initial", "eapol", "arp"],
+)
+def test_metadata_kept_whole(packet):
+    policy = PayloadPolicy("headers", flow_bytes=0, metrics=Registry())
+    assert policy.keep(LINKTYPE_ETHERNET, packet) == len(packet)
+
+
+def test_wlan_frames():
+    policy = PayloadPolicy("headers", flow_bytes=100, metrics=Registry())
+    station, bssid = bytes.fromhex("02112233445f"), bytes.fromhex("02aabbccddee")
+    header = radiotap()
+    protected = header + data_frame(station, bytes(6), bssid, 1, bytes(1000))
+    # Radiotap, QoS data header and CCMP header plus the flow's first 100 bytes.
+    assert policy.keep(LINKTYPE_IEEE802_11_RADIOTAP, protected) == len(header) + 26 + 8 + 100
+    assert policy.keep(LINKTYPE_IEEE802_11_RADIOTAP, protected) == len(header) + 26 + 8
+    for frame in (beacon(bssid, 1, b"MY SSID", 6), ack(station)):
+        assert policy.keep(LINKTYPE_IEEE802_11_RADIOTAP, header + frame) == len(header + frame)
+    # Unprotected EAPOL (the handshake) is kept whole.
+    eapol = bytearray(data_frame(station, bytes(6), bssid, 2, b""))
+    eapol[1] &= ~0x40
+    eapol = header + bytes(eapol) + b"\xaa\xaa\x03\x00\x00\x00\x88\x8e" + bytes(95)
+    assert policy.keep(LINKTYPE_IEEE802_11_RADIOTAP, eapol) == len(eapol)
+
+
+def test_busy_hotspot_cut_by_order_of_magnitude():
+    rng = random.Random(1)
+    packets = []
+    for _ in range(3000):
+        sport = rng.randrange(50000, 50040)
+        roll = rng.random()
+        if roll < 0.02:
+            packets.append(udp(sport, 53, DNS_QUERY))
+        elif roll < 0.04:
+            packets.append(tcp(sport, 443, CLIENT_HELLO))
+        elif roll < 0.2:
+            packets.append(tcp(sport, 443, bytes(40)))
+        else:
+            packets.append(tcp(443, sport, rng.randbytes(1400), SERVER, CLIENT))
+    metrics = Registry()
+    policy = PayloadPolicy("headers", flow_bytes=1024, metrics=metrics)
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "1_ap_00001.pcapng")
+        write_capture(path, packets)
+        mtime = os.stat(path).st_mtime_ns - 10**9
+        os.utime(path, ns=(mtime, mtime))
+        before, after = policy.apply(path)
+        assert before > 10 * after
+        assert os.stat(path).st_mtime_ns == mtime
+        assert metrics.counter("pi_payload_removed_bytes_total").get(mode="headers") == (
+            before - after
+        )
+        lengths = read_epbs(path)
+        # Every packet is still there with its original length.
+        assert [orig for _, orig in lengths] == [len(packet) for packet in packets]
+        assert sum(captured for captured, _ in lengths) < sum(map(len, packets)) / 10
+
+
+def test_observer_uploads_truncated_file():
+    mock_session = MagicMock()
+    mock_session.post.return_value.status_code = 200
+    with tempfile.TemporaryDirectory() as tempdir:
+        observer = DumpcapObserver(
+            mock_session,
+            0,
+            "MY MAC",
+            "http://localhost:8000/ap/analyze",
+            path=tempdir,
+            payload_policy=PayloadPolicy("headers", flow_bytes=0, metrics=Registry()),
+        )
+        path = os.path.join(tempdir, "1_ap_00001.pcapng")
+        write_capture(path, [tcp(443, 50000, bytes(1400), SERVER, CLIENT)] * 10)
+        observer.push_to_queue(path)
+        observer.uploader.shutdown(wait=True)
+        body = mock_session.post.call_args.kwargs["data"]
+        assert body.file_size < 1400
+        assert body.fields["name"] == path
+
+
+def test_truncation_under_live_observer():
+    mock_session = MagicMock()
+    mock_session.post.return_value.status_code = 200
+    packets = [tcp(443, 50000, bytes(1400), SERVER, CLIENT)] * 10
+    with tempfile.TemporaryDirectory() as tempdir:
+        observer = DumpcapObserver(
+            mock_session,
+            0,
+            "MY MAC",
+            "http://localhost:8000/ap/analyze",
+            path=tempdir,
+            payload_policy=PayloadPolicy("headers", flow_bytes=0, metrics=Registry()),
+        )
+        observer.start_observer()
+        paths = [os.path.join(tempdir, f"1_ap_0000{i}.pcapng") for i in range(1, 4)]
+        for path in paths:
+            write_capture(path, packets)
+            time.sleep(0.5)
+        # The rewrite's temporary file is neither taken for a ring file nor
+        # trips up the observer thread.
+        assert observer.finished_file == paths[-1]
+        assert observer.my_observer.is_alive()
+        observer.shutdown_observer()
+        observer.uploader.executor.shutdown(wait=True)
+        names = [c.kwargs["data"].fields["name"] for c in mock_session.post.call_args_list]
+        assert names == paths
+        assert not any(name.endswith(".tmp") for name in os.listdir(tempdir))
+
+
+def test_session_specs():
+    default = PayloadPolicy("full", snaplen=200, flow_bytes=512, metrics=Registry())
+    assert make_payload_policy(None, default) is default
+    assert make_payload_policy("snaplen", default).dumpcap_snaplen() == 200
+    policy = make_payload_policy({"mode": "headers", "flow_bytes": 64}, default)
+    assert (policy.mode, policy.flow_bytes, policy.dumpcap_snaplen()) == ("headers", 64, None)
+    with pytest.raises(ValueError):
+        make_payload_policy("nothing", default)
@@ -1,12 +1,38 @@
 """
 Tests for pi_sniffer
 """
+import asyncio
+import io
+import json
+import os
+import struct
 import tempfile
+import threading
+import requests
 from unittest.mock import MagicMock, patch, ANY
 import sys
 
+import pytest
+
 sys.modules["sysdmanager"] = MagicMock()
 from pi_sniffer import PiSniffer, WiFiState
+from src.hop_scheduler import HopScheduler
+from src.metrics import Registry
+from src.multi_radio import radio_output
+from src.payload_policy import PayloadPolicy
+from src.probe_extractor import PcapngReader, iter_probe_records
+from src.rotation import AdaptiveRotation, RotationController
+from src.runtime import Runtime, Wakeup
+from src.status_reporter import StatusReporter
+from bench.bench_fleet import SimulatedWiFi, run_fleet
+from test.fake_backend import FakeBackend
+from test.test_probe_extractor import (
+    interface_block,
+    packet_block,
+    probe_request,
+    radiotap,
+    section_header,
+)
 
 INT_IFACE = "wlan0"
 EXT_IFACE = "wlan1"
@@ -52,6 +78,14 @@ def mock_init(self, ext_iface, int_iface, wifi_ap_password, token, server_url):
 
     self.server_url = SERVER_URL
     self.is_instruction_available = None
+    self.instruction_event = Wakeup()
+    self.channel = None
+    self.status_wakeup = Wakeup()
+    self.control_plane = "legacy"
+    self.executed_code = None
+    self.pending_access_point = None
+    self.upload_compression = None
+    self.upload_compression_level = None
     self.session_id = 1
     self.data_file = None
     self.access_point = dict(channel=None, ssid=None, sticky_ap=0)
@@ -62,6 +96,31 @@ def mock_init(self, ext_iface, int_iface, wifi_ap_password, token, server_url):
     self.req_session.get.return_value = get
 
     self.observer = MagicMock()
+    self.verbose = False
+    self.probe_upload_format = "pcapng"
+    self.probe_window = 60
+    self.probe_follower = None
+    self.probe_uploader = None
+    self.probe_lock = threading.Lock()
+    self.upload_workers = 2
+    self.spool = MagicMock()
+    self.spool_max_bytes = 64 * 1024 * 1024
+    self.spool_max_files = 100
+    self.rotation = RotationController()
+    self.capture_dir = "/tmp/pi_sniffer_data"
+    self.storage = None
+    self.ap_capture_filter = "all"
+    self.session_capture_filter = None
+    self.hop_scheduler = HopScheduler()
+    self.radio_output = "merged"
+    self.metrics = Registry()
+    self.payload_policy = PayloadPolicy(metrics=self.metrics)
+    self.session_payload_policy = None
+    self.runtime = Runtime(metrics=self.metrics)
+    self.metrics_in_status = False
+    self.status_reporter = None
+    self.metrics_server = None
+    self.instruction_noticed_at = None
     self._create_urls()
 
 
@@ -71,14 +130,14 @@ def test_start_probe_request_mode_and_capturing_data():
     mock_sniffer.execute_instruction(1)
     mock_sniffer.wifi.set_probe_req_mode.assert_called_once()
     mock_sniffer.wifi.start_collecting_data.assert_called_once_with(
-        mock_sniffer.data_file, probe_req_only=True
+        mock_sniffer.data_file, probe_req_only=True, scheduler=mock_sniffer.hop_scheduler
     )
 
     # Second execution of instruction 1 should NOT call the function again as collection has been started
     mock_sniffer.execute_instruction(1)
     mock_sniffer.wifi.set_probe_req_mode.assert_called_once()
     mock_sniffer.wifi.start_collecting_data.assert_called_once_with(
-        mock_sniffer.data_file, probe_req_only=True
+        mock_sniffer.data_file, probe_req_only=True, scheduler=mock_sniffer.hop_scheduler
     )
 
 
@@ -99,15 +158,81 @@ def test_stop_probe_request_mode_and_send_data():
         mock_sniffer.wifi.stop_collecting_data.assert_called_once()
         mock_sniffer.req_session.post.assert_called_once_with(
             "http://localhost:8000/probe/analyze/",
-            data={
-                "mac": "MY MAC",
-                "name": data_file.name,
-                "session_id": 1,
-            },
-            files={
-                "data": ANY
-            },  # Had to use ANY here as the two BufferedReaders were causing an Assertion Error.
+            data=ANY,
+            headers={"Content-Type": ANY},
+            timeout=60,
         )
+        assert mock_sniffer.req_session.post.call_args.kwargs["data"].fields == {
+            "mac": "MY MAC",
+            "name": os.path.basename(data_file.name),
+            "session_id": 1,
+        }
+
+
+@patch.object(PiSniffer, "__init__", mock_init)
+def test_probe_upload_timeout_keeps_capture():
+    mock_sniffer = PiSniffer(None, None, None, None, None)
+    mock_sniffer.req_session.post.side_effect = requests.ReadTimeout("timed out")
+    with tempfile.NamedTemporaryFile(suffix=".pcapng") as data_file:
+        assert not mock_sniffer.upload_probe_capture(data_file.name)
+        assert os.path.exists(data_file.name)
+        assert mock_sniffer.req_session.post.call_args.kwargs["timeout"] == 60
+
+
+@patch.object(PiSniffer, "__init__", mock_init)
+@patch("pi_sniffer.extract_probe_records")
+def test_stop_probe_request_mode_sends_records(mock_extract):
+    mock_sniffer = PiSniffer(None, None, None, None, None)
+    mock_sniffer.probe_upload_format = "records"
+    mock_sniffer.execute_instruction(1)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        mock_sniffer.data_file = tempdir + "/1_probe.pcapng"
+        records_file = tempdir + "/1_probe.ndjson"
+        open(mock_sniffer.data_file, "w").close()
+        open(records_file, "w").close()
+        mock_extract.return_value = records_file
+        mock_sniffer.req_session.post.return_value.status_code = 200
+
+        mock_sniffer.execute_instruction(2)
+        mock_extract.assert_called_once_with(tempdir + "/1_probe.pcapng")
+        mock_sniffer.req_session.post.assert_called_once_with(
+            "http://localhost:8000/probe/analyze/",
+            data=ANY,
+            headers={"Content-Type": ANY},
+            timeout=60,
+        )
+        body = mock_sniffer.req_session.post.call_args.kwargs["data"]
+        assert body.fields == {
+            "mac": "MY MAC",
+            "name": "1_probe.ndjson",
+            "session_id": 1,
+            "format": "probe-ndjson-v1",
+        }
+        assert body.path == records_file
+        assert not os.path.exists(records_file)
+        assert mock_sniffer.data_file is None
+
+
+@patch.object(PiSniffer, "__init__", mock_init)
+def test_damaged_probe_capture_uploaded_as_pcapng():
+    mock_sniffer = PiSniffer(None, None, None, None, None)
+    mock_sniffer.probe_upload_format = "records"
+    mock_sniffer.req_session.post.return_value.status_code = 200
+    with tempfile.TemporaryDirectory() as tempdir:
+        capture_file = tempdir + "/1_probe.pcapng"
+        packet = packet_block(radiotap() + probe_request())
+        with open(capture_file, "wb") as capture:
+            # Ends in a block with an invalid length.
+            capture.write(section_header() + interface_block() + packet * 5)
+            capture.write(struct.pack("<II", 6, 13) + bytes(16))
+
+        assert mock_sniffer.upload_probe_capture(capture_file)
+        body = mock_sniffer.req_session.post.call_args.kwargs["data"]
+        assert body.path == capture_file
+        assert body.fields["name"] == "1_probe.pcapng"
+        assert "format" not in body.fields
+        assert os.listdir(tempdir) == []
 
 
 @patch.object(PiSniffer, "__init__", mock_init)
@@ -119,7 +244,7 @@ def test_start_hotspot_mode_and_capturing_data(mock_observer):
     # Assert ap is started
     mock_sniffer.wifi.set_hostap_mode.assert_called_once()
     mock_sniffer.req_session.get.assert_called_once_with(
-        "http://localhost:8000/session/ap/", params={"sticky": 0}
+        "http://localhost:8000/session/ap/", params={"sticky": 0}, timeout=20
     )
     mock_sniffer.wifi.change_hostap.assert_called_once_with("MY SSID", 42)
 
@@ -131,6 +256,17 @@ def test_start_hotspot_mode_and_capturing_data(mock_observer):
         "MY MAC",
         "http://localhost:8000/ap/analyze/",
         path="/tmp/pi_sniffer_data",
+        max_workers=2,
+        spool=mock_sniffer.spool,
+        max_spool_bytes=64 * 1024 * 1024,
+        max_spool_files=100,
+        on_backpressure=mock_sniffer.wifi.pause_collecting_ap_data,
+        compression=None,
+        compression_level=None,
+        rotation=mock_sniffer.rotation,
+        storage=None,
+        payload_policy=None,
+        metrics=mock_sniffer.metrics,
     )
 
 
@@ -160,18 +296,23 @@ def test_stop_everything():
     mock_sniffer.wifi.stop_collecting_ap_data.assert_not_called()
     mock_sniffer.wifi.stop_collecting_data.assert_not_called()
 
-    # Test stopping of Probe request mode.
-    with patch("pi_sniffer.open"):
+    # Test stopping of Probe request mode. tshark never wrote a capture, so
+    # there is nothing to upload.
+    with tempfile.TemporaryDirectory() as tempdir:
+        mock_sniffer.capture_dir = tempdir
         mock_sniffer.execute_instruction(1)
         mock_sniffer.execute_instruction(5)
         mock_sniffer.wifi.stop_collecting_data.assert_called_once()
-        mock_sniffer.req_session.post.assert_called_once()
+        mock_sniffer.req_session.post.assert_not_called()
+        assert mock_sniffer.data_file is None
 
     # Test stopping of HostAP request mode.
     with patch("pi_sniffer.DumpcapObserver", autospec=True):
         mock_sniffer.execute_instruction(3)
+        mock_sniffer.wifi.restart_opennds.reset_mock()
         mock_sniffer.execute_instruction(5)
-        mock_sniffer.wifi.restart_opennds.assert_called_once()
+        # Once for every instruction 5, once more leaving hotspot mode.
+        assert mock_sniffer.wifi.restart_opennds.call_count == 2
         mock_sniffer.wifi.stop_collecting_ap_data.assert_called_once()
         mock_sniffer.observer.shutdown_observer.assert_called_once()
 
@@ -185,7 +326,7 @@ def test_start_sticky_hotspot_mode_and_start_capturing(mock_observer):
     # Assert ap is started
     mock_sniffer.wifi.set_hostap_mode.assert_called_once()
     mock_sniffer.req_session.get.assert_called_once_with(
-        "http://localhost:8000/session/ap/", params={"sticky": 1}
+        "http://localhost:8000/session/ap/", params={"sticky": 1}, timeout=20
     )
     mock_sniffer.wifi.change_hostap.assert_called_once_with("MY SSID", 42)
 
@@ -197,6 +338,17 @@ def test_start_sticky_hotspot_mode_and_start_capturing(mock_observer):
         "MY MAC",
         "http://localhost:8000/ap/analyze/",
         path="/tmp/pi_sniffer_data",
+        max_workers=2,
+        spool=mock_sniffer.spool,
+        max_spool_bytes=64 * 1024 * 1024,
+        max_spool_files=100,
+        on_backpressure=mock_sniffer.wifi.pause_collecting_ap_data,
+        compression=None,
+        compression_level=None,
+        rotation=mock_sniffer.rotation,
+        storage=None,
+        payload_policy=None,
+        metrics=mock_sniffer.metrics,
     )
 
 
@@ -230,3 +382,406 @@ def test_start_and_stop_hotspot_mode_during_probe_request_mode_no_effect():
     mock_sniffer.execute_instruction(4)
     mock_sniffer.wifi.stop_collecting_ap_data.assert_not_called()
     mock_sniffer.observer.shutdown_observer.assert_not_called()
+
+
+@patch.object(PiSniffer, "__init__", mock_init)
+def test_pushed_instruction_wakes_instruction_loop():
+    mock_sniffer = PiSniffer(None, None, None, None, None)
+    mock_sniffer.on_instruction_pushed({"code": 3})
+    assert mock_sniffer.is_instruction_available == 1
+    assert mock_sniffer.instruction_event.is_set()
+
+
+@patch.object(PiSniffer, "__init__", mock_init)
+@patch("pi_sniffer.DumpcapObserver", autospec=True)
+def test_batched_control_plane_single_request(mock_observer):
+    backend = FakeBackend(session_id=7, access_point={"ssid": "CAFE", "channel": 11})
+    try:
+        mock_sniffer = PiSniffer(None, None, None, None, None)
+        mock_sniffer.server_url = backend.url
+        mock_sniffer.req_session = requests.Session()
+        mock_sniffer._create_urls()
+        mock_sniffer.control_plane = "batched"
+        backend.issue(3)
+
+        assert mock_sniffer.handle_instruction() == 3
+        assert backend.requests == [("GET", "/control/sync/")]
+        assert mock_sniffer.session_id == 7
+        mock_sniffer.wifi.change_hostap.assert_called_once_with("CAFE", 11)
+
+        # Acknowledgement is sent with the next status update.
+        mock_sniffer.ip_address = "1.2.3.4"
+        mock_sniffer.wifi.get_connected_users.return_value = []
+        assert mock_sniffer.executed_code == 3
+        assert mock_sniffer.status_wakeup.is_set()
+        mock_sniffer.send_status_update()
+        assert backend.executed == [3]
+        assert mock_sniffer.executed_code is None
+    finally:
+        backend.close()
+
+
+@patch.object(PiSniffer, "__init__", mock_init)
+def test_batched_control_plane_falls_back_to_legacy():
+    backend = FakeBackend(batched=False)
+    try:
+        mock_sniffer = PiSniffer(None, None, None, None, None)
+        mock_sniffer.server_url = backend.url
+        mock_sniffer.req_session = requests.Session()
+        mock_sniffer._create_urls()
+        mock_sniffer.control_plane = "batched"
+        backend.issue(1)
+
+        assert mock_sniffer.handle_instruction() == 1
+        assert mock_sniffer.control_plane == "legacy"
+        assert backend.requests == [
+            ("GET", "/control/sync/"),
+            ("GET", "/instructions/get_for_execution/"),
+            ("GET", "/session/latest/"),
+            ("POST", "/instructions/executed/"),
+        ]
+        assert backend.executed == [1]
+    finally:
+        backend.close()
+
+
+@patch.object(PiSniffer, "__init__", mock_init)
+def test_batched_control_plane_unreachable_uses_legacy():
+    mock_sniffer = PiSniffer(None, None, None, None, None)
+    mock_sniffer.control_plane = "batched"
+    legacy = MagicMock()
+    legacy.json.return_value = {"code": 3, "id": 7}
+    get = mock_sniffer.req_session.get
+    get.side_effect = [requests.ConnectTimeout("timed out"), legacy, legacy]
+    with patch.object(mock_sniffer, "execute_instruction") as execute:
+        assert mock_sniffer.handle_instruction() == 3
+    execute.assert_called_once_with(3)
+    assert [request.args[0] for request in get.call_args_list] == [
+        mock_sniffer.urls["control_sync"],
+        mock_sniffer.urls["instruction_fetch"],
+        mock_sniffer.urls["session_fetch"],
+    ]
+    assert get.call_args_list[0].kwargs["timeout"] == 20
+    # Only this instruction falls back, the batched control plane stays on.
+    assert mock_sniffer.control_plane == "batched"
+
+
+@patch.object(PiSniffer, "__init__", mock_init)
+def test_metrics_sent_with_status_update():
+    backend = FakeBackend()
+    try:
+        mock_sniffer = PiSniffer(None, None, None, None, None)
+        mock_sniffer.server_url = backend.url
+        mock_sniffer.req_session = requests.Session()
+        mock_sniffer._create_urls()
+        mock_sniffer.ip_address = "1.2.3.4"
+        mock_sniffer.metrics_in_status = True
+        backend.issue(5)
+        mock_sniffer.on_instruction_pushed({"code": 5})
+        mock_sniffer.handle_instruction()
+        assert mock_sniffer.instruction_noticed_at is None
+
+        mock_sniffer.send_status_update()
+        metrics = backend.status_updates[0]["metrics"]
+        assert metrics['pi_instruction_latency_seconds_count{code="5"}'] == 1
+    finally:
+        backend.close()
+
+
+@patch.object(PiSniffer, "__init__", mock_init)
+def test_runtime_executes_pushed_instruction():
+    backend = FakeBackend(session_id=7)
+    try:
+        mock_sniffer = PiSniffer(None, None, None, None, None)
+        mock_sniffer.server_url = backend.url
+        mock_sniffer.req_session = requests.Session()
+        mock_sniffer._create_urls()
+        mock_sniffer.ip_address = "1.2.3.4"
+        mock_sniffer.wifi.capture_processes.return_value = {}
+        backend.issue(1)
+        timer = threading.Timer(0.1, mock_sniffer.on_instruction_pushed, [{"code": 1}])
+        stopper = threading.Timer(1, mock_sniffer.runtime.stop)
+        timer.start()
+        stopper.start()
+        mock_sniffer.runtime.run(
+            status=mock_sniffer.status_loop(),
+            instructions=mock_sniffer.instruction_loop(),
+        )
+        assert backend.executed == [1]
+        assert mock_sniffer.state == WiFiState.ProbeReq
+        assert backend.status_updates
+    finally:
+        mock_sniffer.runtime.shutdown()
+        backend.close()
+
+
+@patch.object(PiSniffer, "__init__", mock_init)
+def test_delta_status_reports_keep_backend_in_sync():
+    backend = FakeBackend()
+    try:
+        mock_sniffer = PiSniffer(None, None, None, None, None)
+        mock_sniffer.server_url = backend.url
+        mock_sniffer.req_session = requests.Session()
+        mock_sniffer._create_urls()
+        mock_sniffer.ip_address = "1.2.3.4"
+        mock_sniffer.status_reporter = StatusReporter(
+            full_every=4, gzip_min_size=256, metrics=mock_sniffer.metrics
+        )
+        mock_sniffer.state = WiFiState.HostAP
+        mock_sniffer.access_point = dict(channel=6, ssid="CAFE", sticky_ap=0)
+        many = [f"02:00:00:00:00:{i:02x}" for i in range(40)]
+        users = [["a"], ["a"], ["a", "b"], ["b"], ["b"], many, many, ["c"], ["c"]]
+        for connected in users:
+            mock_sniffer.wifi.get_connected_users.return_value = connected
+            mock_sniffer.send_status_update()
+            assert backend.pi_status["MY MAC"]["ap_details"] == {
+                "access_point": mock_sniffer.access_point,
+                "connected_users": sorted(connected),
+            }
+        # Pi restarted backend side, a resync brings it back.
+        backend.pi_status.clear()
+        mock_sniffer.send_status_update()
+        mock_sniffer.send_status_update()
+        assert backend.pi_status["MY MAC"]["state"] == "WiFiState.HostAP"
+
+        mock_sniffer.state = WiFiState.NoState
+        mock_sniffer.send_status_update()
+        assert backend.pi_status["MY MAC"]["state"] == "WiFiState.NoState"
+        assert [status["report"] for status in backend.status_updates] == [
+            "full", "heartbeat", "delta", "delta", "heartbeat",
+            "full", "heartbeat", "delta", "heartbeat", "heartbeat", "full", "full",
+        ]
+    finally:
+        backend.close()
+
+
+@patch.object(PiSniffer, "__init__", mock_init)
+def test_status_update_timeout_survived():
+    mock_sniffer = PiSniffer(None, None, None, None, None)
+    mock_sniffer.ip_address = "1.2.3.4"
+    mock_sniffer.req_session.post.side_effect = requests.ReadTimeout("timed out")
+    mock_sniffer.send_status_update()
+    assert mock_sniffer.metrics.snapshot()["pi_status_update_errors_total"] == 1
+
+
+@patch.object(PiSniffer, "__init__", mock_init)
+def test_failed_ack_does_not_rerun_instruction():
+    mock_sniffer = PiSniffer(None, None, None, None, None)
+    mock_sniffer.req_session.get.return_value.json.return_value = {"code": 3, "id": 7}
+    mock_sniffer.req_session.post.side_effect = requests.ConnectionError("refused")
+    mock_sniffer.is_instruction_available = 1
+    with patch.object(mock_sniffer, "execute_instruction") as execute:
+        with pytest.raises(requests.ConnectionError):
+            asyncio.run(mock_sniffer.instruction_loop())
+    execute.assert_called_once_with(3)
+    # The restarted instruction loop waits for the next instruction instead.
+    assert not mock_sniffer.is_instruction_available
+    for request in mock_sniffer.req_session.method_calls:
+        assert request.kwargs["timeout"] == 20
+
+
+@patch.object(PiSniffer, "__init__", mock_init)
+def test_stop_probe_request_mode_sends_aggregates():
+    backend = FakeBackend()
+    with tempfile.TemporaryDirectory() as tempdir:
+        try:
+            mock_sniffer = PiSniffer(None, None, None, None, None)
+            mock_sniffer.capture_dir = tempdir
+            mock_sniffer.server_url = backend.url
+            mock_sniffer.req_session = requests.Session()
+            mock_sniffer._create_urls()
+            mock_sniffer.probe_upload_format = "aggregate"
+            mock_sniffer.execute_instruction(1)
+            assert mock_sniffer.probe_follower is not None
+
+            packet = packet_block(radiotap(rssi=-55) + probe_request())
+            with open(mock_sniffer.data_file, "wb") as capture:
+                capture.write(section_header() + interface_block() + packet * 20)
+            mock_sniffer.execute_instruction(2)
+            mock_sniffer.probe_uploader.shutdown(wait=True)
+
+            ((path, form),) = backend.uploads
+            assert path == "/probe/analyze/"
+            assert form["format"] == b"probe-aggregate-v1"
+            header, row = form["data"].decode().splitlines()
+            assert json.loads(header)["frames"] == 20
+            assert json.loads(row)[5] == 20
+            assert os.listdir(tempdir) == []
+            assert mock_sniffer.data_file is None
+            assert mock_sniffer.probe_follower is None
+        finally:
+            backend.close()
+
+
+def start_two_radios(mock_sniffer):
+    """Make probe capture start on wlan1 and an extra radio wlan2."""
+
+    def start_collecting_data(output, **_kwargs):
+        mock_sniffer.wifi.probe_outputs = {
+            EXT_IFACE: output,
+            "wlan2": radio_output(output, "wlan2"),
+        }
+
+    mock_sniffer.wifi.start_collecting_data.side_effect = start_collecting_data
+    mock_sniffer.execute_instruction(1)
+    for path, rssi in zip(mock_sniffer.wifi.probe_outputs.values(), (-55, -70)):
+        packet = packet_block(radiotap(rssi=rssi) + probe_request())
+        with open(path, "wb") as capture:
+            capture.write(section_header() + interface_block() + packet * 10)
+
+
+@pytest.mark.parametrize("radio_output_mode", ["merged", "per_radio", "aggregate"])
+@patch.object(PiSniffer, "__init__", mock_init)
+def test_stop_probe_request_mode_uploads_every_radio(radio_output_mode):
+    backend = FakeBackend()
+    with tempfile.TemporaryDirectory() as tempdir:
+        try:
+            mock_sniffer = PiSniffer(None, None, None, None, None)
+            mock_sniffer.capture_dir = tempdir
+            mock_sniffer.server_url = backend.url
+            mock_sniffer.req_session = requests.Session()
+            mock_sniffer._create_urls()
+            if radio_output_mode == "aggregate":
+                mock_sniffer.probe_upload_format = "aggregate"
+            else:
+                mock_sniffer.radio_output = radio_output_mode
+            start_two_radios(mock_sniffer)
+            mock_sniffer.execute_instruction(2)
+            if mock_sniffer.probe_uploader:
+                mock_sniffer.probe_uploader.shutdown(wait=True)
+
+            forms = [form for _, form in backend.uploads]
+            if radio_output_mode == "merged":
+                (form,) = forms
+                records = list(iter_probe_records(PcapngReader(io.BytesIO(form["data"]))))
+                assert sorted({record["rssi"] for record in records}) == [-70, -55]
+                assert len(records) == 20
+            elif radio_output_mode == "per_radio":
+                assert [form.get("radio") for form in forms] == [None, b"wlan2"]
+            else:
+                # Heard by both radios, still one group.
+                (form,) = forms
+                _, row = form["data"].decode().splitlines()
+                assert json.loads(row)[5] == 20
+            assert os.listdir(tempdir) == []
+            assert mock_sniffer.data_file is None
+        finally:
+            backend.close()
+
+
+@patch.object(PiSniffer, "__init__", mock_init)
+def test_hotspot_capture_rearmed_when_rotation_changes():
+    mock_sniffer = PiSniffer(None, None, None, None, None)
+    now = [0.0]
+    mock_sniffer.rotation = RotationController(
+        AdaptiveRotation(target_mb=4, max_latency=60), clock=lambda: now[0]
+    )
+    with patch("pi_sniffer.DumpcapObserver", autospec=True):
+        mock_sniffer.execute_instruction(3)
+    mock_sniffer.wifi.start_collecting_ap_data.assert_called_once_with(
+        mock_sniffer.data_file,
+        mock_sniffer.rotation.current,
+        capture_filter="all",
+        snaplen=None,
+    )
+    mock_sniffer.observer.paused = False
+    first_file = mock_sniffer.data_file
+
+    # Busy hotspot, 1 MB/s: files of 4 MB every 4 seconds instead of 60.
+    mock_sniffer.rotation.observe_file(15 * 1024 * 1024, 15)
+    assert mock_sniffer.update_rotation() is None
+    now[0] = 61.0
+    ring = mock_sniffer.update_rotation()
+    assert (ring.duration, ring.filesize_kb) == (5, 4194)
+    mock_sniffer.wifi.rearm_collecting_ap_data.assert_called_once_with(
+        mock_sniffer.data_file, ring
+    )
+    assert mock_sniffer.data_file.endswith("_ap.pcapng")
+
+    # Paused for backpressure, dumpcap is left stopped.
+    mock_sniffer.rotation.observe_file(1024, 60)
+    mock_sniffer.rotation.observe_file(1024, 60)
+    now[0] = 200.0
+    mock_sniffer.observer.paused = True
+    assert mock_sniffer.update_rotation() is None
+    mock_sniffer.wifi.rearm_collecting_ap_data.assert_called_once()
+    assert first_file.startswith("/tmp/pi_sniffer_data/1_")
+
+
+@patch.object(PiSniffer, "__init__", mock_init)
+@patch("pi_sniffer.DumpcapObserver", autospec=True)
+def test_session_selects_capture_filter(mock_observer):
+    for control_plane in ("legacy", "batched"):
+        backend = FakeBackend(session_id=7, capture_filter="bssid_data")
+        try:
+            mock_sniffer = PiSniffer(None, None, None, None, None)
+            mock_sniffer.server_url = backend.url
+            mock_sniffer.req_session = requests.Session()
+            mock_sniffer._create_urls()
+            mock_sniffer.control_plane = control_plane
+            backend.issue(3)
+            mock_sniffer.handle_instruction()
+            mock_sniffer.wifi.start_collecting_ap_data.assert_called_once_with(
+                mock_sniffer.data_file, ANY, capture_filter="bssid_data", snaplen=None
+            )
+        finally:
+            backend.close()
+
+
+@patch.object(PiSniffer, "__init__", mock_init)
+@patch("pi_sniffer.DumpcapObserver", autospec=True)
+def test_session_selects_payload_policy(mock_observer):
+    mock_sniffer = PiSniffer(None, None, None, None, None)
+    mock_sniffer.req_session.get.return_value.json.return_value = {
+        "ssid": "MY SSID",
+        "channel": 42,
+        "payload_policy": {"mode": "snaplen", "snaplen": 128},
+    }
+    mock_sniffer.execute_instruction(3)
+    mock_sniffer.wifi.start_collecting_ap_data.assert_called_once_with(
+        mock_sniffer.data_file, ANY, capture_filter="all", snaplen=128
+    )
+    assert mock_observer.call_args.kwargs["payload_policy"] is None
+
+    # Next session keeps headers and flow starts, truncating ring files.
+    mock_sniffer.req_session.get.return_value.json.return_value = {
+        "ssid": "MY SSID",
+        "channel": 42,
+        "payload_policy": "headers",
+    }
+    mock_sniffer.execute_instruction(3)
+    policy = mock_observer.call_args.kwargs["payload_policy"]
+    assert (policy.mode, policy.flow_bytes) == ("headers", 1024)
+    assert mock_sniffer.wifi.start_collecting_ap_data.call_args.kwargs["snaplen"] is None
+
+
+def test_fleet_of_simulated_pis():
+    result = run_fleet(3, 3, 4, status_update_interval=0.2, control_plane="batched")
+    assert result["endpoints"]["POST /status/update/"]["requests"] >= 3
+    assert result["endpoints"]["POST /status/update/"]["bytes_in"] > 0
+    assert 1 <= result["executed"] <= result["issued"]
+    assert result["latency"][0.5] < 3
+
+
+def test_startup_steps_timed(capsys):
+    with tempfile.TemporaryDirectory() as capture_dir:
+        wifi = SimulatedWiFi(0)
+        with patch.object(wifi, "set_probe_req_mode") as set_probe_req_mode:
+            pi = PiSniffer(
+                None,
+                None,
+                None,
+                AUTH_CODE,
+                SERVER_URL,
+                capture_dir=capture_dir,
+                wifi=wifi,
+                autorun=False,
+            )
+        set_probe_req_mode.assert_called_once()
+        pi.runtime.shutdown()
+    steps = [name for name, _, _ in pi.startup.steps]
+    assert sorted(steps) == ["nm_disable", "resume_uploads", "wifi_state"]
+    assert steps.index("nm_disable") < steps.index("wifi_state")
+    assert pi.startup.elapsed is not None
+    output = capsys.readouterr().out
+    assert "resume_uploads" in output and "ready" in output
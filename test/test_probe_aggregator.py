@@ -0,0 +1,131 @@
+"""
+Tests for probe aggregator
+"""
+import io
+import json
+import os
+import random
+import tempfile
+
+from src.probe_aggregator import (
+    AGGREGATE_FIELDS,
+    AGGREGATE_FORMAT,
+    CaptureFollower,
+    ProbeAggregator,
+)
+from .test_probe_extractor import (
+    interface_block,
+    packet_block,
+    probe_request,
+    radiotap,
+    section_header,
+)
+
+
+def record(ts, mac="a4:b1:c2:d3:e4:f5", ssid="", rssi=-60, digest="00112233aabbccdd"):
+    return {"ts": ts, "mac": mac, "rssi": rssi, "ssid": ssid, "ie_digest": digest}
+
+
+def rows_by_mac(rows):
+    return {row[AGGREGATE_FIELDS.index("mac")]: dict(zip(AGGREGATE_FIELDS, row)) for row in rows}
+
+
+def test_burst_aggregated():
+    aggregator = ProbeAggregator(window=60)
+    for i, rssi in enumerate([-70, -60, -50, None]):
+        aggregator.add(record(120.0 + i * 0.1, rssi=rssi))
+    aggregator.add(record(121.0, mac="02:11:22:33:44:ff", rssi=None))
+    assert len(aggregator) == 2
+    rows = rows_by_mac(aggregator.flush())
+    assert rows["a4:b1:c2:d3:e4:f5"] == {
+        "first_seen": 120.0,
+        "last_seen": 120.3,
+        "mac": "a4:b1:c2:d3:e4:f5",
+        "ssid": "",
+        "ie_digest": "00112233aabbccdd",
+        "count": 4,
+        "rssi_min": -70,
+        "rssi_max": -50,
+        "rssi_mean": -60.0,
+    }
+    assert rows["02:11:22:33:44:ff"]["rssi_mean"] is None
+    assert len(aggregator) == 0
+
+
+def test_grouped_by_ssid_digest_and_window():
+    aggregator = ProbeAggregator(window=60)
+    aggregator.add(record(10))
+    aggregator.add(record(11, ssid="CoffeeShop"))
+    aggregator.add(record(12, digest="ffffffffffffffff"))
+    aggregator.add(record(70))
+    assert len(aggregator) == 4
+
+
+def test_flush_closed_only_keeps_current_window():
+    aggregator = ProbeAggregator(window=60)
+    aggregator.add(record(10, ssid="Old"))
+    aggregator.add(record(65, ssid="Current"))
+    rows = aggregator.flush(closed_only=True)
+    assert [row[AGGREGATE_FIELDS.index("ssid")] for row in rows] == ["Old"]
+    aggregator.add(record(66, ssid="Current"))
+    aggregator.add(record(67, ssid="Other"))
+    assert aggregator.ssid_names == ["Current", "Other"]
+    rows = aggregator.flush()
+    counts = {row[AGGREGATE_FIELDS.index("ssid")]: row[AGGREGATE_FIELDS.index("count")] for row in rows}
+    assert counts == {"Current": 2, "Other": 1}
+    assert aggregator.flush() == []
+
+
+def test_bounded_rows():
+    aggregator = ProbeAggregator(window=60, max_rows=3)
+    for i in range(5):
+        aggregator.add(record(1, mac=f"02:00:00:00:00:{i:02x}"))
+    assert aggregator.add(record(2, mac="02:00:00:00:00:00"))
+    assert len(aggregator) == 3
+    assert aggregator.dropped == 2
+    output = io.StringIO()
+    aggregator.write_batch(aggregator.flush(), output)
+    header, *rows = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert header["format"] == AGGREGATE_FORMAT
+    assert (header["frames"], header["dropped"]) == (4, 2)
+    assert len(rows) == 3
+
+
+def test_crowded_venue_bounded():
+    # 500 phones probing in bursts of 4, 12000 probe requests a minute.
+    rng = random.Random(1)
+    phones = [
+        (f"02:00:00:00:{i // 256:02x}:{i % 256:02x}", f"{rng.getrandbits(64):016x}")
+        for i in range(500)
+    ]
+    aggregator = ProbeAggregator(window=60)
+    uploaded = 0
+    for second in range(240):
+        for mac, digest in rng.sample(phones, 50):
+            for _ in range(4):
+                aggregator.add(record(second + rng.random(), mac, "", -60, digest))
+        if second % 60 == 59:
+            uploaded += len(aggregator.flush(closed_only=True))
+            # Groups are per phone and window, not per probe request.
+            assert uploaded <= len(phones) * (second + 1) // 60
+    assert len(aggregator) <= len(phones)
+    assert sum(len(column) for column in aggregator.columns.values()) <= 11 * len(phones)
+
+
+def test_capture_follower_reads_growing_capture():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "1_probe.pcapng")
+        aggregator = ProbeAggregator(window=60)
+        follower = CaptureFollower(path, aggregator)
+        assert follower.poll() == 0
+        packet = packet_block(radiotap(rssi=-55) + probe_request())
+        with open(path, "wb") as capture:
+            capture.write(section_header() + interface_block() + packet + packet[:10])
+        assert follower.poll() == 1
+        with open(path, "ab") as capture:
+            capture.write(packet[10:] + packet)
+        assert follower.poll() == 2
+        follower.close()
+        (row,) = aggregator.flush()
+        assert row[AGGREGATE_FIELDS.index("count")] == 3
+        assert row[AGGREGATE_FIELDS.index("ssid")] == "CoffeeShop"
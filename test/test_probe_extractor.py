@@ -0,0 +1,159 @@
+"""
+Tests for probe extractor
+"""
+import io
+import json
+import os
+import struct
+import tempfile
+
+from src.probe_extractor import (
+    PcapngReader,
+    extract_probe_records,
+    frequency_to_channel,
+    iter_probe_records,
+    parse_radiotap,
+    RECORD_FIELDS,
+)
+
+SRC_MAC = bytes.fromhex("a4b1c2d3e4f5")
+
+
+def block(block_type, body):
+    """Build a little endian pcapng block."""
+    body += b"\x00" * (-len(body) % 4)
+    length = len(body) + 12
+    return struct.pack("<II", block_type, length) + body + struct.pack("<I", length)
+
+
+def section_header():
+    return block(0x0A0D0D0A, struct.pack("<IHHq", 0x1A2B3C4D, 1, 0, -1))
+
+
+def interface_block(linktype=127):
+    return block(1, struct.pack("<HHI", linktype, 0, 65535))
+
+
+def packet_block(data, timestamp_us=1_600_000_000_000_000):
+    return block(
+        6,
+        struct.pack(
+            "<IIIII",
+            0,
+            timestamp_us >> 32,
+            timestamp_us & 0xFFFFFFFF,
+            len(data),
+            len(data),
+        )
+        + data,
+    )
+
+
+def radiotap(frequency=2437, rssi=-61, fcs=False):
+    """Radiotap header with TSFT, flags, rate, channel and antenna signal."""
+    present = (1 << 0) | (1 << 1) | (1 << 2) | (1 << 3) | (1 << 5)
+    fields = struct.pack("<QBBHHb", 1234, 0x10 if fcs else 0, 2, frequency, 0xA0, rssi)
+    header_length = 8 + len(fields)
+    return struct.pack("<BBHI", 0, 0, header_length, present) + fields
+
+
+# Supported rates, HT capabilities, extended capabilities and a vendor element,
+# roughly what a phone sends.
+PHONE_IES = (
+    b"\x01\x08\x02\x04\x0b\x16\x0c\x12\x18\x24"
+    + b"\x2d\x1a" + bytes(range(26))
+    + b"\x7f\x08" + b"\x00\x00\x08\x80\x00\x00\x00\x40"
+    + b"\xdd\x1e\x00\x50\xf2\x08" + bytes(26)
+)
+
+
+def probe_request(ssid=b"CoffeeShop", seq=1234, extra_ies=PHONE_IES):
+    header = struct.pack("<HH", 0x0040, 0) + b"\xff" * 6 + SRC_MAC + b"\xff" * 6
+    header += struct.pack("<H", seq << 4)
+    ies = bytes([0, len(ssid)]) + ssid + b"\x03\x01\x06" + extra_ies
+    return header + ies
+
+
+def beacon():
+    header = struct.pack("<HH", 0x0080, 0) + b"\xff" * 6 + SRC_MAC + SRC_MAC
+    return header + struct.pack("<H", 0) + b"\x00" * 12 + b"\x00\x03abc"
+
+
+def capture(*packets):
+    return section_header() + interface_block() + b"".join(packet_block(p) for p in packets)
+
+
+def test_frequency_to_channel():
+    assert frequency_to_channel(2412) == 1
+    assert frequency_to_channel(2484) == 14
+    assert frequency_to_channel(5180) == 36
+    assert frequency_to_channel(900) is None
+
+
+def test_parse_radiotap_fields():
+    length, fields = parse_radiotap(radiotap(frequency=2462, rssi=-42))
+    assert length == 23
+    assert fields == {"flags": 0, "frequency": 2462, "rssi": -42}
+
+
+def test_probe_requests_extracted_and_other_frames_skipped():
+    data = capture(
+        radiotap() + probe_request(),
+        radiotap() + beacon(),
+        radiotap(frequency=2412, rssi=-70, fcs=True) + probe_request(ssid=b"", seq=7) + b"\xde\xad\xbe\xef",
+    )
+    records = list(iter_probe_records(PcapngReader(io.BytesIO(data))))
+
+    assert len(records) == 2
+    assert records[0] == {
+        "ts": 1_600_000_000.0,
+        "mac": "a4:b1:c2:d3:e4:f5",
+        "rssi": -61,
+        "channel": 6,
+        "ssid": "CoffeeShop",
+        "seq": 1234,
+        "ie_digest": records[0]["ie_digest"],
+    }
+    assert records[1]["ssid"] == ""
+    assert records[1]["channel"] == 1
+    assert records[1]["seq"] == 7
+    # The FCS is stripped and SSID/channel are excluded from the digest.
+    assert records[0]["ie_digest"] == records[1]["ie_digest"]
+
+
+def test_ie_digest_changes_with_capabilities():
+    data = capture(
+        radiotap() + probe_request(),
+        radiotap() + probe_request(extra_ies=b"\x01\x02\x02\x04"),
+    )
+    records = list(iter_probe_records(PcapngReader(io.BytesIO(data))))
+    assert records[0]["ie_digest"] != records[1]["ie_digest"]
+
+
+def test_reader_resumes_after_partial_block():
+    data = capture(radiotap() + probe_request(seq=1), radiotap() + probe_request(seq=2))
+    stream = io.BytesIO(data[:-10])
+    reader = PcapngReader(stream)
+    assert [r["seq"] for r in iter_probe_records(reader)] == [1]
+
+    stream.seek(0, os.SEEK_END)
+    stream.write(data[-10:])
+    assert [r["seq"] for r in iter_probe_records(reader)] == [2]
+
+
+def test_extract_probe_records_writes_smaller_ndjson():
+    data = capture(*[radiotap() + probe_request(seq=i) for i in range(100)])
+    with tempfile.TemporaryDirectory() as tempdir:
+        capture_file = os.path.join(tempdir, "1_probe.pcapng")
+        with open(capture_file, "wb") as output:
+            output.write(data)
+
+        records_file = extract_probe_records(capture_file)
+
+        assert records_file == os.path.join(tempdir, "1_probe.ndjson")
+        with open(records_file) as records:
+            lines = records.read().splitlines()
+        assert json.loads(lines[0])["fields"] == RECORD_FIELDS
+        assert len(lines) == 101
+        assert json.loads(lines[1])[1] == "a4:b1:c2:d3:e4:f5"
+        assert os.path.getsize(records_file) * 2 < os.path.getsize(capture_file)
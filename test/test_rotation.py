@@ -0,0 +1,104 @@
+"""
+Tests for rotation
+"""
+import pytest
+
+from src.rotation import AdaptiveRotation, FixedRotation, Ring, RotationController
+
+MB = 1024 * 1024
+
+
+def simulate(controller, rates, uplink=2 * MB, horizon=3600):
+    """Run dumpcap against capture rates in bytes per second by time.
+
+    rates is a list of (start second, rate). Returns the files written as
+    (closed at, size, seconds) and the ring changes as (time, ring).
+    """
+    clock = [0.0]
+    controller.clock = lambda: clock[0]
+    controller.changed_at = 0.0
+    files, changes = [], []
+    opened = 0.0
+    while clock[0] < horizon:
+        rate = [rate for start, rate in rates if start <= clock[0]][-1]
+        ring = controller.current
+        seconds = ring.duration
+        if ring.filesize_kb:
+            seconds = min(seconds, ring.filesize_kb * 1000 / rate)
+        clock[0] = opened + seconds
+        size = rate * seconds
+        files.append((clock[0], size, seconds))
+        controller.observe_file(size, seconds)
+        controller.observe_upload(size, size / uplink)
+        opened = clock[0]
+        ring = controller.update()
+        if ring is not None:
+            changes.append((clock[0], ring))
+    return files, changes
+
+
+def test_ring_args():
+    assert Ring(15).args() == "-b duration:15"
+    assert Ring(30, 4096).args() == "-b duration:30 -b filesize:4096"
+    assert not Ring(30, 4096).differs(Ring(40, 3000), 0.5)
+    assert Ring(30, 4096).differs(Ring(50, 4096), 0.5)
+    assert Ring(30).differs(Ring(30, 4096), 0.5)
+
+
+def test_fixed_rotation_never_changes():
+    controller = RotationController(FixedRotation(15))
+    files, changes = simulate(controller, [(0, 1000), (600, 5 * MB)])
+    assert changes == []
+    assert {seconds for _, _, seconds in files} == {15}
+    assert controller.current.args() == "-b duration:15"
+
+
+def test_adaptive_rotation_follows_traffic():
+    controller = RotationController(AdaptiveRotation(target_mb=4, max_latency=60))
+    # Quiet, then a busy hour start, then quiet again.
+    files, changes = simulate(
+        controller, [(0, 2000), (1200, 2 * MB), (2400, 2000)], uplink=10 * MB
+    )
+    quiet = [f for f in files if f[0] <= 1200]
+    busy = [f for f in files if 1500 < f[0] < 2400]
+    late = [f for f in files if f[0] > 2700]
+    # Quiet periods: one file per max_latency instead of one per 15 seconds.
+    assert {seconds for _, _, seconds in quiet} == {60}
+    assert len(quiet) == 20
+    # Busy periods: files capped near the target size.
+    assert max(size for _, size, _ in busy) <= 4 * MB
+    assert min(size for _, size, _ in busy) >= 3 * MB
+    assert {seconds for _, _, seconds in late} == {60}
+    # Re-armed as soon as the first busy file closes, and back within two
+    # steps as the smoothed rate drops, no flapping in between.
+    assert changes[0][0] < 1210
+    assert [ring.duration for _, ring in changes] == [7, 12, 60]
+    assert all(later - earlier >= 60 for (earlier, _), (later, _) in zip(changes, changes[1:]))
+
+
+def test_slow_uplink_shrinks_files():
+    controller = RotationController(
+        AdaptiveRotation(target_mb=4, max_latency=60, upload_seconds=10)
+    )
+    files, _ = simulate(controller, [(0, 200 * 1024)], uplink=100 * 1024, horizon=900)
+    # 100 kB/s uplink, files that upload in 10 seconds.
+    assert controller.current.filesize_kb == 1024
+    assert files[-1][1] == pytest.approx(1024 * 1000)
+
+
+def test_changes_limited_by_min_interval():
+    now = [0.0]
+    controller = RotationController(
+        AdaptiveRotation(), min_interval=60, clock=lambda: now[0]
+    )
+    controller.observe_file(10 * MB, 10)
+    assert controller.update() is None
+    now[0] = 60.0
+    assert controller.update().duration == 5
+    for _ in range(20):
+        controller.observe_file(1000, 60)
+    now[0] = 90.0
+    assert controller.update() is None
+    now[0] = 120.0
+    assert controller.update().duration == 60
+    assert controller.stats()["changes"] == 2
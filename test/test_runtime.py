@@ -0,0 +1,128 @@
+"""
+Tests for the asyncio runtime
+"""
+import asyncio
+import subprocess
+import threading
+import time
+
+import pytest
+
+from src.metrics import Registry
+from src.runtime import Runtime, Wakeup
+
+
+def test_wakeup_set_from_thread():
+    wakeup = Wakeup()
+
+    async def wait():
+        threading.Timer(0.05, wakeup.set).start()
+        started = time.monotonic()
+        assert await wakeup.wait(5)
+        return time.monotonic() - started
+
+    assert asyncio.run(wait()) < 1
+    assert wakeup.is_set()
+    wakeup.clear()
+    assert not asyncio.run(wakeup.wait(0.01))
+
+
+def test_wakeup_already_set():
+    wakeup = Wakeup()
+    wakeup.set()
+    assert asyncio.run(wakeup.wait(0))
+
+
+def test_call_runs_in_executor():
+    runtime = Runtime(metrics=Registry())
+    threads = []
+
+    async def main():
+        threads.append(await runtime.call(lambda: threading.current_thread().name))
+
+    runtime.run(main=main())
+    runtime.shutdown()
+    assert threads[0].startswith("pi_runtime")
+
+
+def test_stop_cancels_tasks():
+    runtime = Runtime(metrics=Registry())
+    cancelled = []
+
+    async def forever():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    threading.Timer(0.05, runtime.stop).start()
+    runtime.run(first=forever(), second=forever())
+    runtime.shutdown()
+    assert cancelled == [True, True]
+
+
+def test_failing_task_stops_others():
+    runtime = Runtime(metrics=Registry())
+
+    async def fail():
+        raise ValueError("broken")
+
+    with pytest.raises(ValueError):
+        runtime.run(fail=fail(), sleep=asyncio.sleep(60))
+    runtime.shutdown()
+
+
+def test_failing_loop_restarted_alone():
+    registry = Registry()
+    runtime = Runtime(metrics=registry, restart_delay=0.01)
+    runs = []
+    ticks = []
+
+    async def flaky():
+        runs.append(len(runs))
+        if len(runs) < 3:
+            raise TimeoutError("read timed out")
+        return "done"
+
+    async def ticking():
+        while True:
+            ticks.append(True)
+            await asyncio.sleep(0.01)
+
+    runtime.run(flaky=flaky, ticking=ticking)
+    runtime.shutdown()
+    assert runs == [0, 1, 2]
+    assert ticks
+    assert registry.snapshot()['pi_task_restarts_total{task="flaky"}'] == 2
+
+
+def test_thread_per_task():
+    runtime = Runtime(metrics=Registry())
+    # Every task blocks in the executor at once, only possible with a
+    # thread for each.
+    barrier = threading.Barrier(3, timeout=5)
+
+    async def blocking():
+        await runtime.call(barrier.wait)
+
+    runtime.run(first=blocking(), second=blocking(), third=blocking())
+    runtime.shutdown()
+
+
+def test_supervise_reports_exit_once():
+    registry = Registry()
+    runtime = Runtime(metrics=registry)
+    process = subprocess.Popen(["true"])
+    process.wait()
+
+    async def main():
+        await asyncio.wait_for(
+            runtime.supervise(lambda: {"tshark": process, "dumpcap": None}, 0.01),
+            0.1,
+        )
+
+    with pytest.raises(asyncio.TimeoutError):
+        runtime.run(main=main())
+    runtime.shutdown()
+    assert registry.snapshot()['pi_process_exits_total{process="tshark"}'] == 1
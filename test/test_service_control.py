@@ -0,0 +1,73 @@
+"""
+Tests for service control
+"""
+import time
+from unittest.mock import MagicMock
+
+from src.metrics import Registry
+from src.service_control import ServiceController
+
+
+class FakeSystemd:
+    """Units become active or inactive a while after systemctl returns."""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.states = {}
+
+    def run(self, command):
+        _, action, unit = command.split()
+        self.states[unit] = (action != "stop", time.monotonic() + self.delay)
+
+    def is_active(self, unit):
+        active, at = self.states.get(unit, (False, 0))
+        return active if time.monotonic() >= at else not active
+
+
+def test_start_waits_for_active_and_ready():
+    systemd = FakeSystemd()
+    ready = MagicMock(side_effect=[False, False, True])
+    metrics = Registry()
+    services = ServiceController(
+        systemd, systemd.run, poll_interval=0.01, metrics=metrics
+    )
+    assert services.start("hostapd.service", ready=ready)
+    assert systemd.is_active("hostapd.service")
+    assert ready.call_count == 3
+    unit, action, elapsed, done = services.steps[0]
+    assert (unit, action, done) == ("hostapd.service", "start", True)
+    assert 0.05 <= elapsed < 1
+    count, _ = metrics.histogram("pi_service_control_seconds").get(
+        unit="hostapd.service", action="start"
+    )
+    assert count == 1
+
+
+def test_stop_waits_for_inactive():
+    systemd = FakeSystemd()
+    services = ServiceController(systemd, systemd.run, poll_interval=0.01)
+    services.start("dnsmasq.service")
+    assert services.stop("dnsmasq.service")
+    assert not systemd.is_active("dnsmasq.service")
+
+
+def test_times_out_when_never_ready():
+    systemd = FakeSystemd(delay=0)
+    metrics = Registry()
+    services = ServiceController(
+        systemd, systemd.run, timeout=0.1, poll_interval=0.01, metrics=metrics
+    )
+    started = time.monotonic()
+    assert not services.restart("hostapd.service", ready=lambda: False)
+    assert time.monotonic() - started < 1
+    assert services.steps[-1][3] is False
+    assert metrics.counter("pi_service_control_timeouts_total").get(
+        unit="hostapd.service", action="restart"
+    ) == 1
+
+
+def test_failing_check_retried():
+    systemd = FakeSystemd(delay=0)
+    ready = MagicMock(side_effect=[OSError("netlink"), True])
+    services = ServiceController(systemd, systemd.run, poll_interval=0.01)
+    assert services.start("hostapd.service", ready=ready)
@@ -0,0 +1,70 @@
+"""
+Tests for spool
+"""
+import os
+import tempfile
+
+from src.spool import Spool, SPOOL_NAME, CAPTURED, QUEUED, UPLOADING, ACKED
+
+URL = "http://localhost:8000/ap/analyze/"
+
+
+def make_file(tempdir, name, size=10):
+    path = os.path.join(tempdir, name)
+    with open(path, "wb") as data_file:
+        data_file.write(b"x" * size)
+    return path
+
+
+def test_states_survive_reopen():
+    with tempfile.TemporaryDirectory() as tempdir:
+        db_path = os.path.join(tempdir, SPOOL_NAME)
+        spool = Spool(db_path)
+        file1 = make_file(tempdir, "1_ap_00001.pcapng")
+        file2 = make_file(tempdir, "1_ap_00002.pcapng")
+        file3 = make_file(tempdir, "1_ap_00003.pcapng")
+        file4 = make_file(tempdir, "1_ap_00004.pcapng")
+        for path in (file1, file2, file3, file4):
+            spool.add(path, URL, {"mac": "MY MAC", "name": path, "session_id": 1})
+        spool.set_state(file1, ACKED)
+        spool.set_state(file2, UPLOADING)
+        spool.set_state(file4, QUEUED)
+        assert [path for path, _ in spool.pending(URL)] == [file3]
+        spool.close()
+
+        # Simulate restart: the interrupted and queued uploads are pending again.
+        spool = Spool(db_path)
+        assert spool.state(file1) is None
+        assert spool.state(file2) == CAPTURED
+        assert spool.state(file4) == CAPTURED
+        assert [path for path, _ in spool.pending(URL)] == [file2, file3, file4]
+        assert spool.pending(URL)[0][1]["session_id"] == 1
+        assert spool.pending("http://other/") == []
+        spool.close()
+
+
+def test_usage_counts_unacked_files():
+    with tempfile.TemporaryDirectory() as tempdir:
+        spool = Spool(os.path.join(tempdir, SPOOL_NAME))
+        file1 = make_file(tempdir, "file1", size=100)
+        file2 = make_file(tempdir, "file2", size=50)
+        spool.add(file1, URL, {})
+        spool.add(file2, URL, {})
+        spool.set_state(file2, UPLOADING)
+        assert spool.usage() == (2, 150)
+        spool.set_state(file1, ACKED)
+        assert spool.usage() == (1, 50)
+        spool.forget(file2)
+        assert spool.usage() == (0, 0)
+        spool.close()
+
+
+def test_untracked_files_found():
+    with tempfile.TemporaryDirectory() as tempdir:
+        spool = Spool(os.path.join(tempdir, SPOOL_NAME))
+        tracked = make_file(tempdir, "1_x_ap_00001_x.pcapng")
+        orphan = make_file(tempdir, "1_x_ap_00002_x.pcapng")
+        make_file(tempdir, "1_x_probe.pcapng")
+        spool.add(tracked, URL, {})
+        assert spool.untracked(tempdir, "*_ap_*.pcapng") == [orphan]
+        spool.close()
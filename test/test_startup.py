@@ -0,0 +1,78 @@
+"""
+Tests for startup timing
+"""
+import threading
+import time
+
+import pytest
+
+from src.metrics import Registry
+from src.startup import StartupTimer
+
+
+class FakeClock:
+    """Clock advanced by hand."""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_steps_are_timed_and_reported():
+    clock = FakeClock()
+    metrics = Registry()
+    startup = StartupTimer(metrics=metrics, clock=clock)
+
+    def slow(seconds, result):
+        clock.now += seconds
+        return result
+
+    assert startup.step("wifi", slow, 0.25, "handler") == "handler"
+    clock.now += 0.5
+    with pytest.raises(ZeroDivisionError):
+        startup.step("broken", lambda: 1 / 0)
+    assert startup.finish() == pytest.approx(0.75)
+    assert startup.steps == [("wifi", 0.0, 0.25), ("broken", 0.75, 0.0)]
+    report = startup.report().splitlines()
+    assert report[1].split() == ["wifi", "0.000", "0.250"]
+    assert report[-1].split() == ["ready", "0.750"]
+    rendered = metrics.render()
+    assert 'pi_startup_step_seconds_count{step="wifi"} 1' in rendered
+    assert "pi_startup_seconds 0.75" in rendered
+
+
+def test_independent_steps_run_concurrently():
+    startup = StartupTimer(metrics=Registry())
+    # Both steps have to be running at once to get past the barrier.
+    barrier = threading.Barrier(2, timeout=5)
+
+    def meet(name):
+        barrier.wait()
+        return name
+
+    def step(name):
+        return startup.step(name, meet, name)
+
+    assert startup.concurrently(lambda: step("first"), lambda: step("second")) == [
+        "first",
+        "second",
+    ]
+    assert sorted(name for name, _, _ in startup.steps) == ["first", "second"]
+
+
+def test_concurrent_error_raised_once_all_steps_finished():
+    startup = StartupTimer(metrics=Registry())
+    finished = threading.Event()
+
+    def failing():
+        raise OSError("No HOSTAPD service")
+
+    def slow():
+        time.sleep(0.1)
+        finished.set()
+
+    with pytest.raises(OSError):
+        startup.concurrently(failing, slow)
+    assert finished.is_set()
@@ -0,0 +1,110 @@
+"""
+Tests for station_tracker
+"""
+import time
+
+from src.station_tracker import StationTracker, parse_event
+from .fake_hostapd import FakeHostapd
+
+# Events as logged by hostapd_cli -a on a hotspot session, with seconds.
+RECORDED_EVENTS = [
+    (0.0, "AP-ENABLED"),
+    (3.2, "AP-STA-CONNECTED a4:b1:c2:d3:e4:f5"),
+    (3.3, "EAPOL-4WAY-HS-COMPLETED a4:b1:c2:d3:e4:f5"),
+    (9.8, "AP-STA-CONNECTED 02:11:22:33:44:FF p2p_dev_addr=02:11:22:33:44:ff"),
+    (41.0, "AP-STA-DISCONNECTED a4:b1:c2:d3:e4:f5"),
+    (55.5, "AP-STA-CONNECTED a4:b1:c2:d3:e4:f5"),
+    (60.0, "AP-STA-POLL-OK 02:11:22:33:44:ff"),
+]
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_parse_event():
+    assert parse_event("AP-STA-CONNECTED 02:11:22:33:44:FF") == (
+        "AP-STA-CONNECTED",
+        "02:11:22:33:44:ff",
+    )
+    assert parse_event("AP-STA-POLL-OK 02:11:22:33:44:ff") is None
+    assert parse_event("AP-ENABLED") is None
+
+
+def test_replay_recorded_events():
+    tracker = StationTracker("/nonexistent", clock=lambda: 70.0)
+    tracker.replay(RECORDED_EVENTS)
+    assert sorted(tracker.get_connected_users()) == [
+        "02:11:22:33:44:ff",
+        "a4:b1:c2:d3:e4:f5",
+    ]
+    assert tracker.is_connected("02:11:22:33:44:FF")
+    durations = tracker.session_durations()
+    assert durations["a4:b1:c2:d3:e4:f5"] == (41.0 - 3.2) + (70.0 - 55.5)
+    assert durations["02:11:22:33:44:ff"] == 70.0 - 9.8
+
+
+def test_follows_hostapd_events():
+    hostapd = FakeHostapd()
+    hostapd.connect("a4:b1:c2:d3:e4:f5", rx_bytes=1200, tx_bytes=800, connected_time=30)
+    tracker = StationTracker(hostapd.path, check_interval=0.05)
+    try:
+        tracker.start()
+        assert tracker.connected
+        assert tracker.get_stations()[0]["rx_bytes"] == 1200
+        assert tracker.session_durations()["a4:b1:c2:d3:e4:f5"] >= 30
+
+        hostapd.connect("02:11:22:33:44:ff")
+        assert wait_until(lambda: tracker.is_connected("02:11:22:33:44:ff"))
+        hostapd.disconnect("a4:b1:c2:d3:e4:f5")
+        assert wait_until(lambda: not tracker.is_connected("a4:b1:c2:d3:e4:f5"))
+        assert tracker.get_connected_users() == ["02:11:22:33:44:ff"]
+        assert len(tracker.sessions) == 1
+
+        hostapd.stations["02:11:22:33:44:ff"]["tx_bytes"] = 4096
+        tracker.refresh()
+        assert tracker.get_stations()[0]["tx_bytes"] == 4096
+    finally:
+        tracker.stop()
+        hostapd.close()
+
+
+def test_reconnects_after_hostapd_restart():
+    hostapd = FakeHostapd()
+    directory = hostapd.directory
+    tracker = StationTracker(hostapd.path, check_interval=0.05)
+    try:
+        tracker.start()
+        hostapd.connect("a4:b1:c2:d3:e4:f5")
+        assert wait_until(lambda: tracker.is_connected("a4:b1:c2:d3:e4:f5"))
+        hostapd.owns_directory = False
+        hostapd.close()
+        assert wait_until(lambda: not tracker.connected)
+
+        hostapd = FakeHostapd(directory=directory)
+        hostapd.owns_directory = True
+        hostapd.connect("02:11:22:33:44:ff")
+        assert wait_until(lambda: tracker.connected)
+        # Stations dropped by the restart are replaced by the ones hostapd has.
+        assert tracker.get_connected_users() == ["02:11:22:33:44:ff"]
+    finally:
+        tracker.stop()
+        hostapd.close()
+
+
+def test_stop_does_not_wait_for_receive_timeout():
+    hostapd = FakeHostapd()
+    tracker = StationTracker(hostapd.path, check_interval=5)
+    try:
+        tracker.start()
+        # Let the event thread block in its receive.
+        time.sleep(0.1)
+        started = time.monotonic()
+        tracker.stop()
+        assert time.monotonic() - started < 1
+        assert tracker.thread is None and tracker.monitor is None
+    finally:
+        hostapd.close()
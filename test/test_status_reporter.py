@@ -0,0 +1,102 @@
+"""
+Tests for status_reporter
+"""
+import gzip
+import json
+
+from src.metrics import Registry
+from src.status_reporter import StatusReporter
+
+
+def status(users=None, state="WiFiState.HostAP", ip="1.2.3.4"):
+    return {
+        "mac": "MY MAC",
+        "ip": ip,
+        "state": state,
+        "ap_details": {
+            "access_point": {"ssid": "CAFE", "channel": 6, "sticky_ap": 0},
+            "connected_users": users,
+        },
+    }
+
+
+def send(reporter, payload, response=None):
+    report = reporter.build(payload)
+    reporter.acknowledge(response or {})
+    return report
+
+
+def test_full_then_heartbeat():
+    reporter = StatusReporter(metrics=Registry())
+    first = send(reporter, status(["a"]))
+    assert first["report"] == "full"
+    assert first["ap_details"]["connected_users"] == ["a"]
+    second = send(reporter, status(["a"]))
+    assert second == {"mac": "MY MAC", "report": "heartbeat", "seq": 2, "base": 1}
+
+
+def test_users_delta():
+    reporter = StatusReporter(metrics=Registry())
+    send(reporter, status(["a", "b"]))
+    report = send(reporter, status(["b", "c"]))
+    assert report["report"] == "delta"
+    assert report["base"] == 1
+    assert report["connected_users_added"] == ["c"]
+    assert report["connected_users_removed"] == ["a"]
+    assert "ap_details" not in report
+
+
+def test_other_change_sends_full():
+    reporter = StatusReporter(metrics=Registry())
+    send(reporter, status(["a"]))
+    assert send(reporter, status(None, state="WiFiState.ProbeReq"))["report"] == "full"
+    reporter = StatusReporter(deltas=False, metrics=Registry())
+    send(reporter, status(["a"]))
+    assert send(reporter, status(["a", "b"]))["report"] == "full"
+
+
+def test_full_every():
+    reporter = StatusReporter(full_every=3, metrics=Registry())
+    kinds = [send(reporter, status(["a"]))["report"] for _ in range(8)]
+    assert kinds == ["full", "heartbeat", "heartbeat", "heartbeat"] * 2
+
+
+def test_unacknowledged_report_is_not_base():
+    reporter = StatusReporter(metrics=Registry())
+    send(reporter, status(["a"]))
+    reporter.build(status(["a", "b"]))
+    reporter.reset()
+    assert reporter.build(status(["a", "b"]))["report"] == "full"
+
+
+def test_resync():
+    reporter = StatusReporter(metrics=Registry())
+    send(reporter, status(["a"]))
+    send(reporter, status(["a"]), {"resync": True})
+    assert send(reporter, status(["a"]))["report"] == "full"
+
+
+def test_passes_through_other_fields():
+    reporter = StatusReporter(metrics=Registry())
+    send(reporter, status(["a"]))
+    payload = status(["a"])
+    payload["executed"] = {"code": 3}
+    report = send(reporter, payload)
+    assert report["report"] == "heartbeat"
+    assert report["executed"] == {"code": 3}
+
+
+def test_encode_gzip_large_reports():
+    registry = Registry()
+    reporter = StatusReporter(gzip_min_size=512, metrics=registry)
+    many = [f"02:00:00:00:{i // 256:02x}:{i % 256:02x}" for i in range(100)]
+    body, headers = reporter.encode(reporter.build(status(many)))
+    assert headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(body))["ap_details"]["connected_users"] == many
+    reporter.acknowledge({})
+    body, headers = reporter.encode(reporter.build(status(many)))
+    assert "Content-Encoding" not in headers
+    assert json.loads(body)["report"] == "heartbeat"
+    snapshot = registry.snapshot()
+    assert snapshot['pi_status_reports_total{report="full"}'] == 1
+    assert snapshot['pi_status_reports_total{report="heartbeat"}'] == 1
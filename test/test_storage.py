@@ -0,0 +1,140 @@
+"""
+Tests for storage
+"""
+import os
+import tempfile
+from time import sleep
+from unittest.mock import MagicMock
+
+from src.dumpcap_observer import DumpcapObserver
+from src.metrics import Registry
+from src.rotation import Ring
+from src.spool import ACKED, SPOOL_NAME, Spool
+from src.storage import StorageManager
+
+URL = "http://localhost:8000/ap/analyze/"
+KB = 1024
+
+
+def write_file(directory, name, size, age=0):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as data_file:
+        data_file.write(b"x" * size)
+    # Files are ordered by modification time.
+    os.utime(path, (1000000 + age, 1000000 + age))
+    return path
+
+
+def test_oldest_first_with_writer_outrunning_uploader():
+    metrics = Registry()
+    with tempfile.TemporaryDirectory() as tempdir:
+        spool = Spool(os.path.join(tempdir, SPOOL_NAME))
+        storage = StorageManager(tempdir, spool, 1000 * KB, "oldest", metrics=metrics)
+        written = []
+        for i in range(60):
+            # dumpcap writes a new ring file, the previous one is finished.
+            written.append(write_file(tempdir, f"1_ap_{i:05d}.pcapng", 100 * KB, age=i))
+            if len(written) > 1:
+                spool.add(written[-2], URL, {"session_id": 1})
+            # The uploader only gets one file out for every four written.
+            if i % 4 == 0 and spool.pending(URL):
+                path, _ = spool.pending(URL)[0]
+                os.remove(path)
+                spool.set_state(path, ACKED)
+            used, _ = storage.enforce()
+            assert used <= 1000 * KB
+        # The newest captures are kept, the file being written is never evicted.
+        assert os.path.exists(written[-1])
+        assert os.path.exists(written[-2])
+        evicted = metrics.counter("pi_storage_evicted_files_total").get(
+            policy="oldest", state="captured"
+        )
+        assert evicted > 30
+        assert metrics.counter("pi_storage_evicted_bytes_total").get(
+            policy="oldest"
+        ) == evicted * 100 * KB
+        assert not storage.over_budget()
+        # Evicted files are no longer pending upload.
+        assert all(os.path.exists(path) for path, _ in spool.pending(URL))
+        spool.close()
+
+
+def test_fair_share_evicts_from_biggest_session():
+    with tempfile.TemporaryDirectory() as tempdir:
+        spool = Spool(os.path.join(tempdir, SPOOL_NAME))
+        # Session 1 is older but small, session 2 took most of the budget.
+        old = [write_file(tempdir, f"1_ap_{i}.pcapng", 100 * KB, age=i) for i in range(2)]
+        new = [write_file(tempdir, f"2_ap_{i}.pcapng", 100 * KB, age=10 + i) for i in range(8)]
+        for path in old + new:
+            spool.add(path, URL, {})
+        storage = StorageManager(tempdir, spool, 800 * KB, "fair_share", metrics=Registry())
+        _, evicted = storage.enforce()
+        assert evicted == new[:2]
+        assert all(os.path.exists(path) for path in old)
+
+        oldest = StorageManager(tempdir, spool, 600 * KB, "oldest", metrics=Registry())
+        _, evicted = oldest.enforce()
+        assert evicted == old
+        spool.close()
+
+
+def test_acked_only_pauses_capture_instead_of_evicting():
+    mock_session = MagicMock()
+    mock_session.post.return_value.status_code = 500
+    on_backpressure = MagicMock()
+    with tempfile.TemporaryDirectory() as tempdir:
+        spool = Spool(os.path.join(tempdir, SPOOL_NAME))
+        storage = StorageManager(tempdir, spool, 300 * KB, "acked_only", metrics=Registry())
+        observer = DumpcapObserver(
+            mock_session,
+            0,
+            "MY MAC",
+            URL,
+            path=tempdir,
+            max_workers=1,
+            spool=spool,
+            on_backpressure=on_backpressure,
+            storage=storage,
+        )
+        observer.uploader.backoff_base = 0.01
+        leftover = write_file(tempdir, "0_ap_0.pcapng", 50 * KB)
+        spool.add(leftover, URL, {})
+        spool.set_state(leftover, ACKED)
+        paths = [write_file(tempdir, f"1_ap_{i}.pcapng", 100 * KB) for i in range(5)]
+        for path in paths:
+            observer.on_created(MagicMock(src_path=path))
+        on_backpressure.assert_called_once_with(True)
+        # Only the acknowledged leftover went, nothing pending upload.
+        assert not os.path.exists(leftover)
+        assert all(os.path.exists(path) for path in paths)
+
+        # The backend recovers and capture resumes once under budget.
+        mock_session.post.return_value.status_code = 200
+        for _ in range(50):
+            if on_backpressure.call_count == 2:
+                break
+            sleep(0.1)
+        on_backpressure.assert_called_with(False)
+        observer.stopped = True
+        observer.uploader.shutdown(wait=True, cancel_retries=True)
+        spool.close()
+
+
+def test_ring_matches_budget():
+    with tempfile.TemporaryDirectory() as tempdir:
+        spool = Spool(os.path.join(tempdir, SPOOL_NAME))
+        budget = 16 * 1024 * KB
+        storage = StorageManager(tempdir, spool, budget, "oldest", metrics=Registry())
+        ring = storage.ring(Ring(15), 1)
+        assert ring.args() == "-b duration:15 -b filesize:1048 -b files:16"
+        assert storage.ring(Ring(5, 4194), 1).files == 4
+
+        # With fair share a second session on disk halves the ring.
+        path = write_file(tempdir, "1_ap_0.pcapng", 10)
+        spool.add(path, URL, {})
+        fair = StorageManager(tempdir, spool, budget, "fair_share", metrics=Registry())
+        assert fair.ring(Ring(5, 4194), 2).files == 2
+
+        acked_only = StorageManager(tempdir, spool, budget, "acked_only", metrics=Registry())
+        assert acked_only.ring(Ring(15), 1) == Ring(15)
+        spool.close()
@@ -0,0 +1,152 @@
+"""
+Tests for uploader
+"""
+import os
+import tempfile
+import threading
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from src.metrics import Registry
+from src.spool import SPOOL_NAME, Spool
+from src.uploader import Uploader, idempotency_key
+
+FORM = {"mac": "MY MAC", "name": "file1", "session_id": 1}
+
+
+def response(status_code):
+    mock_response = MagicMock()
+    mock_response.status_code = status_code
+    return mock_response
+
+
+def make_file(tempdir, name="file1", data=b"Data1\n"):
+    path = os.path.join(tempdir, name)
+    with open(path, "wb") as data_file:
+        data_file.write(data)
+    return path
+
+
+def test_file_removed_only_after_ack():
+    mock_session = MagicMock()
+    mock_session.post.side_effect = [
+        requests.Timeout("timed out"),
+        response(503),
+        response(200),
+    ]
+    uploader = Uploader(mock_session, "http://localhost/ap/analyze/", backoff_base=0)
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = make_file(tempdir)
+        with patch("src.uploader.os.remove", wraps=os.remove) as mock_remove:
+            assert uploader.upload(path, FORM)
+            mock_remove.assert_called_once_with(path)
+        assert not os.path.exists(path)
+
+    keys = {c.kwargs["headers"]["Idempotency-Key"] for c in mock_session.post.mock_calls}
+    assert len(keys) == 1
+    stats = uploader.stats()
+    assert stats["acked"] == 1
+    assert stats["retries"] == 2
+    assert stats["bytes_uploaded"] == 6
+
+
+def test_file_kept_when_never_acked():
+    mock_session = MagicMock()
+    mock_session.post.return_value = response(500)
+    uploader = Uploader(
+        mock_session, "http://localhost/ap/analyze/", max_attempts=3, backoff_base=0
+    )
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = make_file(tempdir)
+        assert not uploader.upload(path, FORM)
+        assert os.path.exists(path)
+    assert mock_session.post.call_count == 3
+    assert uploader.stats()["failed"] == 1
+
+
+def test_client_error_not_retried():
+    mock_session = MagicMock()
+    mock_session.post.return_value = response(400)
+    uploader = Uploader(mock_session, "http://localhost/ap/analyze/", backoff_base=0)
+    with tempfile.TemporaryDirectory() as tempdir:
+        assert not uploader.upload(make_file(tempdir), FORM)
+    mock_session.post.assert_called_once()
+
+
+def test_parallel_uploads_tracked_in_stats():
+    mock_session = MagicMock()
+    mock_session.post.return_value = response(201)
+    uploader = Uploader(mock_session, "http://localhost/ap/analyze/", max_workers=4)
+    with tempfile.TemporaryDirectory() as tempdir:
+        futures = [
+            uploader.submit(make_file(tempdir, f"file{i}"), FORM) for i in range(8)
+        ]
+        assert all(future.result() for future in futures)
+        uploader.shutdown(wait=True)
+        assert os.listdir(tempdir) == []
+    stats = uploader.stats()
+    assert stats["acked"] == 8
+    assert stats["queue_depth"] == 0
+    assert stats["in_flight"] == 0
+
+
+def test_backoff_delay_bounded():
+    uploader = Uploader(MagicMock(), "url", backoff_base=1, backoff_max=10)
+    assert all(0 <= uploader.backoff_delay(attempt) <= 10 for attempt in range(20))
+
+
+def test_idempotency_key_depends_on_file_identity():
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = make_file(tempdir)
+        assert idempotency_key(path, FORM) == idempotency_key(path, dict(FORM))
+        assert idempotency_key(path, FORM) != idempotency_key(
+            path, dict(FORM, session_id=2)
+        )
+
+
+def test_upload_metrics_reported():
+    mock_session = MagicMock()
+    mock_session.post.side_effect = [response(503), response(200), response(400)]
+    metrics = Registry()
+    uploader = Uploader(
+        mock_session, "http://localhost/ap/analyze/", backoff_base=0, metrics=metrics
+    )
+    with tempfile.TemporaryDirectory() as tempdir:
+        uploader.submit(make_file(tempdir, "file1"), FORM).result()
+        uploader.submit(make_file(tempdir, "file2"), FORM).result()
+    endpoint = {"endpoint": "/ap/analyze/"}
+    assert metrics.counter("pi_upload_files_queued_total").get(**endpoint) == 2
+    assert metrics.counter("pi_upload_files_acked_total").get(**endpoint) == 1
+    assert metrics.counter("pi_upload_files_failed_total").get(**endpoint) == 1
+    assert metrics.counter("pi_upload_retries_total").get(**endpoint) == 1
+    assert metrics.counter("pi_upload_bytes_total").get(**endpoint) == 6
+    assert metrics.histogram("pi_upload_latency_seconds").get(**endpoint)[0] == 1
+
+
+def test_resume_skips_files_already_queued():
+    release = threading.Event()
+
+    def post(*_args, **_kwargs):
+        release.wait(5)
+        return response(200)
+
+    mock_session = MagicMock()
+    mock_session.post.side_effect = post
+    url = "http://localhost/ap/analyze/"
+    with tempfile.TemporaryDirectory() as tempdir:
+        spool = Spool(os.path.join(tempdir, SPOOL_NAME))
+        for name in ("file1", "file2", "file3"):
+            spool.add(make_file(tempdir, name), url, FORM)
+        first = Uploader(mock_session, url, max_workers=1, spool=spool, metrics=Registry())
+        assert first.resume() == 3
+        # Queued and in flight files belong to the first uploader.
+        second = Uploader(mock_session, url, spool=spool, metrics=Registry())
+        assert second.resume() == 0
+        release.set()
+        first.shutdown(wait=True)
+        second.shutdown(wait=True)
+        assert mock_session.post.call_count == 3
+        assert first.stats()["acked"] == 3
+        assert spool.usage() == (0, 0)
+        spool.close()
@@ -0,0 +1,103 @@
+"""
+Tests for WiFi handler capture processes
+"""
+import os
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from unittest.mock import MagicMock, patch
+
+sys.modules["sysdmanager"] = MagicMock()
+# pylint: disable=wrong-import-position
+from src.metrics import Registry
+from src.rotation import Ring
+from src.wifi import WiFiHandler
+
+# Writes the end of its capture file only once asked to stop, like dumpcap
+# finishing the last ring file.
+SLOW_DUMPCAP = """#!/bin/sh
+while [ $# -gt 1 ]; do [ "$1" = "-w" ] && out="$2"; shift; done
+trap 'sleep 0.5; echo complete >> "$out"; exit 0' TERM
+echo partial > "$out"
+while true; do sleep 0.1; done
+"""
+STUBBORN_DUMPCAP = """#!/bin/sh
+trap '' TERM
+while true; do sleep 0.1; done
+"""
+
+
+def fake_dumpcap(directory, script):
+    """Write a dumpcap stand-in running script."""
+    path = os.path.join(directory, "dumpcap")
+    with open(path, "w") as dumpcap:
+        dumpcap.write(script)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+@patch("src.wifi.DNSMasq")
+@patch("src.wifi.HostAP")
+def test_stop_waits_for_last_file(_hostap, _dnsmasq):
+    with tempfile.TemporaryDirectory() as tempdir:
+        wifi = WiFiHandler(
+            "wlan1",
+            "wlan0",
+            "password",
+            dumpcap_bin=fake_dumpcap(tempdir, SLOW_DUMPCAP),
+            metrics=Registry(),
+        )
+        output = os.path.join(tempdir, "1_ap.pcapng")
+        wifi.start_dumpcap(output, Ring(15))
+        deadline = time.monotonic() + 5
+        while not os.path.exists(output) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        wifi.stop_collecting_ap_data()
+        with open(output) as capture:
+            assert capture.read() == "partial\ncomplete\n"
+        assert wifi.ap_data_collector_process is None
+
+
+def test_stuck_capture_killed():
+    with tempfile.TemporaryDirectory() as tempdir:
+        process = subprocess.Popen(  # pylint: disable=subprocess-popen-preexec-fn
+            fake_dumpcap(tempdir, STUBBORN_DUMPCAP), preexec_fn=os.setpgrp
+        )
+        time.sleep(0.2)
+        started = time.monotonic()
+        assert not WiFiHandler.stop_process(process, timeout=0.3)
+        assert time.monotonic() - started < 3
+        assert process.returncode is not None
+
+
+@patch("src.wifi.DNSMasq")
+@patch("src.wifi.HostAP")
+def test_rearm_waits_for_old_capture(_hostap, _dnsmasq):
+    with tempfile.TemporaryDirectory() as tempdir:
+        wifi = WiFiHandler(
+            "wlan1",
+            "wlan0",
+            "password",
+            dumpcap_bin=fake_dumpcap(tempdir, SLOW_DUMPCAP),
+            metrics=Registry(),
+        )
+        first, second = (os.path.join(tempdir, f"{i}_ap.pcapng") for i in (1, 2))
+        wifi.start_dumpcap(first, Ring(15))
+        old = wifi.ap_data_collector_process
+        deadline = time.monotonic() + 5
+        while not os.path.exists(first) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        started = []
+        start_dumpcap = wifi.start_dumpcap
+
+        def check_old_stopped(output, ring):
+            started.append(old.poll() is not None and os.path.getsize(first))
+            start_dumpcap(output, ring)
+
+        with patch.object(wifi, "start_dumpcap", side_effect=check_old_stopped):
+            wifi.rearm_collecting_ap_data(second, Ring(30))
+        assert started == [len("partial\ncomplete\n")]
+        assert wifi.ap_data_collector_process is not old
+        wifi.stop_collecting_ap_data()